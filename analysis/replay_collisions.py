@@ -0,0 +1,136 @@
+"""Replays the accelerometer readings and drive commands from a log file
+through the collision detector, and compares when it noticed collisions with
+when the speed history did.
+
+Usage: python -m analysis.replay_collisions <log file>
+"""
+
+import json
+import sys
+
+from analysis.replay_location_filters import DRIVE_RE
+from analysis.replay_location_filters import timestamp
+from control.collision_detector import CollisionDetector
+from control.telemetry import ACCELEROMETER_FORWARD_AXIS
+from control.telemetry import ACCELEROMETER_LEFT_AXIS
+from control.telemetry import Telemetry
+
+STOPPED_MESSAGE = 'not moving according to speed history'
+
+
+def read_events(lines):
+    """Returns (time, kind, data) tuples for the accelerometer readings,
+    drive commands and speed history detections in a log, in the order they
+    were logged.
+    """
+    events = []
+    for line in lines:
+        match = DRIVE_RE.search(line)
+        if match is not None:
+            events.append((timestamp(line), 'drive', float(match.group(1))))
+        elif STOPPED_MESSAGE in line:
+            events.append((timestamp(line), 'stopped', None))
+        elif '"acceleration_g_x"' in line:
+            try:
+                data = json.loads(line[line.find('{'):line.rfind('}') + 1])
+            except ValueError:
+                continue
+            if data[ACCELEROMETER_FORWARD_AXIS] is not None:
+                # Use when the sample was taken, like Telemetry does
+                event_time_s = data.get('timestamp_s')
+                if event_time_s is None:
+                    event_time_s = timestamp(line)
+                events.append((event_time_s, 'accelerometer', data))
+    return events
+
+
+def replay(events):
+    """Replays events through a collision detector. The accelerometer bias is
+    learned while the throttle is 0, like Telemetry does. Returns a list of
+    (time, kind) tuples for the collisions it detected.
+    """
+    detector = CollisionDetector()
+    throttle = 0.0
+    bias_g = [0.0, 0.0]
+    bias_readings = 0
+    collisions = []
+    for event_time_s, kind, data in events:
+        if kind == 'drive':
+            throttle = data
+            detector.drive(event_time_s, throttle)
+        elif kind == 'accelerometer':
+            forward_g = data[ACCELEROMETER_FORWARD_AXIS]
+            left_g = data[ACCELEROMETER_LEFT_AXIS]
+            if throttle == 0.0:
+                if bias_readings == 0:
+                    bias_g = [forward_g, left_g]
+                else:
+                    alpha = Telemetry.ACCELEROMETER_BIAS_ALPHA
+                    bias_g[0] += alpha * (forward_g - bias_g[0])
+                    bias_g[1] += alpha * (left_g - bias_g[1])
+                bias_readings += 1
+            if bias_readings < Telemetry.ACCELEROMETER_CALIBRATION_READINGS:
+                detector.add(
+                    event_time_s,
+                    None,
+                    None,
+                    data['acceleration_g_z']
+                )
+            else:
+                detector.add(
+                    event_time_s,
+                    forward_g - bias_g[0],
+                    left_g - bias_g[1],
+                    data['acceleration_g_z']
+                )
+            collision = detector.collision()
+            if collision is not None:
+                collisions.append((event_time_s, collision))
+    return collisions
+
+
+def main():
+    """Main function."""
+    if sys.version_info.major <= 2:
+        print('Please use Python 3')
+        sys.exit(1)
+    if len(sys.argv) != 2:
+        print('Usage: {} <log file>'.format(sys.argv[0]))
+        sys.exit(1)
+
+    with open(sys.argv[1]) as file_:
+        events = read_events(file_.readlines())
+    if not any(kind == 'accelerometer' for _, kind, _ in events):
+        print('No accelerometer readings found')
+        sys.exit(1)
+
+    start_s = events[0][0]
+    collisions = replay(events)
+    for collision_s, kind in collisions:
+        print('{:8.2f}s {}'.format(collision_s - start_s, kind))
+    print('{} collisions detected'.format(len(collisions)))
+
+    # How much sooner the accelerometer noticed than the speed history
+    stopped = [time_s for time_s, kind, _ in events if kind == 'stopped']
+    for stopped_s in stopped:
+        earlier = [
+            collision_s for collision_s, _ in collisions
+            if stopped_s - 10.0 < collision_s <= stopped_s
+        ]
+        if earlier:
+            print(
+                '{:8.2f}s speed history stopped, {:.2f}s after the'
+                ' accelerometer'.format(
+                    stopped_s - start_s,
+                    stopped_s - earlier[0]
+                )
+            )
+        else:
+            print(
+                '{:8.2f}s speed history stopped, not detected by the'
+                ' accelerometer'.format(stopped_s - start_s)
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Replays the sensor readings and drive commands from a log file through each
+of the location filters and compares them.
+
+Accuracy is measured by how well each filter predicts the next GPS reading
+before it's applied. If a device is held out, its readings are never applied
+and are only used to score the filters, so with two GPS sources, one can be
+used to judge how well the filters do with the other one.
+
+Usage: python -m analysis.replay_location_filters <log file> [held out device id]
+"""
+
+from dateutil import parser as dateparser
+import json
+import math
+import mock
+import re
+import sys
+import time
+
+from control.ekf_location_filter import EkfLocationFilter
+from control.telemetry import LOCATION_FILTERS
+from control.telemetry import Telemetry
+
+DRIVE_RE = re.compile(r'Throttle: (-?[0-9.]+), steering: (-?[0-9.]+)')
+# Same as Telemetry._update_estimated_drive
+BASE_MAX_TURN_RATE_D_S = 150.0
+# Let the filters converge before scoring
+WARM_UP_READINGS = 10
+
+
+def timestamp(line):
+    """Returns the timestamp of a log line."""
+    dt = dateparser.parse(line[:line.find(',')])
+    comma = line.find(',')
+    millis = float(line[comma + 1:line.find(':', comma)])
+    return dt.timestamp() + millis / 1000.
+
+
+def read_events(lines):
+    """Returns (time, kind, data) tuples for the readings and drive commands
+    in a log.
+    """
+    events = []
+    for line in lines:
+        match = DRIVE_RE.search(line)
+        if match is not None:
+            events.append((
+                timestamp(line),
+                'drive',
+                (float(match.group(1)), float(match.group(2)))
+            ))
+            continue
+        if '"device_id"' not in line:
+            continue
+        try:
+            data = json.loads(line[line.find('{'):line.rfind('}') + 1])
+        except ValueError:
+            continue
+        if data['device_id'] == 'estimate':
+            continue
+        if 'latitude_d' in data:
+            events.append((timestamp(line), 'gps', data))
+        elif 'compass_d' in data:
+            events.append((timestamp(line), 'compass', data))
+    return events
+
+
+def replay(events, filter_class, held_out_device=None):
+    """Replays events through a location filter. Returns the RMS prediction
+    error in meters, the number of scored readings and the average time per
+    update in seconds.
+    """
+    clock = [events[0][0]]
+    patches = [
+        mock.patch(module + '.time')
+        for module in ('control.location_filter', 'control.ekf_location_filter')
+    ]
+    for patch in patches:
+        patch.start().time.side_effect = lambda: clock[0]
+
+    try:
+        location_filter = None
+        squared_error = 0.0
+        scored = 0
+        readings = 0
+        updates = 0
+        update_time_s = 0.0
+        for event_time_s, kind, data in events:
+            clock[0] = event_time_s
+            start = time.time()
+
+            if kind == 'drive':
+                if location_filter is None:
+                    continue
+                throttle, steering = data
+                if hasattr(location_filter, 'manual_steering_angle'):
+                    location_filter.manual_steering_angle(
+                        steering * EkfLocationFilter.MAX_STEERING_ANGLE_D
+                    )
+                elif throttle != 0.0:
+                    location_filter.manual_steering(
+                        steering * BASE_MAX_TURN_RATE_D_S
+                    )
+                else:
+                    location_filter.manual_steering(0.0)
+
+            elif kind == 'compass':
+                if location_filter is None:
+                    continue
+                location_filter.update_compass(
+                    data['compass_d'],
+                    data['confidence']
+                )
+
+            else:
+                x_m = Telemetry.longitude_to_m_offset(
+                    data['longitude_d'],
+                    data['latitude_d']
+                )
+                y_m = Telemetry.latitude_to_m_offset(data['latitude_d'])
+                if location_filter is None:
+                    location_filter = filter_class(
+                        x_m,
+                        y_m,
+                        data['heading_d']
+                    )
+                    continue
+
+                readings += 1
+                location_filter.update_dead_reckoning()
+                if readings > WARM_UP_READINGS and (
+                        held_out_device is None
+                        or data['device_id'] == held_out_device
+                ):
+                    estimate = location_filter.estimated_location()
+                    squared_error += (
+                        (estimate[0] - x_m) ** 2 + (estimate[1] - y_m) ** 2
+                    )
+                    scored += 1
+                if data['device_id'] != held_out_device:
+                    location_filter.update_gps(
+                        x_m,
+                        y_m,
+                        data['accuracy_m'],
+                        data['accuracy_m'],
+                        data['heading_d'],
+                        data['speed_m_s']
+                    )
+
+            update_time_s += time.time() - start
+            updates += 1
+    finally:
+        for patch in patches:
+            patch.stop()
+
+    if scored == 0:
+        return None, 0, update_time_s / max(updates, 1)
+    return (
+        math.sqrt(squared_error / scored),
+        scored,
+        update_time_s / max(updates, 1)
+    )
+
+
+def main():
+    """Main function."""
+    if sys.version_info.major <= 2:
+        print('Please use Python 3')
+        sys.exit(1)
+    if len(sys.argv) not in (2, 3):
+        print('Usage: {} <log file> [held out device id]'.format(sys.argv[0]))
+        sys.exit(1)
+
+    with open(sys.argv[1]) as file_:
+        events = read_events(file_.readlines())
+    held_out_device = sys.argv[2] if len(sys.argv) > 2 else None
+    if not events:
+        print('No readings found')
+        sys.exit(1)
+
+    for name in sorted(LOCATION_FILTERS.keys()):
+        error_m, scored, update_s = replay(
+            events,
+            LOCATION_FILTERS[name],
+            held_out_device
+        )
+        if error_m is None:
+            print('{:8} no readings to score'.format(name))
+            continue
+        print(
+            '{:8} RMS prediction error {:.2f} m over {} readings,'
+            ' {:.1f} us per update'.format(
+                name,
+                error_m,
+                scored,
+                update_s * 1e6
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Records video from the Pi camera in its own thread.
+
+Starting the camera takes a while, and it used to be done by Command just
+before it started driving, so the car sat on the starting line waiting for
+it. Start and stop requests are queued here and return right away.
+
+While recording, the time that each frame was captured is saved, using the
+same clock as the telemetry (time.time()), so the video can be lined up with
+the logs. When the recording stops, the frame index is written next to the
+video as <video file>.frames, with one "frame,timestamp_s" line per frame.
+"""
+
+import queue
+import threading
+import time
+
+from messaging import metrics
+from messaging.async_logger import AsyncLogger
+
+try:
+    import picamera
+except ImportError:
+    class Dummy(object):  # pylint: disable=missing-docstring,too-few-public-methods
+        def __getattr__(self, attr):
+            time.sleep(0.01)
+            return Dummy()
+        def __call__(self, *args, **kwargs):
+            time.sleep(0.01)
+            return Dummy()
+    picamera = Dummy()
+
+
+class FrameIndexOutput(object):
+    """File-like output for the camera that writes the video to a file and
+    saves when each frame was captured.
+    """
+
+    def __init__(self, camera, file_name):
+        self._camera = camera
+        self._file = open(file_name, 'wb')
+        # Camera clock to time.time()
+        self._offset_s = None
+        self.frames = []
+
+    def write(self, data):
+        """Writes encoded video data. The camera writes each frame in one or
+        more pieces, and the frame is complete on the last one.
+        """
+        frame = self._camera.frame
+        if (
+                frame is not None
+                and frame.complete
+                and frame.timestamp is not None
+        ):
+            if self._offset_s is None:
+                self._offset_s = time.time() - self._camera.timestamp / 1e6
+            self.frames.append(
+                (frame.index, frame.timestamp / 1e6 + self._offset_s)
+            )
+        return self._file.write(data)
+
+    def flush(self):
+        """Flushes the video file."""
+        self._file.flush()
+
+    def close(self):
+        """Closes the video file."""
+        self._file.close()
+
+
+class CameraRecorder(threading.Thread):
+    """Starts and stops recording video when asked, without blocking the
+    caller.
+    """
+
+    def __init__(self, camera=None):
+        """Opens a PiCamera in the thread unless camera is given."""
+        super(CameraRecorder, self).__init__()
+        self.name = self.__class__.__name__
+        self._camera = camera
+        self._requests = queue.Queue()
+        self._logger = AsyncLogger()
+        self._output = None
+        self._file_name = None
+        self._frames = []
+        self._lock = threading.Lock()
+        self._start_time = metrics.histogram(
+            'camera_request_seconds',
+            'Time taken by the camera to handle recording requests',
+            request='start'
+        )
+        self._stop_time = metrics.histogram(
+            'camera_request_seconds',
+            'Time taken by the camera to handle recording requests',
+            request='stop'
+        )
+
+    def start_recording(self, file_name):
+        """Asks the camera to start recording to file_name."""
+        self._requests.put(file_name)
+
+    def stop_recording(self):
+        """Asks the camera to stop recording."""
+        self._requests.put(False)
+
+    def kill(self):
+        """Stops recording and stops the thread."""
+        self._requests.put(None)
+
+    def is_recording(self):
+        """Returns True if the camera is recording."""
+        with self._lock:
+            return self._output is not None
+
+    def frames(self):
+        """Returns (frame index, timestamp) pairs for the frames of the
+        current or last recording.
+        """
+        with self._lock:
+            if self._output is not None:
+                return list(self._output.frames)
+            return list(self._frames)
+
+    def run(self):
+        """Handles recording requests until killed."""
+        if self._camera is None:
+            try:
+                self._camera = picamera.PiCamera()
+            except Exception as exc:  # pylint: disable=broad-except
+                self._logger.warning('Unable to open camera: {}'.format(exc))
+        while True:
+            request = self._requests.get()
+            if request is None:
+                break
+            if self._camera is None:
+                continue
+            if request is False:
+                self._stop_camera()
+            else:
+                self._start_camera(request)
+        self._stop_camera()
+
+    def _start_camera(self, file_name):
+        """Starts recording."""
+        if self._output is not None:
+            self._logger.info(
+                'Already recording video to {}'.format(self._file_name)
+            )
+            return
+        start = time.time()
+        output = None
+        try:
+            output = FrameIndexOutput(self._camera, file_name)
+            self._camera.start_recording(output, format='h264')
+        except Exception as exc:  # pylint: disable=broad-except
+            self._logger.warning('Unable to save video: {}'.format(exc))
+            if output is not None:
+                output.close()
+            return
+        with self._lock:
+            self._output = output
+            self._file_name = file_name
+        self._start_time.observe(time.time() - start)
+        self._logger.info('Recording video to {}'.format(file_name))
+
+    def _stop_camera(self):
+        """Stops recording and saves the frame index."""
+        if self._output is None:
+            return
+        start = time.time()
+        try:
+            self._camera.stop_recording()
+        except Exception as exc:  # pylint: disable=broad-except
+            self._logger.warning('Unable to stop video: {}'.format(exc))
+        output = self._output
+        output.close()
+        with self._lock:
+            self._frames = output.frames
+            self._output = None
+        self._stop_time.observe(time.time() - start)
+
+        try:
+            with open(self._file_name + '.frames', 'w') as index_file:
+                index_file.write('frame,timestamp_s\n')
+                for index, timestamp_s in self._frames:
+                    index_file.write('{},{:.6f}\n'.format(index, timestamp_s))
+        except IOError as exc:
+            self._logger.warning(
+                'Unable to save frame index: {}'.format(exc)
+            )
+        self._logger.info(
+            'Recorded {} frames to {}'.format(
+                len(self._frames),
+                self._file_name
+            )
+        )
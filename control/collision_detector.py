@@ -0,0 +1,152 @@
+"""Detects when the car has run into something or is stuck, from the
+accelerometer and the commanded throttle.
+
+Waiting for the GPS to report a speed of 0 takes seconds, and some GPS modules
+report a slow drift instead of 0 when they're stationary. The accelerometer
+reacts much sooner:
+
+- impact: the car suddenly decelerates, or is pushed sideways, much harder
+  than it can by itself. Forward readings are compared to the mean of the last
+  few, so driving up a slope doesn't look like an impact.
+- stall: the car was told to drive from a standstill (or kept the throttle on
+  after an impact), but after STALL_S it hasn't picked up any speed according
+  to the integrated forward acceleration, and it isn't vibrating like it would
+  if it were rolling over the ground.
+
+The windows are sized in seconds rather than readings, because accelerometers
+report at different rates: the SUP800F sends a few samples in a burst after
+each GPS fix, about once a second, while others send a steady stream. Readings
+should be given with the time they were taken, and the horizontal readings
+should already have the accelerometer's bias removed. Everything is O(1)
+amortized per reading.
+"""
+
+from messaging import metrics
+from messaging.streaming_statistics import TimeWindowedStats
+
+STANDARD_GRAVITY_M_S_S = 9.80665
+
+
+class CollisionDetector(object):  # pylint: disable=too-many-instance-attributes
+    """Detects impacts and stalls from accelerometer readings."""
+    # Longer than the gaps between SUP800F bursts, so that there's always
+    # something to compare the first reading of a burst to
+    IMPACT_WINDOW_S = 2.0
+    # The car can only accelerate about 0.1 g by itself, and turns at up to
+    # about 1 g at top speed
+    IMPACT_DECELERATION_G = 0.8
+    IMPACT_LATERAL_G = 1.5
+    STALL_THROTTLE = 0.3
+    STALL_S = 0.3
+    # The vibration is measured over this long, once there are enough
+    # readings for the standard deviation to mean something
+    STALL_WINDOW_S = 0.5
+    STALL_MIN_READINGS = 3
+    STALL_SPEED_M_S = 0.25
+    STALL_VIBRATION_G = 0.03
+    # Don't integrate over gaps in the readings, other than the ones between
+    # SUP800F bursts
+    MAX_READING_GAP_S = 1.5
+
+    def __init__(self):
+        self._forward_g = TimeWindowedStats(self.IMPACT_WINDOW_S)
+        self._vertical_g = TimeWindowedStats(self.STALL_WINDOW_S)
+        self._throttle = 0.0
+        # When the car started trying to drive, and the speed it has gained
+        # since then. None if it's not trying or has already got going.
+        self._armed_s = None
+        self._speed_m_s = 0.0
+        self._last_reading_s = None
+        self._collision = None
+
+        self._impacts = metrics.counter(
+            'collisions_total',
+            'Impacts and stalls detected from the accelerometer',
+            kind='impact'
+        )
+        self._stalls = metrics.counter(
+            'collisions_total',
+            'Impacts and stalls detected from the accelerometer',
+            kind='stall'
+        )
+
+    def drive(self, timestamp_s, throttle):
+        """Handles a drive command."""
+        if throttle >= self.STALL_THROTTLE:
+            if self._throttle <= 0.0:
+                self._arm(timestamp_s)
+        else:
+            self._armed_s = None
+        self._throttle = throttle
+
+    def add(self, timestamp_s, forward_g, left_g, vertical_g):
+        """Handles an accelerometer reading taken at timestamp_s. forward_g
+        and left_g should have the bias removed, and can be None if the bias
+        isn't known yet.
+        """
+        if self._last_reading_s is None:
+            elapsed_s = 0.0
+        else:
+            elapsed_s = min(
+                max(timestamp_s - self._last_reading_s, 0.0),
+                self.MAX_READING_GAP_S
+            )
+        self._last_reading_s = timestamp_s
+        if forward_g is None or left_g is None:
+            return
+
+        self._forward_g.expire(timestamp_s)
+        if self._is_impact(forward_g, left_g):
+            self._detect('impact', self._impacts)
+            self._forward_g.clear()
+            if self._throttle >= self.STALL_THROTTLE:
+                # It might be pushing against whatever it hit
+                self._arm(timestamp_s)
+            return
+        self._forward_g.add(timestamp_s, forward_g)
+
+        if self._armed_s is None:
+            return
+        self._vertical_g.add(timestamp_s, vertical_g)
+        self._speed_m_s = max(
+            self._speed_m_s + forward_g * STANDARD_GRAVITY_M_S_S * elapsed_s,
+            0.0
+        )
+        if self._speed_m_s >= self.STALL_SPEED_M_S:
+            # It got going
+            self._armed_s = None
+        elif (
+                timestamp_s - self._armed_s >= self.STALL_S
+                and len(self._vertical_g) >= self.STALL_MIN_READINGS
+                and self._vertical_g.std_dev() < self.STALL_VIBRATION_G
+        ):
+            self._detect('stall', self._stalls)
+            self._armed_s = None
+
+    def collision(self):
+        """Returns the kind of the last collision, 'impact' or 'stall', and
+        forgets it. Returns None if there hasn't been one since the last call.
+        """
+        collision = self._collision
+        self._collision = None
+        return collision
+
+    def _is_impact(self, forward_g, left_g):
+        """Returns True if the reading looks like the car hit something."""
+        if self._throttle <= 0.0 or len(self._forward_g) == 0:
+            return False
+        return (
+            self._forward_g.mean - forward_g > self.IMPACT_DECELERATION_G
+            or abs(left_g) > self.IMPACT_LATERAL_G
+        )
+
+    def _arm(self, timestamp_s):
+        """Starts watching for a stall."""
+        self._armed_s = timestamp_s
+        self._speed_m_s = 0.0
+        self._vertical_g.clear()
+
+    def _detect(self, kind, counter):
+        """Records a collision."""
+        self._collision = kind
+        counter.inc()
@@ -9,24 +9,14 @@ import threading
 import time
 import traceback
 
+from control.camera_recorder import CameraRecorder
 from control.telemetry import Telemetry
 from messaging import config
+from messaging import metrics
 from messaging.message_consumer import consume_messages
 from messaging.async_logger import AsyncLogger
 from messaging.async_producers import CommandForwardProducer
-
-
-try:
-    import picamera
-except ImportError:
-    class Dummy(object):  # pylint: disable=missing-docstring,too-few-public-methods
-        def __getattr__(self, attr):
-            time.sleep(0.01)
-            return Dummy()
-        def __call__(self, *args, **kwargs):
-            time.sleep(0.01)
-            return Dummy()
-    picamera = Dummy()
+from messaging.scheduler import get_scheduler
 
 
 class Command(threading.Thread):  # pylint: disable=too-many-instance-attributes
@@ -37,6 +27,12 @@ class Command(threading.Thread):  # pylint: disable=too-many-instance-attributes
     NEUTRAL_TIME_2_S = 0.25
     NEUTRAL_TIME_3_S = 1.0
     STRAIGHT_TIME_S = 8.0
+    STOP_RECORDING_DELAY_S = 5.0
+    INVERTED_CHECK_S = 0.25
+    INVERTED_START_DELAY_S = 3.0
+    # Keys for the scheduled tasks, so that there's only one of each pending
+    STOP_RECORDING_TASK = 'command:stop-recording'
+    INVERTED_START_TASK = 'command:inverted-start'
 
     def __init__(
             self,
@@ -44,8 +40,11 @@ class Command(threading.Thread):  # pylint: disable=too-many-instance-attributes
             driver,
             waypoint_generator,
             sleep_time_milliseconds=None,
+            camera_recorder=None,
     ):
-        """Create the Command thread."""
+        """Create the Command thread. Video is recorded with
+        camera_recorder, which is started and stopped with this thread.
+        """
         super(Command, self).__init__()
         self.name = self.__class__.__name__
 
@@ -56,6 +55,7 @@ class Command(threading.Thread):  # pylint: disable=too-many-instance-attributes
             self._sleep_time_seconds = sleep_time_milliseconds / 1000.0
         self._driver = driver
         self._logger = AsyncLogger()
+        self._scheduler = get_scheduler()
         self._forwarder = CommandForwardProducer()
         self._run = True
         self._run_course = False
@@ -65,7 +65,28 @@ class Command(threading.Thread):  # pylint: disable=too-many-instance-attributes
         self._wake_time = None
         self._start_time = None
 
-        self._camera = picamera.PiCamera()
+        self._loop_time = metrics.histogram(
+            'command_loop_seconds',
+            'Time spent awake in each control loop iteration'
+        )
+        # The histogram buckets are too coarse to see small regressions
+        self._loop_time_summary = metrics.summary(
+            'command_loop_awake_seconds',
+            'Quantiles of the time spent awake in each control loop iteration'
+        )
+        self._loop_overruns = metrics.counter(
+            'command_loop_overruns_total',
+            'Control loop iterations that took longer than the loop period'
+        )
+        # Mostly time spent waiting for the GIL, e.g. for the web servers
+        self._loop_jitter = metrics.summary(
+            'command_loop_jitter_seconds',
+            'How much later than scheduled the control loop woke up'
+        )
+
+        if camera_recorder is None:
+            camera_recorder = CameraRecorder()
+        self._camera = camera_recorder
 
         # If the car is on the starting line (not started yet)
         self._on_starting_line = True
@@ -83,6 +104,8 @@ class Command(threading.Thread):  # pylint: disable=too-many-instance-attributes
         self._thread.name = '{}:consume_messages'.format(
             self.__class__.__name__
         )
+        # Messages are handled by the dispatcher, this only waits for QUIT
+        self._thread.daemon = True
         self._thread.start()
 
     def _handle_message(self, command):
@@ -109,23 +132,24 @@ class Command(threading.Thread):  # pylint: disable=too-many-instance-attributes
             return
 
         if command == 'start':
-            try:
-                now = datetime.datetime.now()
-                file_name = '/data/{}-{}-{}_{}:{}:{}.h264'.format(
-                    now.year,
-                    now.month,
-                    now.day,
-                    now.hour,
-                    now.minute,
-                    now.second
-                )
+            now = datetime.datetime.now()
+            file_name = '/data/{}-{}-{}_{}:{}:{}.h264'.format(
+                now.year,
+                now.month,
+                now.day,
+                now.hour,
+                now.minute,
+                now.second
+            )
+            # If it was stopped recently, it's still recording. Otherwise,
+            # the camera starts in its own thread while the car drives.
+            if not self._scheduler.cancel(self.STOP_RECORDING_TASK):
                 self._camera.start_recording(file_name)
-            except Exception as exc:  # pylint: disable=broad-except
-                self._logger.warning('Unable to save video: {}'.format(exc))
             self.run_course()
 
         elif command == 'stop':
-            threading.Thread(target=self._stop_recording).start()
+            self._scheduler.cancel(self.INVERTED_START_TASK)
+            self._stop_recording()
             self.stop()
 
         elif command == 'reset':
@@ -144,14 +168,31 @@ class Command(threading.Thread):  # pylint: disable=too-many-instance-attributes
             time_awake = self._sleep_time - self._wake_time
         else:
             time_awake = 0.0
-        time.sleep(max(self._sleep_time_seconds - time_awake, 0.0))
+        self._loop_time.observe(time_awake)
+        self._loop_time_summary.observe(time_awake)
+        if time_awake > self._sleep_time_seconds:
+            self._loop_overruns.inc()
+        sleep_seconds = max(self._sleep_time_seconds - time_awake, 0.0)
+        time.sleep(sleep_seconds)
         self._wake_time = time.time()
+        self._loop_jitter.observe(
+            self._wake_time - self._sleep_time - sleep_seconds
+        )
 
     def run(self):
         """Run in a thread, controls the RC car."""
+        self._camera.start()
+        try:
+            self._control()
+        finally:
+            self._camera.kill()
+            self._camera.join()
+
+    def _control(self):
+        """Controls the RC car until killed."""
         error_count = 0
         if self._waypoint_generator.done():
-            threading.Thread(target=self._stop_recording).start()
+            self._stop_recording()
             self._logger.info('All waypoints reached')
             return
 
@@ -162,18 +203,11 @@ class Command(threading.Thread):  # pylint: disable=too-many-instance-attributes
                         self._handle_message(self._commands.get())
                     if self._telemetry.is_inverted():
                         self._logger.info('Car is inverted, starting in 3')
-
-                        def inverted_start():
-                            while self._telemetry.is_inverted():
-                                time.sleep(0.25)
-                            self._logger.info('Starting in 3 seconds')
-                            time.sleep(3)
-                            if not self._run_course:
-                                self._handle_message('start')
-                            else:
-                                self._logger.info('Inverted start aborted')
-
-                        threading.Thread(target=inverted_start).start()
+                        self._scheduler.schedule(
+                            0.0,
+                            self._inverted_start,
+                            key=self.INVERTED_START_TASK
+                        )
 
                     self._wait()
 
@@ -266,7 +300,15 @@ class Command(threading.Thread):  # pylint: disable=too-many-instance-attributes
         """Returns an iterator that drives everything."""
         course_iterator = self._run_course_iterator()
         while True:
-            if (
+            # The accelerometer notices much sooner than the GPS speed
+            collision = self._telemetry.get_collision()
+            stuck = True
+            if collision is not None:
+                self._logger.info(
+                    'RC car detected a {} from the accelerometer,'
+                    ' reversing'.format(collision)
+                )
+            elif (
                     self._telemetry.is_stopped()
                     and self._start_time is not None
                     and time.time() - self._start_time > 2.0
@@ -274,7 +316,10 @@ class Command(threading.Thread):  # pylint: disable=too-many-instance-attributes
                 self._logger.info(
                     'RC car is not moving according to speed history, reversing'
                 )
+            else:
+                stuck = False
 
+            if stuck:
                 unstuck_iterator = self._unstuck_yourself_iterator(1.0)
 
                 while next(unstuck_iterator):
@@ -512,5 +557,35 @@ class Command(threading.Thread):  # pylint: disable=too-many-instance-attributes
 
     def _stop_recording(self):
         """Stops recording after a little while."""
-        time.sleep(5)
-        self._camera.stop_recording()
+        self._scheduler.schedule(
+            self.STOP_RECORDING_DELAY_S,
+            self._camera.stop_recording,
+            key=self.STOP_RECORDING_TASK
+        )
+
+    def _inverted_start(self):
+        """Starts the course a few seconds after the car has been turned
+        back over.
+        """
+        if self._telemetry.is_inverted():
+            self._scheduler.schedule(
+                self.INVERTED_CHECK_S,
+                self._inverted_start,
+                key=self.INVERTED_START_TASK
+            )
+            return
+        self._logger.info(
+            'Starting in {:g} seconds'.format(self.INVERTED_START_DELAY_S)
+        )
+        self._scheduler.schedule(
+            self.INVERTED_START_DELAY_S,
+            self._start_after_inverted,
+            key=self.INVERTED_START_TASK
+        )
+
+    def _start_after_inverted(self):
+        """Starts the course unless it's already been started."""
+        if not self._run_course:
+            self._commands.put('start')
+        else:
+            self._logger.info('Inverted start aborted')
@@ -0,0 +1,313 @@
+"""Compass (magnetometer) calibration.
+
+The magnetometer readings should trace a circle around the origin as the car
+turns, but nearby iron and magnets distort them: hard iron shifts the center
+of the circle, and soft iron stretches it into a rotated ellipse. EllipseFit
+fits an ellipse to the readings by least squares, and CompassCalibration maps
+readings from that ellipse back onto a circle around the origin.
+
+Calibrations are saved to disk by CalibrationStore, keyed by device, so that
+the compass doesn't need to be calibrated before every run.
+"""
+
+import json
+import math
+import numpy
+import os
+import threading
+import time
+
+
+class CompassCalibration(object):
+    """Hard and soft iron correction for a magnetometer, plus the expected
+    squared magnitude of corrected readings, for rejecting outliers.
+    """
+
+    def __init__(
+            self,
+            offsets,
+            soft_iron=None,
+            magnitude_mean=None,
+            magnitude_std_dev=None,
+            samples=None,
+            timestamp_s=None
+    ):
+        self.offsets = (float(offsets[0]), float(offsets[1]))
+        if soft_iron is None:
+            soft_iron = ((1.0, 0.0), (0.0, 1.0))
+        self.soft_iron = tuple(
+            (float(row[0]), float(row[1])) for row in soft_iron
+        )
+        self.magnitude_mean = magnitude_mean
+        self.magnitude_std_dev = magnitude_std_dev
+        self.samples = samples
+        self.timestamp_s = timestamp_s
+
+    def correct(self, flux_x, flux_y):
+        """Returns the corrected (x, y) flux of a reading."""
+        x_offset = flux_x - self.offsets[0]
+        y_offset = flux_y - self.offsets[1]
+        row_1, row_2 = self.soft_iron
+        return (
+            row_1[0] * x_offset + row_1[1] * y_offset,
+            row_2[0] * x_offset + row_2[1] * y_offset
+        )
+
+    def correct_many(self, flux_x, flux_y):
+        """Returns arrays of the corrected x and y flux of arrays of
+        readings.
+        """
+        x_offset = numpy.asarray(flux_x, dtype=float) - self.offsets[0]
+        y_offset = numpy.asarray(flux_y, dtype=float) - self.offsets[1]
+        row_1, row_2 = self.soft_iron
+        return (
+            row_1[0] * x_offset + row_1[1] * y_offset,
+            row_2[0] * x_offset + row_2[1] * y_offset
+        )
+
+    def to_dict(self):
+        """Returns the calibration as a JSON serializable dictionary."""
+        return {
+            'offsets': list(self.offsets),
+            'soft_iron': [list(row) for row in self.soft_iron],
+            'magnitude_mean': self.magnitude_mean,
+            'magnitude_std_dev': self.magnitude_std_dev,
+            'samples': self.samples,
+            'timestamp_s': self.timestamp_s,
+        }
+
+    @staticmethod
+    def from_dict(values):
+        """Returns a calibration from a dictionary from to_dict. The
+        magnitudes are needed to reject outliers, so if either is missing,
+        both are taken from DEFAULT_CALIBRATION.
+        """
+        magnitude_mean = values.get('magnitude_mean')
+        magnitude_std_dev = values.get('magnitude_std_dev')
+        if magnitude_mean is None or magnitude_std_dev is None:
+            magnitude_mean = DEFAULT_CALIBRATION.magnitude_mean
+            magnitude_std_dev = DEFAULT_CALIBRATION.magnitude_std_dev
+        return CompassCalibration(
+            values['offsets'],
+            values.get('soft_iron'),
+            float(magnitude_mean),
+            float(magnitude_std_dev),
+            values.get('samples'),
+            values.get('timestamp_s')
+        )
+
+
+# From a calibration observation of the SUP800F on the car, before soft iron
+# correction
+DEFAULT_CALIBRATION = CompassCalibration(
+    (-11.87, -5.97),
+    magnitude_mean=353.310,
+    magnitude_std_dev=117.918
+)
+
+
+class EllipseFit(object):
+    """Least squares ellipse fit that takes readings as they arrive. Only the
+    6x6 matrix of sums of products of (x^2, xy, y^2, x, y, 1) is kept, so
+    memory use is constant and fitting can be done at any point.
+    """
+    MIN_SAMPLES = 50
+    # Longer ellipses than this probably mean that the car didn't turn all of
+    # the way around
+    MAX_AXIS_RATIO = 3.0
+
+    def __init__(self):
+        # Readings are shifted by the first one to keep the sums well
+        # conditioned
+        self._reference = None
+        self._sums = numpy.zeros((6, 6))
+        self._minimums = numpy.array([float('inf')] * 2)
+        self._maximums = numpy.array([-float('inf')] * 2)
+        self.count = 0
+
+    def add(self, flux_x, flux_y):
+        """Adds a single reading."""
+        self.add_many(numpy.array([flux_x]), numpy.array([flux_y]))
+
+    def add_many(self, flux_x, flux_y):
+        """Adds arrays of readings."""
+        flux_x = numpy.asarray(flux_x, dtype=float)
+        flux_y = numpy.asarray(flux_y, dtype=float)
+        if len(flux_x) == 0:
+            return
+        if self._reference is None:
+            self._reference = (flux_x[0], flux_y[0])
+        self._minimums = numpy.minimum(
+            self._minimums,
+            (flux_x.min(), flux_y.min())
+        )
+        self._maximums = numpy.maximum(
+            self._maximums,
+            (flux_x.max(), flux_y.max())
+        )
+        x = flux_x - self._reference[0]  # pylint: disable=invalid-name
+        y = flux_y - self._reference[1]  # pylint: disable=invalid-name
+        features = numpy.column_stack(
+            (x * x, x * y, y * y, x, y, numpy.ones(len(x)))
+        )
+        self._sums += features.T.dot(features)
+        self.count += len(x)
+
+    def fit(self):
+        """Returns the CompassCalibration for the readings so far. If they
+        don't fit an ellipse well, only the hard iron offset is corrected,
+        using the middle of the range of readings. Raises ValueError if there
+        aren't enough readings.
+        """
+        if self.count < self.MIN_SAMPLES:
+            raise ValueError(
+                'Need at least {} readings to calibrate, have {}'.format(
+                    self.MIN_SAMPLES,
+                    self.count
+                )
+            )
+        reference = numpy.array(self._reference)
+        try:
+            center, soft_iron = self._fit_ellipse()
+        except (ValueError, numpy.linalg.LinAlgError):
+            center = (self._minimums + self._maximums) * 0.5 - reference
+            soft_iron = numpy.identity(2)
+
+        mean, variance = self._magnitude_statistics(center, soft_iron)
+        return CompassCalibration(
+            center + reference,
+            soft_iron.tolist(),
+            mean,
+            math.sqrt(variance),
+            self.count,
+            time.time()
+        )
+
+    def _fit_ellipse(self):
+        """Returns the center, relative to the reference, and the matrix
+        that maps the ellipse onto a circle. Raises ValueError if the
+        readings aren't an ellipse.
+        """
+        # Direct least squares fit of a x^2 + b xy + c y^2 + d x + e y + f = 0
+        # with 4ac - b^2 = 1, which is always an ellipse. See Halir and
+        # Flusser, "Numerically stable direct least squares fitting of
+        # ellipses".
+        sums = self._sums
+        quadratic_sums = sums[:3, :3]
+        mixed_sums = sums[:3, 3:]
+        linear_sums = sums[3:, 3:]
+        linear_from_quadratic = -numpy.linalg.solve(linear_sums, mixed_sums.T)
+        reduced = quadratic_sums + mixed_sums.dot(linear_from_quadratic)
+        # Multiply by the inverse of the constraint matrix
+        reduced = numpy.array([
+            reduced[2] / 2.0,
+            -reduced[1],
+            reduced[0] / 2.0,
+        ])
+        _, eigenvectors = numpy.linalg.eig(reduced)
+        eigenvectors = numpy.real(eigenvectors)
+        constraint = (
+            4.0 * eigenvectors[0] * eigenvectors[2] - eigenvectors[1] ** 2
+        )
+        candidates = numpy.nonzero(constraint > 0.0)[0]
+        if len(candidates) == 0:
+            raise ValueError('Not an ellipse')
+        quadratic_coefficients = eigenvectors[:, candidates[0]]
+        # pylint: disable=invalid-name
+        a, b, c = quadratic_coefficients
+        d, e, f = linear_from_quadratic.dot(quadratic_coefficients)
+
+        # Rewrite it as (p - center)' Q (p - center) = 1
+        quadratic = numpy.array([[a, b / 2.0], [b / 2.0, c]])
+        center = -0.5 * numpy.linalg.solve(quadratic, (d, e))
+        scale = center.dot(quadratic).dot(center) - f
+        if scale == 0.0:
+            raise ValueError('Not an ellipse')
+        eigenvalues, eigenvectors = numpy.linalg.eigh(quadratic / scale)
+        if eigenvalues.min() <= 0.0:
+            raise ValueError('Not an ellipse')
+        semi_axes = 1.0 / numpy.sqrt(eigenvalues)
+        if semi_axes.max() / semi_axes.min() > self.MAX_AXIS_RATIO:
+            raise ValueError('Ellipse is too long')
+
+        # Scale to a circle with the same area, so that magnitudes stay
+        # about the same as they were before soft iron correction
+        radius = math.sqrt(semi_axes[0] * semi_axes[1])
+        soft_iron = radius * eigenvectors.dot(
+            numpy.diag(numpy.sqrt(eigenvalues))
+        ).dot(eigenvectors.T)
+        return center, soft_iron
+
+    def _magnitude_statistics(self, center, soft_iron):
+        """Returns the mean and variance of the squared magnitude of the
+        corrected readings. It's a linear combination of the features, so it
+        comes straight from the sums.
+        """
+        # |W (p - c)|^2 = p' M p - 2 c' M p + c' M c, where M = W' W
+        product = soft_iron.T.dot(soft_iron)
+        product_center = product.dot(center)
+        weights = numpy.array([
+            product[0, 0],
+            2.0 * product[0, 1],
+            product[1, 1],
+            -2.0 * product_center[0],
+            -2.0 * product_center[1],
+            center.dot(product_center),
+        ])
+        moments = self._sums / self.count
+        mean = weights.dot(moments[:, 5])
+        variance = weights.dot(moments).dot(weights) - mean ** 2
+        return mean, max(variance, 0.0)
+
+
+class CalibrationStore(object):
+    """Saves and loads calibrations in a JSON file, keyed by device."""
+
+    def __init__(self, file_name):
+        self._file_name = file_name
+        self._lock = threading.Lock()
+
+    def load(self, device_id):
+        """Returns the saved calibration for a device, or None if there
+        isn't one. Raises ValueError if the file is corrupt.
+        """
+        with self._lock:
+            calibrations = self._read()
+        if device_id not in calibrations:
+            return None
+        try:
+            return CompassCalibration.from_dict(calibrations[device_id])
+        except (KeyError, TypeError, IndexError, ValueError) as exc:
+            raise ValueError(
+                'Bad calibration for {}: {}'.format(device_id, exc)
+            )
+
+    def save(self, device_id, calibration):
+        """Saves the calibration for a device."""
+        with self._lock:
+            try:
+                calibrations = self._read()
+            except ValueError:
+                # Don't let a corrupt file keep us from saving a good one
+                calibrations = {}
+            calibrations[device_id] = calibration.to_dict()
+            # Write and rename so that a crash doesn't leave a partial file
+            temp_file_name = self._file_name + '.tmp'
+            with open(temp_file_name, 'w') as file_:
+                json.dump(calibrations, file_, indent=2, sort_keys=True)
+            os.replace(temp_file_name, self._file_name)
+
+    def _read(self):
+        """Returns all of the saved calibrations."""
+        if not os.path.exists(self._file_name):
+            return {}
+        with open(self._file_name) as file_:
+            try:
+                calibrations = json.load(file_)
+            except ValueError as exc:
+                raise ValueError(
+                    'Unable to read {}: {}'.format(self._file_name, exc)
+                )
+        if not isinstance(calibrations, dict):
+            raise ValueError('Bad calibration file {}'.format(self._file_name))
+        return calibrations
@@ -0,0 +1,351 @@
+"""Compiles KML and KMZ course files into course bundles.
+
+A course file has a LineString placemark with the waypoints, a Polygon
+placemark named "course" with the outer boundary, and Polygon placemarks named
+"inner..." for obstacles. Parsing it with pykml is slow, and both the waypoint
+generator and Telemetry need it, so load_course parses each file once into a
+CourseBundle with everything projected to meters. Bundles are cached in memory
+and on disk, keyed by the hash of the file contents, so loading the same
+course again, in this run or the next one, skips the KML parsing.
+"""
+
+from pykml import parser
+import hashlib
+import math
+import os
+import re
+import struct
+import threading
+import zipfile
+
+from control.telemetry import CENTRAL_LATITUDE
+from control.telemetry import CENTRAL_LONGITUDE
+from control.telemetry import Telemetry
+
+
+COURSE_DIRECTORY = 'paths' + os.sep
+DEFAULT_CACHE_DIRECTORY = COURSE_DIRECTORY + '.cache' + os.sep
+# Change this when the bundle format or what's compiled into it changes
+BUNDLE_MAGIC = b'AVCC'
+BUNDLE_VERSION = 1
+_HEADER_FORMAT = '<4sH'
+_COUNT_FORMAT = '<I'
+
+
+class CourseBundle(object):
+    """The waypoints and boundaries of a course, in meters from the central
+    point, with the segment headings and lengths between waypoints and
+    bounding boxes of the polygons precomputed.
+    """
+
+    def __init__(self, waypoints, course, inner, file_hash=None):
+        """waypoints is None if the course file doesn't have any."""
+        self.waypoints = waypoints
+        self.course = course
+        self.inner = inner
+        self.file_hash = file_hash
+
+        self.segment_headings_d = []
+        self.segment_lengths_m = []
+        for start, end in zip(waypoints or (), (waypoints or ())[1:]):
+            self.segment_headings_d.append(
+                Telemetry.relative_degrees(start[0], start[1], end[0], end[1])
+            )
+            self.segment_lengths_m.append(
+                math.sqrt((end[0] - start[0]) ** 2 + (end[1] - start[1]) ** 2)
+            )
+        self.course_bounds = self._bounds(course) if course else None
+        self.inner_bounds = [self._bounds(polygon) for polygon in inner]
+
+    def point_in_course(self, point_m):
+        """Returns True if a point is inside the course and outside all of
+        the inner obstacles. Courses without a boundary contain every point.
+        """
+        if not self.course:
+            return True
+        if not self._in_bounds(point_m, self.course_bounds):
+            return False
+        if not Telemetry.point_in_polygon(point_m, self.course):
+            return False
+        for polygon, bounds in zip(self.inner, self.inner_bounds):
+            if self._in_bounds(point_m, bounds) and Telemetry.point_in_polygon(
+                    point_m,
+                    polygon
+            ):
+                return False
+        return True
+
+    def to_bytes(self):
+        """Returns the bundle in the binary bundle format."""
+        parts = [struct.pack(_HEADER_FORMAT, BUNDLE_MAGIC, BUNDLE_VERSION)]
+        if self.waypoints is None:
+            parts.append(struct.pack('<?', False))
+        else:
+            parts.append(struct.pack('<?', True))
+            parts.append(_pack_points(self.waypoints))
+        parts.append(_pack_values(self.segment_headings_d))
+        parts.append(_pack_values(self.segment_lengths_m))
+        parts.append(_pack_points(self.course))
+        parts.append(struct.pack(_COUNT_FORMAT, len(self.inner)))
+        for polygon in self.inner:
+            parts.append(_pack_points(polygon))
+        return b''.join(parts)
+
+    @staticmethod
+    def from_bytes(data, file_hash=None):
+        """Returns a bundle from to_bytes. Raises ValueError if the data isn't
+        a bundle of the current version.
+        """
+        try:
+            magic, version = struct.unpack_from(_HEADER_FORMAT, data)
+            if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+                raise ValueError('Not a version {} course bundle'.format(
+                    BUNDLE_VERSION
+                ))
+            offset = struct.calcsize(_HEADER_FORMAT)
+            has_waypoints = struct.unpack_from('<?', data, offset)[0]
+            offset += 1
+            waypoints = None
+            if has_waypoints:
+                waypoints, offset = _unpack_points(data, offset)
+            headings_d, offset = _unpack_values(data, offset)
+            lengths_m, offset = _unpack_values(data, offset)
+            course, offset = _unpack_points(data, offset)
+            inner_count = struct.unpack_from(_COUNT_FORMAT, data, offset)[0]
+            offset += struct.calcsize(_COUNT_FORMAT)
+            inner = []
+            for _ in range(inner_count):
+                polygon, offset = _unpack_points(data, offset)
+                inner.append(polygon)
+        except struct.error as exc:
+            raise ValueError('Truncated course bundle: {}'.format(exc))
+        if offset != len(data):
+            raise ValueError('Extra data in course bundle')
+
+        bundle = CourseBundle.__new__(CourseBundle)
+        bundle.waypoints = waypoints
+        bundle.course = course
+        bundle.inner = inner
+        bundle.file_hash = file_hash
+        bundle.segment_headings_d = headings_d
+        bundle.segment_lengths_m = lengths_m
+        bundle.course_bounds = (
+            CourseBundle._bounds(course) if course else None
+        )
+        bundle.inner_bounds = [
+            CourseBundle._bounds(polygon) for polygon in inner
+        ]
+        return bundle
+
+    @staticmethod
+    def _bounds(points):
+        """Returns the (min x, min y, max x, max y) of some points."""
+        return (
+            min(point[0] for point in points),
+            min(point[1] for point in points),
+            max(point[0] for point in points),
+            max(point[1] for point in points),
+        )
+
+    @staticmethod
+    def _in_bounds(point, bounds):
+        """Returns True if a point is in a bounding box."""
+        return (
+            bounds[0] <= point[0] <= bounds[2]
+            and bounds[1] <= point[1] <= bounds[3]
+        )
+
+
+def _pack_values(values):
+    """Packs a count and a list of doubles."""
+    return struct.pack(
+        '<I{}d'.format(len(values)),
+        len(values),
+        *values
+    )
+
+
+def _unpack_values(data, offset):
+    """Unpacks _pack_values and returns the list and the new offset."""
+    count = struct.unpack_from(_COUNT_FORMAT, data, offset)[0]
+    offset += struct.calcsize(_COUNT_FORMAT)
+    values_format = '<{}d'.format(count)
+    values = list(struct.unpack_from(values_format, data, offset))
+    return values, offset + struct.calcsize(values_format)
+
+
+def _pack_points(points):
+    """Packs a list of (x, y) points."""
+    return _pack_values([value for point in points for value in point])
+
+
+def _unpack_points(data, offset):
+    """Unpacks _pack_points and returns the list and the new offset."""
+    values, offset = _unpack_values(data, offset)
+    return list(zip(values[0::2], values[1::2])), offset
+
+
+def compile_kml(kml_stream, file_hash=None):
+    """Parses a KML stream and returns its CourseBundle. Raises ValueError
+    if it's not a KML file.
+    """
+    def get_child(element, tag_name):
+        """Returns the child element with the given tag name."""
+        try:
+            return getattr(element, tag_name)
+        except AttributeError:
+            raise ValueError('No {tag} element found'.format(tag=tag_name))
+
+    def get_points(coordinates):
+        """Returns the points in a coordinates element, in meters."""
+        points = []
+        text = coordinates.text.strip()
+        for csv in re.split(r'\s', text):
+            (
+                longitude,
+                latitude,
+                altitude  # pylint: disable=unused-variable
+            ) = csv.split(',')
+
+            latitude = float(latitude)
+            # This is Telemetry.longitude_to_m_offset without its cache of
+            # the meters per degree, which depends on earlier calls, so that
+            # bundles only depend on the file
+            m_per_d_longitude = Telemetry.latitude_to_m_per_d_longitude(
+                latitude,
+                cache=True
+            )
+            points.append((
+                m_per_d_longitude * (float(longitude) - CENTRAL_LONGITUDE),
+                Telemetry.latitude_to_m_offset(latitude)
+            ))
+        return points
+
+    root = parser.parse(kml_stream).getroot()
+    if 'kml' not in root.tag:
+        raise ValueError('Not a KML file')
+
+    waypoints = None
+    course = []
+    inner = []
+    document = get_child(root, 'Document')
+    for placemark in document.iterchildren():
+        if not placemark.tag.endswith('Placemark'):
+            continue
+
+        if hasattr(placemark, 'LineString'):
+            # Only the first path has waypoints
+            if waypoints is None:
+                # Unlike all of the other tag names, "coordinates" is not
+                # capitalized
+                waypoints = get_points(
+                    get_child(placemark.LineString, 'coordinates')
+                )
+            continue
+
+        try:
+            polygon = get_child(placemark, 'Polygon')
+        except ValueError:
+            continue
+        bound = get_child(polygon, 'outerBoundaryIs')
+        ring = get_child(bound, 'LinearRing')
+        points = get_points(get_child(ring, 'coordinates'))
+        if str(placemark.name).startswith('course'):
+            course = points
+        elif str(placemark.name).startswith('inner'):
+            inner.append(points)
+
+    return CourseBundle(waypoints, course, inner, file_hash)
+
+
+def course_file_name(kml_file_name):
+    """Returns the path of a course file, which is relative to the paths
+    directory.
+    """
+    if not kml_file_name.startswith(COURSE_DIRECTORY):
+        kml_file_name = COURSE_DIRECTORY + kml_file_name
+    return kml_file_name
+
+
+class CourseCache(object):
+    """Cache of compiled courses, in memory and on disk."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY):
+        self._directory = directory
+        self._bundles = {}
+        self._lock = threading.Lock()
+
+    def load(self, kml_file_name):
+        """Returns the CourseBundle for a KML or KMZ file, compiling it if it
+        hasn't been seen before.
+        """
+        kml_file_name = course_file_name(kml_file_name)
+        with open(kml_file_name, 'rb') as file_:
+            contents = file_.read()
+        # Courses are projected around the central point
+        file_hash = hashlib.sha1(
+            contents
+            + '{!r},{!r}'.format(CENTRAL_LATITUDE, CENTRAL_LONGITUDE).encode()
+        ).hexdigest()
+
+        with self._lock:
+            if file_hash in self._bundles:
+                return self._bundles[file_hash]
+
+        bundle = self._read(file_hash)
+        if bundle is None:
+            if kml_file_name.endswith('.kmz'):
+                with zipfile.ZipFile(kml_file_name) as archive:
+                    with archive.open('doc.kml') as stream:
+                        bundle = compile_kml(stream, file_hash)
+            else:
+                with open(kml_file_name, 'rb') as stream:
+                    bundle = compile_kml(stream, file_hash)
+            self._write(bundle)
+
+        with self._lock:
+            self._bundles[file_hash] = bundle
+        return bundle
+
+    def clear(self):
+        """Forgets the bundles in memory."""
+        with self._lock:
+            self._bundles.clear()
+
+    def _bundle_file_name(self, file_hash):
+        """Returns the file name of a bundle."""
+        return os.path.join(self._directory, file_hash + '.course')
+
+    def _read(self, file_hash):
+        """Returns the cached bundle from disk, or None."""
+        try:
+            with open(self._bundle_file_name(file_hash), 'rb') as file_:
+                return CourseBundle.from_bytes(file_.read(), file_hash)
+        except (IOError, OSError, ValueError):
+            # Missing, unreadable or from an old version; just recompile it
+            return None
+
+    def _write(self, bundle):
+        """Saves a bundle to disk, if possible. The cache is only an
+        optimization, so failures are ignored.
+        """
+        file_name = self._bundle_file_name(bundle.file_hash)
+        temp_file_name = '{}.{}.tmp'.format(file_name, os.getpid())
+        try:
+            if not os.path.exists(self._directory):
+                os.makedirs(self._directory)
+            with open(temp_file_name, 'wb') as file_:
+                file_.write(bundle.to_bytes())
+            os.replace(temp_file_name, file_name)
+        except (IOError, OSError):
+            pass
+
+
+_CACHE = CourseCache()
+
+
+def load_course(kml_file_name):
+    """Returns the CourseBundle for a KML or KMZ file in the paths
+    directory, using the shared cache.
+    """
+    return _CACHE.load(kml_file_name)
@@ -1,5 +1,8 @@
 """Drives the Tamiya Grasshopper."""
 
+import time
+
+from messaging import metrics
 from messaging.async_logger import AsyncLogger
 
 THROTTLE_GPIO_PIN = 18
@@ -24,6 +27,14 @@ class Driver(object):
         self._throttle = 0.0
         self._steering = 0.0
         self._max_throttle = 1.0
+        self._drive_commands = metrics.counter(
+            'driver_commands_total',
+            'Drive commands sent to the servos'
+        )
+        self._write_time = metrics.histogram(
+            'driver_write_seconds',
+            'Time spent writing drive commands to pi-blaster'
+        )
 
         with open('/dev/pi-blaster', 'w') as blaster:
             blaster.write(
@@ -72,6 +83,8 @@ class Driver(object):
             # Reverse is slower than forward, so allow 2x
             throttle = max(-2 * self._max_throttle, throttle_percentage, -1.0)
 
+        self._drive_commands.inc()
+        start = time.time()
         with open('/dev/pi-blaster', 'w') as blaster:
             blaster.write(
                 '{pin}={throttle}\n'.format(
@@ -85,6 +98,7 @@ class Driver(object):
                     steering=self._get_steering(steering_percentage)
                 )
             )
+        self._write_time.observe(time.time() - start)
 
     def get_throttle(self):
         """Returns the current throttle."""
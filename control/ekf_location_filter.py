@@ -0,0 +1,321 @@
+"""Extended Kalman filter for the location of the vehicle, using a kinematic
+bicycle model. It has the same interface as LocationFilter, so Telemetry can
+use either one.
+
+Unlike LocationFilter, heading changes are part of the model instead of being
+applied on the side, and the state includes the yaw rate and acceleration.
+The yaw rate follows the steering angle and speed:
+
+    yaw rate = speed * tan(steering angle) / wheelbase
+
+so the car turns faster at higher speeds, instead of at a fixed rate for a
+given steering value.
+"""
+
+import math
+import numpy
+import time
+
+# pylint: disable=no-member
+
+
+def _wrap_radians(angle_r):
+    """Wraps an angle to [-pi, pi)."""
+    return (angle_r + math.pi) % (2.0 * math.pi) - math.pi
+
+
+# Converts degrees squared to radians squared
+_D2_TO_R2 = math.radians(1.0) ** 2
+
+
+class EkfLocationFilter(object):
+    """Extended Kalman filter for the location of the vehicle."""
+    MAX_SPEED_M_S = 11.0 * 5280 / 60 / 60 / 3.2808399  # 11 MPH
+
+    # Tamiya Grasshopper
+    WHEELBASE_M = 0.253
+    # From observation, the car turns at about 150 d/s at full steering and
+    # half throttle (about 2.25 m/s), which works out to about 16.5 degrees
+    MAX_STEERING_ANGLE_D = 16.5
+    # How quickly the yaw rate follows the steering, i.e. how long it takes
+    # for the servo to move and the tires to bite
+    YAW_RATE_TIME_CONSTANT_S = 0.2
+    # Without accelerometer readings, let the acceleration fade out
+    ACCELERATION_TIME_CONSTANT_S = 1.0
+    # Measurements that are older than this are moved forward to the time of
+    # the last observation using the current speed and heading
+    MAX_DELAY_S = 1.0
+
+    # State indices
+    X, Y, HEADING, SPEED, YAW_RATE, ACCELERATION = range(6)
+
+    # Process noise per second
+    PROCESS_NOISE = numpy.diag([
+        0.05,  # x m
+        0.05,  # y m
+        2.0 * _D2_TO_R2,  # heading r
+        0.5,  # speed m/s
+        math.radians(30.0) ** 2,  # yaw rate r/s
+        1.0,  # acceleration m/s/s
+    ])
+
+    # Measurement noise. Like LocationFilter, these are variances, and the
+    # GPS accuracy is used as the position variance.
+    GPS_HEADING_NOISE = 5.0 * _D2_TO_R2
+    GPS_SPEED_NOISE = MAX_SPEED_M_S * 0.1
+    # These are coming from GPS readings that are out of bounds, so they
+    # are set artificially high
+    HEADING_SPEED_HEADING_NOISE = 20.0 * _D2_TO_R2
+    HEADING_SPEED_SPEED_NOISE = MAX_SPEED_M_S * 0.5
+    SPEED_ESTIMATION_NOISE = 2.0
+    # The motor and the ground shake the accelerometer a lot
+    ACCELEROMETER_NOISE = 0.5 ** 2
+    # Below this speed, the lateral acceleration is mostly noise and can't be
+    # used to measure the yaw rate
+    MIN_YAW_RATE_SPEED_M_S = 1.0
+    # Extra position variance per second of delay for late measurements
+    DELAY_NOISE_M_S = 0.5
+
+    def __init__(self, x_m, y_m, heading_d=None):
+        if heading_d is None:
+            heading_d = 0.0
+        self._estimates = numpy.array(
+            [x_m, y_m, math.radians(heading_d), 0.0, 0.0, 0.0]
+        )
+        self._covariance = numpy.diag([1.0, 1.0, 1.0, 1.0, 0.1, 0.1])
+        self._identity = numpy.identity(6)
+        self._last_observation_s = time.time()
+        # Either the steering angle or a fixed turn rate drives the yaw rate
+        self._steering_angle_r = 0.0
+        self._turn_rate_r_s = None
+
+    def update_gps(
+            self,
+            x_m,
+            y_m,
+            x_accuracy_m,
+            y_accuracy_m,
+            heading_d,
+            speed_m_s,
+            timestamp_s=None
+    ):
+        """Update the state estimation using the provided GPS measurement.
+        timestamp_s is when the measurement was taken, if known.
+        """
+        indices = [self.X, self.Y]
+        values = [x_m, y_m]
+        noise = [x_accuracy_m, y_accuracy_m]
+        if heading_d is not None:
+            indices.append(self.HEADING)
+            values.append(math.radians(heading_d))
+            noise.append(self.GPS_HEADING_NOISE)
+        if speed_m_s is not None:
+            indices.append(self.SPEED)
+            values.append(speed_m_s)
+            noise.append(self.GPS_SPEED_NOISE)
+        self._measure(indices, values, noise, timestamp_s)
+
+    def update_heading_and_speed(self, heading_d, speed_m_s):
+        """Updates the heading and speed based on GPS readings. This should be
+        used for out of bounds measurements, where while the coordinates
+        positions may be bad, the heading and speed are usually good.
+        """
+        if heading_d is None or speed_m_s is None:
+            return
+        self._measure(
+            [self.HEADING, self.SPEED],
+            [math.radians(heading_d), speed_m_s],
+            [self.HEADING_SPEED_HEADING_NOISE, self.HEADING_SPEED_SPEED_NOISE]
+        )
+
+    def update_compass(self, compass_d, confidence):
+        """Update the heading estimation."""
+        self._measure(
+            [self.HEADING],
+            [math.radians(compass_d)],
+            # Same guess as LocationFilter
+            [(45.0 + 45.0 * (1.0 - confidence)) * _D2_TO_R2]
+        )
+
+    def update_dead_reckoning(self):
+        """Update the dead reckoning position estimate."""
+        self._predict_to(time.time())
+
+    def update_accelerometer(self, forward_m_s_s, right_m_s_s):
+        """Update the acceleration and yaw rate estimation from the
+        accelerometer.
+        """
+        indices = [self.ACCELERATION]
+        values = [forward_m_s_s]
+        noise = [self.ACCELEROMETER_NOISE]
+        # Predict first so that the yaw rate is computed from the current
+        # speed
+        self._predict_to(time.time())
+        speed_m_s = self._estimates[self.SPEED]
+        if abs(speed_m_s) >= self.MIN_YAW_RATE_SPEED_M_S:
+            # centripetal acceleration = speed * yaw rate
+            indices.append(self.YAW_RATE)
+            values.append(right_m_s_s / speed_m_s)
+            noise.append(self.ACCELEROMETER_NOISE / speed_m_s ** 2)
+        self._measure(indices, values, noise)
+
+    def manual_throttle(self, speed_m_s):
+        """Update the estimated speed based on throttle input."""
+        self._measure([self.SPEED], [speed_m_s], [self.SPEED_ESTIMATION_NOISE])
+
+    def manual_steering(self, turn_d_s):
+        """Sets a fixed turn rate, for compatibility with LocationFilter.
+        Prefer manual_steering_angle.
+        """
+        self._turn_rate_r_s = math.radians(turn_d_s)
+
+    def manual_steering_angle(self, steering_angle_d):
+        """Update the steering angle of the front wheels. Positive is right."""
+        self._turn_rate_r_s = None
+        self._steering_angle_r = math.radians(steering_angle_d)
+
+    def estimated_location(self):
+        """Returns the estimated true location in x and y meters."""
+        return (self._estimates[self.X], self._estimates[self.Y])
+
+    def estimated_heading(self):
+        """Returns the estimated true heading in degrees."""
+        return math.degrees(self._estimates[self.HEADING]) % 360.0
+
+    def estimated_speed(self):
+        """Returns the estimated speed in meters per second."""
+        return self._estimates[self.SPEED]
+
+    def estimated_yaw_rate_d_s(self):
+        """Returns the estimated yaw rate in degrees per second."""
+        return math.degrees(self._estimates[self.YAW_RATE])
+
+    def estimated_acceleration_m_s_s(self):
+        """Returns the estimated forward acceleration."""
+        return self._estimates[self.ACCELERATION]
+
+    def _measure(self, indices, values, noise, timestamp_s=None):
+        """Predicts forward to when a measurement was taken and applies it.
+        Late measurements are moved forward to the last observation instead.
+        """
+        now = time.time()
+        if timestamp_s is None or timestamp_s > now:
+            timestamp_s = now
+        delay_s = self._last_observation_s - timestamp_s
+        if delay_s <= 0.0:
+            self._predict_to(timestamp_s)
+        elif delay_s <= self.MAX_DELAY_S:
+            values, noise = self._move_forward(indices, values, noise, delay_s)
+        else:
+            self._predict_to(now)
+        self._update(indices, values, noise)
+
+    def _move_forward(self, indices, values, noise, delay_s):
+        """Moves a late measurement forward by delay_s using the current
+        estimates.
+        """
+        estimates = self._estimates
+        heading_r = estimates[self.HEADING]
+        distance_m = estimates[self.SPEED] * delay_s
+        shift = {
+            self.X: distance_m * math.sin(heading_r),
+            self.Y: distance_m * math.cos(heading_r),
+            self.HEADING: estimates[self.YAW_RATE] * delay_s,
+            self.SPEED: estimates[self.ACCELERATION] * delay_s,
+        }
+        extra_noise = (delay_s * self.DELAY_NOISE_M_S) ** 2
+        values = [
+            value + shift.get(index, 0.0)
+            for index, value in zip(indices, values)
+        ]
+        noise = [
+            value + (extra_noise if index in (self.X, self.Y) else 0.0)
+            for index, value in zip(indices, noise)
+        ]
+        return values, noise
+
+    def _predict_to(self, timestamp_s):
+        """Runs the prediction step up to some time."""
+        time_diff_s = timestamp_s - self._last_observation_s
+        if time_diff_s <= 0.0:
+            return
+        self._last_observation_s = timestamp_s
+        self._predict(time_diff_s)
+
+    def _predict(self, time_diff_s):
+        """Runs the bicycle model forward and updates the covariance."""
+        x_m, y_m, heading_r, speed_m_s, yaw_rate_r_s, acceleration_m_s_s = \
+            self._estimates
+        dt = time_diff_s  # pylint: disable=invalid-name
+
+        # The yaw rate moves towards what the steering is asking for
+        gain = min(dt / self.YAW_RATE_TIME_CONSTANT_S, 1.0)
+        if self._turn_rate_r_s is None:
+            yaw_per_speed = math.tan(self._steering_angle_r) / self.WHEELBASE_M
+            target_yaw_rate_r_s = speed_m_s * yaw_per_speed
+        else:
+            yaw_per_speed = 0.0
+            target_yaw_rate_r_s = self._turn_rate_r_s
+        new_yaw_rate_r_s = (
+            yaw_rate_r_s + (target_yaw_rate_r_s - yaw_rate_r_s) * gain
+        )
+
+        distance_m = speed_m_s * dt + 0.5 * acceleration_m_s_s * dt * dt
+        sin_heading = math.sin(heading_r)
+        cos_heading = math.cos(heading_r)
+        decay = math.exp(-dt / self.ACCELERATION_TIME_CONSTANT_S)
+
+        self._estimates = numpy.array([
+            x_m + distance_m * sin_heading,
+            y_m + distance_m * cos_heading,
+            _wrap_radians(heading_r + new_yaw_rate_r_s * dt),
+            speed_m_s + acceleration_m_s_s * dt,
+            new_yaw_rate_r_s,
+            acceleration_m_s_s * decay,
+        ])
+
+        # Jacobian of the model
+        half_dt2 = 0.5 * dt * dt
+        jacobian = numpy.identity(6)
+        jacobian[0, 2] = distance_m * cos_heading
+        jacobian[0, 3] = dt * sin_heading
+        jacobian[0, 5] = half_dt2 * sin_heading
+        jacobian[1, 2] = -distance_m * sin_heading
+        jacobian[1, 3] = dt * cos_heading
+        jacobian[1, 5] = half_dt2 * cos_heading
+        jacobian[2, 3] = gain * yaw_per_speed * dt
+        jacobian[2, 4] = (1.0 - gain) * dt
+        jacobian[3, 5] = dt
+        jacobian[4, 3] = gain * yaw_per_speed
+        jacobian[4, 4] = 1.0 - gain
+        jacobian[5, 5] = decay
+
+        self._covariance = (
+            jacobian.dot(self._covariance).dot(jacobian.T)
+            + self.PROCESS_NOISE * dt
+        )
+
+    def _update(self, indices, values, noise):
+        """Runs the Kalman update for the measured states."""
+        innovation = numpy.array(values) - self._estimates[indices]
+        if self.HEADING in indices:
+            position = indices.index(self.HEADING)
+            innovation[position] = _wrap_radians(innovation[position])
+
+        # H just selects states, so H * P * H' and P * H' are slices
+        covariance_columns = self._covariance[:, indices]
+        innovation_covariance = covariance_columns[indices, :] + numpy.diag(
+            # Keep it invertible even if a measurement claims to be perfect
+            numpy.maximum(noise, 1e-6)
+        )
+        kalman_gain = covariance_columns.dot(
+            numpy.linalg.inv(innovation_covariance)
+        )
+
+        self._estimates = self._estimates + kalman_gain.dot(innovation)
+        self._estimates[self.HEADING] = _wrap_radians(
+            self._estimates[self.HEADING]
+        )
+        self._covariance = self._covariance - kalman_gain.dot(
+            self._covariance[indices, :]
+        )
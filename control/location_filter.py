@@ -87,6 +87,22 @@ class LocationFilter(object):
         [0, 0, 0, MAX_SPEED_M_S * 0.5]
     ])
 
+    # Measurements are kept so that late ones (GPS fixes are usually 100+ ms
+    # old by the time that they get here) can be applied at the time that
+    # they were taken, and the later ones replayed after them
+    HISTORY_SIZE = 64
+    # Measurements older than this, or that would need more than this many
+    # later ones to be replayed, are applied when they arrive instead
+    MAX_DELAY_S = 1.0
+    MAX_REPLAY = 16
+
+    # Accelerometer readings older than this are ignored, in case the
+    # readings stop coming in
+    ACCELEROMETER_TIMEOUT_S = 0.5
+    # Below this speed, the lateral acceleration is mostly noise and can't be
+    # used to measure the turn rate
+    MIN_TURN_RATE_SPEED_M_S = 1.0
+
     # http://robotsforroboticists.com/kalman-filtering/ is a great reference
     def __init__(self, x_m, y_m, heading_d=None):
         if heading_d is None:
@@ -115,6 +131,40 @@ class LocationFilter(object):
 
         self._last_observation_s = time.time()
         self._estimated_turn_rate_d_s = 0.0
+        # From the accelerometer, used as control inputs
+        self._acceleration_m_s_s = 0.0
+        self._measured_turn_rate_d_s = None
+        self._last_accelerometer_s = None
+
+        # Ring buffer of past measurements and accelerometer readings, along
+        # with the estimates, covariance and accelerometer inputs right after
+        # each one was applied and the turn rate used to predict up to it.
+        # Missing values are NaN.
+        size = self.HISTORY_SIZE
+        self._history_time_s = numpy.zeros(size)
+        self._history_turn_rate_d_s = numpy.zeros(size)
+        self._history_estimates = numpy.zeros((size, 4))
+        self._history_covariance = numpy.zeros((size, 4, 4))
+        self._history_measurements = numpy.zeros((size, 4))
+        self._history_observer = numpy.zeros((size, 4, 4))
+        self._history_noise = numpy.zeros((size, 4, 4))
+        # Forward and right m/s/s for accelerometer readings
+        self._history_accelerometer_m_s_s = numpy.zeros((size, 2))
+        self._history_acceleration_m_s_s = numpy.zeros(size)
+        self._history_measured_turn_rate_d_s = numpy.zeros(size)
+        self._history_last_accelerometer_s = numpy.zeros(size)
+        self._history_start = 0
+        self._history_count = 0
+        # Start with the initial state so that measurements from before the
+        # first one can be replayed. It's the oldest entry, so it never needs
+        # to be replayed itself.
+        zeros = numpy.zeros((4, 4))
+        self._record(
+            self._last_observation_s,
+            numpy.matrix([0.0, 0.0, 0.0, 0.0]).transpose(),
+            zeros,
+            zeros
+        )
 
     def update_gps(
             self,
@@ -123,16 +173,15 @@ class LocationFilter(object):
             x_accuracy_m,
             y_accuracy_m,
             heading_d,
-            speed_m_s
+            speed_m_s,
+            timestamp_s=None
     ):
-        """Update the state estimation using the provided GPS measurement."""
+        """Update the state estimation using the provided GPS measurement.
+        timestamp_s is when the measurement was taken, if known.
+        """
         self.GPS_MEASUREMENT_NOISE[0].itemset(0, x_accuracy_m)
         self.GPS_MEASUREMENT_NOISE[1].itemset(1, y_accuracy_m)
 
-        now = time.time()
-        time_diff_s = now - self._last_observation_s
-        self._last_observation_s = now
-
         if heading_d is None:
             heading_d = 0.0
             if speed_m_s is None:
@@ -150,11 +199,11 @@ class LocationFilter(object):
             [x_m, y_m, heading_d, speed_m_s]
         ).transpose()  # z
 
-        self._update(
+        self._measure(
             measurements,
             matrix,
             self.GPS_MEASUREMENT_NOISE,
-            time_diff_s
+            timestamp_s
         )
 
     def update_heading_and_speed(self, heading_d, speed_m_s):
@@ -164,19 +213,14 @@ class LocationFilter(object):
         """
         if heading_d is None or speed_m_s is None:
             return
-        now = time.time()
-        time_diff_s = now - self._last_observation_s
-        self._last_observation_s = now
-
         measurements = numpy.matrix(
             [0, 0, heading_d, speed_m_s]
         ).transpose()  # z
 
-        self._update(
+        self._measure(
             measurements,
             self.HEADING_SPEED_OBSERVER_MATRIX,
-            self.HEADING_SPEED_MEASUREMENT_NOISE,
-            time_diff_s
+            self.HEADING_SPEED_MEASUREMENT_NOISE
         )
 
     def update_compass(self, compass_d, confidence):
@@ -185,19 +229,14 @@ class LocationFilter(object):
             [0.0, 0.0, compass_d, 0.0]
         ).transpose()  # z
 
-        now = time.time()
-        time_diff_s = now - self._last_observation_s
-        self._last_observation_s = now
-
         self.COMPASS_MEASUREMENT_NOISE[2].itemset(
             2,
             45 + 45 * (1.0 - confidence)
         )
-        self._update(
+        self._measure(
             measurements,
             self.COMPASS_OBSERVER_MATRIX,
-            self.COMPASS_MEASUREMENT_NOISE,
-            time_diff_s
+            self.COMPASS_MEASUREMENT_NOISE
         )
 
     def update_dead_reckoning(self):
@@ -214,21 +253,226 @@ class LocationFilter(object):
             [0.0, 0.0, 0.0, speed_m_s]
         ).transpose()  # z
 
-        now = time.time()
-        time_diff_s = now - self._last_observation_s
-        self._last_observation_s = now
-
-        self._update(
+        self._measure(
             measurements,
             self.SPEED_ESTIMATION_OBSERVER_MATRIX,
-            self.SPEED_ESTIMATION_MEASUREMENT_NOISE,
-            time_diff_s
+            self.SPEED_ESTIMATION_MEASUREMENT_NOISE
         )
 
     def manual_steering(self, turn_d_s):
         """Update the estimated turn rate based on steering input."""
         self._estimated_turn_rate_d_s = turn_d_s
 
+    def update_accelerometer(self, forward_m_s_s, right_m_s_s):
+        """Update the acceleration used for dead reckoning. The forward
+        acceleration changes the speed, and the lateral acceleration gives the
+        turn rate, which is more accurate than guessing it from the steering.
+        """
+        self._apply_accelerometer(forward_m_s_s, right_m_s_s, time.time())
+
+    def _apply_accelerometer(self, forward_m_s_s, right_m_s_s, timestamp_s):
+        """Applies an accelerometer reading at a time after the last
+        observation and records it in the history, so that it's replayed in
+        order with late measurements.
+        """
+        # The previous reading applies up until now
+        self._prediction_step(timestamp_s - self._last_observation_s)
+        self._last_observation_s = timestamp_s
+        self._acceleration_m_s_s = forward_m_s_s
+        speed_m_s = self.estimated_speed()
+        if abs(speed_m_s) >= self.MIN_TURN_RATE_SPEED_M_S:
+            # centripetal acceleration = speed * turn rate
+            self._measured_turn_rate_d_s = math.degrees(
+                right_m_s_s / speed_m_s
+            )
+        else:
+            self._measured_turn_rate_d_s = None
+        self._last_accelerometer_s = timestamp_s
+        zeros = numpy.zeros((4, 4))
+        self._record(
+            timestamp_s,
+            numpy.matrix([0.0, 0.0, 0.0, 0.0]).transpose(),
+            zeros,
+            zeros,
+            (forward_m_s_s, right_m_s_s)
+        )
+
+    def _measure(
+            self,
+            measurements,
+            observer_matrix,
+            measurement_noise,
+            timestamp_s=None
+    ):
+        """Applies a measurement taken at timestamp_s, or now if it's not
+        known. If later measurements have already been applied, the filter is
+        rewound to before the measurement and the later ones are replayed.
+        """
+        now = time.time()
+        if timestamp_s is None or timestamp_s > now:
+            timestamp_s = now
+
+        if timestamp_s >= self._last_observation_s:
+            self._apply(
+                measurements,
+                observer_matrix,
+                measurement_noise,
+                timestamp_s
+            )
+            return
+
+        index = self._history_index_before(timestamp_s)
+        if (
+                index is None
+                or now - timestamp_s > self.MAX_DELAY_S
+                or self._history_count - index - 1 > self.MAX_REPLAY
+        ):
+            # Too old to replay, so just use it now
+            self._apply(measurements, observer_matrix, measurement_noise, now)
+            return
+
+        # Take out the later measurements and rewind to just before this one
+        size = self.HISTORY_SIZE
+        later = [
+            (self._history_start + offset) % size
+            for offset in range(index + 1, self._history_count)
+        ]
+        replay = (
+            self._history_time_s[later],
+            self._history_turn_rate_d_s[later],
+            self._history_measurements[later],
+            self._history_observer[later],
+            self._history_noise[later],
+            self._history_accelerometer_m_s_s[later],
+        )
+        position = (self._history_start + index) % size
+        self._estimates = numpy.matrix(
+            self._history_estimates[position]
+        ).transpose()
+        self._covariance_matrix = numpy.matrix(
+            self._history_covariance[position]
+        )
+        self._last_observation_s = self._history_time_s[position]
+        self._acceleration_m_s_s = float(
+            self._history_acceleration_m_s_s[position]
+        )
+        self._measured_turn_rate_d_s = self._optional(
+            self._history_measured_turn_rate_d_s[position]
+        )
+        self._last_accelerometer_s = self._optional(
+            self._history_last_accelerometer_s[position]
+        )
+        self._history_count = index + 1
+
+        turn_rate_d_s = self._estimated_turn_rate_d_s
+        if later:
+            # Use the turn rate from when the measurement was taken
+            self._estimated_turn_rate_d_s = replay[1][0]
+        self._apply(
+            measurements,
+            observer_matrix,
+            measurement_noise,
+            timestamp_s
+        )
+        for replay_index in range(len(later)):
+            self._estimated_turn_rate_d_s = replay[1][replay_index]
+            forward_m_s_s, right_m_s_s = replay[5][replay_index]
+            if not math.isnan(forward_m_s_s):
+                self._apply_accelerometer(
+                    forward_m_s_s,
+                    right_m_s_s,
+                    replay[0][replay_index]
+                )
+                continue
+            self._apply(
+                numpy.matrix(replay[2][replay_index]).transpose(),
+                numpy.matrix(replay[3][replay_index]),
+                numpy.matrix(replay[4][replay_index]),
+                replay[0][replay_index]
+            )
+        self._estimated_turn_rate_d_s = turn_rate_d_s
+
+    def _apply(
+            self,
+            measurements,
+            observer_matrix,
+            measurement_noise,
+            timestamp_s
+    ):
+        """Applies a measurement at a time after the last observation and
+        records it in the history.
+        """
+        self._update(
+            measurements,
+            observer_matrix,
+            measurement_noise,
+            timestamp_s - self._last_observation_s
+        )
+        self._last_observation_s = timestamp_s
+        self._record(
+            timestamp_s,
+            measurements,
+            observer_matrix,
+            measurement_noise
+        )
+
+    def _record(
+            self,
+            timestamp_s,
+            measurements,
+            observer_matrix,
+            measurement_noise,
+            accelerometer_m_s_s=None
+    ):
+        """Adds a measurement or an accelerometer reading and the current
+        state to the history.
+        """
+        size = self.HISTORY_SIZE
+        if self._history_count < size:
+            position = (self._history_start + self._history_count) % size
+            self._history_count += 1
+        else:
+            # Overwrite the oldest
+            position = self._history_start
+            self._history_start = (self._history_start + 1) % size
+        self._history_time_s[position] = timestamp_s
+        self._history_turn_rate_d_s[position] = self._estimated_turn_rate_d_s
+        self._history_estimates[position] = self._estimates.A1
+        self._history_covariance[position] = self._covariance_matrix
+        self._history_measurements[position] = measurements.A1
+        self._history_observer[position] = observer_matrix
+        self._history_noise[position] = measurement_noise
+        if accelerometer_m_s_s is None:
+            accelerometer_m_s_s = (float('nan'), float('nan'))
+        self._history_accelerometer_m_s_s[position] = accelerometer_m_s_s
+        self._history_acceleration_m_s_s[position] = self._acceleration_m_s_s
+        self._history_measured_turn_rate_d_s[position] = (
+            float('nan') if self._measured_turn_rate_d_s is None
+            else self._measured_turn_rate_d_s
+        )
+        self._history_last_accelerometer_s[position] = (
+            float('nan') if self._last_accelerometer_s is None
+            else self._last_accelerometer_s
+        )
+
+    @staticmethod
+    def _optional(value):
+        """Converts a NaN from the history back to None."""
+        if math.isnan(value):
+            return None
+        return float(value)
+
+    def _history_index_before(self, timestamp_s):
+        """Returns the index in the history of the newest measurement taken
+        no later than timestamp_s, or None if there isn't one.
+        """
+        size = self.HISTORY_SIZE
+        for index in range(self._history_count - 1, -1, -1):
+            position = (self._history_start + index) % size
+            if self._history_time_s[position] <= timestamp_s:
+                return index
+        return None
+
     def _update(
             self,
             measurements,
@@ -302,7 +546,6 @@ class LocationFilter(object):
             (0.0, time_diff_s),
             heading_r
         )
-        speed_m_s = self.estimated_speed()
         transition = numpy.matrix([  # A
             [1.0, 0.0, 0.0, x_delta],
             [0.0, 1.0, 0.0, y_delta],
@@ -310,16 +553,43 @@ class LocationFilter(object):
             [0.0, 0.0, 0.0, 1.0]
         ])
 
+        if (
+                self._last_accelerometer_s is not None
+                and self._last_observation_s - self._last_accelerometer_s
+                < self.ACCELEROMETER_TIMEOUT_S
+        ):
+            acceleration_m_s_s = self._acceleration_m_s_s
+            turn_rate_d_s = self._measured_turn_rate_d_s
+        else:
+            acceleration_m_s_s = 0.0
+            turn_rate_d_s = None
+        if turn_rate_d_s is None:
+            turn_rate_d_s = self._estimated_turn_rate_d_s
+
         # Update heading estimate based on steering
         new_heading = Telemetry.wrap_degrees(
             self.estimated_heading()
-            + self._estimated_turn_rate_d_s * time_diff_s
+            + turn_rate_d_s * time_diff_s
         )
         self._estimates.itemset(2, new_heading)
 
-        # TODO: Add acceleration values
-
         self._estimates = transition * self._estimates
+
+        # The acceleration is a control input, x = A * x + B * u
+        if acceleration_m_s_s != 0.0:
+            distance_m = 0.5 * acceleration_m_s_s * time_diff_s ** 2
+            self._estimates.itemset(
+                0,
+                self._estimates.item(0) + distance_m * math.sin(heading_r)
+            )
+            self._estimates.itemset(
+                1,
+                self._estimates.item(1) + distance_m * math.cos(heading_r)
+            )
+            self._estimates.itemset(
+                3,
+                self._estimates.item(3) + acceleration_m_s_s * time_diff_s
+            )
         return transition
 
     def estimated_location(self):
@@ -0,0 +1,304 @@
+"""Prepares GPS readings from multiple devices (e.g. the SUP800F and phones
+running web telemetry) for the location filter.
+
+Each device has its own latency, its own slowly varying position bias and its
+own idea of how accurate it is. If the readings are fed to the filter as is,
+two sources fight each other instead of improving the estimate. For every
+device, this keeps track of:
+
+- latency: how old readings are when they arrive. Readings are moved forward
+  to the current time using their speed and heading.
+- bias: the average offset of the device's readings from the consensus of all
+  of the devices. It's removed from the readings.
+- accuracy scale: how much the reported accuracy has to be scaled to match the
+  observed error.
+
+Device clocks are expected to be roughly in sync with ours; the SUP800F and
+phones set theirs from GPS. Readings that look like they come from a device
+with a bad clock are passed through without being moved.
+
+Device IDs come from web clients, so only MAX_DEVICES devices are tracked at
+once, and only the first MAX_DEVICES get their own metric labels.
+"""
+
+import collections
+import math
+import threading
+import time
+
+from messaging import metrics
+
+
+class GpsDevice(object):  # pylint: disable=too-few-public-methods
+    """Fusion state for a single GPS device. Its metrics are labelled with
+    label, which defaults to the device ID.
+    """
+
+    def __init__(self, device_id, label=None):
+        if label is None:
+            label = device_id
+        self.device_id = device_id
+        self.latency_s = None
+        self.bias_x_m = 0.0
+        self.bias_y_m = 0.0
+        self.accuracy_scale = 1.0
+        self.readings = 0
+        self.last_seen_s = None
+        self.last_accuracy_m = None
+
+        self.latency_gauge = metrics.gauge(
+            'gps_device_latency_seconds',
+            'Average age of GPS readings when they arrive',
+            device=label
+        )
+        self.bias_x_gauge = metrics.gauge(
+            'gps_device_bias_m',
+            'Estimated position bias of GPS devices',
+            device=label,
+            axis='x'
+        )
+        self.bias_y_gauge = metrics.gauge(
+            'gps_device_bias_m',
+            'Estimated position bias of GPS devices',
+            device=label,
+            axis='y'
+        )
+        self.accuracy_scale_gauge = metrics.gauge(
+            'gps_device_accuracy_scale',
+            'Observed error divided by reported accuracy of GPS devices',
+            device=label
+        )
+        self.unaligned = metrics.counter(
+            'gps_device_unaligned_readings_total',
+            'GPS readings whose timestamps were too far off to use',
+            device=label
+        )
+
+
+class GpsFusion(object):
+    """Time aligns GPS readings and corrects them for per-device bias and
+    accuracy.
+    """
+    # Readings outside of this age range are assumed to come from a device
+    # with a bad clock
+    MIN_AGE_S = -0.5
+    MAX_AGE_S = 2.0
+    # Moving a reading forward adds error, because we don't know exactly how
+    # the vehicle moved
+    EXTRAPOLATION_ERROR_M_S = 0.5
+    # Smoothing factors for the per-device estimates
+    LATENCY_ALPHA = 0.1
+    BIAS_ALPHA = 0.05
+    ACCURACY_ALPHA = 0.05
+    MIN_ACCURACY_SCALE = 0.5
+    MAX_ACCURACY_SCALE = 5.0
+    # The filter needs some readings to converge before its estimate can be
+    # used to judge the devices
+    WARM_UP_READINGS = 10
+    # Devices that haven't sent a reading in this long don't count towards
+    # the consensus
+    ACTIVE_S = 5.0
+    # When there are this many devices, the least recently seen one is
+    # forgotten to make room for a new one
+    MAX_DEVICES = 10
+    OTHER_DEVICE = 'other'
+
+    def __init__(self, extrapolate=None):
+        """If extrapolate is False, readings aren't moved forward to the
+        current time; use this if the location filter applies readings at the
+        time they were taken.
+        """
+        if extrapolate is None:
+            extrapolate = True
+        self._extrapolate = extrapolate
+        # Least recently seen first
+        self._devices = collections.OrderedDict()
+        # Devices with their own metric labels
+        self._labels = set()
+        self._readings = 0
+        self._lock = threading.Lock()
+
+    def align(
+            self,
+            device_id,
+            x_m,
+            y_m,
+            accuracy_m,
+            heading_d,
+            speed_m_s,
+            timestamp_s,
+            estimate_m,
+            now=None
+    ):
+        """Returns the (x_m, y_m, accuracy_m) to give to the location filter
+        for a GPS reading. estimate_m is the filter's current (x_m, y_m)
+        estimate.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            device = self._devices.get(device_id)
+            if device is None:
+                if len(self._devices) >= self.MAX_DEVICES:
+                    self._devices.popitem(last=False)
+                device = GpsDevice(device_id, self._device_label(device_id))
+                self._devices[device_id] = device
+            else:
+                self._devices[device_id] = self._devices.pop(device_id)
+            device.readings += 1
+            device.last_seen_s = now
+            device.last_accuracy_m = accuracy_m
+            self._readings += 1
+
+            moved = self._move_to_now(
+                device,
+                x_m,
+                y_m,
+                accuracy_m,
+                heading_d,
+                speed_m_s,
+                timestamp_s,
+                now
+            )
+            # The estimate is for now, so compare it to the moved reading
+            if self._readings > self.WARM_UP_READINGS:
+                self._learn(device, moved[0], moved[1], moved[2], estimate_m)
+            if self._extrapolate:
+                x_m, y_m, accuracy_m = moved
+
+            bias_x_m, bias_y_m = self._relative_bias(device, now)
+            return (
+                x_m - bias_x_m,
+                y_m - bias_y_m,
+                accuracy_m * device.accuracy_scale
+            )
+
+    def devices(self):
+        """Returns the current estimates for each device."""
+        with self._lock:
+            return {
+                device_id: {
+                    'latency_s': device.latency_s,
+                    'bias_x_m': device.bias_x_m,
+                    'bias_y_m': device.bias_y_m,
+                    'accuracy_scale': device.accuracy_scale,
+                    'readings': device.readings,
+                }
+                for device_id, device in self._devices.items()
+            }
+
+    def device_label(self, device_id):
+        """Returns the metric label for a device: its ID for the first
+        MAX_DEVICES devices, and OTHER_DEVICE for the rest.
+        """
+        with self._lock:
+            return self._device_label(device_id)
+
+    def _device_label(self, device_id):
+        """Returns the metric label for a device. Must hold the lock."""
+        if device_id not in self._labels:
+            if len(self._labels) >= self.MAX_DEVICES:
+                return self.OTHER_DEVICE
+            self._labels.add(device_id)
+        return device_id
+
+    def measurement_time(self, timestamp_s, now=None):
+        """Returns when a reading was taken in seconds, or None if its
+        timestamp is missing or can't be trusted.
+        """
+        if timestamp_s is None:
+            return None
+        if now is None:
+            now = time.time()
+        # Browsers report milliseconds
+        if timestamp_s > 1e11:
+            timestamp_s /= 1000.0
+        if not self.MIN_AGE_S <= now - timestamp_s <= self.MAX_AGE_S:
+            return None
+        return timestamp_s
+
+    def _move_to_now(
+            self,
+            device,
+            x_m,
+            y_m,
+            accuracy_m,
+            heading_d,
+            speed_m_s,
+            timestamp_s,
+            now
+    ):
+        """Moves a reading forward to the current time."""
+        timestamp_s = self.measurement_time(timestamp_s, now)
+        if timestamp_s is None:
+            device.unaligned.inc()
+            return x_m, y_m, accuracy_m
+        age_s = now - timestamp_s
+
+        if device.latency_s is None:
+            device.latency_s = age_s
+        else:
+            device.latency_s += self.LATENCY_ALPHA * (age_s - device.latency_s)
+        device.latency_gauge.set(device.latency_s)
+
+        if heading_d is None or speed_m_s is None:
+            return x_m, y_m, accuracy_m
+        heading_r = math.radians(heading_d)
+        distance_m = speed_m_s * age_s
+        return (
+            x_m + distance_m * math.sin(heading_r),
+            y_m + distance_m * math.cos(heading_r),
+            accuracy_m + abs(age_s) * self.EXTRAPOLATION_ERROR_M_S
+        )
+
+    def _learn(self, device, x_m, y_m, accuracy_m, estimate_m):
+        """Updates the bias and accuracy scale of a device from how far its
+        reading is from the estimate.
+        """
+        residual_x_m = x_m - estimate_m[0]
+        residual_y_m = y_m - estimate_m[1]
+        device.bias_x_m += self.BIAS_ALPHA * (residual_x_m - device.bias_x_m)
+        device.bias_y_m += self.BIAS_ALPHA * (residual_y_m - device.bias_y_m)
+        device.bias_x_gauge.set(device.bias_x_m)
+        device.bias_y_gauge.set(device.bias_y_m)
+
+        # Compare the error that's left after removing the bias to what the
+        # device reports. The location filter uses the accuracy as the
+        # measurement variance, so compare it to the squared error.
+        error_squared = (
+            (residual_x_m - device.bias_x_m) ** 2
+            + (residual_y_m - device.bias_y_m) ** 2
+        ) / 2.0
+        ratio = error_squared / max(accuracy_m, 0.1)
+        scale = device.accuracy_scale
+        scale += self.ACCURACY_ALPHA * (ratio - scale)
+        device.accuracy_scale = min(
+            max(scale, self.MIN_ACCURACY_SCALE),
+            self.MAX_ACCURACY_SCALE
+        )
+        device.accuracy_scale_gauge.set(device.accuracy_scale)
+
+    def _relative_bias(self, device, now):
+        """Returns the bias of a device relative to the weighted average bias
+        of all of the active devices. The absolute bias can't be observed, so
+        the devices are pulled towards their consensus. With one device, this
+        is always 0.
+        """
+        total_weight = 0.0
+        mean_x_m = 0.0
+        mean_y_m = 0.0
+        for other in self._devices.values():
+            if now - other.last_seen_s > self.ACTIVE_S:
+                continue
+            accuracy_m = max(
+                other.last_accuracy_m * other.accuracy_scale,
+                0.1
+            )
+            weight = 1.0 / accuracy_m ** 2
+            total_weight += weight
+            mean_x_m += weight * other.bias_x_m
+            mean_y_m += weight * other.bias_y_m
+        return (
+            device.bias_x_m - mean_x_m / total_weight,
+            device.bias_y_m - mean_y_m / total_weight
+        )
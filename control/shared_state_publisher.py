@@ -0,0 +1,51 @@
+"""Publishes the fused telemetry to shared memory for other processes."""
+
+import threading
+import time
+
+
+class SharedStatePublisher(threading.Thread):
+    """Periodically writes the fused telemetry and the current waypoint into
+    the estimate section of the shared state.
+    """
+    SLEEP_SECONDS = 0.05
+
+    def __init__(
+            self,
+            shared_state,
+            telemetry,
+            waypoint_generator,
+            sleep_seconds=None
+    ):
+        super(SharedStatePublisher, self).__init__()
+        self.name = self.__class__.__name__
+        self._state = shared_state
+        self._telemetry = telemetry
+        self._waypoint_generator = waypoint_generator
+        if sleep_seconds is None:
+            self._sleep_seconds = self.SLEEP_SECONDS
+        else:
+            self._sleep_seconds = sleep_seconds
+        self._run = True
+
+    def run(self):
+        """Runs in a thread."""
+        while self._run:
+            time.sleep(self._sleep_seconds)
+            try:
+                self.publish()
+            except:  # pylint: disable=bare-except
+                pass
+
+    def publish(self):
+        """Writes the current estimate."""
+        # Don't update, because dead reckoning should only be driven by the
+        # control loop
+        values = self._telemetry.get_data(update=False)
+        values['waypoint_x_m'], values['waypoint_y_m'] = \
+            self._waypoint_generator.get_raw_waypoint()
+        self._state.write('estimate', values)
+
+    def kill(self):
+        """Stops the thread."""
+        self._run = False
@@ -0,0 +1,62 @@
+"""Stands in for Telemetry and the waypoint generator, using the state that
+the control process writes to shared memory.
+"""
+
+from messaging import config
+from messaging.message_producer import get_producer
+from messaging.shared_state import DEFAULT_NAME
+from messaging.shared_state import SharedState
+
+
+class SharedTelemetry(object):
+    """Stands in for Telemetry and the waypoint generator for things that
+    only show the state of the car, like the web apps and TelemetryDumper.
+    Reading never waits for the control loop.
+    """
+
+    ESTIMATE_FIELDS = (
+        'speed_m_s',
+        'heading_d',
+        'x_m',
+        'y_m',
+        'throttle',
+        'steering',
+    )
+
+    def __init__(self, state_name=DEFAULT_NAME):
+        self._state = SharedState(state_name)
+
+    def get_data(self, update=None):  # pylint: disable=unused-argument
+        """Returns the approximated telemetry data."""
+        estimate = self._read('estimate')
+        return {field: estimate[field] for field in self.ESTIMATE_FIELDS}
+
+    def get_target_drive(self):
+        """Returns the throttle and steering that the car was last told to
+        drive with.
+        """
+        drive = self._read('drive')
+        return drive['throttle'], drive['steering']
+
+    def get_raw_waypoint(self):
+        """Returns the current waypoint."""
+        estimate = self._read('estimate')
+        return estimate['waypoint_x_m'], estimate['waypoint_y_m']
+
+    @staticmethod
+    def load_kml_from_file_name(kml_file_name):
+        """Tells the control process's Telemetry to load the course."""
+        get_producer(config.TELEMETRY_EXCHANGE).publish({
+            'load_waypoints': kml_file_name
+        })
+
+    def close(self):
+        """Detaches from the shared memory block."""
+        self._state.close()
+
+    def _read(self, section):
+        """Returns the latest values of a section."""
+        values = self._state.read(section)
+        if values is None:
+            return dict.fromkeys(self._state.fields(section))
+        return values
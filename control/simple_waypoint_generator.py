@@ -11,18 +11,17 @@ waypoint per call; this should allow interfaces to implement other algorithms,
 such as the "rabbit chase" method.
 """
 
-from pykml import parser
 import copy
-import json
 import math
-import os
-import re
 import threading
 
-from control.telemetry import Telemetry
+from control.course_bundle import compile_kml
+from control.course_bundle import load_course
 from messaging import config
 from messaging.async_logger import AsyncLogger
 from messaging.message_consumer import consume_messages
+from messaging.message_consumer import load_message
+from messaging.scheduler import get_scheduler
 
 
 class SimpleWaypointGenerator(object):
@@ -48,6 +47,8 @@ class SimpleWaypointGenerator(object):
             self.__class__.__name__,
             config.WAYPOINT_EXCHANGE
         )
+        # Messages are handled by the dispatcher, this only waits for QUIT
+        thread.daemon = True
         thread.start()
 
     def get_current_waypoint(self, x_m, y_m):  # pylint: disable=unused-argument
@@ -99,73 +100,50 @@ class SimpleWaypointGenerator(object):
 
     def _handle_message(self, message):
         """Handles a message from the waypoint exchange."""
-        message = json.loads(str(message))
+        message = load_message(message)
         if 'command' not in message:
             self._logger.error('Invalid waypoint message: {}'.format(message))
             return
         if message['command'] == 'load' and 'file' in message:
-            try:
-                self._waypoints = self.get_waypoints_from_file_name(message['file'])
-                self._current_waypoint_index = 0
-            except Exception as exc:  # pylint: disable=broad-except
-                self._logger.error(
-                    'Unable to load waypoints from {}: {}'.format(
-                        message['file'],
-                        exc
-                    )
-                )
+            # Parsing the KML is too slow for the dispatcher's thread
+            file_name = message['file']
+            get_scheduler().schedule(
+                0.0,
+                lambda: self._load_waypoints_from_file_name(file_name),
+                key='waypoints:load',
+                replace=True
+            )
         else:
             self._logger.error(
                 'Invalid waypoint exchange message: {}'.format(message)
             )
 
-    @classmethod
-    def get_waypoints_from_file_name(cls, kml_file_name):
+    def _load_waypoints_from_file_name(self, kml_file_name):
+        """Replaces the waypoints with the ones from a file."""
+        try:
+            self._waypoints = self.get_waypoints_from_file_name(kml_file_name)
+            self._current_waypoint_index = 0
+        except Exception as exc:  # pylint: disable=broad-except
+            self._logger.error(
+                'Unable to load waypoints from {}: {}'.format(
+                    kml_file_name,
+                    exc
+                )
+            )
+
+    @staticmethod
+    def get_waypoints_from_file_name(kml_file_name):
         """Loads the KML waypoints from a file."""
-        directory = 'paths' + os.sep
-        if not kml_file_name.startswith(directory):
-            kml_file_name = directory + kml_file_name
-        if kml_file_name.endswith('.kmz'):
-            import zipfile
-            with zipfile.ZipFile(kml_file_name) as archive:
-                kml_stream = archive.open('doc.kml')
-                return cls._load_waypoints(kml_stream)
-        else:
-            with open(kml_file_name) as file_:
-                return cls._load_waypoints(file_)
+        bundle = load_course(kml_file_name)
+        if bundle.waypoints is None:
+            raise ValueError('No waypoints in {}'.format(kml_file_name))
+        # The bundle is shared, so don't let callers change it
+        return list(bundle.waypoints)
 
     @staticmethod
     def _load_waypoints(kml_stream):
         """Loads and returns the waypoints from a KML string."""
-
-        def get_child(element, tag_name):
-            """Returns the child element with the given tag name."""
-            try:
-                return getattr(element, tag_name)
-            except AttributeError:
-                raise ValueError('No {tag} element found'.format(tag=tag_name))
-
-        root = parser.parse(kml_stream).getroot()
-        if 'kml' not in root.tag:
-            raise ValueError('Not a KML file')
-
-        document = get_child(root, 'Document')
-        placemark = get_child(document, 'Placemark')
-        line_string = get_child(placemark, 'LineString')
-        # Unlike all of the other tag names, "coordinates" is not capitalized
-        coordinates = get_child(line_string, 'coordinates')
-
-        waypoints = []
-        text = coordinates.text.strip()
-        for csv in re.split(r'\s', text):
-            (
-                longitude,
-                latitude,
-                altitude  # pylint: disable=unused-variable
-            ) = csv.split(',')
-
-            waypoints.append((
-                Telemetry.longitude_to_m_offset(float(longitude), float(latitude)),
-                Telemetry.latitude_to_m_offset(float(latitude))
-            ))
+        waypoints = compile_kml(kml_stream).waypoints
+        if waypoints is None:
+            raise ValueError('No LineString element found')
         return waypoints
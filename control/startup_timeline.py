@@ -0,0 +1,93 @@
+"""Records how long each phase of startup takes, so that boot to ready time
+can be tracked. Phases can run in parallel in different threads.
+
+    with STARTUP_TIMELINE.phase('import control'):
+        import control.command
+    ...
+    STARTUP_TIMELINE.mark('ready')
+    STARTUP_TIMELINE.log(logger)
+"""
+
+import collections
+import contextlib
+import threading
+import time
+
+from messaging import metrics
+
+Phase = collections.namedtuple(  # pylint: disable=invalid-name
+    'Phase',
+    ('name', 'thread_name', 'start_s', 'duration_s')
+)
+
+
+class StartupTimeline(object):
+    """Timeline of startup phases, relative to when it was created."""
+
+    def __init__(self):
+        self._start_s = time.time()
+        self._phases = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager that records how long its block takes."""
+        start_s = time.time()
+        try:
+            yield
+        finally:
+            self._record(name, start_s, time.time() - start_s)
+
+    def mark(self, name):
+        """Records a point in time, e.g. when everything is ready."""
+        self._record(name, time.time(), 0.0)
+
+    def elapsed_s(self):
+        """Returns the time since the timeline was created."""
+        return time.time() - self._start_s
+
+    def phases(self):
+        """Returns the recorded phases, in the order they started."""
+        with self._lock:
+            return sorted(self._phases, key=lambda phase: phase.start_s)
+
+    def report(self):
+        """Returns the timeline as lines of text."""
+        lines = ['Startup timeline (start, duration, phase, thread):']
+        for phase in self.phases():
+            lines.append('{:7.3f} s {:7.3f} s  {} ({})'.format(
+                phase.start_s,
+                phase.duration_s,
+                phase.name,
+                phase.thread_name
+            ))
+        return lines
+
+    def log(self, logger):
+        """Logs the timeline."""
+        for line in self.report():
+            logger.info(line)
+
+    def _record(self, name, start_s, duration_s):
+        """Records a phase."""
+        phase = Phase(
+            name,
+            threading.current_thread().name,
+            start_s - self._start_s,
+            duration_s
+        )
+        with self._lock:
+            self._phases.append(phase)
+        metrics.gauge(
+            'startup_phase_seconds',
+            'How long each phase of startup took',
+            phase=name
+        ).set(duration_s)
+        metrics.gauge(
+            'startup_phase_start_seconds',
+            'When each phase of startup started, from the start of the timeline',
+            phase=name
+        ).set(phase.start_s)
+
+
+STARTUP_TIMELINE = StartupTimeline()
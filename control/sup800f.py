@@ -1,6 +1,7 @@
 """Functions for communicating with the SUP800F GPS module."""
 import collections
 import functools
+import numpy
 import struct
 
 
@@ -49,6 +50,22 @@ BinaryMessage = collections.namedtuple(  # pylint: disable=invalid-name
     ))
 )
 
+SENSOR_DATA_ID = 0xCF
+NAVIGATION_DATA_ID = 0xA8
+BINARY_MESSAGE_BYTES = struct.calcsize(BINARY_FORMAT)
+# The same layout as BINARY_FORMAT, for decoding several messages at once
+BINARY_DTYPE = numpy.dtype([
+    ('header', 'V7'),
+    ('acceleration_g_x', '>f4'),
+    ('acceleration_g_y', '>f4'),
+    ('acceleration_g_z', '>f4'),
+    ('magnetic_flux_ut_x', '>f4'),
+    ('magnetic_flux_ut_y', '>f4'),
+    ('magnetic_flux_ut_z', '>f4'),
+    ('pressure_p', '>u4'),
+    ('temperature_c', '>f4'),
+    ('tail', 'V3'),
+])
 
 
 def format_message(payload):
@@ -93,19 +110,39 @@ def get_message(ser, timeout_bytes=None):
         return b'\xA0\xA1' + struct.pack('!H', payload_length) + rest
 
 
+def is_sensor_data(binary_message):
+    """Returns True if a binary message has sensor readings, or False if it's
+    navigation data. Raises EnvironmentError for any other message.
+    """
+    # TODO: I guess the SUP800F also returns navigation data messages? Ignore
+    # them for now, but this shouldn't be called
+    if binary_message[4] == NAVIGATION_DATA_ID:
+        return False
+    if binary_message[4] != SENSOR_DATA_ID:
+        raise EnvironmentError('Invalid id while parsing binary message')
+    return True
+
+
 def parse_binary(binary_message):
     """Parses a binary message (temperature, accelerometer, magnetometer, and
     pressure) from the SUP800F module.
     """
-    # TODO: I guess the SUP800F also returns navigation data messages? Ignore
-    # them for now, but this shouldn't be called
-    if binary_message[4] == 0xA8:
+    if not is_sensor_data(binary_message):
         return None
-    if binary_message[4] != 0xCF:
-        raise EnvironmentError('Invalid id while parsing binary message')
     return BinaryMessage(*struct.unpack(BINARY_FORMAT, binary_message))
 
 
+def parse_binary_burst(binary_messages):
+    """Parses several binary messages into a NumPy structured array with the
+    fields of BinaryMessage. Navigation data messages are skipped.
+    """
+    readings = b''.join(
+        message for message in binary_messages
+        if is_sensor_data(message) and len(message) == BINARY_MESSAGE_BYTES
+    )
+    return numpy.frombuffer(readings, dtype=BINARY_DTYPE)
+
+
 def switch_to_nmea_mode(ser):
     """Switches to the NMEA message mode."""
     _change_mode(ser, 1)
@@ -16,27 +16,61 @@ import pytz
 import threading
 import time
 
+from control.compass_calibration import CalibrationStore
+from control.compass_calibration import DEFAULT_CALIBRATION
+from control.compass_calibration import EllipseFit
+from control.sup800f import BINARY_MESSAGE_BYTES
 from control.sup800f import get_message
+from control.sup800f import is_sensor_data
 from control.sup800f import parse_binary
+from control.sup800f import parse_binary_burst
 from control.sup800f import switch_to_binary_mode
 from control.sup800f import switch_to_nmea_mode
 from control.telemetry import Telemetry
 from messaging import config
+from messaging import metrics
 from messaging.async_logger import AsyncLogger
 from messaging.async_producers import TelemetryProducer
 from messaging.message_consumer import consume_messages
+from messaging.streaming_statistics import Ewma
 
 
 # Below this speed, the GPS module uses the compass to compute heading, if the
 # compass is calibrated
 COMPASS_SPEED_CUTOFF_KM_HOUR = 10.0
 COMPASS_SPEED_CUTOFF_M_S = COMPASS_SPEED_CUTOFF_KM_HOUR * 1000.0 / 3600.0
+# The magnitude of the magnetic field drifts (e.g. with temperature), so the
+# outlier gate slowly follows the readings that pass it
+MAGNITUDE_ALPHA = 0.001
+# In a normal distribution, 95% of readings should be within 2 std devs
+MAGNITUDE_GATE_STD_DEVS = 2.0
+# Only the readings that pass the gate are followed, and they're missing the
+# tails, so their variance is this much smaller than the true variance. Left
+# uncorrected, the gate would keep shrinking until it dropped about 15% of
+# good readings. This is the variance of a standard normal distribution
+# truncated to +/- MAGNITUDE_GATE_STD_DEVS.
+MAGNITUDE_TRUNCATED_VARIANCE = 1.0 - (
+    2.0 * MAGNITUDE_GATE_STD_DEVS
+    * math.exp(-MAGNITUDE_GATE_STD_DEVS ** 2 / 2.0) / math.sqrt(2.0 * math.pi)
+    / math.erf(MAGNITUDE_GATE_STD_DEVS / math.sqrt(2.0))
+)
+# Calibrations are saved here, next to the logs
+DEFAULT_CALIBRATION_FILE_NAME = '/data/compass-calibration.json'
+DEVICE_ID = 'sup800f'
+# Binary messages are read in bursts between GPS readings. Each accelerometer
+# sample is published on its own, and the compass readings in a burst are
+# combined into one.
+BINARY_BURST_SIZE = 3
+# Boulder
+MAGNETIC_DECLINATION_D = 8.666
 
 
 class Sup800fTelemetry(threading.Thread):
     """Reader of GPS module that implements the TelemetryData interface."""
-    def __init__(self, serial):
-        """Create the TelemetryData thread."""
+    def __init__(self, serial, calibration_file_name=None):
+        """Create the TelemetryData thread. The compass calibration is loaded
+        from and saved to calibration_file_name.
+        """
         super(Sup800fTelemetry, self).__init__()
         self.name = self.__class__.__name__
 
@@ -45,10 +79,12 @@ class Sup800fTelemetry(threading.Thread):
         self._logger = AsyncLogger()
         self._run = True
         self._iterations = 0
-        # These initial measurements are from a calibration observation
-        self._compass_offsets = (-11.87, -5.97)
-        self._magnitude_mean = 353.310
-        self._magnitude_std_dev = 117.918
+        if calibration_file_name is None:
+            calibration_file_name = DEFAULT_CALIBRATION_FILE_NAME
+        self._calibration_store = CalibrationStore(calibration_file_name)
+        self._calibration = None
+        self._magnitude = None
+        self._set_calibration(self._load_calibration())
 
         self._calibrate_compass_end_time = None
         self._nmea_mode = True
@@ -58,6 +94,19 @@ class Sup800fTelemetry(threading.Thread):
 
         self._hdop = 5.0
 
+        self._nmea_messages = metrics.counter(
+            'sup800f_nmea_messages_total',
+            'NMEA messages handled from the SUP800F'
+        )
+        self._binary_messages = metrics.counter(
+            'sup800f_binary_messages_total',
+            'Binary messages handled from the SUP800F'
+        )
+        self._dropped_compass = metrics.counter(
+            'sup800f_dropped_compass_messages_total',
+            'Compass readings dropped for being too far from the mean'
+        )
+
         def handle_message(message):
             """Handles command messages. Only cares about calibrate compass;
             other messages are ignored.
@@ -74,6 +123,8 @@ class Sup800fTelemetry(threading.Thread):
             self.__class__.__name__,
             config.COMMAND_FORWARDED_EXCHANGE
         )
+        # Messages are handled by the dispatcher, this only waits for QUIT
+        thread.daemon = True
         thread.start()
 
     def run(self):
@@ -107,7 +158,9 @@ class Sup800fTelemetry(threading.Thread):
 
     def _run_inner(self):
         """Inner part of run."""
-        binary_count = 0
+        burst = []
+        # When each message was read, since they don't have timestamps
+        burst_times_s = []
         while self._run:
             if self._calibrate_compass_end_time is not None:
                 self._calibrate_compass()
@@ -118,12 +171,19 @@ class Sup800fTelemetry(threading.Thread):
                     switch_to_binary_mode(self._serial)
                     self._nmea_mode = False
             else:
-                if self._get_binary():
-                    binary_count += 1
-                    if binary_count >= 3:
+                message = self._get_binary()
+                if message is not None:
+                    burst.append(message)
+                    burst_times_s.append(time.time())
+                    if len(burst) >= BINARY_BURST_SIZE:
+                        self._handle_binary_burst(
+                            parse_binary_burst(burst),
+                            burst_times_s
+                        )
+                        burst = []
+                        burst_times_s = []
                         switch_to_nmea_mode(self._serial)
                         self._nmea_mode = True
-                        binary_count = 0
 
     def _get_gprc(self):
         """Gets and processes a single GPRC message."""
@@ -135,26 +195,37 @@ class Sup800fTelemetry(threading.Thread):
             raise EnvironmentError('Not a UTF-8 message')
 
         if line.startswith('$GPRMC'):
+            self._nmea_messages.inc()
             self._handle_gprmc(line)
             return True
         elif line.startswith('$GPGSA'):
+            self._nmea_messages.inc()
             self._handle_gpgsa(line)
             return True
         return False
 
     def _get_binary(self):
-        """Gets and processes a single binary message."""
+        """Gets a single binary sensor message. Returns None if no message
+        was received or if it wasn't sensor data.
+        """
         try:
             message = get_message(self._serial, 1000)
         except ValueError:
             self._logger.error('No binary message received')
-            return False
-
-        parsed = parse_binary(message)
-        if parsed is None:
-            return False
-        self._handle_binary(parsed)
-        return True
+            return None
+
+        if not is_sensor_data(message):
+            return None
+        if len(message) != BINARY_MESSAGE_BYTES:
+            self._logger.warn(
+                'Binary message was {} bytes, expected {}'.format(
+                    len(message),
+                    BINARY_MESSAGE_BYTES
+                )
+            )
+            return None
+        self._binary_messages.inc()
+        return message
 
     @staticmethod
     def _timestamp(dt):
@@ -233,32 +304,48 @@ class Sup800fTelemetry(threading.Thread):
         #vdop = float(parts[-1].split('*')[0])
         self._hdop = hdop
 
-    def _handle_binary(self, message):
-        """Handles properietary SUP800F binary messages."""
-        if message is None:
-            return
-        flux_x = float(message.magnetic_flux_ut_x - self._compass_offsets[0])
-        flux_y = float(message.magnetic_flux_ut_y - self._compass_offsets[1])
-        if flux_x == 0.0:
-            # TODO: Figure out what to do here
+    def _handle_binary_burst(self, readings, timestamps_s):
+        """Handles a burst of properietary SUP800F binary messages, as a
+        structured array from parse_binary_burst, and when each was read.
+        """
+        if len(readings) == 0:
             return
-        self._last_compass_heading_d = Telemetry.wrap_degrees(
-            270.0 - math.degrees(
-                math.atan2(flux_y, flux_x)
-            ) + 8.666  # Boulder declination
+        # Averaging would hide short spikes, like hitting something
+        for reading, timestamp_s in zip(readings, timestamps_s):
+            self._telemetry.accelerometer_reading(
+                float(reading['acceleration_g_x']),
+                float(reading['acceleration_g_y']),
+                float(reading['acceleration_g_z']),
+                'sup800f',
+                timestamp_s
+            )
+
+        flux_x, flux_y = self._calibration.correct_many(
+            readings['magnetic_flux_ut_x'],
+            readings['magnetic_flux_ut_y']
         )
-        magnitude = flux_x ** 2 + flux_y ** 2
-        std_devs_away = abs(
-            self._magnitude_mean - magnitude
-        ) / self._magnitude_std_dev
-        # In a normal distribution, 95% of readings should be within 2 std devs
-        if std_devs_away > 2.0:
-            self._dropped_compass_messages += 1
+        # TODO: Figure out what to do with 0 readings
+        nonzero = flux_x != 0.0
+        flux_x = flux_x[nonzero]
+        flux_y = flux_y[nonzero]
+        if len(flux_x) == 0:
+            return
+
+        magnitudes = flux_x ** 2 + flux_y ** 2
+        std_devs_away = numpy.abs(
+            self._magnitude.mean - magnitudes
+        ) / max(self._magnitude_std_dev(), 1e-6)
+        accepted = std_devs_away <= MAGNITUDE_GATE_STD_DEVS
+        dropped_count = len(accepted) - int(numpy.count_nonzero(accepted))
+        if dropped_count > 0:
+            self._dropped_compass.inc(dropped_count)
+        if dropped_count == len(accepted):
+            self._dropped_compass_messages += dropped_count
             if self._dropped_compass_messages > self._dropped_threshold:
                 self._logger.warn(
                     'Dropped {} compass messages in a row, std dev = {}'.format(
                         self._dropped_compass_messages,
-                        round(std_devs_away, 3)
+                        round(float(std_devs_away.min()), 3)
                     )
                 )
                 self._dropped_compass_messages = 0
@@ -266,22 +353,31 @@ class Sup800fTelemetry(threading.Thread):
             return
         self._dropped_compass_messages = 0
         self._dropped_threshold = 10
+        for magnitude in magnitudes[accepted]:
+            self._magnitude.add(float(magnitude))
 
-        if std_devs_away > 1.0:
-            confidence = 2.0 - std_devs_away
-        else:
-            confidence = 1.0
+        confidences = numpy.minimum(
+            MAGNITUDE_GATE_STD_DEVS - std_devs_away[accepted],
+            1.0
+        )
+        # Circular mean weighted by confidence, so that headings around north
+        # don't average to south. The length of the mean vector shrinks when
+        # the readings disagree, so it scales the confidence.
+        angles_r = numpy.arctan2(flux_y[accepted], flux_x[accepted])
+        sin_sum = float((confidences * numpy.sin(angles_r)).sum())
+        cos_sum = float((confidences * numpy.cos(angles_r)).sum())
+        confidence_sum = float(confidences.sum())
+        if confidence_sum <= 0.0:
+            return
+        agreement = math.hypot(sin_sum, cos_sum) / confidence_sum
+        self._last_compass_heading_d = Telemetry.wrap_degrees(
+            270.0 - math.degrees(math.atan2(sin_sum, cos_sum))
+            + MAGNETIC_DECLINATION_D
+        )
 
         self._telemetry.compass_reading(
             self._last_compass_heading_d,
-            confidence,
-            'sup800f'
-        )
-
-        self._telemetry.accelerometer_reading(
-            message.acceleration_g_x,
-            message.acceleration_g_y,
-            message.acceleration_g_z,
+            confidence_sum / len(confidences) * agreement,
             'sup800f'
         )
 
@@ -296,6 +392,55 @@ class Sup800fTelemetry(threading.Thread):
         else:
             self._logger.warn('Compass is already being calibrated')
 
+    def _load_calibration(self):
+        """Returns the saved compass calibration, or the default one."""
+        try:
+            calibration = self._calibration_store.load(DEVICE_ID)
+        except (IOError, OSError, ValueError) as exc:
+            self._logger.warn(
+                'Unable to load compass calibration: {}'.format(exc)
+            )
+            calibration = None
+        if calibration is None:
+            self._logger.info('Using default compass calibration')
+            return DEFAULT_CALIBRATION
+        self._logger.info(
+            'Loaded compass calibration from {} samples'.format(
+                calibration.samples
+            )
+        )
+        return calibration
+
+    def _magnitude_std_dev(self):
+        """Returns the estimated standard deviation of the magnitudes,
+        including the ones that the gate drops.
+        """
+        return math.sqrt(
+            self._magnitude.variance / MAGNITUDE_TRUNCATED_VARIANCE
+        )
+
+    def _set_calibration(self, calibration):
+        """Sets the compass calibration and resets the magnitude gate."""
+        self._calibration = calibration
+        # The Ewma follows the variance of the readings that pass the gate
+        self._magnitude = Ewma(
+            MAGNITUDE_ALPHA,
+            mean=calibration.magnitude_mean,
+            variance=(
+                calibration.magnitude_std_dev ** 2
+                * MAGNITUDE_TRUNCATED_VARIANCE
+            )
+        )
+        self._logger.info(
+            'Compass offsets: {}, soft iron: {}, magnitudes mean: {},'
+            ' standard deviation: {}'.format(
+                [round(i, 2) for i in calibration.offsets],
+                [[round(i, 3) for i in row] for row in calibration.soft_iron],
+                round(calibration.magnitude_mean, 3),
+                round(calibration.magnitude_std_dev, 3)
+            )
+        )
+
     def _calibrate_compass(self):
         """Calibrates the compass."""
         self._logger.info('Calibrating compass; setting to binary mode')
@@ -304,9 +449,7 @@ class Sup800fTelemetry(threading.Thread):
         for _ in range(10):
             self._serial.readline()
 
-        maxes = [-float('inf')] * 2
-        mins = [float('inf')] * 2
-        flux_readings = []
+        fit = EllipseFit()
         # We should be driving for this long
         while time.time() < self._calibrate_compass_end_time:
             data = get_message(self._serial)
@@ -323,35 +466,20 @@ class Sup800fTelemetry(threading.Thread):
             # TODO: This should never be None, see comment in sup800f.py
             if binary is None:
                 continue
-            flux_values = (
-                binary.magnetic_flux_ut_x,
-                binary.magnetic_flux_ut_y,
-            )
-            maxes = [max(a, b) for a, b in zip(maxes, flux_values)]
-            mins = [min(a, b) for a, b in zip(mins, flux_values)]
-            flux_readings.append(flux_values)
+            fit.add(binary.magnetic_flux_ut_x, binary.magnetic_flux_ut_y)
 
-        self._compass_offsets = [
-            (max_ + min_) * 0.5 for max_, min_ in zip(maxes, mins)
-        ]
-        self._logger.info(
-            'Compass calibrated, offsets are {}'.format(
-                [round(i, 2) for i in self._compass_offsets]
-            )
-        )
-        total_magnitudes = numpy.array([
-            (x - self._compass_offsets[0]) ** 2 +
-            (y - self._compass_offsets[1]) ** 2
-            for x, y in flux_readings
-        ])
-        self._magnitude_mean = total_magnitudes.mean()
-        self._magnitude_std_dev = total_magnitudes.std()
-        self._logger.info(
-            'Magnitudes mean: {}, standard deviation: {}'.format(
-                round(self._magnitude_mean, 3),
-                round(self._magnitude_std_dev, 3)
-            )
-        )
+        try:
+            calibration = fit.fit()
+        except ValueError as exc:
+            self._logger.warn('Not calibrating compass: {}'.format(exc))
+        else:
+            self._set_calibration(calibration)
+            try:
+                self._calibration_store.save(DEVICE_ID, calibration)
+            except (IOError, OSError) as exc:
+                self._logger.warn(
+                    'Unable to save compass calibration: {}'.format(exc)
+                )
 
         self._calibrate_compass_end_time = None
         switch_to_nmea_mode(self._serial)
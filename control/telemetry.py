@@ -1,19 +1,29 @@
 """Telemetry class that takes raw sensor data and filters it to remove noise
 and provide more accurate telemetry data.
 """
-from pykml import parser
 import collections
 import json
 import math
-import os
-import re
 import threading
+import time
 
+from control.collision_detector import CollisionDetector
+from control.ekf_location_filter import EkfLocationFilter
 from control.location_filter import LocationFilter
+from control.sensor_fusion import GpsFusion
 from control.synchronized import synchronized
 from messaging import config
+from messaging import metrics
 from messaging.message_consumer import consume_messages
+from messaging.message_consumer import load_message
 from messaging.async_logger import AsyncLogger
+from messaging.scheduler import get_scheduler
+from messaging.streaming_statistics import WindowedMinMax
+from messaging.telemetry_messages import AccelReading
+from messaging.telemetry_messages import CompassReading
+from messaging.telemetry_messages import DriveCommand
+from messaging.telemetry_messages import GpsReading
+from messaging.telemetry_messages import message_from_dict
 
 #pylint: disable=invalid-name
 
@@ -30,6 +40,17 @@ ZERO_TO_TOP_S = 5.0
 THROTTLE_CHANGE_PER_S = 1.0 / ZERO_TO_TOP_S
 MAX_SPEED_M_S = 4.5
 
+STANDARD_GRAVITY_M_S_S = 9.80665
+# The SUP800F is mounted with x pointing forward and y pointing left
+ACCELEROMETER_FORWARD_AXIS = 'acceleration_g_x'
+ACCELEROMETER_LEFT_AXIS = 'acceleration_g_y'
+
+# The location filters that can be used, by name
+LOCATION_FILTERS = {
+    'kalman': LocationFilter,
+    'ekf': EkfLocationFilter,
+}
+
 
 class Telemetry(object):
     """Provides up to date telemetry data to other modules. This class will use
@@ -40,17 +61,45 @@ class Telemetry(object):
     M_PER_D_LATITUDE = EQUATORIAL_RADIUS_M * 2.0 * math.pi / 360.0
     HISTORICAL_SPEED_READINGS_COUNT = 10
     HISTORICAL_ACCELEROMETER_READINGS_COUNT = 5
-
-    def __init__(self, kml_file_name=None):
-        self._data = {}
+    # The accelerometer's bias (including any tilt in how it's mounted) is
+    # learned while the car is stopped, and it isn't used until then
+    ACCELEROMETER_BIAS_ALPHA = 0.05
+    ACCELEROMETER_CALIBRATION_READINGS = 20
+    STOPPED_SPEED_M_S = 0.2
+
+    def __init__(self, kml_file_name=None, location_filter=None, shared_state=None):
+        """location_filter is the name of the location filter to use, one of
+        LOCATION_FILTERS. Defaults to 'kalman'. If shared_state is given, the
+        latest GPS and compass readings and drive command are written to it.
+        """
+        if location_filter is None:
+            location_filter = 'kalman'
+        # The most recent GPS reading, and where it is if it was in bounds
+        self._data = None
+        self._data_m = None
         self._logger = AsyncLogger()
-        self._speed_history = collections.deque()
-        self._z_acceleration_g = collections.deque()
+        self._shared_state = shared_state
+        self._speed_history = WindowedMinMax(
+            self.HISTORICAL_SPEED_READINGS_COUNT
+        )
+        self._z_acceleration_g = WindowedMinMax(
+            self.HISTORICAL_ACCELEROMETER_READINGS_COUNT
+        )
+        self._accelerometer_bias_g = [0.0, 0.0]
+        self._accelerometer_bias_readings = 0
+        self._collision_detector = CollisionDetector()
         self._lock = threading.Lock()
 
         # TODO: For the competition, just hard code the compass. For now, the
         # Kalman filter should start reading in values and correct quickly.
-        self._location_filter = LocationFilter(0.0, 0.0, 0.0)
+        self._location_filter = LOCATION_FILTERS[location_filter](
+            0.0,
+            0.0,
+            0.0
+        )
+        # The filter applies GPS readings at the time they were taken, so
+        # they don't need to be moved forward
+        self._gps_fusion = GpsFusion(extrapolate=False)
         self._estimated_steering = 0.0
         self._estimated_throttle = 0.0
 
@@ -59,6 +108,15 @@ class Telemetry(object):
 
         self._ignored_points = collections.defaultdict(lambda: 0)
         self._ignored_points_thresholds = collections.defaultdict(lambda: 10)
+        # Device -> (GPS readings counter, ignored points counter)
+        self._gps_counters = {}
+
+        self._message_handlers = {
+            GpsReading: self._handle_gps_reading,
+            CompassReading: self._handle_compass_reading,
+            AccelReading: self._handle_accelerometer_reading,
+            DriveCommand: self._handle_drive_command,
+        }
 
         consume = lambda: consume_messages(
             config.TELEMETRY_EXCHANGE,
@@ -69,6 +127,8 @@ class Telemetry(object):
             self.__class__.__name__,
             config.TELEMETRY_EXCHANGE
         )
+        # Messages are handled by the dispatcher, this only waits for QUIT
+        thread.daemon = True
         thread.start()
 
         self._course_m = None
@@ -77,19 +137,19 @@ class Telemetry(object):
                 self.load_kml_from_file_name(kml_file_name)
                 self._logger.info(
                     'Loaded {} course points and {} inner objects'.format(
-                        len(self._course_m['course']),
-                        len(self._course_m['inner'])
+                        len(self._course_m.course),
+                        len(self._course_m.inner)
                     )
                 )
             else:
                 self._course_m = None
 
             if self._course_m is not None:
-                if len(self._course_m['course']) == 0:
+                if len(self._course_m.course) == 0:
                     self._logger.warn(
                         'No course defined for {}'.format(kml_file_name)
                     )
-                if len(self._course_m['inner']) == 0:
+                if len(self._course_m.inner) == 0:
                     self._logger.warn(
                         'No inner obstacles defined for {}'.format(kml_file_name)
                     )
@@ -98,8 +158,15 @@ class Telemetry(object):
 
     @synchronized
     def get_raw_data(self):
-        """Returns the raw most recent telemetry readings."""
-        return self._data
+        """Returns a copy of the most recent GPS reading, with x_m and y_m if
+        it was in bounds.
+        """
+        if self._data is None:
+            return {}
+        data = self._data.to_dict()
+        if self._data_m is not None:
+            data['x_m'], data['y_m'] = self._data_m
+        return data
 
     @synchronized
     def get_data(self, update=None):
@@ -109,10 +176,6 @@ class Telemetry(object):
         if update:
             self._location_filter.update_dead_reckoning()
         values = {}
-        for key in ('accelerometer_m_s_s',):  # Left as a loop if we want more later
-            if key in self._data:
-                values[key] = self._data[key]
-
         values['speed_m_s'] = self._location_filter.estimated_speed()
         values['heading_d'] = self._location_filter.estimated_heading()
         x_m, y_m = self._location_filter.estimated_location()
@@ -144,86 +207,244 @@ class Telemetry(object):
 
         self._target_steering = steering
         self._target_throttle = throttle
-
-    def _handle_message(self, message):
-        """Stores telemetry data from messages received from some source."""
-        original_message = message
-        message = json.loads(original_message)
-        if 'speed_m_s' in message and message['speed_m_s'] <= MAX_SPEED_M_S:
-            self._speed_history.append(message['speed_m_s'])
-            while len(self._speed_history) > self.HISTORICAL_SPEED_READINGS_COUNT:
-                self._speed_history.popleft()
-
-        if 'compass_d' in message:
-            self._update_estimated_drive()
-            self._location_filter.update_compass(
-                message['compass_d'],
-                message['confidence']
+        self._collision_detector.drive(time.time(), throttle)
+        if self._shared_state is not None:
+            self._shared_state.write(
+                'drive',
+                {'throttle': throttle, 'steering': steering}
             )
-            self._logger.debug(original_message)
-
-        elif 'acceleration_g_z' in message:
-            # TODO(skari): Detect if we've run into something
-            self._z_acceleration_g.append(message['acceleration_g_z'])
-            while len(self._z_acceleration_g) > self.HISTORICAL_ACCELEROMETER_READINGS_COUNT:
-                self._z_acceleration_g.popleft()
-
-            self._logger.debug(original_message)
 
-        elif 'latitude_d' in message:
-            if message['speed_m_s'] < MAX_SPEED_M_S:
-                self._handle_gps_message(message)
+    @synchronized
+    def get_target_drive(self):
+        """Returns the throttle and steering that the car was last told to
+        drive with.
+        """
+        return self._target_throttle, self._target_steering
 
-            self._data = message
-            self._logger.debug(original_message)
+    def _handle_message(self, message):
+        """Stores telemetry data from messages received from some source."""
+        decoded = load_message(message)
+        if isinstance(decoded, dict):
+            if 'readings' in decoded:
+                # Batches are logged one reading per line, just like single
+                # readings, so that the analysis scripts can read them
+                for reading in decoded['readings']:
+                    self._handle_reading(reading)
+                return
+            self._handle_reading(decoded)
+        else:
+            self._message_handlers[type(decoded)](decoded)
 
-        elif 'load_waypoints' in message:
-            self.load_kml_from_file_name(message['load_waypoints'])
+    def _handle_reading(self, reading):
+        """Stores telemetry data from a single reading in a dict, e.g. from
+        another process.
+        """
+        message = message_from_dict(reading)
+        if message is not None:
+            self._message_handlers[type(message)](message)
+            return
+
+        if (
+                reading.get('speed_m_s') is not None
+                and reading['speed_m_s'] <= MAX_SPEED_M_S
+        ):
+            self._speed_history.add(reading['speed_m_s'])
+        if 'load_waypoints' in reading:
+            # Loading the course is too slow for the dispatcher's thread
+            file_name = reading['load_waypoints']
+            get_scheduler().schedule(
+                0.0,
+                lambda: self.load_kml_from_file_name(file_name),
+                key='telemetry:load-course',
+                replace=True
+            )
+        else:
+            self._logger.debug('Unexpected message: {}'.format(reading))
+
+    def _handle_compass_reading(self, reading):
+        """Handles a compass reading."""
+        self._update_estimated_drive()
+        self._location_filter.update_compass(
+            reading.compass_d,
+            reading.confidence
+        )
+        if self._shared_state is not None:
+            self._shared_state.write('compass', {
+                'compass_d': reading.compass_d,
+                'confidence': reading.confidence,
+            })
+        # The logger encodes readings as JSON
+        self._logger.debug(reading)
+
+    def _handle_accelerometer_reading(self, reading):
+        """Handles an accelerometer reading."""
+        self._z_acceleration_g.add(reading.acceleration_g_z)
+        if getattr(reading, ACCELEROMETER_FORWARD_AXIS) is not None:
+            self._handle_accelerometer_message(reading)
+            self._detect_collision(reading)
+
+        self._logger.debug(reading)
+
+    def _handle_gps_reading(self, reading):
+        """Handles a GPS reading."""
+        # iPhone produces null if there is no speed fix yet, but the position
+        # is still good
+        speed_m_s = reading.speed_m_s
+        if speed_m_s is not None and speed_m_s <= MAX_SPEED_M_S:
+            self._speed_history.add(speed_m_s)
+        self._data = reading
+        self._data_m = None
+        if speed_m_s is None or speed_m_s < MAX_SPEED_M_S:
+            self._handle_gps_message(reading)
+        if self._shared_state is not None:
+            self._shared_state.write('gps', {
+                'latitude_d': reading.latitude_d,
+                'longitude_d': reading.longitude_d,
+                'accuracy_m': reading.accuracy_m,
+                'heading_d': reading.heading_d,
+                'speed_m_s': reading.speed_m_s,
+            })
+
+        self._logger.debug(reading)
+
+    def _handle_drive_command(self, command):
+        """Handles a drive command from another process."""
+        self.process_drive_command(command.throttle, command.steering)
+
+    def _handle_accelerometer_message(self, message):
+        """Handles the horizontal acceleration from an accelerometer
+        message.
+        """
+        forward_g = getattr(message, ACCELEROMETER_FORWARD_AXIS)
+        left_g = getattr(message, ACCELEROMETER_LEFT_AXIS)
+        stopped = self._target_throttle == 0.0 and (
+            len(self._speed_history) == 0
+            or self._speed_history.last() < self.STOPPED_SPEED_M_S
+        )
+        if stopped:
+            # Anything we measure now is bias
+            bias = self._accelerometer_bias_g
+            if self._accelerometer_bias_readings == 0:
+                bias[0], bias[1] = forward_g, left_g
+            else:
+                bias[0] += self.ACCELEROMETER_BIAS_ALPHA * (forward_g - bias[0])
+                bias[1] += self.ACCELEROMETER_BIAS_ALPHA * (left_g - bias[1])
+            self._accelerometer_bias_readings += 1
+            self._location_filter.update_accelerometer(0.0, 0.0)
+            return
+
+        if self._accelerometer_bias_readings < self.ACCELEROMETER_CALIBRATION_READINGS:
+            return
+        self._location_filter.update_accelerometer(
+            (forward_g - self._accelerometer_bias_g[0]) * STANDARD_GRAVITY_M_S_S,
+            # When turning right, the car accelerates towards the center of
+            # the turn, which reads as negative on the left axis
+            -(left_g - self._accelerometer_bias_g[1]) * STANDARD_GRAVITY_M_S_S
+        )
 
+    @synchronized
+    def _detect_collision(self, message):
+        """Passes the acceleration from an accelerometer message, without
+        the bias, to the collision detector.
+        """
+        if self._accelerometer_bias_readings < self.ACCELEROMETER_CALIBRATION_READINGS:
+            forward_g = left_g = None
         else:
-            self._logger.debug(
-                'Unexpected message: {}'.format(original_message)
+            forward_g = (
+                getattr(message, ACCELEROMETER_FORWARD_AXIS)
+                - self._accelerometer_bias_g[0]
+            )
+            left_g = (
+                getattr(message, ACCELEROMETER_LEFT_AXIS)
+                - self._accelerometer_bias_g[1]
             )
+        # Samples can arrive in bursts, so use when it was taken if it's known
+        timestamp_s = message.timestamp_s
+        if timestamp_s is None:
+            timestamp_s = time.time()
+        self._collision_detector.add(
+            timestamp_s,
+            forward_g,
+            left_g,
+            message.acceleration_g_z
+        )
+
+    def _get_gps_counters(self, label):
+        """Returns the GPS readings and ignored points counters for a device
+        label.
+        """
+        counters = self._gps_counters.get(label)
+        if counters is None:
+            counters = (
+                metrics.counter(
+                    'telemetry_gps_readings_total',
+                    'GPS readings received per device',
+                    device=label
+                ),
+                metrics.counter(
+                    'telemetry_ignored_points_total',
+                    'Out of bounds GPS readings dropped per device',
+                    device=label
+                ),
+            )
+            self._gps_counters[label] = counters
+        return counters
 
     def _handle_gps_message(self, message):
         """Handles a GPS telemetry message."""
-        device = message['device_id']
+        device = message.device_id
+        # Device IDs come from web clients, so the per-device state here is
+        # kept by label, which is shared once there are too many devices
+        label = self._gps_fusion.device_label(device)
         point_m = (
             Telemetry.longitude_to_m_offset(
-                message['longitude_d'],
-                message['latitude_d']
+                message.longitude_d,
+                message.latitude_d
             ),
-            Telemetry.latitude_to_m_offset(message['latitude_d'])
+            Telemetry.latitude_to_m_offset(message.latitude_d)
         )
+        readings, ignored_points = self._get_gps_counters(label)
+        readings.inc()
         if self._m_point_in_course(point_m):
-            self._ignored_points[device] = 0
-            self._ignored_points_thresholds[device] = 10
-            message['x_m'] = point_m[0]
-            message['y_m'] = point_m[1]
+            self._ignored_points[label] = 0
+            self._ignored_points_thresholds[label] = 10
+            self._data_m = point_m
 
             self._update_estimated_drive()
+            x_m, y_m, accuracy_m = self._gps_fusion.align(
+                device,
+                point_m[0],
+                point_m[1],
+                message.accuracy_m,
+                message.heading_d,
+                message.speed_m_s,
+                message.timestamp_s,
+                self._location_filter.estimated_location()
+            )
             self._location_filter.update_gps(
-                message['x_m'],
-                message['y_m'],
+                x_m,
+                y_m,
                 # The location filter supports accuracy in both directions,
                 # but TelemetryProducer only reports one right now. I don't
                 # think any of my sources report both right now.
-                message['accuracy_m'],
-                message['accuracy_m'],
-                message['heading_d'],
-                message['speed_m_s']
+                accuracy_m,
+                accuracy_m,
+                message.heading_d,
+                message.speed_m_s,
+                self._gps_fusion.measurement_time(message.timestamp_s)
             )
         else:
-            self._ignored_points[device] += 1
-            if self._ignored_points[device] > self._ignored_points_thresholds[device]:
+            self._ignored_points[label] += 1
+            ignored_points.inc()
+            if self._ignored_points[label] > self._ignored_points_thresholds[label]:
                 self._logger.info(
                     'Dropped {} out of bounds points from {} in a row'.format(
-                        self._ignored_points[device],
-                        device
+                        self._ignored_points[label],
+                        label
                     )
                 )
-                self._ignored_points[device] = 0
-                self._ignored_points_thresholds[device] += 10
+                self._ignored_points[label] = 0
+                self._ignored_points_thresholds[label] += 10
             else:
                 self._logger.debug(
                     'Ignoring out of bounds point: {}'.format(point_m)
@@ -233,30 +454,30 @@ class Telemetry(object):
             # to be fairly accurate, even if the actual coordinates are
             # off. i.e., GPS readings are usually consistently off by N
             # meters in the short term and not random all over the place.
-            if 'heading_d' in message and 'speed_m_s' in message:
-                heading_d = message['heading_d']
-                speed_m_s = message['speed_m_s']
-                # iPhone sometimes produces null if there is no speed fix yet
-                if heading_d is not None and speed_m_s is not None:
-                    if speed_m_s <= MAX_SPEED_M_S:
-                        self._location_filter.update_heading_and_speed(
-                            heading_d,
+            heading_d = message.heading_d
+            speed_m_s = message.speed_m_s
+            # iPhone sometimes produces null if there is no speed fix yet
+            if heading_d is not None and speed_m_s is not None:
+                if speed_m_s <= MAX_SPEED_M_S:
+                    self._location_filter.update_heading_and_speed(
+                        heading_d,
+                        speed_m_s
+                    )
+                else:
+                    self._logger.debug(
+                        'Ignoring too high of speed value: {}'.format(
                             speed_m_s
                         )
-                    else:
-                        self._logger.debug(
-                            'Ignoring too high of speed value: {}'.format(
-                                speed_m_s
-                            )
-                        )
+                    )
 
     @synchronized
     def is_stopped(self):
         """Determines if the RC car is moving."""
-        if len(self._speed_history) < self.HISTORICAL_SPEED_READINGS_COUNT:
+        if not self._speed_history.full():
             return False
 
-        if all((speed == 0.0 for speed in self._speed_history)):
+        history = self._speed_history
+        if history.minimum() == 0.0 and history.maximum() == 0.0:
             self._speed_history.clear()
             return True
         return False
@@ -264,27 +485,35 @@ class Telemetry(object):
     @synchronized
     def is_inverted(self):
         """Determines if the RC car is inverted."""
-        if len(self._z_acceleration_g) < self.HISTORICAL_ACCELEROMETER_READINGS_COUNT:
+        if not self._z_acceleration_g.full():
             return False
 
-        if all((z_acceleration_g < 0.0 for z_acceleration_g in self._z_acceleration_g)):
+        if self._z_acceleration_g.maximum() < 0.0:
             self._z_acceleration_g.clear()
             return True
         return False
 
+    @synchronized
+    def get_collision(self):
+        """Returns 'impact' if the RC car has run into something, or 'stall'
+        if it's being told to drive but isn't moving, according to the
+        accelerometer. Returns None otherwise. Each collision is only
+        returned once.
+        """
+        return self._collision_detector.collision()
+
     @synchronized
     def load_kml_from_file_name(self, kml_file_name):
-        """Loads KML from a file name."""
-        directory = 'paths' + os.sep
-        if not kml_file_name.startswith(directory):
-            kml_file_name = directory + kml_file_name
-        if kml_file_name.endswith('.kmz'):
-            import zipfile
-            with zipfile.ZipFile(kml_file_name) as archive:
-                self._course_m = self._load_kml_from_stream(archive.open('doc.kml'))
-        else:
-            with open(kml_file_name) as stream:
-                self._course_m = self._load_kml_from_stream(stream)
+        """Loads the course boundaries from a KML or KMZ file name."""
+        # course_bundle uses Telemetry, so it can't be imported at the top
+        from control.course_bundle import load_course
+        try:
+            self._course_m = load_course(kml_file_name)
+        except ValueError as exc:
+            self._logger.warn(
+                'Unable to load course {}: {}'.format(kml_file_name, exc)
+            )
+            self._course_m = None
 
     def _update_estimated_drive(self):
         """Updates the estimations of the drive state, e.g. the current
@@ -298,6 +527,14 @@ class Telemetry(object):
             self._location_filter.manual_throttle(
                 self._estimated_throttle * MAX_SPEED_M_S
             )
+        if hasattr(self._location_filter, 'manual_steering_angle'):
+            # The filter models how the turn rate depends on speed
+            self._location_filter.manual_steering_angle(
+                self._estimated_steering
+                * EkfLocationFilter.MAX_STEERING_ANGLE_D
+            )
+            return
+
         # Values for Tamiya Grasshopper, from observation. This is at .5
         # throttle, but we turn faster at higher speeds.
         BASE_MAX_TURN_RATE_D_S = 150.0
@@ -314,66 +551,10 @@ class Telemetry(object):
         else:
             self._location_filter.manual_steering(0)
 
-    def _load_kml_from_stream(self, kml_stream):
-        """Loads the course boundaries from a KML file."""
-        course = collections.defaultdict(lambda: [])
-
-        def get_child(element, tag_name):
-            """Returns the child element with the given tag name."""
-            try:
-                return getattr(element, tag_name)
-            except AttributeError:
-                raise ValueError('No {tag} element found'.format(tag=tag_name))
-
-        root = parser.parse(kml_stream).getroot()
-        if 'kml' not in root.tag:
-            self._logger.warn('Not a KML file')
-            return None
-
-        document = get_child(root, 'Document')
-        for placemark in document.iterchildren():
-            if not placemark.tag.endswith('Placemark'):
-                continue
-
-            try:
-                polygon = get_child(placemark, 'Polygon')
-            except ValueError:
-                # The KML also includes Path elements; those are fine
-                continue
-
-            bound = get_child(polygon, 'outerBoundaryIs')
-            ring = get_child(bound, 'LinearRing')
-            coordinates = get_child(ring, 'coordinates')
-            waypoints = []
-            text = coordinates.text.strip()
-            for csv in re.split(r'\s', text):
-                (
-                    longitude,
-                    latitude,
-                    altitude  # pylint: disable=unused-variable
-                ) = csv.split(',')
-
-                waypoints.append((
-                    Telemetry.longitude_to_m_offset(float(longitude), float(latitude)),
-                    Telemetry.latitude_to_m_offset(float(latitude)),
-                ))
-
-            if str(placemark.name).startswith('course'):
-                course['course'] = waypoints
-            elif str(placemark.name).startswith('inner'):
-                course['inner'].append(waypoints)
-
-        return course
-
     def _m_point_in_course(self, point_m):
         if self._course_m is None:
             return True
-        if not self.point_in_polygon(point_m, self._course_m['course']):
-            return False
-        for inner in self._course_m['inner']:
-            if self.point_in_polygon(point_m, inner):
-                return False
-        return True
+        return self._course_m.point_in_course(point_m)
 
     @staticmethod
     def rotate_radians_clockwise(point, radians):
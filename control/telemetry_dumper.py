@@ -10,6 +10,8 @@ class TelemetryDumper(threading.Thread):
     """Dumps telemetry data to the websocket handler for broadcast to all
     clients.
     """
+    # Clients can ask for updates up to the control loop rate
+    MIN_SLEEP_SECONDS = 0.02
 
     def __init__(
         self,
@@ -33,11 +35,18 @@ class TelemetryDumper(threading.Thread):
         """Runs in a thread."""
         while self._run:
             try:
-                time.sleep(self._sleep_seconds)
+                # Wake up as often as the fastest client wants updates; the
+                # handler decides which clients are due for a frame
+                interval_s = self._web_socket_handler.telemetry_interval_s()
+                if interval_s is None:
+                    interval_s = self._sleep_seconds
+                time.sleep(max(interval_s, self.MIN_SLEEP_SECONDS))
                 # TODO(2015-01-04) Include waypoint and raw sensor data too
-                data = self._telemetry.get_data()
-                data['throttle'] = self._telemetry._target_throttle  # pylint: disable=protected-access
-                data['steering'] = self._telemetry._target_steering  # pylint: disable=protected-access
+                # Don't update, because dead reckoning should only be driven
+                # by the control loop
+                data = self._telemetry.get_data(update=False)
+                data['throttle'], data['steering'] = \
+                    self._telemetry.get_target_drive()
                 data['compass_calibrated'] = 'unknown'
 
                 x_m, y_m = self._waypoint_generator.get_raw_waypoint()
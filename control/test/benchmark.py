@@ -1,13 +1,49 @@
 """Benchmarks the parts of the system."""
 
+import collections
+import json
+import logging
+import math
+import mock
+import numpy
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import threading
 import time
 
+from control import statistics
 from control.command import Command
+from control.compass_calibration import DEFAULT_CALIBRATION
+from control.course_bundle import CourseCache
+from control.course_bundle import compile_kml
 from control.simple_waypoint_generator import SimpleWaypointGenerator
+from control.ekf_location_filter import EkfLocationFilter
 from control.location_filter import LocationFilter
+from control.sensor_fusion import GpsFusion
+from control.sup800f import BINARY_FORMAT
+from control.sup800f import parse_binary
+from control.sup800f import parse_binary_burst
+from control.telemetry import CENTRAL_LATITUDE
+from control.telemetry import CENTRAL_LONGITUDE
 from control.telemetry import Telemetry
 from control.test.dummy_driver import DummyDriver
 from control.test.dummy_logger import DummyLogger
+from messaging.in_process_queue import DEFAULT_MAX_SIZE
+from messaging.log_sink import AsyncFileHandler
+from messaging.message_consumer import consume_messages
+from messaging.message_consumer import wait_for_consumer
+from messaging.message_producer import MessageProducer
+from messaging.shared_state import SharedState
+from messaging.streaming_statistics import P2Quantile
+from messaging.streaming_statistics import RunningStats
+from messaging.streaming_statistics import WindowedMinMax
+from messaging.telemetry_messages import AccelReading
+from messaging.telemetry_messages import CompassReading
+from messaging.telemetry_messages import GpsReading
 
 # pylint: disable=invalid-name
 # pylint: disable=protected-access
@@ -92,12 +128,748 @@ def benchmark_command_run_course_iterator():
     )
 
 
+class SimulatedGps(object):  # pylint: disable=too-few-public-methods
+    """A GPS device with its own rate, latency, bias and noise."""
+
+    def __init__(
+            self,
+            device_id,
+            rate_hz,
+            latency_s,
+            bias_m,
+            error_m,
+            reported_accuracy_m
+    ):
+        self.device_id = device_id
+        self.interval_s = 1.0 / rate_hz
+        self.latency_s = latency_s
+        self.bias_m = bias_m
+        self.error_m = error_m
+        self.reported_accuracy_m = reported_accuracy_m
+
+
+SUP800F = SimulatedGps('sup800f', 5.0, 0.1, (0.5, -0.5), 1.5, 2.5)
+PHONE = SimulatedGps('phone', 1.0, 0.8, (-3.0, 2.0), 3.0, 5.0)
+
+
+def simulate_gps_fusion(
+        sources,
+        fuse,
+        use_timestamps=False,
+        filter_class=LocationFilter,
+        duration_s=120.0,
+        seed=1,
+        speed_variation_m_s=0.0,
+        accelerometer=False
+):
+    """Drives in a circle with the given GPS sources and returns the RMS
+    error of the location filter's position estimate. If use_timestamps is
+    True, the filter applies readings at the time they were taken. The speed
+    goes up and down by speed_variation_m_s. If accelerometer is True, the
+    filter also gets noisy accelerometer readings at 20 Hz.
+    """
+    rng = random.Random(seed)
+    radius_m = 20.0
+    speed_m_s = 3.0
+    turn_rate_d_s = math.degrees(speed_m_s / radius_m)
+    step_s = 0.02
+    # Period of the speed changes is 2 pi * this
+    speed_period_s = 3.0
+
+    def true_speed(time_s):
+        """Returns the true speed and forward acceleration at some time."""
+        return (
+            speed_m_s + speed_variation_m_s * math.sin(time_s / speed_period_s),
+            speed_variation_m_s / speed_period_s
+            * math.cos(time_s / speed_period_s)
+        )
+
+    def true_state(time_s):
+        """Returns the true x, y and heading at some time."""
+        distance_m = speed_m_s * time_s + speed_variation_m_s * speed_period_s * (
+            1.0 - math.cos(time_s / speed_period_s)
+        )
+        heading_d = math.degrees(distance_m / radius_m) % 360.0
+        angle_r = math.radians(heading_d)
+        return (
+            radius_m * (1.0 - math.cos(angle_r)),
+            radius_m * math.sin(angle_r),
+            heading_d
+        )
+
+    clock = [1000.0]
+    with mock.patch('control.location_filter.time') as mock_time, \
+            mock.patch('control.ekf_location_filter.time') as ekf_mock_time:
+        mock_time.time.side_effect = lambda: clock[0]
+        ekf_mock_time.time.side_effect = lambda: clock[0]
+        location_filter = filter_class(0.0, 0.0, 0.0)
+        if hasattr(location_filter, 'manual_steering_angle'):
+            location_filter.manual_steering_angle(
+                math.degrees(
+                    math.atan(EkfLocationFilter.WHEELBASE_M / radius_m)
+                )
+            )
+        else:
+            location_filter.manual_steering(turn_rate_d_s)
+        fusion = GpsFusion(extrapolate=not use_timestamps)
+
+        # (delivery time, device, reading time, x, y, heading, speed)
+        in_flight = []
+        next_reading_s = {source.device_id: 0.0 for source in sources}
+        squared_error = 0.0
+        samples = 0
+        for step in range(int(duration_s / step_s)):
+            time_s = step * step_s
+            clock[0] = 1000.0 + time_s
+
+            for source in sources:
+                if time_s >= next_reading_s[source.device_id]:
+                    next_reading_s[source.device_id] += source.interval_s
+                    x_m, y_m, heading_d = true_state(time_s)
+                    in_flight.append((
+                        time_s + source.latency_s,
+                        source,
+                        time_s,
+                        x_m + source.bias_m[0] + rng.gauss(0, source.error_m),
+                        y_m + source.bias_m[1] + rng.gauss(0, source.error_m),
+                        heading_d + rng.gauss(0, 5.0),
+                        true_speed(time_s)[0] + rng.gauss(0, 0.2),
+                    ))
+
+            arrived = [i for i in in_flight if i[0] <= time_s]
+            in_flight = [i for i in in_flight if i[0] > time_s]
+            for _, source, reading_s, x_m, y_m, heading_d, speed in arrived:
+                accuracy_m = source.reported_accuracy_m
+                if fuse:
+                    x_m, y_m, accuracy_m = fusion.align(
+                        source.device_id,
+                        x_m,
+                        y_m,
+                        accuracy_m,
+                        heading_d,
+                        speed,
+                        1000.0 + reading_s,
+                        location_filter.estimated_location(),
+                        clock[0]
+                    )
+                location_filter.update_gps(
+                    x_m,
+                    y_m,
+                    accuracy_m,
+                    accuracy_m,
+                    heading_d,
+                    speed,
+                    1000.0 + reading_s if use_timestamps else None
+                )
+
+            # The compass comes in at 10 Hz with no delay
+            if step % 5 == 0:
+                location_filter.update_compass(
+                    true_state(time_s)[2] + rng.gauss(0, 5.0),
+                    0.5
+                )
+
+            if accelerometer and step % 5 == 2:
+                speed, acceleration = true_speed(time_s)
+                location_filter.update_accelerometer(
+                    acceleration + rng.gauss(0, 0.5),
+                    speed ** 2 / radius_m + rng.gauss(0, 0.5)
+                )
+
+            location_filter.update_dead_reckoning()
+            # Give the filter some time to converge before measuring
+            if time_s > 10.0:
+                x_m, y_m, _ = true_state(time_s)
+                estimate = location_filter.estimated_location()
+                squared_error += (
+                    (estimate[0] - x_m) ** 2 + (estimate[1] - y_m) ** 2
+                )
+                samples += 1
+
+    return math.sqrt(squared_error / samples)
+
+
+def benchmark_gps_fusion():
+    """Compares the position error with one and two GPS sources, with and
+    without per-device fusion.
+    """
+    for name, sources in (
+            ('SUP800F', (SUP800F,)),
+            ('phone', (PHONE,)),
+            ('SUP800F + phone', (SUP800F, PHONE)),
+    ):
+        for fuse, use_timestamps, mode in (
+                (False, False, 'raw'),
+                (False, True, 'raw+oosm'),
+                (True, False, 'fused'),
+                (True, True, 'fused+oosm'),
+        ):
+            print(
+                '{:16} {:11} RMS position error {:.2f} m'.format(
+                    name,
+                    mode,
+                    simulate_gps_fusion(sources, fuse, use_timestamps)
+                )
+            )
+
+
+def benchmark_course_bundle():
+    """Compares compiling a course to loading its bundle from the disk and
+    memory caches.
+    """
+    kml_file_name = 'rally-long.kml'
+    iterations = 50
+
+    def timed(name, function):
+        """Prints how long a function took."""
+        start = time.time()
+        for _ in range(iterations):
+            function()
+        print('{:20} {:.3} ms'.format(
+            name,
+            (time.time() - start) / iterations * 1000.0
+        ))
+
+    def compile_():
+        """Parses the KML."""
+        with open('paths/' + kml_file_name, 'rb') as file_:
+            compile_kml(file_)
+
+    directory = tempfile.mkdtemp()
+    memory_cache = CourseCache(directory)
+    memory_cache.load(kml_file_name)
+    timed('compile', compile_)
+    timed('disk cache', lambda: CourseCache(directory).load(kml_file_name))
+    timed('memory cache', lambda: memory_cache.load(kml_file_name))
+
+
+def benchmark_sup800f_binary():
+    """Compares decoding SUP800F binary messages and computing headings one
+    at a time to doing it for bursts with NumPy.
+    """
+    rng = random.Random(1)
+    messages = []
+    for _ in range(3000):
+        message = bytearray(struct.pack(
+            BINARY_FORMAT,
+            *([rng.gauss(0.0, 0.1) for _ in range(3)]
+              + [rng.gauss(0.0, 20.0) for _ in range(3)]
+              + [101325, 20.0])
+        ))
+        message[4] = 0xCF
+        messages.append(bytes(message))
+
+    start = time.time()
+    for message in messages:
+        parsed = parse_binary(message)
+        flux_x, flux_y = DEFAULT_CALIBRATION.correct(
+            parsed.magnetic_flux_ut_x,
+            parsed.magnetic_flux_ut_y
+        )
+        Telemetry.wrap_degrees(270.0 - math.degrees(math.atan2(flux_y, flux_x)))
+        json.dumps({'compass_d': 0.0, 'confidence': 1.0, 'device_id': 'sup800f'})
+    end = time.time()
+    print(
+        '{:24} {:.3} us per message, {} compass messages'.format(
+            'one at a time',
+            (end - start) / len(messages) * 1e6,
+            len(messages)
+        )
+    )
+
+    for burst_size in (3, 10, 100):
+        start = time.time()
+        published = 0
+        for index in range(0, len(messages), burst_size):
+            readings = parse_binary_burst(messages[index:index + burst_size])
+            flux_x, flux_y = DEFAULT_CALIBRATION.correct_many(
+                readings['magnetic_flux_ut_x'],
+                readings['magnetic_flux_ut_y']
+            )
+            angles_r = numpy.arctan2(flux_y, flux_x)
+            Telemetry.wrap_degrees(
+                270.0 - math.degrees(math.atan2(
+                    float(numpy.sin(angles_r).sum()),
+                    float(numpy.cos(angles_r).sum())
+                ))
+            )
+            json.dumps({'compass_d': 0.0, 'confidence': 1.0, 'device_id': 'sup800f'})
+            published += 1
+        end = time.time()
+        print(
+            '{:24} {:.3} us per message, {} compass messages'.format(
+                'bursts of {}'.format(burst_size),
+                (end - start) / len(messages) * 1e6,
+                published
+            )
+        )
+
+
+def benchmark_accelerometer():
+    """Compares the position error with and without the accelerometer when
+    the speed changes between GPS readings.
+    """
+    # The accelerometer matters most between slow GPS fixes
+    gps = SimulatedGps('gps', 1.0, 0.1, (0.5, -0.5), 1.5, 2.5)
+    for filter_class in (LocationFilter, EkfLocationFilter):
+        for speed_variation_m_s in (0.0, 2.0):
+            for accelerometer in (False, True):
+                print(
+                    '{:18} speed +/- {} m/s, accelerometer {:5} RMS position error {:.2f} m'.format(
+                        filter_class.__name__,
+                        speed_variation_m_s,
+                        str(accelerometer),
+                        simulate_gps_fusion(
+                            (gps,),
+                            True,
+                            True,
+                            filter_class,
+                            speed_variation_m_s=speed_variation_m_s,
+                            accelerometer=accelerometer
+                        )
+                    )
+                )
+
+
+def benchmark_location_filter_delayed_gps():
+    """Benchmark the location filter GPS update when the reading arrives
+    after other measurements and they need to be replayed.
+    """
+    location_filter = LocationFilter(0.0, 0.0, 0.0)
+    iterations = 100
+    start = time.time()
+    for _ in range(iterations):
+        taken_s = time.time()
+        # The compass keeps coming in while we wait for the GPS reading
+        for _ in range(5):
+            location_filter.update_compass(20.0, 1.0)
+        location_filter.update_gps(100.0, 100.0, 1.0, 1.0, 20.0, 4.5, taken_s)
+    end = time.time()
+    print(
+        '{} iterations of LocationFilter.update_gps replaying 5 compass updates, each took {:.5}'.format(
+            iterations,
+            (end - start) / float(iterations)
+        )
+    )
+
+
+def benchmark_ekf_location_filter():
+    """Compares the cost of each update and the position error of the
+    LocationFilter and the EkfLocationFilter.
+    """
+    iterations = 1000
+    for filter_class in (LocationFilter, EkfLocationFilter):
+        for name, update in (
+                ('update_gps', lambda f: f.update_gps(100.0, 100.0, 1.0, 1.0, 20.0, 4.5)),
+                ('update_compass', lambda f: f.update_compass(20.0, 1.0)),
+                ('update_dead_reckoning', lambda f: f.update_dead_reckoning()),
+        ):
+            location_filter = filter_class(0.0, 0.0, 0.0)
+            start = time.time()
+            for _ in range(iterations):
+                update(location_filter)
+            end = time.time()
+            print(
+                '{} iterations of {}.{}, each took {:.5}'.format(
+                    iterations,
+                    filter_class.__name__,
+                    name,
+                    (end - start) / float(iterations)
+                )
+            )
+
+    for name, sources in (
+            ('SUP800F', (SUP800F,)),
+            ('phone', (PHONE,)),
+            ('SUP800F + phone', (SUP800F, PHONE)),
+    ):
+        for filter_class in (LocationFilter, EkfLocationFilter):
+            print(
+                '{:16} {:18} RMS position error {:.2f} m'.format(
+                    name,
+                    filter_class.__name__,
+                    simulate_gps_fusion(sources, True, True, filter_class)
+                )
+            )
+
+
+def benchmark_streaming_statistics():
+    """Compares the streaming statistics to the vendored statistics module,
+    for a calibration run's worth of magnetometer readings.
+    """
+    rng = random.Random(1)
+    readings = [rng.gauss(350.0, 120.0) for _ in range(2000)]
+
+    def timed(name, function):
+        """Prints how long a function took."""
+        start = time.time()
+        result = function()
+        print('{:30} {:.5} s, {:.6g}'.format(name, time.time() - start, result))
+
+    def running_std_dev():
+        """Streaming population standard deviation."""
+        stats = RunningStats()
+        for reading in readings:
+            stats.add(reading)
+        return stats.std_dev()
+
+    def median():
+        """Streaming median estimate."""
+        quantile = P2Quantile(0.5)
+        for reading in readings:
+            quantile.add(reading)
+        return quantile.value()
+
+    def window_check():
+        """Telemetry.is_stopped style check after every reading."""
+        window = WindowedMinMax(10)
+        stopped = 0
+        for reading in readings:
+            window.add(reading)
+            stopped += window.full() and window.maximum() < 200.0
+        return stopped
+
+    def deque_check():
+        """The old deque based is_stopped check after every reading."""
+        history = collections.deque()
+        stopped = 0
+        for reading in readings:
+            history.append(reading)
+            while len(history) > 10:
+                history.popleft()
+            stopped += len(history) == 10 and all(i < 200.0 for i in history)
+        return stopped
+
+    timed('statistics.pstdev', lambda: statistics.pstdev(readings))
+    timed('RunningStats std_dev', running_std_dev)
+    timed('statistics.median', lambda: statistics.median(readings))
+    timed('P2Quantile median', median)
+    timed('deque window check', deque_check)
+    timed('WindowedMinMax window check', window_check)
+
+
+def benchmark_message_bus():
+    """Compares passing messages to consumers in the same process with
+    sending them through the Unix domain sockets.
+    """
+    message = {
+        'acceleration_g_x': 0.01,
+        'acceleration_g_y': -0.02,
+        'acceleration_g_z': 0.98,
+        'device_id': 'sup800f',
+    }
+    # Fewer than the queue holds, so that none are dropped
+    count = DEFAULT_MAX_SIZE // 2
+    exchange = 'benchmark'
+    for name, in_process in (('in process', True), ('socket', False)):
+        # Throughput and CPU time, including the consumer's threads
+        received = []
+        consumer = threading.Thread(
+            target=lambda: consume_messages(exchange, received.append)
+        )
+        consumer.start()
+        wait_for_consumer(exchange)
+        producer = MessageProducer(exchange, in_process=in_process)
+        start = time.time()
+        start_cpu = time.process_time()
+        for _ in range(count):
+            producer.publish(message)
+        while len(received) < count:
+            time.sleep(0.001)
+        end = time.time()
+        end_cpu = time.process_time()
+        producer.kill()
+        consumer.join()
+        print(
+            '{:12} {:.3} us per message, {:.3} us CPU per message'.format(
+                name,
+                (end - start) / count * 1e6,
+                (end_cpu - start_cpu) / count * 1e6
+            )
+        )
+
+        # Latency, one message at a time
+        arrived = threading.Event()
+        consumer = threading.Thread(
+            target=lambda: consume_messages(
+                exchange,
+                lambda _: arrived.set()
+            )
+        )
+        consumer.start()
+        wait_for_consumer(exchange)
+        producer = MessageProducer(exchange, in_process=in_process)
+        latencies_s = []
+        for _ in range(1000):
+            arrived.clear()
+            start = time.time()
+            producer.publish(message)
+            arrived.wait()
+            latencies_s.append(time.time() - start)
+        producer.kill()
+        consumer.join()
+        latencies_s.sort()
+        print(
+            '{:12} {:.3} us median latency, {:.3} us 99th percentile'.format(
+                name,
+                latencies_s[len(latencies_s) // 2] * 1e6,
+                latencies_s[len(latencies_s) * 99 // 100] * 1e6
+            )
+        )
+
+
+def benchmark_telemetry_messages():
+    """Compares handling telemetry readings as dicts, like other processes
+    send them, to handling typed messages.
+    """
+    telemetry = Telemetry()
+    telemetry._logger = DummyLogger()
+    telemetry._m_point_in_course = lambda point: True
+    readings = []
+    for index in range(3000):
+        readings.append(CompassReading(float(index % 360), 1.0, 'sup800f'))
+        readings.append(AccelReading(0.01, -0.02, 0.98, 'sup800f'))
+        if index % 10 == 0:
+            readings.append(GpsReading(
+                CENTRAL_LATITUDE,
+                CENTRAL_LONGITUDE,
+                5.0,
+                90.0,
+                1.0,
+                None,
+                'sup800f'
+            ))
+    dicts = [reading.to_dict() for reading in readings]
+
+    for name, messages in (('dicts', dicts), ('typed', readings)):
+        start = time.time()
+        for message in messages:
+            telemetry._handle_message(message)
+        end = time.time()
+        print(
+            '{:6} {:.3} us per message'.format(
+                name,
+                (end - start) / len(messages) * 1e6
+            )
+        )
+    print(
+        'Size: dict {} bytes, typed {} bytes per compass reading'.format(
+            sys.getsizeof(dicts[0]),
+            sys.getsizeof(readings[0])
+        )
+    )
+
+
+def benchmark_log_sink():
+    """Compares logging telemetry readings through a FileHandler with the
+    asynchronous, batched handler.
+    """
+    count = 20000
+    rng = random.Random(1)
+    messages = [
+        json.dumps({
+            'acceleration_g_x': rng.gauss(0.0, 0.05),
+            'acceleration_g_y': rng.gauss(0.0, 0.05),
+            'acceleration_g_z': rng.gauss(1.0, 0.05),
+            'device_id': 'sup800f',
+        })
+        for _ in range(count)
+    ]
+    directory = tempfile.mkdtemp()
+    formatter = logging.Formatter('%(asctime)s:%(levelname)s %(message)s')
+    handlers = (
+        ('FileHandler', lambda file_name: logging.FileHandler(file_name)),
+        ('async', AsyncFileHandler),
+        ('async gzip', lambda file_name: AsyncFileHandler(file_name, compress=True)),
+    )
+    try:
+        for name, create in handlers:
+            file_name = os.path.join(directory, name.replace(' ', '-'))
+            handler = create(file_name)
+            handler.setFormatter(formatter)
+            logger = logging.Logger(name)
+            logger.addHandler(handler)
+            start = time.time()
+            for message in messages:
+                logger.debug(message)
+            end = time.time()
+            handler.close()
+            closed = time.time()
+            size = sum(
+                os.path.getsize(os.path.join(directory, file_))
+                for file_ in os.listdir(directory)
+                if file_.startswith(name.replace(' ', '-'))
+            )
+            print(
+                '{:12} {:.3} us per record on the logging thread,'
+                ' {:.3} s until written, {} KiB on disk'.format(
+                    name,
+                    (end - start) / count * 1e6,
+                    closed - start,
+                    size // 1024
+                )
+            )
+    finally:
+        shutil.rmtree(directory)
+
+
+def _run_phones(port, phone_count, rate_hz, stop):
+    """Polls the telemetry from several simulated phones until stopped."""
+    import http.client
+
+    def poll():
+        """Polls like one phone."""
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        while not stop.is_set():
+            connection.request('GET', '/telemetry_json')
+            json.loads(connection.getresponse().read().decode('utf-8'))
+            time.sleep(1.0 / rate_hz)
+
+    phones = [threading.Thread(target=poll) for _ in range(phone_count)]
+    for phone in phones:
+        phone.start()
+    for phone in phones:
+        phone.join()
+
+
+def _serve_state(state_name, port):
+    """Starts a CherryPy server that returns the shared state as JSON."""
+    import cherrypy
+
+    class StateApp(object):  # pylint: disable=too-few-public-methods
+        """Serves the state like the monitor's telemetry_json."""
+
+        def __init__(self):
+            self._state = SharedState(state_name)
+
+        @cherrypy.expose
+        @cherrypy.tools.json_out()
+        def telemetry_json(self):
+            """Returns the state."""
+            return self._state.read('estimate')
+
+    cherrypy.tree.mount(StateApp(), '/')
+    cherrypy.config.update({
+        'server.socket_host': '127.0.0.1',
+        'server.socket_port': port,
+        'engine.autoreload.on': False,
+        'checker.on': False,
+        'log.screen': False,
+    })
+    cherrypy.engine.start()
+    cherrypy.engine.wait(cherrypy.engine.states.STARTED)
+
+
+def _serve_state_forever(state_name, port):
+    """Runs the server in a child process."""
+    import cherrypy
+    _serve_state(state_name, port)
+    cherrypy.engine.block()
+
+
+def benchmark_web_process_jitter():
+    """Measures how late a 50 Hz control loop wakes up while phones poll the
+    web server, with the server in the same process and in its own process.
+    """
+    import cherrypy
+    import multiprocessing
+
+    duration_s = 5.0
+    period_s = 0.02
+    phone_count = 4
+    rate_hz = 20.0
+    port = 18080
+    state = SharedState('benchmark-jitter', create=True)
+    location_filter = LocationFilter(0.0, 0.0, 0.0)
+    try:
+        for name, server in (
+                ('no phones', None),
+                ('web process', 'process'),
+                ('in process', 'thread'),
+        ):
+            web_process = None
+            if server == 'process':
+                web_process = multiprocessing.Process(
+                    target=_serve_state_forever,
+                    args=(state.name, port)
+                )
+                web_process.start()
+                time.sleep(2.0)
+            elif server == 'thread':
+                _serve_state(state.name, port)
+
+            stop = multiprocessing.Event()
+            phones = None
+            if server is not None:
+                phones = multiprocessing.Process(
+                    target=_run_phones,
+                    args=(port, phone_count, rate_hz, stop)
+                )
+                phones.start()
+                time.sleep(0.5)
+
+            # Same timing as Command._wait
+            lateness_s = []
+            wake_s = time.time()
+            end_s = wake_s + duration_s
+            while wake_s < end_s:
+                location_filter.update_dead_reckoning()
+                x_m, y_m = location_filter.estimated_location()
+                state.write('estimate', {'x_m': x_m, 'y_m': y_m})
+                sleep_start_s = time.time()
+                sleep_s = max(period_s - (sleep_start_s - wake_s), 0.0)
+                time.sleep(sleep_s)
+                wake_s = time.time()
+                lateness_s.append(wake_s - sleep_start_s - sleep_s)
+
+            stop.set()
+            if phones is not None:
+                phones.join()
+            if web_process is not None:
+                web_process.terminate()
+                web_process.join()
+            elif server == 'thread':
+                cherrypy.engine.exit()
+
+            lateness_s.sort()
+            print(
+                '{:12} {} loops, late by {:.3} ms median, {:.3} ms 99th'
+                ' percentile, {:.3} ms max'.format(
+                    name,
+                    len(lateness_s),
+                    lateness_s[len(lateness_s) // 2] * 1e3,
+                    lateness_s[len(lateness_s) * 99 // 100] * 1e3,
+                    lateness_s[-1] * 1e3
+                )
+            )
+    finally:
+        state.close()
+
+
+BENCHMARKS = {
+    'web_process_jitter': benchmark_web_process_jitter,
+    'log_sink': benchmark_log_sink,
+    'telemetry_messages': benchmark_telemetry_messages,
+    'message_bus': benchmark_message_bus,
+    'course_bundle': benchmark_course_bundle,
+    'sup800f_binary': benchmark_sup800f_binary,
+    'streaming_statistics': benchmark_streaming_statistics,
+    'accelerometer': benchmark_accelerometer,
+    'ekf_location_filter': benchmark_ekf_location_filter,
+    'location_filter_update_gps': benchmark_location_filter_update_gps,
+    'location_filter_delayed_gps': benchmark_location_filter_delayed_gps,
+    'location_filter_update_compass': benchmark_location_filter_update_compass,
+    'location_filter_update_dead_reckoning': benchmark_location_filter_update_dead_reckoning,
+    'command_run_course_iterator': benchmark_command_run_course_iterator,
+    'gps_fusion': benchmark_gps_fusion,
+}
+
+
 def main():
-    """Runs all the benchmarks."""
-    benchmark_location_filter_update_gps()
-    benchmark_location_filter_update_compass()
-    benchmark_location_filter_update_dead_reckoning()
-    benchmark_command_run_course_iterator()
+    """Runs the benchmarks named on the command line, or all of them."""
+    names = sys.argv[1:] or sorted(BENCHMARKS.keys())
+    for name in names:
+        BENCHMARKS[name]()
 
 if __name__ == '__main__':
     main()
@@ -4,7 +4,7 @@
     get_turn(self)
 """
 
-from messaging.async_logger import AsyncLogger()
+from messaging.async_logger import AsyncLogger
 
 
 class DummyDriver(object):
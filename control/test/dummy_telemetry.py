@@ -4,6 +4,7 @@ methods:
     get_data(self)
     process_drive_command(self, throttle, turn)
     is_stopped(self)
+    get_collision(self)
     handle_message(self, data_dict)
 """
 
@@ -73,6 +74,10 @@ class DummyTelemetry(object):
         """Returns True if the car is stopped."""
         return False
 
+    def get_collision(self):  # pylint: disable=no-self-use
+        """Returns the kind of collision the car had, if any."""
+        return None
+
     def handle_message(self, data_dict):
         """Handles recent data from the Telemetry module. For the dummy class,
         we ignore messages.
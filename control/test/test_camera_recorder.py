@@ -0,0 +1,151 @@
+"""Tests the camera recorder."""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from control.camera_recorder import CameraRecorder
+
+
+class FakeFrame(object):  # pylint: disable=too-few-public-methods
+    """Like picamera.PiVideoFrame."""
+
+    def __init__(self, index, timestamp, complete):
+        self.index = index
+        self.timestamp = timestamp
+        self.complete = complete
+
+
+class FakeCamera(object):
+    """Camera that's slow to start and writes each frame in two pieces,
+    with a clock that started a while ago.
+    """
+    START_S = 0.2
+    FRAME_S = 0.01
+    CLOCK_START_S = 1000.0
+
+    def __init__(self):
+        self.frame = None
+        self._clock_zero_s = time.time() - self.CLOCK_START_S
+        self._recording = threading.Event()
+        self._thread = None
+
+    @property
+    def timestamp(self):
+        """Returns the camera's clock in microseconds."""
+        return int((time.time() - self._clock_zero_s) * 1e6)
+
+    def start_recording(self, output, format=None):  # pylint: disable=redefined-builtin,unused-argument
+        """Starts writing frames to output after a while."""
+        time.sleep(self.START_S)
+        self._recording.set()
+        self._thread = threading.Thread(target=self._write, args=(output,))
+        self._thread.start()
+
+    def stop_recording(self):
+        """Stops writing frames."""
+        self._recording.clear()
+        self._thread.join()
+
+    def _write(self, output):
+        """Writes frames until stopped."""
+        index = 0
+        # The header doesn't have a timestamp
+        self.frame = FakeFrame(index, None, True)
+        output.write(b'header')
+        while self._recording.is_set():
+            index += 1
+            timestamp = self.timestamp
+            self.frame = FakeFrame(index, timestamp, False)
+            output.write(b'first')
+            self.frame = FakeFrame(index, timestamp, True)
+            output.write(b'second')
+            time.sleep(self.FRAME_S)
+        output.flush()
+
+
+class TestCameraRecorder(unittest.TestCase):
+    """Tests the camera recorder."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.camera = FakeCamera()
+        self.recorder = CameraRecorder(self.camera)
+        self.recorder.start()
+
+    def tearDown(self):
+        self.recorder.kill()
+        self.recorder.join()
+        shutil.rmtree(self.directory)
+
+    def _wait_for(self, condition):
+        """Waits for the recorder thread to do something."""
+        for _ in range(100):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail('Timed out')
+
+    def test_record(self):
+        """Requests shouldn't wait for the camera, and frame times should
+        match time.time().
+        """
+        file_name = os.path.join(self.directory, 'video.h264')
+        start = time.time()
+        self.recorder.start_recording(file_name)
+        self.assertLess(time.time() - start, FakeCamera.START_S / 2.0)
+        self.assertFalse(self.recorder.is_recording())
+
+        self._wait_for(lambda: len(self.recorder.frames()) >= 5)
+        self.assertTrue(self.recorder.is_recording())
+        # Starting again shouldn't replace the recording
+        self.recorder.start_recording(file_name + '.other')
+        self.recorder.stop_recording()
+        self._wait_for(lambda: not self.recorder.is_recording())
+        end = time.time()
+
+        frames = self.recorder.frames()
+        indexes = [index for index, _ in frames]
+        self.assertEqual(indexes, list(range(1, len(frames) + 1)))
+        times = [timestamp_s for _, timestamp_s in frames]
+        self.assertEqual(times, sorted(times))
+        self.assertGreaterEqual(times[0], start + FakeCamera.START_S - 0.01)
+        self.assertLessEqual(times[-1], end + 0.01)
+
+        with open(file_name, 'rb') as video:
+            self.assertTrue(video.read().startswith(b'headerfirstsecond'))
+        with open(file_name + '.frames') as index_file:
+            lines = index_file.read().splitlines()
+        self.assertEqual(lines[0], 'frame,timestamp_s')
+        self.assertEqual(len(lines), len(frames) + 1)
+        index, timestamp_s = lines[1].split(',')
+        self.assertEqual(int(index), 1)
+        self.assertAlmostEqual(float(timestamp_s), times[0], 5)
+        self.assertFalse(os.path.exists(file_name + '.other'))
+
+    def test_errors(self):
+        """A recording that can't be started shouldn't stop the thread."""
+        self.recorder.start_recording(
+            os.path.join(self.directory, 'missing', 'video.h264')
+        )
+        self.recorder.stop_recording()
+        file_name = os.path.join(self.directory, 'video.h264')
+        self.recorder.start_recording(file_name)
+        self._wait_for(self.recorder.is_recording)
+
+    def test_kill(self):
+        """Killing should stop the recording."""
+        file_name = os.path.join(self.directory, 'video.h264')
+        self.recorder.start_recording(file_name)
+        self._wait_for(self.recorder.is_recording)
+        self.recorder.kill()
+        self.recorder.join(1.0)
+        self.assertFalse(self.recorder.is_alive())
+        self.assertTrue(os.path.exists(file_name + '.frames'))
+
+
+if __name__ == '__main__':
+    unittest.main()
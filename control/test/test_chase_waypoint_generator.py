@@ -5,9 +5,12 @@ import unittest
 # Patch out the logger
 from messaging import async_logger
 from control.test.dummy_logger import DummyLogger
+_ASYNC_LOGGER = async_logger.AsyncLogger
 async_logger.AsyncLogger = DummyLogger
 
 from control.chase_waypoint_generator import ChaseWaypointGenerator
+# Only the modules imported above use the dummy logger
+async_logger.AsyncLogger = _ASYNC_LOGGER
 
 #pylint: disable=invalid-name
 #pylint: disable=protected-access
@@ -0,0 +1,218 @@
+"""Tests the collision detector."""
+
+import datetime
+import json
+import random
+import unittest
+
+from analysis.replay_collisions import read_events
+from analysis.replay_collisions import replay
+from control.collision_detector import CollisionDetector
+
+# The SUP800F sends a burst of accelerometer samples after each GPS fix,
+# about once a second. Sup800fTelemetry reads BINARY_BURST_SIZE binary
+# messages, about 0.1 s apart, and publishes them when the burst is done.
+SUP800F_PERIOD_S = 1.0
+SUP800F_BURST_SIZE = 3
+SUP800F_SAMPLE_S = 0.1
+START = datetime.datetime(2016, 6, 18, 10, 0, 0)
+
+
+class Recording(object):
+    """Writes log lines like the car does, with a biased and noisy
+    accelerometer. The samples are sent in bursts, like the SUP800F does,
+    and logged when the burst is published along with when they were taken.
+    """
+
+    def __init__(
+            self,
+            period_s=SUP800F_PERIOD_S,
+            burst_size=SUP800F_BURST_SIZE,
+            sample_s=SUP800F_SAMPLE_S
+    ):
+        self.lines = []
+        self.time_s = 0.0
+        self._period_s = period_s
+        self._burst_size = burst_size
+        self._sample_s = sample_s
+        self._random = random.Random(1)
+
+    def _log(self, message):
+        """Adds a log line."""
+        stamp = START + datetime.timedelta(seconds=self.time_s)
+        self.lines.append('{},{:03d}:DEBUG {}'.format(
+            stamp.strftime('%Y-%m-%d %H:%M:%S'),
+            stamp.microsecond // 1000,
+            message
+        ))
+
+    def burst_times_s(self):
+        """Returns when the samples in the next burst will be taken,
+        relative to START.
+        """
+        end_s = self.time_s + self._period_s
+        return [
+            end_s - self._sample_s * (self._burst_size - 1 - index)
+            for index in range(self._burst_size)
+        ]
+
+    def drive(self, throttle):
+        """Logs a drive command."""
+        self._log('Throttle: {}, steering: 0.0'.format(throttle))
+
+    def stopped(self):
+        """Logs the speed history noticing that the car stopped."""
+        self._log('RC car is not moving according to speed history, reversing')
+
+    def accelerometer(
+            self,
+            seconds,
+            forward_g=0.0,
+            left_g=0.0,
+            vibration_g=0.0
+    ):
+        """Logs bursts of accelerometer readings for seconds."""
+        end_s = self.time_s + seconds
+        while self.time_s < end_s:
+            sample_times_s = self.burst_times_s()
+            self.time_s += self._period_s
+            noise = lambda: self._random.gauss(0.0, 0.005)
+            for sample_s in sample_times_s:
+                self._log(json.dumps({
+                    'acceleration_g_x': 0.05 + forward_g + noise(),
+                    'acceleration_g_y': -0.02 + left_g + noise(),
+                    'acceleration_g_z':
+                        1.0 + self._random.gauss(0.0, vibration_g),
+                    'device_id': 'sup800f',
+                    'timestamp_s': START.timestamp() + sample_s,
+                }))
+
+
+class TestCollisionDetector(unittest.TestCase):
+    """Tests the collision detector."""
+
+    @staticmethod
+    def _replay(recording):
+        """Returns the times and kinds of the detected collisions."""
+        return replay(read_events(recording.lines))
+
+    def test_driving(self):
+        """Driving over rough ground and turning hard shouldn't look like a
+        collision.
+        """
+        recording = Recording()
+        recording.accelerometer(10.0)
+        recording.drive(0.5)
+        recording.accelerometer(3.0, forward_g=0.1, vibration_g=0.1)
+        recording.accelerometer(5.0, vibration_g=0.1)
+        recording.accelerometer(2.0, left_g=0.9, vibration_g=0.1)
+        recording.accelerometer(2.0, left_g=-0.9, vibration_g=0.1)
+        recording.drive(0.0)
+        recording.accelerometer(2.0, forward_g=-0.2)
+        self.assertEqual(self._replay(recording), [])
+
+    def test_rough_ground_fast(self):
+        """With a fast accelerometer, the vibration should be judged over
+        STALL_WINDOW_S rather than the last few readings, which can happen
+        to agree while the car creeps over rough ground.
+        """
+        recording = Recording(0.02, 1, 0.0)
+        recording.accelerometer(10.0)
+        recording.drive(0.5)
+        recording.accelerometer(3.0, vibration_g=0.1)
+        self.assertEqual(self._replay(recording), [])
+
+    def test_impact(self):
+        """Running into something should be noticed right away, and if the
+        car keeps pushing, so should the stall.
+        """
+        recording = Recording()
+        recording.accelerometer(10.0)
+        recording.drive(0.5)
+        recording.accelerometer(3.0, forward_g=0.1, vibration_g=0.1)
+        recording.accelerometer(2.0, vibration_g=0.1)
+        impact_s = recording.burst_times_s()[0]
+        recording.accelerometer(SUP800F_PERIOD_S / 2.0, forward_g=-2.0)
+        recording.accelerometer(3.0, vibration_g=0.01)
+        recording.stopped()
+
+        collisions = self._replay(recording)
+        self.assertEqual([kind for _, kind in collisions], ['impact', 'stall'])
+        # The first sample of the burst shows it
+        self.assertAlmostEqual(
+            collisions[0][0] - START.timestamp(),
+            impact_s,
+            2
+        )
+        # It takes the next burst to see that it isn't vibrating, and the
+        # speed history takes several seconds longer
+        self.assertLess(
+            collisions[1][0] - collisions[0][0],
+            SUP800F_PERIOD_S * 1.5
+        )
+
+    def test_stall(self):
+        """Trying to drive into something from a standstill should be
+        noticed, and faster with faster readings.
+        """
+        for period_s, burst_size, sample_s in (
+                (SUP800F_PERIOD_S, SUP800F_BURST_SIZE, SUP800F_SAMPLE_S),
+                (0.02, 1, 0.0),
+        ):
+            recording = Recording(period_s, burst_size, sample_s)
+            recording.accelerometer(10.0)
+            recording.drive(0.5)
+            drive_s = recording.time_s
+            recording.accelerometer(3.0, vibration_g=0.01)
+            collisions = self._replay(recording)
+            self.assertEqual([kind for _, kind in collisions], ['stall'])
+            latency_s = collisions[0][0] - START.timestamp() - drive_s
+            self.assertGreaterEqual(latency_s, CollisionDetector.STALL_S)
+            # By the end of the first burst after STALL_S
+            self.assertLess(
+                latency_s,
+                CollisionDetector.STALL_S + period_s * 1.5
+            )
+
+    def test_burst_timing(self):
+        """The same readings should give the same result whether they arrive
+        one at a time or in bursts, because the windows are in seconds.
+        """
+        def run(period_s, burst_size, sample_s):
+            """Returns when impacts were noticed at some rate."""
+            recording = Recording(period_s, burst_size, sample_s)
+            recording.accelerometer(10.0)
+            recording.drive(0.5)
+            recording.accelerometer(0.6, forward_g=0.1, vibration_g=0.1)
+            recording.accelerometer(0.3, forward_g=-1.5)
+            return [
+                time_s for time_s, kind in self._replay(recording)
+                if kind == 'impact'
+            ]
+
+        steady = run(0.1, 1, 0.0)
+        bursts = run(0.3, 3, 0.1)
+        self.assertEqual(len(steady), 1)
+        self.assertEqual(len(bursts), 1)
+        self.assertAlmostEqual(steady[0], bursts[0], 2)
+
+    def test_stopped(self):
+        """Bumps while the car isn't trying to drive aren't collisions."""
+        detector = CollisionDetector()
+        for index in range(10):
+            detector.add(index * 0.1, 0.0, 0.0, 1.0)
+        detector.add(1.0, -3.0, 2.0, 1.0)
+        self.assertIs(detector.collision(), None)
+
+        detector.drive(1.1, 0.5)
+        detector.add(1.2, 0.0, 0.0, 1.0)
+        detector.add(1.3, -3.0, 0.0, 1.0)
+        self.assertEqual(detector.collision(), 'impact')
+        self.assertIs(detector.collision(), None)
+        # Readings without the bias are ignored
+        detector.add(1.4, None, None, 1.0)
+        self.assertIs(detector.collision(), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+"""Tests the compass calibration."""
+
+import math
+import numpy
+import os
+import shutil
+import tempfile
+import unittest
+
+from control.compass_calibration import CalibrationStore
+from control.compass_calibration import CompassCalibration
+from control.compass_calibration import DEFAULT_CALIBRATION
+from control.compass_calibration import EllipseFit
+
+#pylint: disable=invalid-name
+
+
+def ellipse_readings(count, center, semi_axes, rotation_d, noise=0.0, seed=1):
+    """Returns the true angles and (x, y) readings of a rotated ellipse."""
+    rng = numpy.random.RandomState(seed)
+    angles_r = rng.uniform(0.0, 2.0 * math.pi, count)
+    rotation_r = math.radians(rotation_d)
+    x_axis = semi_axes[0] * numpy.cos(angles_r)
+    y_axis = semi_axes[1] * numpy.sin(angles_r)
+    cos_r = math.cos(rotation_r)
+    sin_r = math.sin(rotation_r)
+    x = center[0] + x_axis * cos_r - y_axis * sin_r
+    y = center[1] + x_axis * sin_r + y_axis * cos_r
+    if noise:
+        x += rng.normal(0.0, noise, count)
+        y += rng.normal(0.0, noise, count)
+    return angles_r, x, y
+
+
+class TestCompassCalibration(unittest.TestCase):
+    """Tests the compass calibration."""
+
+    def test_ellipse_fit(self):
+        """Soft and hard iron should be removed."""
+        angles_r, x, y = ellipse_readings(
+            500,
+            (20.0, -5.0),
+            (50.0, 30.0),
+            30.0
+        )
+        fit = EllipseFit()
+        # Readings can be added in batches or one at a time
+        fit.add_many(x[:250], y[:250])
+        for x_ut, y_ut in zip(x[250:], y[250:]):
+            fit.add(x_ut, y_ut)
+        self.assertEqual(fit.count, 500)
+        calibration = fit.fit()
+        self.assertAlmostEqual(calibration.offsets[0], 20.0)
+        self.assertAlmostEqual(calibration.offsets[1], -5.0)
+
+        corrected = numpy.array([
+            calibration.correct(x_ut, y_ut) for x_ut, y_ut in zip(x, y)
+        ])
+        magnitudes = numpy.sqrt((corrected ** 2).sum(axis=1))
+        # A circle with the same area
+        radius = math.sqrt(50.0 * 30.0)
+        for magnitude in magnitudes:
+            self.assertAlmostEqual(magnitude, radius)
+        self.assertAlmostEqual(calibration.magnitude_mean, radius ** 2)
+        self.assertAlmostEqual(calibration.magnitude_std_dev, 0.0, 3)
+
+        # Headings are only off by a constant rotation
+        headings_r = numpy.arctan2(corrected[:, 1], corrected[:, 0])
+        errors_r = numpy.angle(numpy.exp(1j * (headings_r - angles_r)))
+        self.assertAlmostEqual(errors_r.max(), errors_r.min())
+
+    def test_noisy_fit(self):
+        """Should match the statistics of the corrected readings."""
+        _, x, y = ellipse_readings(500, (-12.0, 6.0), (20.0, 18.0), 80.0, 1.0)
+        fit = EllipseFit()
+        fit.add_many(x, y)
+        calibration = fit.fit()
+        corrected = numpy.array([
+            calibration.correct(x_ut, y_ut) for x_ut, y_ut in zip(x, y)
+        ])
+        squared = (corrected ** 2).sum(axis=1)
+        self.assertAlmostEqual(calibration.magnitude_mean, squared.mean(), 6)
+        self.assertAlmostEqual(
+            calibration.magnitude_std_dev,
+            squared.std(),
+            6
+        )
+        self.assertAlmostEqual(calibration.offsets[0], -12.0, 0)
+        self.assertAlmostEqual(calibration.offsets[1], 6.0, 0)
+
+    def test_fallback(self):
+        """Readings that aren't an ellipse only get a hard iron offset."""
+        fit = EllipseFit()
+        with self.assertRaises(ValueError):
+            fit.fit()
+
+        # The car didn't turn, so the readings just wobble along a line
+        rng = numpy.random.RandomState(1)
+        for noise in (0.0, 0.5):
+            x = numpy.linspace(0.0, 10.0, 100)
+            y = 0.5 * x + rng.normal(0.0, noise, 100) if noise else 0.5 * x
+            fit = EllipseFit()
+            fit.add_many(x, y)
+            calibration = fit.fit()
+            self.assertEqual(calibration.soft_iron, ((1.0, 0.0), (0.0, 1.0)))
+            self.assertAlmostEqual(calibration.offsets[0], 5.0)
+
+    def test_store(self):
+        """Calibrations should be saved by device."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        file_name = os.path.join(directory, 'calibration.json')
+        store = CalibrationStore(file_name)
+        self.assertIsNone(store.load('sup800f'))
+
+        calibration = CompassCalibration(
+            (1.0, 2.0),
+            ((1.1, 0.1), (0.1, 0.9)),
+            100.0,
+            10.0,
+            200,
+            1000.0
+        )
+        store.save('sup800f', calibration)
+        store.save('phone', CompassCalibration((3.0, 4.0)))
+        loaded = CalibrationStore(file_name).load('sup800f')
+        self.assertEqual(loaded.to_dict(), calibration.to_dict())
+        self.assertEqual(store.load('phone').offsets, (3.0, 4.0))
+        self.assertFalse(os.path.exists(file_name + '.tmp'))
+        # Missing magnitudes come from the default
+        self.assertEqual(
+            store.load('phone').magnitude_mean,
+            DEFAULT_CALIBRATION.magnitude_mean
+        )
+        self.assertEqual(
+            store.load('phone').magnitude_std_dev,
+            DEFAULT_CALIBRATION.magnitude_std_dev
+        )
+
+        with open(file_name, 'w') as file_:
+            file_.write(
+                '{"sup800f": {"offsets": [1, 2], "magnitude_mean": "big",'
+                ' "magnitude_std_dev": 1}}'
+            )
+        with self.assertRaises(ValueError):
+            store.load('sup800f')
+        with open(file_name, 'w') as file_:
+            file_.write('[]')
+        with self.assertRaises(ValueError):
+            store.load('sup800f')
+        # Saving replaces a corrupt file
+        store.save('sup800f', calibration)
+        self.assertEqual(store.load('sup800f').offsets, (1.0, 2.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""Tests the course bundles."""
+
+import math
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from control.course_bundle import CourseBundle
+from control.course_bundle import CourseCache
+from control.course_bundle import compile_kml
+from control.telemetry import Telemetry
+
+#pylint: disable=protected-access
+
+COURSE_FILE_NAME = 'sparkfun-avc-2016.kml'
+
+
+class TestCourseBundle(unittest.TestCase):
+    """Tests the course bundles."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_compile_kml(self):
+        """Should have the waypoints, course and inner obstacles."""
+        with open('paths/' + COURSE_FILE_NAME, 'rb') as file_:
+            bundle = compile_kml(file_)
+        self.assertGreater(len(bundle.waypoints), 2)
+        self.assertGreater(len(bundle.course), 2)
+        self.assertEqual(len(bundle.inner), 3)
+        self.assertEqual(
+            len(bundle.segment_headings_d),
+            len(bundle.waypoints) - 1
+        )
+        start, end = bundle.waypoints[0], bundle.waypoints[1]
+        self.assertAlmostEqual(
+            bundle.segment_lengths_m[0],
+            math.sqrt((end[0] - start[0]) ** 2 + (end[1] - start[1]) ** 2)
+        )
+        self.assertAlmostEqual(
+            bundle.segment_headings_d[0],
+            Telemetry.relative_degrees(start[0], start[1], end[0], end[1])
+        )
+
+        # The waypoints should all be in the course
+        for waypoint in bundle.waypoints:
+            self.assertTrue(bundle.point_in_course(waypoint))
+        self.assertFalse(bundle.point_in_course((10000.0, 10000.0)))
+
+    def test_bytes(self):
+        """Bundles should survive being written and read."""
+        bundle = CourseBundle(
+            [(0.0, 0.0), (0.0, 10.0), (10.0, 10.0)],
+            [(-20.0, -20.0), (-20.0, 20.0), (20.0, 20.0), (20.0, -20.0)],
+            [[(-1.0, -1.0), (-1.0, 1.0), (1.0, 1.0), (1.0, -1.0)]]
+        )
+        read = CourseBundle.from_bytes(bundle.to_bytes())
+        for attribute in (
+                'waypoints', 'course', 'inner', 'segment_headings_d',
+                'segment_lengths_m', 'course_bounds', 'inner_bounds'
+        ):
+            self.assertEqual(
+                getattr(read, attribute),
+                getattr(bundle, attribute),
+                attribute
+            )
+        self.assertEqual(read.segment_headings_d, [0.0, 90.0])
+        self.assertFalse(read.point_in_course((0.0, 0.0)))
+        self.assertTrue(read.point_in_course((5.0, 5.0)))
+        self.assertFalse(read.point_in_course((25.0, 5.0)))
+
+        # Courses without waypoints or boundaries
+        bundle = CourseBundle(None, [], [])
+        read = CourseBundle.from_bytes(bundle.to_bytes())
+        self.assertIsNone(read.waypoints)
+        self.assertTrue(read.point_in_course((25.0, 5.0)))
+
+        with self.assertRaises(ValueError):
+            CourseBundle.from_bytes(b'not a bundle')
+        with self.assertRaises(ValueError):
+            CourseBundle.from_bytes(bundle.to_bytes()[:-1])
+
+    def test_cache(self):
+        """Courses should only be compiled once."""
+        cache = CourseCache(self.directory)
+        bundle = cache.load(COURSE_FILE_NAME)
+        self.assertIs(cache.load(COURSE_FILE_NAME), bundle)
+        bundle_file_names = os.listdir(self.directory)
+        self.assertEqual(bundle_file_names, [bundle.file_hash + '.course'])
+
+        # Later runs read the bundle from disk
+        with mock.patch('control.course_bundle.compile_kml') as compile_:
+            compile_.side_effect = AssertionError('Should not compile')
+            read = CourseCache(self.directory).load(COURSE_FILE_NAME)
+        self.assertEqual(read.waypoints, bundle.waypoints)
+        self.assertEqual(read.inner, bundle.inner)
+
+        # Bad bundles are recompiled
+        with open(os.path.join(self.directory, bundle_file_names[0]), 'w') as file_:
+            file_.write('corrupt')
+        read = CourseCache(self.directory).load(COURSE_FILE_NAME)
+        self.assertEqual(read.course, bundle.course)
+
+        # An unwritable cache still works
+        cache = CourseCache('/nonexistent/cache/')
+        self.assertEqual(
+            cache.load(COURSE_FILE_NAME).waypoints,
+            bundle.waypoints
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
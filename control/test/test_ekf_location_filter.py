@@ -0,0 +1,152 @@
+"""Tests the EKF location filter."""
+
+import math
+import mock
+import unittest
+
+from control.ekf_location_filter import EkfLocationFilter
+
+#pylint: disable=invalid-name
+#pylint: disable=protected-access
+
+
+class TestEkfLocationFilter(unittest.TestCase):
+    """Tests the EKF location filter."""
+
+    def setUp(self):
+        self.now_s = 1000.0
+        patch = mock.patch('control.ekf_location_filter.time')
+        mock_time = patch.start()
+        mock_time.time.side_effect = lambda: self.now_s
+        self.addCleanup(patch.stop)
+
+    def _step(self, location_filter, seconds, step_s=0.1):
+        """Runs dead reckoning for some time."""
+        for _ in range(int(round(seconds / step_s))):
+            self.now_s += step_s
+            location_filter.update_dead_reckoning()
+
+    def test_gps_convergence(self):
+        """Repeated GPS readings should pull in the estimate."""
+        location_filter = EkfLocationFilter(0.0, 0.0, 0.0)
+        for _ in range(50):
+            self.now_s += 0.2
+            location_filter.update_gps(10.0, -5.0, 1.0, 1.0, 90.0, 0.0)
+        x_m, y_m = location_filter.estimated_location()
+        self.assertAlmostEqual(x_m, 10.0, 0)
+        self.assertAlmostEqual(y_m, -5.0, 0)
+        self.assertAlmostEqual(location_filter.estimated_heading(), 90.0, 0)
+
+        # Headings wrap around north
+        for _ in range(50):
+            self.now_s += 0.2
+            location_filter.update_compass(350.0, 1.0)
+        heading_d = location_filter.estimated_heading()
+        self.assertTrue(
+            heading_d > 340.0 or heading_d < 10.0,
+            'Heading {} should be near north'.format(heading_d)
+        )
+
+    def test_bicycle_model(self):
+        """The car should turn faster at higher speeds."""
+        yaw_rates = []
+        for speed_m_s in (1.0, 2.0):
+            location_filter = EkfLocationFilter(0.0, 0.0, 0.0)
+            location_filter._estimates[EkfLocationFilter.SPEED] = speed_m_s
+            location_filter.manual_steering_angle(10.0)
+            self._step(location_filter, 2.0)
+            yaw_rates.append(location_filter.estimated_yaw_rate_d_s())
+
+        for speed_m_s, yaw_rate_d_s in zip((1.0, 2.0), yaw_rates):
+            expected_d_s = math.degrees(
+                speed_m_s * math.tan(math.radians(10.0))
+                / EkfLocationFilter.WHEELBASE_M
+            )
+            self.assertAlmostEqual(yaw_rate_d_s, expected_d_s, 0)
+        self.assertGreater(yaw_rates[1], yaw_rates[0] * 1.9)
+
+        # Steering right turns clockwise
+        location_filter = EkfLocationFilter(0.0, 0.0, 0.0)
+        location_filter._estimates[EkfLocationFilter.SPEED] = 1.0
+        location_filter.manual_steering_angle(10.0)
+        self._step(location_filter, 0.5)
+        self.assertGreater(location_filter.estimated_heading(), 0.0)
+        self.assertLess(location_filter.estimated_heading(), 90.0)
+        x_m, y_m = location_filter.estimated_location()
+        self.assertGreater(x_m, 0.0)
+        self.assertGreater(y_m, 0.0)
+
+    def test_fixed_turn_rate(self):
+        """manual_steering should still work like in LocationFilter."""
+        location_filter = EkfLocationFilter(0.0, 0.0, 0.0)
+        location_filter.manual_steering(-30.0)
+        self._step(location_filter, 3.0)
+        self.assertAlmostEqual(location_filter.estimated_yaw_rate_d_s(), -30.0)
+
+    def test_accelerometer(self):
+        """The accelerometer should drive the acceleration and yaw rate."""
+        location_filter = EkfLocationFilter(0.0, 0.0, 0.0)
+        for _ in range(20):
+            self.now_s += 0.05
+            location_filter.update_accelerometer(2.0, 0.0)
+        self.assertAlmostEqual(
+            location_filter.estimated_acceleration_m_s_s(),
+            2.0,
+            0
+        )
+        self.assertGreater(location_filter.estimated_speed(), 1.0)
+        self.assertGreater(location_filter.estimated_location()[1], 0.5)
+
+        # Hold the speed and turn right; 4 m/s/s at 2 m/s is 2 r/s. The
+        # steering says we're going straight, so the estimate ends up in
+        # between, but closer to what the accelerometer says.
+        for _ in range(40):
+            self.now_s += 0.05
+            location_filter._estimates[EkfLocationFilter.SPEED] = 2.0
+            location_filter.update_accelerometer(0.0, 4.0)
+        yaw_rate_d_s = location_filter.estimated_yaw_rate_d_s()
+        self.assertGreater(yaw_rate_d_s, math.degrees(1.0))
+        self.assertLess(yaw_rate_d_s, math.degrees(2.0))
+
+        # When the steering agrees, the estimate matches
+        location_filter.manual_steering_angle(
+            math.degrees(math.atan(EkfLocationFilter.WHEELBASE_M))
+        )
+        for _ in range(40):
+            self.now_s += 0.05
+            location_filter._estimates[EkfLocationFilter.SPEED] = 2.0
+            location_filter.update_accelerometer(0.0, 4.0)
+        self.assertAlmostEqual(
+            location_filter.estimated_yaw_rate_d_s(),
+            math.degrees(2.0),
+            0
+        )
+
+    def test_delayed_measurement(self):
+        """Late measurements should be moved forward to now."""
+        location_filter = EkfLocationFilter(0.0, 0.0, 0.0)
+        location_filter._estimates[EkfLocationFilter.SPEED] = 2.0
+        self._step(location_filter, 1.0)
+        x_m, y_m = location_filter.estimated_location()
+        self.assertAlmostEqual(x_m, 0.0)
+        self.assertAlmostEqual(y_m, 2.0)
+
+        # A reading from half a second ago that agrees with the estimate
+        # shouldn't move it
+        location_filter.update_gps(
+            0.0, 1.0, 1.0, 1.0, None, None, timestamp_s=self.now_s - 0.5
+        )
+        x_m, y_m = location_filter.estimated_location()
+        self.assertAlmostEqual(x_m, 0.0)
+        self.assertAlmostEqual(y_m, 2.0)
+
+        # Readings that are too old are applied as if they were current
+        location_filter.update_gps(
+            0.0, 1.0, 0.01, 0.01, None, None, timestamp_s=self.now_s - 10.0
+        )
+        _, y_m = location_filter.estimated_location()
+        self.assertAlmostEqual(y_m, 1.0, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
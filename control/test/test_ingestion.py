@@ -0,0 +1,171 @@
+"""Tests the web telemetry ingestion."""
+
+import unittest
+
+from control.web_telemetry.ingestion import IngestionRates
+from control.web_telemetry.ingestion import TelemetryIngester
+from control.web_telemetry.ingestion import validate_reading
+from messaging import metrics
+
+#pylint: disable=invalid-name
+
+
+class DummyProducer(object):  # pylint: disable=too-few-public-methods
+    """Records published batches."""
+
+    def __init__(self):
+        self.batches = []
+
+    def readings(self, readings):
+        """Records the batch."""
+        self.batches.append(readings)
+
+
+def gps_reading(**kwargs):
+    """Returns a valid GPS reading."""
+    reading = {
+        'latitude_d': 40.09,
+        'longitude_d': -105.18,
+        'accuracy_m': 5.0,
+        'heading_d': 90.0,
+        'speed_m_s': 1.0,
+        'timestamp_s': 1000.0,
+    }
+    reading.update(kwargs)
+    return reading
+
+
+class TestIngestion(unittest.TestCase):
+    """Tests the web telemetry ingestion."""
+
+    def test_validate_reading(self):
+        """Tests validating readings."""
+        reading = validate_reading(gps_reading(extra=1), 'phone')
+        self.assertEqual(reading['device_id'], 'phone')
+        self.assertNotIn('extra', reading)
+
+        # Phones without a speed or heading fix send null
+        validate_reading(gps_reading(heading_d=None, speed_m_s=None), 'phone')
+        # Some old phones send strings
+        reading = validate_reading(gps_reading(timestamp_s='1001'), 'phone')
+        self.assertEqual(reading['timestamp_s'], 1001.0)
+
+        compass = validate_reading(
+            {'compass_d': 10.0, 'confidence': 0.5, 'device_id': 'phone'}
+        )
+        self.assertEqual(compass['compass_d'], 10.0)
+
+        for bad in (
+                gps_reading(),
+                gps_reading(latitude_d=91.0, device_id='phone'),
+                gps_reading(accuracy_m=-1.0, device_id='phone'),
+                gps_reading(longitude_d='east', device_id='phone'),
+                gps_reading(timestamp_s=None, device_id='phone'),
+                gps_reading(accuracy_m=float('nan'), device_id='phone'),
+                {'compass_d': 10.0, 'confidence': 2.0, 'device_id': 'phone'},
+                {'altitude_m': 1.0, 'device_id': 'phone'},
+                gps_reading(device_id=['phone']),
+                gps_reading(device_id=''),
+                gps_reading(device_id='x' * 101),
+                [],
+        ):
+            with self.assertRaises(ValueError):
+                validate_reading(bad)
+
+    def test_ingest(self):
+        """Batches should be forwarded in one message."""
+        producer = DummyProducer()
+        ingester = TelemetryIngester(producer)
+
+        # The old single reading format still works
+        self.assertEqual(
+            ingester.ingest(gps_reading(device_id='old')),
+            (1, [])
+        )
+        self.assertEqual(len(producer.batches), 1)
+
+        count, errors = ingester.ingest({
+            'device_id': 'phone',
+            'readings': [
+                gps_reading(timestamp_s=1000.0),
+                gps_reading(timestamp_s=1000.1, latitude_d=100.0),
+                {'compass_d': 10.0, 'confidence': 1.0},
+                gps_reading(timestamp_s=1000.2),
+            ]
+        })
+        self.assertEqual(count, 3)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(len(producer.batches), 2)
+        self.assertEqual(
+            [reading.get('timestamp_s') for reading in producer.batches[1]],
+            [1000.0, None, 1000.2]
+        )
+
+        # Nothing valid, nothing sent
+        self.assertEqual(ingester.ingest({'readings': [{}]})[0], 0)
+        self.assertEqual(len(producer.batches), 2)
+        with self.assertRaises(ValueError):
+            ingester.ingest({'readings': 'nope'})
+
+        rates = ingester.rates.rates()
+        self.assertAlmostEqual(rates['phone'], 3 / IngestionRates.WINDOW_S)
+        self.assertAlmostEqual(rates['old'], 1 / IngestionRates.WINDOW_S)
+
+    def test_metric_labels(self):
+        """Only devices that have sent valid readings should get their own
+        labels, and only a few of them.
+        """
+        ingester = TelemetryIngester(DummyProducer())
+        ingester.MAX_DEVICE_LABELS = 2
+        readings = lambda device: metrics.counter(
+            'web_telemetry_readings_total',
+            device=device
+        ).value()
+        rejected = lambda device: metrics.counter(
+            'web_telemetry_rejected_readings_total',
+            device=device
+        ).value()
+        before = {
+            'other': (readings('other'), rejected('other')),
+            'labels-1': (readings('labels-1'), rejected('labels-1')),
+        }
+
+        # Never sent anything valid
+        ingester.ingest(gps_reading(device_id='labels-0', latitude_d=100.0))
+        ingester.ingest(gps_reading(device_id=['labels-0']))
+        ingester.ingest(gps_reading(device_id='labels-1'))
+        ingester.ingest(gps_reading(device_id='labels-1', latitude_d=100.0))
+        ingester.ingest(gps_reading(device_id='labels-2'))
+        # Too many devices
+        ingester.ingest(gps_reading(device_id='labels-3'))
+        ingester.ingest(gps_reading(device_id='labels-3', latitude_d=100.0))
+
+        self.assertEqual(
+            (readings('labels-1'), rejected('labels-1')),
+            (before['labels-1'][0] + 1, before['labels-1'][1] + 1)
+        )
+        self.assertEqual(
+            (readings('other'), rejected('other')),
+            (before['other'][0] + 1, before['other'][1] + 3)
+        )
+        devices = {
+            labels['labels']['device']
+            for labels
+            in metrics.REGISTRY.to_json()['web_telemetry_readings_total']
+        }
+        self.assertNotIn('labels-0', devices)
+        self.assertNotIn('labels-3', devices)
+
+    def test_rates(self):
+        """Rates should only count recent readings."""
+        rates = IngestionRates(window_s=2.0)
+        for tick in range(20):
+            rates.record('fast', 2, 100.0 + tick * 0.1)
+        rates.record('slow', 1, 100.0)
+        self.assertEqual(rates.rates(102.0), {'fast': 20.0, 'slow': 0.5})
+        self.assertEqual(rates.rates(103.05), {'fast': 9.0})
+        self.assertEqual(rates.rates(110.0), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 """Tests the location Kalman Filter."""
 
 import math
+import mock
 import numpy
 import random
 import unittest
@@ -173,3 +174,149 @@ class TestLocationFilter(unittest.TestCase):
                 0.0  # Tick isn't used for GPS
             )
             check_estimates()
+
+    @mock.patch('control.location_filter.time')
+    def test_delayed_measurement(self, mock_time):
+        """Late measurements should be applied at the time they were taken."""
+        clock = [1000.0]
+        mock_time.time.side_effect = lambda: clock[0]
+
+        def run(in_order):
+            """Runs a compass and a GPS update in some order."""
+            clock[0] = 1000.0
+            location_filter = LocationFilter(0.0, 0.0, 0.0)
+            location_filter.manual_steering(10.0)
+            clock[0] = 1000.2
+            if in_order:
+                location_filter.update_gps(5.0, 5.0, 1.0, 1.0, 45.0, 2.0)
+                clock[0] = 1000.5
+                location_filter.update_compass(50.0, 1.0)
+            else:
+                clock[0] = 1000.5
+                location_filter.update_compass(50.0, 1.0)
+                location_filter.update_gps(
+                    5.0, 5.0, 1.0, 1.0, 45.0, 2.0, 1000.2
+                )
+            return location_filter
+
+        in_order = run(True)
+        late = run(False)
+        for actual, expected in zip(
+                late._estimates.A1,
+                in_order._estimates.A1
+        ):
+            self.assertAlmostEqual(actual, expected)
+        self.assertEqual(late._last_observation_s, 1000.5)
+        self.assertEqual(late._history_count, 3)
+
+        # Too old to replay, so it's applied now
+        clock[0] = 1010.0
+        late.update_gps(5.0, 5.0, 1.0, 1.0, 45.0, 2.0, 1000.3)
+        self.assertEqual(late._last_observation_s, 1010.0)
+
+    @mock.patch('control.location_filter.time')
+    def test_delayed_measurement_accelerometer(self, mock_time):
+        """Replays should use the accelerometer readings from when each
+        measurement was taken, even if they changed before it arrived.
+        """
+        clock = [1000.0]
+        mock_time.time.side_effect = lambda: clock[0]
+
+        def run(in_order):
+            """Runs a GPS update in some order with accelerometer readings."""
+            clock[0] = 1000.0
+            location_filter = LocationFilter(0.0, 0.0, 0.0)
+            location_filter.update_accelerometer(2.0, 0.0)
+            clock[0] = 1000.2
+            if in_order:
+                location_filter.update_gps(1.0, 1.0, 1.0, 1.0, 10.0, 1.0)
+            clock[0] = 1000.3
+            location_filter.update_accelerometer(-1.0, 0.0)
+            clock[0] = 1000.5
+            location_filter.update_compass(20.0, 1.0)
+            if not in_order:
+                location_filter.update_gps(
+                    1.0, 1.0, 1.0, 1.0, 10.0, 1.0, 1000.2
+                )
+            clock[0] = 1000.6
+            location_filter.update_dead_reckoning()
+            return location_filter
+
+        in_order = run(True)
+        late = run(False)
+        for actual, expected in zip(
+                late._estimates.A1,
+                in_order._estimates.A1
+        ):
+            self.assertAlmostEqual(actual, expected)
+        for actual, expected in zip(
+                late._covariance_matrix.A1,
+                in_order._covariance_matrix.A1
+        ):
+            self.assertAlmostEqual(actual, expected)
+        self.assertEqual(late._acceleration_m_s_s, -1.0)
+        self.assertEqual(late._last_accelerometer_s, 1000.3)
+        self.assertEqual(late._history_count, in_order._history_count)
+
+    def test_history_ring_buffer(self):
+        """The history should keep the newest measurements."""
+        location_filter = LocationFilter(0.0, 0.0, 0.0)
+        # The initial state takes up one entry
+        for _ in range(LocationFilter.HISTORY_SIZE + 9):
+            location_filter.update_compass(10.0, 1.0)
+        self.assertEqual(
+            location_filter._history_count,
+            LocationFilter.HISTORY_SIZE
+        )
+        self.assertEqual(location_filter._history_start, 10)
+        newest = (
+            location_filter._history_start
+            + location_filter._history_count
+            - 1
+        ) % LocationFilter.HISTORY_SIZE
+        self.assertEqual(
+            location_filter._history_time_s[newest],
+            location_filter._last_observation_s
+        )
+
+
+    @mock.patch('control.location_filter.time')
+    def test_accelerometer(self, mock_time):
+        """The accelerometer should drive the speed and turn rate."""
+        clock = [1000.0]
+        mock_time.time.side_effect = lambda: clock[0]
+        location_filter = LocationFilter(0.0, 0.0, 0.0)
+
+        # Too slow to trust the lateral acceleration
+        location_filter.update_accelerometer(0.0, 5.0)
+        clock[0] += 0.1
+        location_filter.update_accelerometer(2.0, 0.0)
+        self.assertAlmostEqual(location_filter.estimated_heading(), 0.0)
+        for _ in range(10):
+            clock[0] += 0.1
+            location_filter.update_accelerometer(2.0, 0.0)
+        self.assertAlmostEqual(location_filter.estimated_speed(), 2.0)
+        self.assertAlmostEqual(location_filter.estimated_location()[1], 1.0)
+        self.assertAlmostEqual(location_filter.estimated_heading(), 0.0)
+
+        # The last reading applies until this one
+        clock[0] += 0.1
+        location_filter.update_accelerometer(0.0, 1.1)
+        self.assertAlmostEqual(location_filter.estimated_speed(), 2.2)
+
+        # Going 2.2 m/s with 1.1 m/s/s to the right is a 0.5 rad/s turn
+        clock[0] += 0.4
+        location_filter.update_dead_reckoning()
+        self.assertAlmostEqual(location_filter.estimated_speed(), 2.2)
+        self.assertAlmostEqual(
+            location_filter.estimated_heading(),
+            math.degrees(0.2)
+        )
+
+        # Stale readings are ignored
+        clock[0] += 1.0
+        location_filter.update_dead_reckoning()
+        self.assertAlmostEqual(
+            location_filter.estimated_heading(),
+            math.degrees(0.2)
+        )
@@ -0,0 +1,141 @@
+"""Tests the GPS sensor fusion."""
+
+import unittest
+
+from control.sensor_fusion import GpsFusion
+from messaging import metrics
+
+#pylint: disable=invalid-name
+
+NOW_S = 1500000000.0
+
+
+class TestGpsFusion(unittest.TestCase):
+    """Tests the GPS sensor fusion."""
+
+    def test_time_alignment(self):
+        """Old readings should be moved forward."""
+        fusion = GpsFusion()
+        # Heading north at 2 m/s, half a second old
+        x_m, y_m, accuracy_m = fusion.align(
+            'sup800f', 10.0, 20.0, 1.0, 0.0, 2.0, NOW_S - 0.5,
+            (0.0, 0.0), NOW_S
+        )
+        self.assertAlmostEqual(x_m, 10.0)
+        self.assertAlmostEqual(y_m, 21.0)
+        self.assertGreater(accuracy_m, 1.0)
+        self.assertAlmostEqual(fusion.devices()['sup800f']['latency_s'], 0.5)
+
+        # Heading east, timestamp in milliseconds
+        x_m, y_m, _ = fusion.align(
+            'phone', 10.0, 20.0, 1.0, 90.0, 2.0, (NOW_S - 0.5) * 1000.0,
+            (0.0, 0.0), NOW_S
+        )
+        self.assertAlmostEqual(x_m, 11.0)
+        self.assertAlmostEqual(y_m, 20.0)
+
+        # Bad clocks and missing speeds are passed through
+        for heading_d, speed_m_s, timestamp_s in (
+                (0.0, 2.0, NOW_S - 50.0),
+                (0.0, 2.0, NOW_S + 50.0),
+                (0.0, 2.0, None),
+                (None, None, NOW_S - 0.5),
+        ):
+            self.assertEqual(
+                fusion.align(
+                    'phone',
+                    10.0,
+                    20.0,
+                    1.0,
+                    heading_d,
+                    speed_m_s,
+                    timestamp_s,
+                    (0.0, 0.0),
+                    NOW_S
+                ),
+                (10.0, 20.0, 1.0)
+            )
+
+    def test_single_device_bias(self):
+        """With only one device, there's nothing to compare the bias to."""
+        fusion = GpsFusion()
+        for tick in range(100):
+            x_m, y_m, _ = fusion.align(
+                'sup800f', 3.0, 3.0, 1.0, None, None, None, (0.0, 0.0), tick
+            )
+            self.assertAlmostEqual(x_m, 3.0)
+            self.assertAlmostEqual(y_m, 3.0)
+        self.assertGreater(fusion.devices()['sup800f']['bias_x_m'], 2.0)
+
+    def test_two_device_bias(self):
+        """Devices should be pulled towards each other."""
+        fusion = GpsFusion()
+        for tick in range(200):
+            # The estimate ends up somewhere in between
+            estimate = (0.0, 0.0)
+            fusion.align('a', 2.0, 0.0, 1.0, None, None, None, estimate, tick)
+            fusion.align('b', -2.0, 0.0, 1.0, None, None, None, estimate, tick)
+        a_x_m, _, _ = fusion.align(
+            'a', 2.0, 0.0, 1.0, None, None, None, (0.0, 0.0), 200
+        )
+        b_x_m, _, _ = fusion.align(
+            'b', -2.0, 0.0, 1.0, None, None, None, (0.0, 0.0), 200
+        )
+        self.assertAlmostEqual(a_x_m, 0.0, 1)
+        self.assertAlmostEqual(b_x_m, 0.0, 1)
+
+    def test_accuracy_scale(self):
+        """Devices that are noisier than they claim should be trusted less."""
+        fusion = GpsFusion()
+        for tick in range(200):
+            offset_m = 3.0 if tick % 2 == 0 else -3.0
+            fusion.align(
+                'phone', offset_m, offset_m, 1.0, None, None, None,
+                (0.0, 0.0), tick
+            )
+        self.assertEqual(
+            fusion.devices()['phone']['accuracy_scale'],
+            GpsFusion.MAX_ACCURACY_SCALE
+        )
+
+    def test_device_limit(self):
+        """Devices from web clients shouldn't make the state or metrics grow
+        without bound.
+        """
+        fusion = GpsFusion()
+        count = GpsFusion.MAX_DEVICES + 5
+        for tick in range(count):
+            fusion.align(
+                'limit-{}'.format(tick), 3.0, 3.0, 1.0, None, None, None,
+                (0.0, 0.0), NOW_S + tick
+            )
+            # Keep one device active so that it isn't forgotten
+            fusion.align(
+                'limit-0', 3.0, 3.0, 1.0, None, None, None,
+                (0.0, 0.0), NOW_S + tick
+            )
+        devices = fusion.devices()
+        self.assertEqual(len(devices), GpsFusion.MAX_DEVICES)
+        self.assertIn('limit-0', devices)
+        self.assertIn('limit-{}'.format(count - 1), devices)
+        self.assertNotIn('limit-1', devices)
+
+        labels = {
+            series['labels']['device']
+            for series
+            in metrics.REGISTRY.to_json()['gps_device_latency_seconds']
+            if series['labels']['device'].startswith('limit-')
+        }
+        self.assertEqual(
+            labels,
+            {'limit-{}'.format(tick) for tick in range(GpsFusion.MAX_DEVICES)}
+        )
+        self.assertEqual(fusion.device_label('limit-1'), 'limit-1')
+        self.assertEqual(
+            fusion.device_label('limit-{}'.format(count - 1)),
+            GpsFusion.OTHER_DEVICE
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""Tests the shared telemetry."""
+
+import os
+import unittest
+
+from control.shared_telemetry import SharedTelemetry
+from messaging.shared_state import SharedState
+
+
+class TestSharedTelemetry(unittest.TestCase):
+    """Tests the shared telemetry."""
+
+    def setUp(self):
+        self.state = SharedState(
+            'test-shared-telemetry-{}'.format(os.getpid()),
+            create=True
+        )
+        self.telemetry = SharedTelemetry(self.state.name)
+
+    def tearDown(self):
+        self.telemetry.close()
+        self.state.close()
+
+    def test_state(self):
+        """The telemetry should come from the shared state."""
+        self.assertEqual(self.telemetry.get_raw_waypoint(), (None, None))
+        self.assertEqual(self.telemetry.get_target_drive(), (None, None))
+        self.state.write('estimate', {
+            'x_m': 1.0,
+            'y_m': 2.0,
+            'heading_d': 90.0,
+            'speed_m_s': 3.0,
+            'throttle': 0.5,
+            'steering': -0.25,
+            'waypoint_x_m': 10.0,
+            'waypoint_y_m': 20.0,
+        })
+        self.state.write('drive', {'throttle': 1.0, 'steering': -0.5})
+        self.assertEqual(
+            self.telemetry.get_data(update=False),
+            {
+                'x_m': 1.0,
+                'y_m': 2.0,
+                'heading_d': 90.0,
+                'speed_m_s': 3.0,
+                'throttle': 0.5,
+                'steering': -0.25,
+            }
+        )
+        self.assertEqual(self.telemetry.get_target_drive(), (1.0, -0.5))
+        self.assertEqual(self.telemetry.get_raw_waypoint(), (10.0, 20.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,16 +2,20 @@
 import collections
 import io
 import math
+import time
 import unittest
 import zipfile
 
 # Patch out the logger
 from messaging import async_logger
 from control.test.dummy_logger import DummyLogger
+_ASYNC_LOGGER = async_logger.AsyncLogger
 async_logger.AsyncLogger = DummyLogger
 
 from control.simple_waypoint_generator import SimpleWaypointGenerator
 from control.telemetry import Telemetry
+# Only the modules imported above use the dummy logger
+async_logger.AsyncLogger = _ASYNC_LOGGER
 
 # pylint: disable=protected-access
 # pylint: disable=too-many-public-methods
@@ -58,6 +62,21 @@ class TestSimpleWaypointGenerator(unittest.TestCase):
             self.assertEqual(x_m_1, x_m_2)
             self.assertEqual(y_m_1, y_m_2)
 
+    def test_load_message(self):
+        """Waypoint files should be loaded off the dispatcher's thread."""
+        generator = self.make_generator()
+        generator._handle_message(
+            {'command': 'load', 'file': 'paths/solid-state-depot.kml'}
+        )
+        expected = SimpleWaypointGenerator.get_waypoints_from_file_name(
+            'paths/solid-state-depot.kml'
+        )
+        for _ in range(100):
+            if generator._waypoints == expected:
+                break
+            time.sleep(0.01)
+        self.assertEqual(generator._waypoints, expected)
+
     def test_get_current_waypoint(self):
         """Tests the current waypoint."""
         waypoint_generator = self.make_generator()
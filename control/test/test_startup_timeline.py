@@ -0,0 +1,48 @@
+"""Tests the startup timeline."""
+
+import threading
+import unittest
+
+from control.startup_timeline import StartupTimeline
+from messaging import metrics
+
+
+class TestStartupTimeline(unittest.TestCase):
+    """Tests the startup timeline."""
+
+    def test_phases(self):
+        """Phases should be recorded in the order they started."""
+        timeline = StartupTimeline()
+        with timeline.phase('first'):
+            thread = threading.Thread(
+                target=lambda: timeline.mark('in thread'),
+                name='other'
+            )
+            thread.start()
+            thread.join()
+        with self.assertRaises(ValueError):
+            with timeline.phase('failed'):
+                raise ValueError()
+        timeline.mark('ready')
+
+        phases = timeline.phases()
+        self.assertEqual(
+            [phase.name for phase in phases],
+            ['first', 'in thread', 'failed', 'ready']
+        )
+        self.assertEqual(phases[1].thread_name, 'other')
+        self.assertGreaterEqual(phases[0].duration_s, 0.0)
+        self.assertEqual(phases[3].duration_s, 0.0)
+        self.assertLessEqual(phases[3].start_s, timeline.elapsed_s())
+
+        report = timeline.report()
+        self.assertEqual(len(report), 5)
+        self.assertIn('in thread (other)', report[2])
+        self.assertEqual(
+            metrics.gauge('startup_phase_start_seconds', phase='ready').value(),
+            phases[3].start_s
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
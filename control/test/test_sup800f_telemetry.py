@@ -2,11 +2,18 @@
 
 # pylint: disable=protected-access
 
+import math
+import os
+import random
+import shutil
+import struct
+import tempfile
 import unittest
 
 # Patch out the logger
 from messaging import async_logger
 from control.test.dummy_logger import DummyLogger
+_ASYNC_LOGGER = async_logger.AsyncLogger
 async_logger.AsyncLogger = DummyLogger
 
 # Patch out the telemetry
@@ -21,9 +28,25 @@ class DummyTelemetry(object):
         self.message['bearing'] = bearing
         self.message['speed'] = speed
         self.message['timestamp'] = timestamp
+    def compass_reading(self, compass_d, confidence, device_id):
+        self.message['compass_d'] = compass_d
+        self.message['confidence'] = confidence
+    def accelerometer_reading(self, x, y, z, device_id, timestamp_s=None):
+        self.message.setdefault('acceleration_g', []).append(
+            (x, y, z, timestamp_s)
+        )
 async_producers.TelemetryProducer = DummyTelemetry
 
+from control.sup800f import BINARY_FORMAT
+from control.sup800f import parse_binary
+from control.sup800f import parse_binary_burst
+from control.sup800f_telemetry import MAGNETIC_DECLINATION_D
 from control.sup800f_telemetry import Sup800fTelemetry
+from control.compass_calibration import CalibrationStore
+from control.compass_calibration import CompassCalibration
+from control.compass_calibration import DEFAULT_CALIBRATION
+# Only the modules imported above use the dummy logger
+async_logger.AsyncLogger = _ASYNC_LOGGER
 
 
 class TestSup800fTelemetry(unittest.TestCase):
@@ -58,6 +81,185 @@ class TestSup800fTelemetry(unittest.TestCase):
         )
         self.assertEqual(sup800f._hdop, 1.1)
 
+    def test_calibration_store(self):
+        """Calibrations should be loaded at startup."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        file_name = os.path.join(directory, 'calibration.json')
+
+        sup800f = Sup800fTelemetry(None, file_name)
+        self.assertIs(sup800f._calibration, DEFAULT_CALIBRATION)
+
+        CalibrationStore(file_name).save(
+            'sup800f',
+            CompassCalibration((1.0, 2.0), None, 100.0, 10.0, 200)
+        )
+        sup800f = Sup800fTelemetry(None, file_name)
+        self.assertEqual(sup800f._calibration.offsets, (1.0, 2.0))
+        self.assertEqual(sup800f._magnitude.mean, 100.0)
+        self.assertAlmostEqual(sup800f._magnitude_std_dev(), 10.0)
+
+        # Files without the magnitudes use the default ones
+        with open(file_name, 'w') as file_:
+            file_.write(
+                '{"sup800f": {"offsets": [1.0, 2.0], "magnitude_mean": 100.0}}'
+            )
+        sup800f = Sup800fTelemetry(None, file_name)
+        self.assertEqual(sup800f._calibration.offsets, (1.0, 2.0))
+        self.assertEqual(
+            sup800f._magnitude.mean,
+            DEFAULT_CALIBRATION.magnitude_mean
+        )
+        self.assertAlmostEqual(
+            sup800f._magnitude_std_dev(),
+            DEFAULT_CALIBRATION.magnitude_std_dev
+        )
+
+        # Corrupt files fall back to the default
+        with open(file_name, 'w') as file_:
+            file_.write('{')
+        sup800f = Sup800fTelemetry(None, file_name)
+        self.assertIs(sup800f._calibration, DEFAULT_CALIBRATION)
+
+    @staticmethod
+    def _binary_message(acceleration_g, flux_ut, message_id=0xCF):
+        """Returns a binary message like the SUP800F sends."""
+        message = bytearray(struct.pack(
+            BINARY_FORMAT,
+            *(tuple(acceleration_g) + tuple(flux_ut) + (101325, 20.0))
+        ))
+        message[0:2] = b'\xA0\xA1'
+        message[4] = message_id
+        return bytes(message)
+
+    def test_parse_binary_burst(self):
+        """The burst parser should match the single message parser."""
+        messages = [
+            self._binary_message((0.1, -0.2, 1.0), (10.0, 20.0, 30.0)),
+            self._binary_message((0.0, 0.0, 0.0), (0.0, 0.0, 0.0), 0xA8),
+            self._binary_message((0.5, 0.25, -1.0), (-5.0, 2.5, 0.0)),
+        ]
+        readings = parse_binary_burst(messages)
+        self.assertEqual(len(readings), 2)
+        for reading, message in zip(readings, (messages[0], messages[2])):
+            expected = parse_binary(message)
+            for field in expected._fields:
+                self.assertAlmostEqual(
+                    float(reading[field]),
+                    float(getattr(expected, field)),
+                    5
+                )
+
+        with self.assertRaises(EnvironmentError):
+            parse_binary_burst(
+                [self._binary_message((0, 0, 0), (0, 0, 0), 0x01)]
+            )
+        self.assertEqual(len(parse_binary_burst([])), 0)
+
+    def test_handle_binary_burst(self):
+        """A burst should be published as one compass reading and an
+        accelerometer reading for each message.
+        """
+        sup800f = Sup800fTelemetry(None, '/nonexistent/calibration.json')
+        sup800f._set_calibration(
+            CompassCalibration((0.0, 0.0), None, 100.0 ** 2, 1000.0, 100)
+        )
+
+        def flux(heading_d, magnitude=100.0):
+            """Returns the flux for a heading."""
+            angle_r = math.radians(
+                270.0 + MAGNETIC_DECLINATION_D - heading_d
+            )
+            return (
+                magnitude * math.cos(angle_r),
+                magnitude * math.sin(angle_r),
+                0.0
+            )
+
+        # Headings on both sides of north, and an outlier
+        messages = [
+            self._binary_message((0.0, 0.1, 1.0), flux(350.0)),
+            self._binary_message((0.2, 0.1, 1.0), flux(10.0)),
+            self._binary_message((0.4, 0.1, 1.0), flux(180.0, 1000.0)),
+        ]
+        timestamps_s = [100.0, 100.02, 100.04]
+        dropped = sup800f._dropped_compass.value()
+        sup800f._handle_binary_burst(parse_binary_burst(messages), timestamps_s)
+        message = sup800f._telemetry.message
+        self.assertTrue(
+            message['compass_d'] < 0.01 or message['compass_d'] > 359.99,
+            message['compass_d']
+        )
+        self.assertAlmostEqual(message['confidence'], math.cos(math.radians(10.0)))
+        self.assertEqual(sup800f._dropped_compass.value(), dropped + 1)
+        self.assertEqual(len(message['acceleration_g']), 3)
+        for actual, expected in zip(
+                message['acceleration_g'],
+                (
+                    (0.0, 0.1, 1.0, 100.0),
+                    (0.2, 0.1, 1.0, 100.02),
+                    (0.4, 0.1, 1.0, 100.04),
+                )
+        ):
+            for value, expected_value in zip(actual, expected):
+                self.assertAlmostEqual(value, expected_value)
+
+        # All outliers shouldn't publish a heading
+        sup800f._telemetry.message = {}
+        sup800f._handle_binary_burst(
+            parse_binary_burst(messages[2:]),
+            timestamps_s[2:]
+        )
+        self.assertNotIn('compass_d', sup800f._telemetry.message)
+        self.assertEqual(len(sup800f._telemetry.message['acceleration_g']), 1)
+
+    def test_magnitude_gate(self):
+        """The gate should keep dropping about 5% of normally distributed
+        magnitudes, instead of shrinking because it only follows the
+        readings that pass.
+        """
+        mean = 100.0 ** 2
+        std_dev = 1000.0
+        sup800f = Sup800fTelemetry(None, '/nonexistent/calibration.json')
+        sup800f._set_calibration(
+            CompassCalibration((0.0, 0.0), None, mean, std_dev, 100)
+        )
+        rng = random.Random(1)
+
+        def run(count):
+            """Handles count readings and returns the fraction dropped."""
+            dropped = sup800f._dropped_compass.value()
+            for _ in range(count // 3):
+                messages = []
+                for _ in range(3):
+                    magnitude = math.sqrt(rng.gauss(mean, std_dev))
+                    angle_r = rng.uniform(0.0, 2.0 * math.pi)
+                    messages.append(self._binary_message(
+                        (0.0, 0.0, 1.0),
+                        (
+                            magnitude * math.cos(angle_r),
+                            magnitude * math.sin(angle_r),
+                            0.0
+                        )
+                    ))
+                sup800f._handle_binary_burst(
+                    parse_binary_burst(messages),
+                    [0.0, 0.0, 0.0]
+                )
+            return (sup800f._dropped_compass.value() - dropped) / count
+
+        # Many time constants of MAGNITUDE_ALPHA to reach the steady state
+        run(15000)
+        rejected = run(30000)
+        self.assertGreater(rejected, 0.035)
+        self.assertLess(rejected, 0.06)
+        self.assertAlmostEqual(sup800f._magnitude.mean / mean, 1.0, 2)
+        self.assertAlmostEqual(
+            sup800f._magnitude_std_dev() / std_dev,
+            1.0,
+            1
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,10 +2,16 @@
 import json
 import math
 import mock
+import time
 import unittest
 
+from control.sensor_fusion import GpsFusion
 from control.telemetry import CENTRAL_LATITUDE, CENTRAL_LONGITUDE, Telemetry
+from messaging import metrics
 from messaging.message_consumer import consume_messages
+from messaging.telemetry_messages import AccelReading
+from messaging.telemetry_messages import DriveCommand
+from messaging.telemetry_messages import GpsReading
 
 #pylint: disable=invalid-name
 #pylint: disable=too-many-public-methods
@@ -476,6 +482,9 @@ different from the current algorithm.'''
         sources, such as phones or SUP800F.
         """
         telemetry = Telemetry()
+        readings = metrics.counter('telemetry_gps_readings_total', device='test')
+        ignored = metrics.counter('telemetry_ignored_points_total', device='test')
+        before = (readings.value(), ignored.value())
         self.assertEqual(len(telemetry._speed_history), 0)
         telemetry._handle_message(
             json.dumps(
@@ -513,6 +522,135 @@ different from the current algorithm.'''
         self.assertEqual(mpic.call_count, 2)
         self.assertEqual(len(telemetry._ignored_points), 1)
         self.assertEqual(telemetry._ignored_points['test'], 1)
+        self.assertEqual(
+            (readings.value(), ignored.value()),
+            (before[0] + 2, before[1] + 1)
+        )
+        # The counters are looked up once per device
+        self.assertEqual(
+            telemetry._gps_counters,
+            {'test': (readings, ignored)}
+        )
+
+    @mock.patch.object(Telemetry, '_m_point_in_course')
+    def test_null_speed_and_heading(self, mpic):
+        """Phones without a speed or heading fix send null, which shouldn't
+        stop the rest of the batch from being handled.
+        """
+        telemetry = Telemetry()
+        for in_course in (True, False):
+            mpic.return_value = in_course
+            telemetry._handle_message(json.dumps({'readings': [
+                {
+                    'device_id': 'test',
+                    'latitude_d': CENTRAL_LATITUDE,
+                    'longitude_d': CENTRAL_LONGITUDE,
+                    'accuracy_m': 1.0,
+                    'heading_d': None,
+                    'speed_m_s': None,
+                    'timestamp_s': None,
+                },
+                {
+                    'device_id': 'test',
+                    'latitude_d': CENTRAL_LATITUDE,
+                    'longitude_d': CENTRAL_LONGITUDE,
+                    'accuracy_m': 1.0,
+                    'heading_d': 0.0,
+                    'speed_m_s': 1.0,
+                    'timestamp_s': None,
+                },
+            ]}))
+        self.assertEqual(mpic.call_count, 4)
+        # Only the reading with a speed goes in the history
+        self.assertEqual(len(telemetry._speed_history), 2)
+        self.assertEqual(telemetry.get_raw_data()['speed_m_s'], 1.0)
+
+    @mock.patch.object(Telemetry, '_m_point_in_course')
+    def test_many_devices(self, mpic):
+        """Readings from many devices shouldn't make the per-device state
+        grow without bound.
+        """
+        mpic.return_value = False
+        telemetry = Telemetry()
+        for index in range(GpsFusion.MAX_DEVICES + 5):
+            telemetry._handle_message(GpsReading(
+                CENTRAL_LATITUDE,
+                CENTRAL_LONGITUDE,
+                1.0,
+                0.0,
+                1.0,
+                None,
+                'many-{}'.format(index)
+            ))
+        self.assertEqual(len(telemetry._gps_counters), GpsFusion.MAX_DEVICES + 1)
+        self.assertEqual(
+            len(telemetry._ignored_points),
+            GpsFusion.MAX_DEVICES + 1
+        )
+        self.assertEqual(telemetry._ignored_points[GpsFusion.OTHER_DEVICE], 5)
+
+    @mock.patch.object(Telemetry, '_m_point_in_course')
+    def test_handle_typed_message(self, mpic):
+        """Typed messages from this process should be handled like dicts
+        from other processes, and raw data should be a copy.
+        """
+        telemetry = Telemetry()
+        self.assertEqual(telemetry.get_raw_data(), {})
+
+        mpic.return_value = True
+        reading = GpsReading(
+            CENTRAL_LATITUDE,
+            CENTRAL_LONGITUDE,
+            1.0,
+            0.0,
+            1.0,
+            None,
+            'test'
+        )
+        telemetry._handle_message(reading)
+        self.assertEqual(len(telemetry._speed_history), 1)
+        raw = telemetry.get_raw_data()
+        self.assertEqual(raw['device_id'], 'test')
+        self.assertAlmostEqual(raw['x_m'], 0.0)
+        self.assertAlmostEqual(raw['y_m'], 0.0)
+        # The published reading shouldn't be changed
+        self.assertFalse(hasattr(reading, 'x_m'))
+        raw['device_id'] = 'changed'
+        self.assertEqual(telemetry.get_raw_data()['device_id'], 'test')
+
+        mpic.return_value = False
+        telemetry._handle_message({'readings': [reading.to_dict()]})
+        self.assertNotIn('x_m', telemetry.get_raw_data())
+
+        telemetry._handle_message(AccelReading(None, None, 1.0, 'test'))
+        self.assertEqual(telemetry._z_acceleration_g.last(), 1.0)
+        telemetry._handle_message(DriveCommand(0.5, -0.5))
+        self.assertEqual(telemetry._target_throttle, 0.5)
+        self.assertEqual(telemetry._target_steering, -0.5)
+
+    def test_collision(self):
+        """Accelerometer readings should be used to detect collisions once
+        the bias is known.
+        """
+        telemetry = Telemetry()
+        self.assertIs(telemetry.get_collision(), None)
+        for _ in range(Telemetry.ACCELEROMETER_CALIBRATION_READINGS):
+            telemetry._handle_message(AccelReading(0.1, -0.1, 1.0, 'test'))
+        telemetry.process_drive_command(0.5, 0.0)
+        telemetry._handle_message(AccelReading(0.15, -0.1, 1.0, 'test'))
+        # Phones only report the z axis
+        telemetry._handle_message(AccelReading(None, None, 5.0, 'test'))
+        self.assertIs(telemetry.get_collision(), None)
+        telemetry._handle_message(AccelReading(-1.0, -0.1, 1.0, 'test'))
+        self.assertEqual(telemetry.get_collision(), 'impact')
+        self.assertIs(telemetry.get_collision(), None)
+
+        # Samples from bursts are detected at the time they were taken
+        taken_s = time.time() - 0.5
+        telemetry._handle_message(
+            AccelReading(0.1, -0.1, 1.0, 'test', taken_s)
+        )
+        self.assertEqual(telemetry._collision_detector._last_reading_s, taken_s)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,265 @@
+"""Validates telemetry readings sent from phones and forwards them to the
+telemetry exchange.
+
+Clients can send a single reading per websocket frame or POST, like before, or
+a batch:
+
+    {"device_id": "iPhone-1234", "readings": [{...}, {...}]}
+
+Each reading in a batch has its own timestamp_s. The device_id can be given
+once for the whole batch instead of in every reading. Valid readings are
+published together instead of one message per reading.
+
+The device_id comes from the client, so it's only used as a metric label once
+the device has sent a valid reading, and only for the first few devices.
+Anything else is counted as 'other'.
+"""
+
+import collections
+import math
+import threading
+import time
+
+from messaging import metrics
+from messaging.async_producers import TelemetryProducer
+
+MAX_DEVICE_ID_LENGTH = 100
+
+
+def _is_number(value):
+    """Returns True if value is a finite number."""
+    return (
+        isinstance(value, (int, float))
+        and not isinstance(value, bool)
+        and not math.isinf(value)
+        and not math.isnan(value)
+    )
+
+
+def _check_number(reading, field, minimum=None, maximum=None, nullable=False):
+    """Raises ValueError if a field isn't a number in the given range."""
+    if field not in reading:
+        raise ValueError('Missing {}'.format(field))
+    value = reading[field]
+    if value is None and nullable:
+        return
+    if not _is_number(value):
+        raise ValueError('Bad {}: {}'.format(field, value))
+    if minimum is not None and value < minimum:
+        raise ValueError('Bad {}: {}'.format(field, value))
+    if maximum is not None and value > maximum:
+        raise ValueError('Bad {}: {}'.format(field, value))
+
+
+def validate_reading(reading, device_id=None):
+    """Returns a cleaned up copy of a GPS or compass reading, or raises
+    ValueError if it's invalid.
+    """
+    if not isinstance(reading, dict):
+        raise ValueError('Reading is not an object')
+    if 'device_id' not in reading:
+        if device_id is None:
+            raise ValueError('Missing device_id')
+        reading = dict(reading, device_id=device_id)
+    if (
+            not isinstance(reading['device_id'], str)
+            or not 0 < len(reading['device_id']) <= MAX_DEVICE_ID_LENGTH
+    ):
+        raise ValueError('Bad device_id: {}'.format(reading['device_id']))
+
+    # Some old phones send the timestamp as a string
+    if 'timestamp_s' in reading and not _is_number(reading['timestamp_s']):
+        try:
+            reading = dict(reading, timestamp_s=float(reading['timestamp_s']))
+        except (TypeError, ValueError):
+            raise ValueError('Bad timestamp_s: {}'.format(
+                reading['timestamp_s']
+            ))
+
+    if 'latitude_d' in reading:
+        _check_number(reading, 'latitude_d', -90.0, 90.0)
+        _check_number(reading, 'longitude_d', -180.0, 180.0)
+        _check_number(reading, 'accuracy_m', 0.0)
+        # iPhone produces null if there is no heading or speed fix yet
+        _check_number(reading, 'heading_d', nullable=True)
+        _check_number(reading, 'speed_m_s', nullable=True)
+        _check_number(reading, 'timestamp_s')
+        return {
+            'latitude_d': reading['latitude_d'],
+            'longitude_d': reading['longitude_d'],
+            'accuracy_m': reading['accuracy_m'],
+            'heading_d': reading['heading_d'],
+            'speed_m_s': reading['speed_m_s'],
+            'timestamp_s': reading['timestamp_s'],
+            'device_id': reading['device_id'],
+        }
+
+    if 'compass_d' in reading:
+        _check_number(reading, 'compass_d')
+        _check_number(reading, 'confidence', 0.0, 1.0)
+        cleaned = {
+            'compass_d': reading['compass_d'],
+            'confidence': reading['confidence'],
+            'device_id': reading['device_id'],
+        }
+        if 'timestamp_s' in reading:
+            cleaned['timestamp_s'] = reading['timestamp_s']
+        return cleaned
+
+    raise ValueError('Unknown reading type')
+
+
+class IngestionRates(object):
+    """Tracks how fast each device is sending readings."""
+    WINDOW_S = 10.0
+
+    def __init__(self, window_s=None):
+        if window_s is None:
+            window_s = self.WINDOW_S
+        self._window_s = window_s
+        # Device -> deque of (time, reading count)
+        self._history = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+
+    def record(self, device_id, count, now=None):
+        """Records that a device sent some readings."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            history = self._history[device_id]
+            history.append((now, count))
+            self._trim(history, now)
+
+    def rates(self, now=None):
+        """Returns the readings per second for each device over the window.
+        Devices that haven't sent anything recently are forgotten.
+        """
+        if now is None:
+            now = time.time()
+        rates = {}
+        with self._lock:
+            for device_id in list(self._history.keys()):
+                history = self._history[device_id]
+                self._trim(history, now)
+                if not history:
+                    del self._history[device_id]
+                    continue
+                rates[device_id] = (
+                    sum(count for _, count in history) / self._window_s
+                )
+        return rates
+
+    def _trim(self, history, now):
+        """Drops entries that are older than the window."""
+        while history and history[0][0] < now - self._window_s:
+            history.popleft()
+
+
+class TelemetryIngester(object):
+    """Validates readings from phones and forwards them to the telemetry
+    exchange.
+    """
+    # Devices that get their own metric labels, so that clients can't make
+    # the metrics grow without bound
+    MAX_DEVICE_LABELS = 10
+    OTHER_DEVICE = 'other'
+
+    def __init__(self, producer=None):
+        self._producer = producer
+        self.rates = IngestionRates()
+        # Devices with their own labels
+        self._devices = set()
+        # Label -> (readings counter, rejected readings counter)
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._batch_size = metrics.histogram(
+            'web_telemetry_batch_size',
+            'Readings in each web telemetry frame or POST',
+            buckets=(1, 2, 5, 10, 20, 50, 100)
+        )
+
+    def ingest(self, payload):
+        """Ingests a decoded JSON message containing one reading or a batch of
+        readings. Returns the number of readings forwarded and a list of
+        errors for the readings that were rejected.
+        """
+        if isinstance(payload, dict) and 'readings' in payload:
+            device_id = payload.get('device_id')
+            readings = payload['readings']
+            if not isinstance(readings, list):
+                raise ValueError('readings is not a list')
+        elif isinstance(payload, list):
+            device_id = None
+            readings = payload
+        else:
+            device_id = None
+            readings = [payload]
+
+        valid = []
+        errors = []
+        for reading in readings:
+            try:
+                valid.append(validate_reading(reading, device_id))
+            except ValueError as exc:
+                errors.append(str(exc))
+                if isinstance(reading, dict) and 'device_id' in reading:
+                    rejected_device_id = reading['device_id']
+                else:
+                    rejected_device_id = device_id
+                self._get_counters(rejected_device_id, False)[1].inc()
+
+        self._batch_size.observe(len(readings))
+        if valid:
+            self._get_producer().readings(valid)
+            now = time.time()
+            counts = collections.Counter(
+                reading['device_id'] for reading in valid
+            )
+            for reading_device_id, count in counts.items():
+                self.rates.record(reading_device_id, count, now)
+                self._get_counters(reading_device_id, True)[0].inc(count)
+
+        return len(valid), errors
+
+    def _get_counters(self, device_id, valid):
+        """Returns the readings and rejected readings counters for a device.
+        A device gets its own label when it sends a valid reading, if there
+        are fewer than MAX_DEVICE_LABELS already.
+        """
+        with self._lock:
+            known = isinstance(device_id, str) and device_id in self._devices
+            if (
+                    not known
+                    and valid
+                    and len(self._devices) < self.MAX_DEVICE_LABELS
+            ):
+                self._devices.add(device_id)
+                known = True
+            label = device_id if known else self.OTHER_DEVICE
+            counters = self._counters.get(label)
+            if counters is None:
+                counters = (
+                    metrics.counter(
+                        'web_telemetry_readings_total',
+                        'Readings received from web telemetry devices',
+                        device=label
+                    ),
+                    metrics.counter(
+                        'web_telemetry_rejected_readings_total',
+                        'Invalid web telemetry readings',
+                        device=label
+                    ),
+                )
+                self._counters[label] = counters
+            return counters
+
+    def _get_producer(self):
+        """Returns the producer, creating it the first time. The telemetry
+        exchange doesn't exist until Telemetry is running.
+        """
+        if self._producer is None:
+            self._producer = TelemetryProducer()
+        return self._producer
+
+
+INGESTER = TelemetryIngester()
@@ -3,13 +3,14 @@
 import cherrypy
 import netifaces
 import os
-import sys
 from ws4py.websocket import WebSocket
 import json
 
+from control.web_telemetry.ingestion import INGESTER
 from control.web_telemetry.web_socket_handler import WebSocketHandler
 from messaging.async_logger import AsyncLogger
-from messaging.async_producers import TelemetryProducer
+from monitor.page_cache import CachedPage
+from monitor.page_cache import StaticAssets
 
 STATIC_DIR = 'static-web'
 WEB_TELEMETRY_DIR = 'control' + os.sep + 'web_telemetry' + os.sep
@@ -68,6 +69,12 @@ class StatusApp(object):
             logger.error('No valid host found, listening on loopback')
             self._host_ip = get_ip('lo')
 
+        self._index_page = CachedPage(
+            WEB_TELEMETRY_DIR + 'index.html',
+            self._render_index
+        )
+        self.static = StaticAssets(STATIC_DIR)
+
     @staticmethod
     def get_config(web_telemetry_root_dir):
         """Returns the required CherryPy configuration for this application."""
@@ -77,10 +84,6 @@ class StatusApp(object):
                 'tools.staticdir.root':
                     web_telemetry_root_dir + '/control/web_telemetry/',
             },
-            '/static': {
-                'tools.staticdir.on': True,
-                'tools.staticdir.dir': '..' + os.sep + '..'  + os.sep + STATIC_DIR
-            },
             '/ws': {
                 'tools.websocket.on': True,
                 'tools.websocket.handler_cls': WebSocketHandler
@@ -88,18 +91,14 @@ class StatusApp(object):
         }
 
     @cherrypy.expose
-    def index(self):  # pylint: disable=no-self-use
+    def index(self):
         """Index page."""
+        return self._index_page.serve()
+
+    def _render_index(self, index_page):
+        """Fills in the index page template."""
         # This is the worst templating ever, but I don't feel like it's worth
         # installing a full engine just for this one substitution
-        index_page = None
-        index_file_name = WEB_TELEMETRY_DIR + 'index.html'
-        if sys.version_info.major == 2:
-            with open(index_file_name) as file_:
-                index_page = file_.read().decode('utf-8')
-        else:
-            with open(index_file_name, encoding='utf-8') as file_:
-                index_page = file_.read()
         return index_page.replace(
             '${webSocketAddress}',
             '{host_ip}:{port}/telemetry/ws'.format(
@@ -124,34 +123,11 @@ class StatusApp(object):
     @cherrypy.tools.json_out()
     def post_telemetry(self, message):  # pylint: disable=no-self-use
         """End point for receiving telemetry readings. Some phones don't support
-        websockets, so just use plain old POST.
+        websockets, so just use plain old POST. The message can be a single
+        reading or a batch of readings.
         """
         try:
-            message = json.loads(str(message))
-
-            if 'latitude_d' in message:
-                TelemetryProducer().gps_reading(
-                    message['latitude_d'],
-                    message['longitude_d'],
-                    message['accuracy_m'],
-                    message['heading_d'],
-                    message['speed_m_s'],
-                    message['timestamp_s'],
-                    message['device_id'],
-                )
-            elif 'compass_d' in message:
-                TelemetryProducer().compass_reading(
-                    message['compass_d'],
-                    message['confidence'],
-                    message['device_id'],
-                )
-            else:
-                AsyncLogger().error(
-                    'Received unexpected web telemetry message: {}'.format(
-                        message
-                    )
-                )
-
+            count, errors = INGESTER.ingest(json.loads(str(message)))
         except Exception as exc:  # pylint: disable=broad-except
             AsyncLogger().error(
                 'Invalid POST telemetry message "{}": {} {}'.format(
@@ -162,4 +138,17 @@ class StatusApp(object):
             )
             return {'success': False, 'message': str(exc)}
 
-        return {'success': True}
+        if errors:
+            message = 'Rejected {} readings: {}'.format(
+                len(errors),
+                '; '.join(errors)
+            )
+            AsyncLogger().error('Invalid POST telemetry: {}'.format(message))
+            return {'success': False, 'accepted': count, 'message': message}
+        return {'success': True, 'accepted': count}
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def ingestion_rates(self):  # pylint: disable=no-self-use
+        """Returns the readings per second received from each device."""
+        return INGESTER.rates.rates()
@@ -3,8 +3,8 @@
 from ws4py.websocket import WebSocket
 import json
 
+from control.web_telemetry.ingestion import INGESTER
 from messaging.async_logger import AsyncLogger
-from messaging.async_producers import TelemetryProducer
 
 
 class WebSocketHandler(WebSocket):  # pylint: disable=no-init
@@ -17,28 +17,10 @@ class WebSocketHandler(WebSocket):  # pylint: disable=no-init
             if message.is_binary:
                 # TODO(2016-08-13) Log an error
                 return
-            message = json.loads(str(message))
-            if 'latitude_d' in message:
-                TelemetryProducer().gps_reading(
-                    message['latitude_d'],
-                    message['longitude_d'],
-                    message['accuracy_m'],
-                    message['heading_d'],
-                    message['speed_m_s'],
-                    message['timestamp_s'],
-                    message['device_id'],
-                )
-            elif 'compass_d' in message:
-                TelemetryProducer().compass_reading(
-                    message['compass_d'],
-                    message['confidence'],
-                    message['device_id'],
-                )
-            else:
+            _, errors = INGESTER.ingest(json.loads(str(message)))
+            for error in errors:
                 AsyncLogger().error(
-                    'Received unexpected web telemetry message: "{}"'.format(
-                        message
-                    )
+                    'Received invalid web telemetry reading: {}'.format(error)
                 )
         # We need to catch all exceptions because any that are raised will close
         # the websocket
@@ -1,38 +1,58 @@
 """Main command module that starts the different threads."""
-from ws4py.server.cherrypyserver import WebSocketPlugin
-from ws4py.server.cherrypyserver import WebSocketTool
+# This is first so that the startup timeline includes the imports
+from control.startup_timeline import STARTUP_TIMELINE
+
 import argparse
-import cherrypy
+import concurrent.futures
 import datetime
+import importlib
 import logging
 import os
-import serial
 import signal
 import subprocess
 import sys
 import threading
 import time
 
-from control.command import Command
-from control.driver import Driver, STEERING_GPIO_PIN, STEERING_NEUTRAL_US, THROTTLE_GPIO_PIN, THROTTLE_NEUTRAL_US
-from control.simple_waypoint_generator import SimpleWaypointGenerator
-from control.chase_waypoint_generator import ChaseWaypointGenerator
-from control.extension_waypoint_generator import ExtensionWaypointGenerator
-from control.sup800f import switch_to_nmea_mode
-from control.sup800f_telemetry import Sup800fTelemetry
-from control.telemetry import Telemetry
-from control.telemetry_dumper import TelemetryDumper
-from control.web_telemetry.status_app import StatusApp as WebTelemetryStatusApp
-from messaging import config
-from messaging.async_logger import AsyncLogger, AsyncLoggerReceiver
-from messaging.message_consumer import consume_messages
-from messaging.message_producer import MessageProducer
-from monitor.status_app import StatusApp as MonitorApp
-from monitor.web_socket_logging_handler import WebSocketLoggingHandler
+with STARTUP_TIMELINE.phase('import serial'):
+    import serial
+with STARTUP_TIMELINE.phase('import control'):
+    from control.command import Command
+    from control.driver import Driver, STEERING_GPIO_PIN, STEERING_NEUTRAL_US, THROTTLE_GPIO_PIN, THROTTLE_NEUTRAL_US
+    from control.simple_waypoint_generator import SimpleWaypointGenerator
+    from control.chase_waypoint_generator import ChaseWaypointGenerator
+    from control.extension_waypoint_generator import ExtensionWaypointGenerator
+    from control.sup800f import switch_to_nmea_mode
+    from control.sup800f_telemetry import Sup800fTelemetry
+    from control.telemetry import LOCATION_FILTERS
+    from control.telemetry import Telemetry
+    from control.shared_state_publisher import SharedStatePublisher
+    from control.shared_telemetry import SharedTelemetry
+    from control.telemetry_dumper import TelemetryDumper
+with STARTUP_TIMELINE.phase('import messaging'):
+    from messaging import config
+    from messaging.async_logger import AsyncLogger, AsyncLoggerReceiver
+    from messaging.log_sink import AsyncFileHandler
+    from messaging.message_dispatcher import get_dispatcher
+    from messaging.message_producer import get_producer
+    from messaging.scheduler import get_scheduler
+    from messaging.shared_state import SharedState
+    from monitor.web_server import CherryPyServer
+    from monitor.web_socket_logging_handler import ForwardingLoggingHandler
+    from monitor.web_socket_logging_handler import WebSocketLoggingHandler
 
 # pylint: disable=global-statement
 # pylint: disable=broad-except
 
+# The web servers are only needed once everything else is running, and these
+# are slow to import, so they're imported in the background during startup
+WEB_MODULES = (
+    'cherrypy',
+    'ws4py.server.cherrypyserver',
+    'control.web_telemetry.status_app',
+    'monitor.status_app',
+)
+
 def override_imports_for_non_rpi():
     """Overrides modules that only work on the Raspberry Pi. Importing RPIO
     (used in button) on a non Raspberry Pi raises a SystemError, so for testing
@@ -53,10 +73,7 @@ def override_imports_for_non_rpi():
     switch_to_nmea_mode = lambda *arg: Dummy()
     # Ignore messages
     drop = lambda message: None
-    drop2 = lambda: consume_messages(config.COMMAND_FORWARDED_EXCHANGE, drop)
-    thread = threading.Thread(target=drop2)
-    thread.name = config.COMMAND_FORWARDED_EXCHANGE
-    thread.start()
+    get_dispatcher().register(config.COMMAND_FORWARDED_EXCHANGE, drop)
 
 try:
     from control.button import Button
@@ -66,59 +83,14 @@ except SystemError:
 
 THREADS = []
 POPEN = None
+WEB_PROCESS = None
+SHARED_STATE = None
+# How long the web process gets to stop by itself before it's killed
+WEB_PROCESS_STOP_TIMEOUT_S = 5.0
 DRIVER = None
 EMIT_INITIALIZED = False
 
 
-class CherryPyServer(threading.Thread):
-    """Runs the various web apps in a thread."""
-
-    def __init__(self, port, address, telemetry, waypoint_generator):
-        super(CherryPyServer, self).__init__()
-        self.name = self.__class__.__name__
-
-        # Web monitor
-        config = MonitorApp.get_config(os.path.abspath(os.getcwd()))
-        status_app = cherrypy.tree.mount(
-            MonitorApp(telemetry, waypoint_generator, port),
-            '/',
-            config
-        )
-        cherrypy.config.update({
-            'server.socket_host': address,
-            'server.socket_port': port,
-            'server.ssl_module': 'builtin',
-            'server.ssl_certificate': 'control/web_telemetry/cert.pem',
-            'server.ssl_private_key': 'control/web_telemetry/key.pem',
-            'engine.autoreload.on': False,
-        })
-
-        WebSocketPlugin(cherrypy.engine).subscribe()
-        cherrypy.tools.websocket = WebSocketTool()
-
-        # Web telemetry
-        config = WebTelemetryStatusApp.get_config(os.path.abspath(os.getcwd()))
-        web_telemetry_app = cherrypy.tree.mount(
-            WebTelemetryStatusApp(telemetry, port),
-            '/telemetry',
-            config
-        )
-
-        # OMG, shut up CherryPy, nobody cares about your problems
-        for app in (status_app, web_telemetry_app, cherrypy):
-            app.log.access_log.setLevel(logging.ERROR)
-            app.log.error_log.setLevel(logging.ERROR)
-
-    def run(self):
-        """Runs the thread and server in a thread."""
-        cherrypy.engine.start()
-
-    @staticmethod
-    def kill():
-        """Stops the thread and server."""
-        cherrypy.engine.exit()
-
-
 def terminate(signal_number, stack_frame):  # pylint: disable=unused-argument
     """Terminates the program. Used when a signal is received."""
     print(
@@ -156,12 +128,28 @@ def terminate(signal_number, stack_frame):  # pylint: disable=unused-argument
         pass
 
     for socket in os.listdir(os.sep.join(('.', 'messaging', 'sockets'))):
-        MessageProducer(socket).kill()
-    time.sleep(0.1)
+        get_producer(socket).kill()
+    if WEB_PROCESS is not None:
+        # Killing its log exchange stops it
+        try:
+            WEB_PROCESS.wait(WEB_PROCESS_STOP_TIMEOUT_S)
+        except subprocess.TimeoutExpired:
+            print('Killing web process')
+            WEB_PROCESS.kill()
+    dispatcher = get_dispatcher()
+    dispatcher.kill()
+    dispatcher.join()
+    scheduler = get_scheduler()
+    scheduler.kill()
+    scheduler.join()
 
     for thread in THREADS:
         thread.kill()
         thread.join()
+    if SHARED_STATE is not None:
+        SHARED_STATE.close()
+    # Writes the rest of the log file
+    logging.shutdown()
     # Some threads should still be active
     expected = set(('MainThread', '_TimeoutMonitor'))
     actives = set((thread.name for thread in threading.enumerate()))
@@ -181,74 +169,141 @@ def get_configuration(value, default):
     return default
 
 
-def start_threads(
+def import_web_modules():
+    """Imports the modules that are only needed for the web servers."""
+    with STARTUP_TIMELINE.phase('import web modules'):
+        for module in WEB_MODULES:
+            importlib.import_module(module)
+
+
+def set_up_sup800f(logger):
+    """Opens the SUP800F serial port and switches it to NMEA mode."""
+    with STARTUP_TIMELINE.phase('set up SUP800F'):
+        logger.info('Setting SUP800F to NMEA mode')
+        serial_ = serial.Serial('/dev/ttyAMA0', 115200)
+        serial_.setTimeout(1.0)
+        for _ in range(10):
+            serial_.readline()
+        try:
+            switch_to_nmea_mode(serial_)
+        except:  # pylint: disable=W0702
+            logger.error('Unable to set mode')
+        for _ in range(10):
+            serial_.readline()
+        logger.info('Done')
+    return serial_
+
+
+def start_web_process(port, address, state_name):
+    """Starts the web servers in their own process."""
+    global WEB_PROCESS
+    WEB_PROCESS = subprocess.Popen((
+        sys.executable,
+        '-m',
+        'monitor.web_process',
+        '--port', str(port),
+        '--address', address,
+        '--state', state_name,
+        '--control-pid', str(os.getpid()),
+    ))
+
+
+def start_threads(  # pylint: disable=too-many-arguments,too-many-locals
         waypoint_generator,
         logger,
         web_socket_handler,
         max_throttle,
         kml_file_name,
+        location_filter,
+        compass_calibration_file,
+        web_process,
 ):
     """Runs everything."""
+    # These don't depend on anything else, and setting up the SUP800F mostly
+    # waits on the serial port, so do them while everything else is created
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    if web_process:
+        web_modules_future = None
+    else:
+        web_modules_future = executor.submit(import_web_modules)
+    serial_future = executor.submit(set_up_sup800f, logger)
+
     logger.info('Creating Telemetry')
-    telemetry = Telemetry(kml_file_name)
-    telemetry_dumper = TelemetryDumper(
-        telemetry,
-        waypoint_generator,
-        web_socket_handler
-    )
+    global SHARED_STATE
+    with STARTUP_TIMELINE.phase('create Telemetry'):
+        # The latest state, for the web process and anything else that's
+        # attached to the car
+        SHARED_STATE = SharedState(create=True)
+        telemetry = Telemetry(kml_file_name, location_filter, SHARED_STATE)
+        shared_state_publisher = SharedStatePublisher(
+            SHARED_STATE,
+            telemetry,
+            waypoint_generator
+        )
+        if web_process:
+            # The web process does its own dumping
+            telemetry_dumper = None
+        else:
+            # Dump the shared state instead of waiting on Telemetry's lock
+            shared_telemetry = SharedTelemetry(SHARED_STATE.name)
+            telemetry_dumper = TelemetryDumper(
+                shared_telemetry,
+                shared_telemetry,
+                web_socket_handler
+            )
     logger.info('Done creating Telemetry')
     global DRIVER
-    DRIVER = Driver(telemetry)
-    DRIVER.set_max_throttle(max_throttle)
-
-    logger.info('Setting SUP800F to NMEA mode')
-    serial_ = serial.Serial('/dev/ttyAMA0', 115200)
-    serial_.setTimeout(1.0)
-    for _ in range(10):
-        serial_.readline()
-    try:
-        switch_to_nmea_mode(serial_)
-    except:  # pylint: disable=W0702
-        logger.error('Unable to set mode')
-    for _ in range(10):
-        serial_.readline()
-    logger.info('Done')
-
-    # The following objects must be created in order, because of message
-    # exchange dependencies:
-    # sup800f_telemetry: reads from command forwarded
+    with STARTUP_TIMELINE.phase('create Driver'):
+        DRIVER = Driver(telemetry)
+        DRIVER.set_max_throttle(max_throttle)
+    serial_ = serial_future.result()
+
+    # Producers buffer messages until their consumers are ready, so these
+    # don't need to wait for each other:
+    # sup800f_telemetry: reads from command forwarded, writes to telemetry
     # command: reads from command, writes to command forwarded
     # button: writes to command
     # cherry_py_server: writes to command
-    # TODO(2016-08-21) Have something better than sleeps to work around race
-    # conditions
     logger.info('Creating threads')
-    sup800f_telemetry = Sup800fTelemetry(serial_)
-    time.sleep(0.5)
-    command = Command(telemetry, DRIVER, waypoint_generator)
-    time.sleep(0.5)
+    with STARTUP_TIMELINE.phase('create Sup800fTelemetry'):
+        sup800f_telemetry = Sup800fTelemetry(serial_, compass_calibration_file)
+    with STARTUP_TIMELINE.phase('create Command'):
+        command = Command(telemetry, DRIVER, waypoint_generator)
     button = Button()
     port = int(get_configuration('PORT', 8080))
     address = get_configuration('ADDRESS', '0.0.0.0')
-    cherry_py_server = CherryPyServer(
-        port,
-        address,
-        telemetry,
-        waypoint_generator
-    )
-    time.sleep(0.5)
+    cherry_py_server = None
+    if web_process:
+        with STARTUP_TIMELINE.phase('start web process'):
+            start_web_process(port, address, SHARED_STATE.name)
+    else:
+        web_modules_future.result()
+        with STARTUP_TIMELINE.phase('create CherryPyServer'):
+            cherry_py_server = CherryPyServer(
+                port,
+                address,
+                telemetry,
+                waypoint_generator
+            )
+    executor.shutdown()
 
     global THREADS
-    THREADS += (
-        button,
-        cherry_py_server,
-        command,
-        sup800f_telemetry,
-        telemetry_dumper,
+    THREADS += tuple(
+        thread for thread in (
+            button,
+            cherry_py_server,
+            command,
+            shared_state_publisher,
+            sup800f_telemetry,
+            telemetry_dumper,
+        )
+        if thread is not None
     )
     for thread in THREADS:
         thread.start()
     logger.info('Started all threads')
+    STARTUP_TIMELINE.mark('started all threads')
+    STARTUP_TIMELINE.log(logger)
 
     # Use a fake timeout so that the main thread can still receive signals
     sup800f_telemetry.join(100000000000)
@@ -257,8 +312,9 @@ def start_threads(
     # stop the command module
     command.stop()
     command.join(100000000000)
-    cherry_py_server.kill()
-    cherry_py_server.join(100000000000)
+    if cherry_py_server is not None:
+        cherry_py_server.kill()
+        cherry_py_server.join(100000000000)
     button.kill()
     button.join(100000000000)
 
@@ -286,6 +342,13 @@ def make_parser():
         type=str
     )
 
+    parser.add_argument(
+        '--compress-log',
+        dest='compress_log',
+        help='Compress the log file with gzip. Read it with zcat.',
+        action='store_true'
+    )
+
     parser.add_argument(
         '--video',
         dest='video',
@@ -326,6 +389,30 @@ def make_parser():
         type=float,
     )
 
+    parser.add_argument(
+        '--filter',
+        dest='location_filter',
+        help='The location filter to use.',
+        default='kalman',
+        choices=sorted(LOCATION_FILTERS.keys()),
+    )
+
+    parser.add_argument(
+        '--compass-calibration',
+        dest='compass_calibration_file',
+        help='The file to load and save compass calibrations in.',
+        default=None,
+        type=str,
+    )
+
+    parser.add_argument(
+        '--web-process',
+        dest='web_process',
+        help='Run the web servers in a separate process, so that they don\'t'
+        ' slow down the control loop.',
+        action='store_true'
+    )
+
     parser.add_argument(
         '--chase',
         dest='chase',
@@ -361,14 +448,15 @@ def main():
     try:
         if os.path.exists(args.log):
             os.remove(args.log)
-        file_handler = logging.FileHandler(args.log)
+        # Writing every record as it's logged is slow on the SD card
+        file_handler = AsyncFileHandler(args.log, compress=args.compress_log)
         file_handler.setFormatter(formatter)
         file_handler.setLevel(logging.DEBUG)
         concrete_logger.addHandler(file_handler)
         try:
             last_log = os.path.dirname(args.log) + os.sep + 'last-log.txt'
             with open(last_log, 'a') as last_log:
-                last_log.write(args.log + '\n')
+                last_log.write(file_handler.file_name() + '\n')
         except Exception as exc:
             print('Unable to save last log information: {}'.format(exc))
     except Exception as exception:
@@ -385,10 +473,12 @@ def main():
     async_logger = AsyncLoggerReceiver(concrete_logger)
     # We need to start async_logger now so that other people can log to it
     async_logger.start()
-    time.sleep(0.1)
     THREADS.append(async_logger)
 
-    web_socket_handler = WebSocketLoggingHandler()
+    if args.web_process:
+        web_socket_handler = ForwardingLoggingHandler()
+    else:
+        web_socket_handler = WebSocketLoggingHandler()
     web_socket_handler.setLevel(logging.INFO)
     web_socket_handler.setFormatter(formatter)
     concrete_logger.addHandler(web_socket_handler)
@@ -406,18 +496,19 @@ def main():
             'Setting waypoints to Solid State Depot for testing'
         )
         kml_file = 'solid-state-depot.kml'
-    if args.chase:
-        waypoint_generator = ChaseWaypointGenerator(
-            SimpleWaypointGenerator.get_waypoints_from_file_name(
-                kml_file
+    with STARTUP_TIMELINE.phase('load waypoints'):
+        if args.chase:
+            waypoint_generator = ChaseWaypointGenerator(
+                SimpleWaypointGenerator.get_waypoints_from_file_name(
+                    kml_file
+                )
             )
-        )
-    else:
-        waypoint_generator = ExtensionWaypointGenerator(
-            SimpleWaypointGenerator.get_waypoints_from_file_name(
-                kml_file
+        else:
+            waypoint_generator = ExtensionWaypointGenerator(
+                SimpleWaypointGenerator.get_waypoints_from_file_name(
+                    kml_file
+                )
             )
-        )
 
     logger.debug('Calling start_threads')
 
@@ -427,6 +518,9 @@ def main():
         web_socket_handler,
         args.max_throttle,
         kml_file,
+        args.location_filter,
+        args.compass_calibration_file,
+        args.web_process,
     )
 
 
@@ -1,11 +1,13 @@
 """Logger that sends messages over Unix domain sockets."""
 
-import json
+import queue
 import threading
 
 from messaging import config
 from messaging.message_consumer import consume_messages
-from messaging.message_producer import MessageProducer
+from messaging.message_consumer import load_message
+from messaging.message_producer import dump_message
+from messaging.message_producer import get_producer
 from messaging.singleton_mixin import SingletonMixin
 
 
@@ -14,47 +16,50 @@ class AsyncLogger(SingletonMixin):
 
     def __init__(self):
         super(AsyncLogger, self).__init__()
-        self._producer = MessageProducer(config.LOGS_EXCHANGE)
+        self._producer = get_producer(config.LOGS_EXCHANGE)
         self.warning = self.warn
 
     def debug(self, message):
         """Forwards messages to debug log."""
-        self._producer.publish(json.dumps({
+        self._producer.publish({
             'level': 'debug',
             'message': message
-        }))
+        })
 
     def info(self, message):
         """Forwards messages to info log."""
-        self._producer.publish(json.dumps({
+        self._producer.publish({
             'level': 'info',
             'message': message
-        }))
+        })
 
     def warn(self, message):
         """Forwards messages to warn log."""
-        self._producer.publish(json.dumps({
+        self._producer.publish({
             'level': 'warn',
             'message': message
-        }))
+        })
 
     def error(self, message):
         """Forwards messages to error log."""
-        self._producer.publish(json.dumps({
+        self._producer.publish({
             'level': 'error',
             'message': message
-        }))
+        })
 
     def critical(self, message):
         """Forwards messages to critical log."""
-        self._producer.publish(json.dumps({
+        self._producer.publish({
             'level': 'critical',
             'message': message
-        }))
+        })
 
 
 class AsyncLoggerReceiver(object):
-    """Class that handles Unix domain socket messages."""
+    """Class that handles Unix domain socket messages. The messages are
+    written by the logger in a separate thread, because the handlers (stdout,
+    websockets) are too slow for the message dispatcher's thread.
+    """
 
     def __init__(self, logger):
         super(AsyncLoggerReceiver, self).__init__()
@@ -70,20 +75,40 @@ class AsyncLoggerReceiver(object):
         self._thread.name = '{}:consume_messages'.format(
             self.__class__.__name__
         )
+        self._messages = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop)
+        self._writer.name = '{}:write'.format(self.__class__.__name__)
 
     def start(self):
-        """Starts the thread."""
+        """Starts the threads."""
         if not self._thread.is_alive():
+            self._writer.start()
             self._thread.start()
 
     def kill(self):
         pass
 
     def join(self):
-        """Joins the inner thread."""
+        """Joins the inner threads, once the logs exchange has quit and the
+        remaining messages are written.
+        """
         self._thread.join()
-
-    def _callback(self, json_data):
-        """Callback that handles log messages."""
-        data = json.loads(json_data)
-        self._message_type_to_logger[data['level']](data['message'])
+        self._messages.put(None)
+        self._writer.join()
+
+    def _callback(self, message):
+        """Callback that hands log messages to the writer thread."""
+        self._messages.put(message)
+
+    def _write_loop(self):
+        """Writes log messages until joined."""
+        while True:
+            message = self._messages.get()
+            if message is None:
+                return
+            data = load_message(message)
+            # Readings are logged as JSON for the analysis scripts, but
+            # encoding them is left to this thread
+            self._message_type_to_logger[data['level']](
+                dump_message(data['message'])
+            )
@@ -1,10 +1,12 @@
 """All of the various asynchronous message producers."""
 
-import json
-
 from messaging import config
-from messaging.message_producer import MessageProducer
+from messaging.message_producer import dump_message
+from messaging.message_producer import get_producer
 from messaging.singleton_mixin import SingletonMixin
+from messaging.telemetry_messages import AccelReading
+from messaging.telemetry_messages import CompassReading
+from messaging.telemetry_messages import GpsReading
 
 
 class CommandProducer(SingletonMixin):
@@ -12,7 +14,7 @@ class CommandProducer(SingletonMixin):
 
     def __init__(self):
         super(CommandProducer, self).__init__()
-        self._producer = MessageProducer(config.COMMAND_EXCHANGE)
+        self._producer = get_producer(config.COMMAND_EXCHANGE)
 
     def start(self):
         """Send the start command."""
@@ -40,7 +42,7 @@ class TelemetryProducer(SingletonMixin):
 
     def __init__(self):
         super(TelemetryProducer, self).__init__()
-        self._producer = MessageProducer(config.TELEMETRY_EXCHANGE)
+        self._producer = get_producer(config.TELEMETRY_EXCHANGE)
 
     def gps_reading(
             self,
@@ -53,38 +55,51 @@ class TelemetryProducer(SingletonMixin):
             device_id
     ):
         """Sends a GPS reading."""
-        self._producer.publish(json.dumps({
-            'latitude_d': latitude_d,
-            'longitude_d': longitude_d,
-            'accuracy_m': accuracy_m,
-            'heading_d': heading_d,
-            'speed_m_s': speed_m_s,
-            'timestamp_s': timestamp_s,
-            'device_id': device_id,
-        }))
+        self._producer.publish(GpsReading(
+            latitude_d,
+            longitude_d,
+            accuracy_m,
+            heading_d,
+            speed_m_s,
+            timestamp_s,
+            device_id
+        ))
 
     def compass_reading(self, compass_d, confidence, device_id):
         """Sends a compass reading."""
-        self._producer.publish(json.dumps({
-            'compass_d': compass_d,
-            'confidence': confidence,
-            'device_id': device_id,
-        }))
+        self._producer.publish(CompassReading(compass_d, confidence, device_id))
 
     def accelerometer_reading(
             self,
             acceleration_g_x,
             acceleration_g_y,
             acceleration_g_z,
-            device_id
+            device_id,
+            timestamp_s=None
     ):
         """Sends an accelerometer reading."""
-        self._producer.publish(json.dumps({
-            'acceleration_g_x': acceleration_g_x,
-            'acceleration_g_y': acceleration_g_y,
-            'acceleration_g_z': acceleration_g_z,
-            'device_id': device_id,
-        }))
+        self._producer.publish(AccelReading(
+            acceleration_g_x,
+            acceleration_g_y,
+            acceleration_g_z,
+            device_id,
+            timestamp_s
+        ))
+
+    def readings(self, readings):
+        """Sends a batch of readings. Large batches going to another process
+        are split into multiple messages so that each fits in a datagram.
+        """
+        if self._producer.is_in_process():
+            self._producer.publish({'readings': readings})
+            return
+        message = dump_message({'readings': readings})
+        if len(message) > config.MAX_MESSAGE_BYTES and len(readings) > 1:
+            middle = len(readings) // 2
+            self.readings(readings[:middle])
+            self.readings(readings[middle:])
+        else:
+            self._producer.publish(message)
 
 
 class CommandForwardProducer(SingletonMixin):
@@ -97,7 +112,7 @@ class CommandForwardProducer(SingletonMixin):
     # TODO(skari): Implement multi consumer
     def __init__(self):
         super(CommandForwardProducer, self).__init__()
-        self._producer = MessageProducer(config.COMMAND_FORWARDED_EXCHANGE)
+        self._producer = get_producer(config.COMMAND_FORWARDED_EXCHANGE)
 
     def forward(self, message):
         """Forwards the message."""
@@ -108,13 +123,11 @@ class WaypointProducer(SingletonMixin):
     """Forwards waypoint commands to another exchange."""
     def __init__(self):
         super(WaypointProducer, self).__init__()
-        self._producer = MessageProducer(config.WAYPOINT_EXCHANGE)
+        self._producer = get_producer(config.WAYPOINT_EXCHANGE)
 
     def load_kml_file(self, kml_file_name):
         """Loads some waypoints from a KML file."""
-        self._producer.publish(
-            json.dumps({
-                'command': 'load',
-                'file': kml_file_name
-            })
-        )
+        self._producer.publish({
+            'command': 'load',
+            'file': kml_file_name
+        })
@@ -3,5 +3,11 @@
 COMMAND_EXCHANGE = 'command'
 COMMAND_FORWARDED_EXCHANGE = 'command_forwarded'
 LOGS_EXCHANGE = 'logs'
+# Formatted log lines for websocket clients of the web process
+MONITOR_LOGS_EXCHANGE = 'monitor_logs'
 TELEMETRY_EXCHANGE = 'telemetry'
 WAYPOINT_EXCHANGE = 'waypoint'
+
+# Largest datagram that consumers will receive. Batched messages are split up
+# so that they fit.
+MAX_MESSAGE_BYTES = 65536
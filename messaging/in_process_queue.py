@@ -0,0 +1,93 @@
+"""Queues for passing messages to consumers in the same process.
+
+Everything normally runs in one process, so sending messages through Unix
+domain sockets means encoding, copying and decoding every one of them for
+nothing. Consumers register an InProcessQueue for their exchange, and
+producers in the same process put Python objects directly into it. The
+sockets are still used by producers in other processes.
+"""
+
+import collections
+import threading
+
+from messaging import metrics
+
+# Enough for a few seconds of every sensor at full rate
+DEFAULT_MAX_SIZE = 10000
+
+_QUEUES = {}
+_QUEUES_LOCK = threading.Lock()
+
+
+class InProcessQueue(object):
+    """Bounded queue with one consumer. Putting never blocks or takes a lock;
+    if the consumer falls behind, the oldest messages are dropped. The
+    wakeup can be shared by several queues with one consumer, as long as it
+    has the set, is_set and clear methods of threading.Event.
+    """
+
+    def __init__(self, exchange, max_size=DEFAULT_MAX_SIZE, wakeup=None):
+        self._messages = collections.deque(maxlen=max_size)
+        self._wakeup = threading.Event() if wakeup is None else wakeup
+        self._dropped = metrics.counter(
+            'messages_dropped_total',
+            'Messages dropped because the consumer fell behind',
+            exchange=exchange
+        )
+
+    def put(self, message):
+        """Adds a message and wakes up the consumer."""
+        messages = self._messages
+        if len(messages) == messages.maxlen:
+            self._dropped.inc()
+        messages.append(message)
+        # The consumer clears this before checking for messages, so it can't
+        # miss this one
+        if not self._wakeup.is_set():
+            self._wakeup.set()
+
+    def get(self, timeout_s=None):
+        """Removes and returns the oldest message, waiting for one if needed.
+        Raises IndexError if it times out.
+        """
+        while True:
+            try:
+                return self._messages.popleft()
+            except IndexError:
+                pass
+            self._wakeup.clear()
+            if self._messages:
+                continue
+            if not self._wakeup.wait(timeout_s):
+                raise IndexError('No messages')
+
+    def drain(self):
+        """Removes and returns all of the messages without waiting."""
+        messages = self._messages
+        return [messages.popleft() for _ in range(len(messages))]
+
+    def __len__(self):
+        return len(self._messages)
+
+
+def register(exchange, queue):
+    """Registers the queue of an exchange's consumer. Like rebinding the
+    socket, this takes the exchange over from any earlier consumer.
+    """
+    with _QUEUES_LOCK:
+        _QUEUES[exchange] = queue
+
+
+def unregister(exchange, queue):
+    """Removes the queue of an exchange's consumer."""
+    with _QUEUES_LOCK:
+        if _QUEUES.get(exchange) is queue:
+            del _QUEUES[exchange]
+
+
+def get_queue(exchange):
+    """Returns the queue of the exchange's consumer in this process, or None
+    if there isn't one.
+    """
+    # Reading a dict is atomic, so this doesn't need the lock
+    return _QUEUES.get(exchange)
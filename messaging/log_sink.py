@@ -0,0 +1,255 @@
+"""Logging handler that writes log files from a background thread.
+
+Writing each record to the SD card as it's logged means hundreds of small
+writes a second at debug level, all on the message dispatcher's thread.
+Records are queued instead, and a writer thread formats them and writes them
+in large batches. Compressed logs are written as one gzip member per batch,
+so they can be read with zcat or gzip.open even if the car loses power in the
+middle of a run.
+"""
+
+import collections
+import gzip
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+from messaging import metrics
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+# Most records to keep in memory before dropping some
+DEFAULT_MAX_QUEUED = 20000
+DEFAULT_FLUSH_INTERVAL_S = 1.0
+# Write before the flush interval is up if this many records are waiting
+BATCH_SIZE = 2000
+# Level 6 compresses almost as well as 9 and is several times faster
+COMPRESS_LEVEL = 6
+
+
+class LogFile(object):
+    """Log file that's rotated by size. Rotated files are numbered like
+    RotatingFileHandler's, with .gz added if they're compressed.
+    """
+
+    def __init__(self, file_name, compress, max_bytes, backup_count):
+        self._base_file_name = file_name
+        self._compress = compress
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._file = None
+        self._size = 0
+        self._open()
+
+    def file_name(self, index=0):
+        """Returns the name of the current file, or of a rotated one."""
+        file_name = self._base_file_name
+        if index > 0:
+            file_name = '{}.{}'.format(file_name, index)
+        if self._compress:
+            file_name += '.gz'
+        return file_name
+
+    def write(self, data):
+        """Writes some bytes, compressing them if needed. Returns the number
+        of bytes written to the file.
+        """
+        if self._compress:
+            data = gzip.compress(data, COMPRESS_LEVEL)
+        if self._size > 0 and self._size + len(data) > self._max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+        return len(data)
+
+    def close(self):
+        """Closes the file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self):
+        """Opens a new, empty file."""
+        self._file = open(self.file_name(), 'wb')
+        self._size = 0
+
+    def _rotate(self):
+        """Moves the current file to the first backup and starts a new one."""
+        self.close()
+        if self._backup_count > 0:
+            for index in range(self._backup_count - 1, -1, -1):
+                if os.path.exists(self.file_name(index)):
+                    os.replace(self.file_name(index), self.file_name(index + 1))
+        self._open()
+
+
+class AsyncFileHandler(logging.Handler):
+    """Logging handler that queues records for a writer thread, which writes
+    them in batches. If the writer falls behind, debug records are dropped
+    before anything more important.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self,
+            file_name,
+            compress=False,
+            max_bytes=DEFAULT_MAX_BYTES,
+            backup_count=DEFAULT_BACKUP_COUNT,
+            max_queued=DEFAULT_MAX_QUEUED,
+            flush_interval_s=DEFAULT_FLUSH_INTERVAL_S
+    ):
+        super(AsyncFileHandler, self).__init__()
+        self._file = LogFile(file_name, compress, max_bytes, backup_count)
+        self._max_queued = max_queued
+        self._flush_interval_s = flush_interval_s
+
+        # Debug records are queued separately so that they can be dropped
+        # first. The sequence numbers put them back in order when writing.
+        self._sequence = itertools.count()
+        self._debug = collections.deque()
+        self._other = collections.deque()
+        self._queue_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closing = False
+        self._last_write_time_s = time.time()
+
+        self._queue_depth = metrics.gauge(
+            'log_sink_queue_depth',
+            'Log records waiting to be written'
+        )
+        self._records_written = metrics.counter(
+            'log_sink_records_written_total',
+            'Log records written'
+        )
+        self._bytes_formatted = metrics.counter(
+            'log_sink_formatted_bytes_total',
+            'Bytes of formatted log records, before compression'
+        )
+        self._bytes_written = metrics.counter(
+            'log_sink_written_bytes_total',
+            'Bytes written to log files'
+        )
+        self._throughput = metrics.gauge(
+            'log_sink_write_bytes_per_second',
+            'Bytes written to log files per second, as of the last write'
+        )
+        self._write_time = metrics.histogram(
+            'log_sink_write_seconds',
+            'Time spent formatting and writing each batch of log records'
+        )
+
+        self._writer = threading.Thread(target=self._write_loop)
+        self._writer.name = '{}:write_loop'.format(self.__class__.__name__)
+        # Logging closes handlers at exit, after non-daemon threads finish
+        self._writer.daemon = True
+        self._writer.start()
+
+    def file_name(self):
+        """Returns the name of the file currently being written to."""
+        return self._file.file_name()
+
+    def emit(self, record):
+        """Overridden from Handler; queues the log record."""
+        if self._closing:
+            return
+        with self._queue_lock:
+            if len(self._debug) + len(self._other) >= self._max_queued:
+                if not self._make_room(record):
+                    return
+            entry = (next(self._sequence), record)
+            if record.levelno <= logging.DEBUG:
+                self._debug.append(entry)
+            else:
+                self._other.append(entry)
+            depth = len(self._debug) + len(self._other)
+        self._queue_depth.set(depth)
+        if depth >= BATCH_SIZE and not self._wakeup.is_set():
+            self._wakeup.set()
+
+    def flush(self):
+        """Writes the queued records now."""
+        with self._write_lock:
+            self._write_batch()
+
+    def close(self):
+        """Writes the queued records and closes the file."""
+        self._closing = True
+        self._wakeup.set()
+        if self._writer.is_alive() and self._writer is not threading.current_thread():
+            self._writer.join()
+        with self._write_lock:
+            self._write_batch()
+            self._file.close()
+        super(AsyncFileHandler, self).close()
+
+    def _make_room(self, record):
+        """Drops a record to make room for a new one. Returns False if the new
+        one should be dropped instead. Call this with the queue lock held.
+        """
+        if self._debug:
+            self._debug.popleft()
+            dropped_level = logging.DEBUG
+            keep = True
+        elif record.levelno <= logging.DEBUG:
+            dropped_level = record.levelno
+            keep = False
+        else:
+            _, dropped = self._other.popleft()
+            dropped_level = dropped.levelno
+            keep = True
+        metrics.counter(
+            'log_sink_records_dropped_total',
+            'Log records dropped because the writer fell behind',
+            level=logging.getLevelName(dropped_level)
+        ).inc()
+        return keep
+
+    def _write_loop(self):
+        """Writes batches of records until the handler is closed."""
+        while not self._closing:
+            self._wakeup.wait(self._flush_interval_s)
+            self._wakeup.clear()
+            with self._write_lock:
+                self._write_batch()
+
+    def _write_batch(self):
+        """Formats and writes the queued records. Call this with the write
+        lock held.
+        """
+        with self._queue_lock:
+            debug, other = self._debug, self._other
+            self._debug = collections.deque()
+            self._other = collections.deque()
+        self._queue_depth.set(0)
+        if not debug and not other:
+            return
+
+        start = time.time()
+        lines = []
+        for _, record in heapq.merge(debug, other):
+            try:
+                lines.append(self.format(record))
+            except Exception:  # pylint: disable=broad-except
+                self.handleError(record)
+        lines.append('')
+        data = '\n'.join(lines).encode('utf-8')
+        try:
+            written = self._file.write(data)
+        except (IOError, OSError):
+            # Like FileHandler, report it and carry on. The record is only
+            # used for the error message.
+            self.handleError(record)  # pylint: disable=undefined-loop-variable
+            return
+        end = time.time()
+
+        self._records_written.inc(len(lines) - 1)
+        self._bytes_formatted.inc(len(data))
+        self._bytes_written.inc(written)
+        self._write_time.observe(end - start)
+        self._throughput.set(written / max(end - self._last_write_time_s, 1e-6))
+        self._last_write_time_s = end
@@ -1,36 +1,38 @@
 """Message broker that receives from Unix domain sockets."""
 
-import os
-import socket
+import json
+
+from messaging.message_dispatcher import QUIT  # pylint: disable=unused-import
+from messaging.message_dispatcher import get_dispatcher
+from messaging.message_dispatcher import ready_event
+
+
+def wait_for_consumer(message_type, timeout_s=None):
+    """Blocks until a consumer in this process is receiving messages from an
+    exchange, so that producers can be created. Returns False if it timed out.
+    """
+    return ready_event(message_type).wait(timeout_s)
+
+
+def load_message(message):
+    """Returns the object in a JSON message. Messages from producers in this
+    process are the objects that were published, so they're returned as is.
+    """
+    if isinstance(message, str):
+        return json.loads(message)
+    return message
 
 
 def consume_messages(message_type, callback):
-    """Starts consuming messages."""
-    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
-    socket_folder = os.sep.join(('.', 'messaging', 'sockets'))
-    socket_address = socket_folder + os.sep + message_type
-    if os.path.exists(socket_address):
-        os.remove(socket_address)
-
-    try:
-        os.mkdir(socket_folder)
-    except OSError:
-        pass
-
-    try:
-        sock.bind(socket_address)
-    except socket.error as err:
-        print(err)
-        return
-
-    while True:
-        datagram = sock.recv(4096)
-        if not datagram:
-            break
-        if datagram == b'QUIT':
-            break
-        message = datagram.decode('utf-8')
-        callback(message)
-
-    sock.close()
-    os.remove(socket_address)
+    """Consumes messages until the exchange receives QUIT. Messages from
+    producers in this process are whatever was published; messages from other
+    processes come through the socket as strings.
+
+    The callback is called from the message dispatcher's thread, which is
+    shared by every exchange, so it should return within HANDLER_BUDGET_S
+    and hand anything slower to the scheduler. The calling thread only waits
+    for QUIT.
+    """
+    done = get_dispatcher().register(message_type, callback)
+    if done is not None:
+        done.wait()
@@ -0,0 +1,285 @@
+"""Single thread that receives the messages for every exchange in this
+process and calls their handlers.
+
+Each exchange used to have its own thread blocked on its own socket, so every
+tiny message meant another thread switch. The dispatcher waits on all of the
+exchange sockets and in-process queues with one selector, and each time it
+wakes up, it handles everything that's ready.
+"""
+
+import collections
+import os
+import selectors
+import socket
+import threading
+import time
+import traceback
+
+from messaging import config
+from messaging import in_process_queue
+from messaging import metrics
+from messaging.in_process_queue import InProcessQueue
+
+# Stops an exchange's consumer
+QUIT = 'QUIT'
+
+# Most datagrams to read from one socket before checking the others
+MAX_BATCH_SIZE = 100
+
+# Handlers that take longer than this hold up every other exchange; slow work
+# should be handed to the scheduler instead. Handlers that go over are
+# counted in message_handler_over_budget_total.
+HANDLER_BUDGET_S = 0.005
+
+SOCKET_FOLDER = os.sep.join(('.', 'messaging', 'sockets'))
+
+# Set while a consumer is bound to the exchange and receiving messages
+_READY = collections.defaultdict(threading.Event)
+_READY_LOCK = threading.Lock()
+
+_DISPATCHER = None
+_DISPATCHER_LOCK = threading.Lock()
+
+
+def ready_event(message_type):
+    """Returns the event that's set while an exchange has a consumer."""
+    with _READY_LOCK:
+        return _READY[message_type]
+
+
+def get_dispatcher():
+    """Returns the dispatcher for this process, starting it if needed."""
+    global _DISPATCHER  # pylint: disable=global-statement
+    with _DISPATCHER_LOCK:
+        if _DISPATCHER is None or not _DISPATCHER.is_alive():
+            _DISPATCHER = MessageDispatcher()
+            _DISPATCHER.start()
+        return _DISPATCHER
+
+
+class _Wakeup(object):
+    """Wakes up the dispatcher's selector from other threads. It has the same
+    set, is_set and clear methods as threading.Event, so that in-process
+    queues can use it.
+    """
+
+    def __init__(self):
+        self._reader, self._writer = socket.socketpair()
+        self._reader.setblocking(False)
+        self._writer.setblocking(False)
+        self._is_set = False
+
+    def fileno(self):
+        """Returns the file descriptor to wait on."""
+        return self._reader.fileno()
+
+    def is_set(self):
+        """Returns True if a wakeup is pending."""
+        return self._is_set
+
+    def set(self):
+        """Wakes up the dispatcher."""
+        self._is_set = True
+        try:
+            self._writer.send(b'\0')
+        except BlockingIOError:
+            # Plenty of wakeups are already pending
+            pass
+
+    def clear(self):
+        """Clears pending wakeups. Call this before checking the queues, so
+        that messages put after checking wake the dispatcher up again.
+        """
+        # Drain before resetting the flag. Otherwise a set() in between
+        # would have its byte drained while the flag stays set, and later
+        # puts would skip waking the dispatcher up. This way, a set() at any
+        # point either leaves its byte in the socket or the flag cleared.
+        try:
+            while self._reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        self._is_set = False
+
+
+class _Exchange(object):  # pylint: disable=too-few-public-methods
+    """An exchange's socket, queue and handler."""
+
+    def __init__(self, message_type, sock, queue, handler):
+        self.message_type = message_type
+        self.socket = sock
+        self.queue = queue
+        self.handler = handler
+        self.done = threading.Event()
+        self.received = metrics.counter(
+            'messages_received_total',
+            'Messages received per exchange',
+            exchange=message_type
+        )
+        self.handler_time = metrics.histogram(
+            'message_handler_seconds',
+            'Time spent handling each message',
+            exchange=message_type,
+            handler=getattr(handler, '__qualname__', repr(handler))
+        )
+        self.errors = metrics.counter(
+            'message_handler_errors_total',
+            'Exceptions raised by message handlers',
+            exchange=message_type
+        )
+        self.over_budget = metrics.counter(
+            'message_handler_over_budget_total',
+            'Messages whose handler took longer than the handler budget',
+            exchange=message_type
+        )
+
+
+class MessageDispatcher(threading.Thread):
+    """Receives messages from every registered exchange and calls their
+    handlers, all in one thread. Handlers should return quickly, because
+    messages for every other exchange wait while they run.
+    """
+
+    def __init__(self):
+        super(MessageDispatcher, self).__init__()
+        self.name = self.__class__.__name__
+        self.daemon = True
+        self._selector = selectors.DefaultSelector()
+        self._wakeup = _Wakeup()
+        self._selector.register(self._wakeup, selectors.EVENT_READ)
+        self._exchanges = {}
+        # Registrations are done by the dispatcher thread so that the
+        # selector is only ever used from one thread
+        self._pending = collections.deque()
+        self._run = True
+        self._wakeups = metrics.counter(
+            'message_dispatcher_wakeups_total',
+            'Times the message dispatcher woke up to handle messages'
+        )
+
+    def register(self, message_type, handler):
+        """Binds the exchange's socket and starts calling the handler with its
+        messages. Like rebinding the socket, this takes the exchange over
+        from any earlier handler. Returns an event that's set once the
+        exchange receives QUIT, or None if the socket couldn't be bound.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        socket_address = SOCKET_FOLDER + os.sep + message_type
+        if os.path.exists(socket_address):
+            os.remove(socket_address)
+
+        try:
+            os.mkdir(SOCKET_FOLDER)
+        except OSError:
+            pass
+
+        try:
+            sock.bind(socket_address)
+        except socket.error as err:
+            print(err)
+            sock.close()
+            return None
+        sock.setblocking(False)
+
+        queue = InProcessQueue(message_type, wakeup=self._wakeup)
+        exchange = _Exchange(message_type, sock, queue, handler)
+        self._pending.append(exchange)
+        in_process_queue.register(message_type, queue)
+        ready_event(message_type).set()
+        self._wakeup.set()
+        return exchange.done
+
+    def run(self):
+        """Handles messages until killed."""
+        while self._run:
+            ready = self._selector.select()
+            self._wakeups.inc()
+            for key, _ in ready:
+                if key.fileobj is self._wakeup:
+                    self._wakeup.clear()
+                    self._add_pending()
+                else:
+                    self._receive_datagrams(key.data)
+            for exchange in list(self._exchanges.values()):
+                for message in exchange.queue.drain():
+                    if not self._dispatch(exchange, message):
+                        break
+
+        for exchange in list(self._exchanges.values()):
+            self._remove(exchange)
+
+    def kill(self):
+        """Stops the dispatcher and all of its exchanges."""
+        self._run = False
+        self._wakeup.set()
+
+    def _add_pending(self):
+        """Starts receiving messages for newly registered exchanges."""
+        while self._pending:
+            exchange = self._pending.popleft()
+            if exchange.message_type in self._exchanges:
+                self._remove(
+                    self._exchanges[exchange.message_type],
+                    socket_file=False
+                )
+            self._exchanges[exchange.message_type] = exchange
+            self._selector.register(
+                exchange.socket,
+                selectors.EVENT_READ,
+                exchange
+            )
+
+    def _receive_datagrams(self, exchange):
+        """Handles the datagrams waiting on an exchange's socket."""
+        if exchange.done.is_set():
+            # Taken over by another handler since the selector returned
+            return
+        for _ in range(MAX_BATCH_SIZE):
+            try:
+                datagram = exchange.socket.recv(config.MAX_MESSAGE_BYTES)
+            except BlockingIOError:
+                return
+            if not self._dispatch(exchange, datagram.decode('utf-8')):
+                return
+
+    def _dispatch(self, exchange, message):
+        """Calls the exchange's handler. Returns False if the exchange was
+        told to quit.
+        """
+        if exchange.done.is_set():
+            return False
+        if isinstance(message, str) and message == QUIT:
+            self._remove(exchange)
+            return False
+        exchange.received.inc()
+        start = time.time()
+        try:
+            exchange.handler(message)
+        except Exception:  # pylint: disable=broad-except
+            # Other exchanges share this thread, so keep going
+            exchange.errors.inc()
+            traceback.print_exc()
+        elapsed_s = time.time() - start
+        exchange.handler_time.observe(elapsed_s)
+        if elapsed_s > HANDLER_BUDGET_S:
+            exchange.over_budget.inc()
+        return True
+
+    def _remove(self, exchange, socket_file=True):
+        """Stops receiving messages for an exchange."""
+        if self._exchanges.get(exchange.message_type) is exchange:
+            del self._exchanges[exchange.message_type]
+        self._selector.unregister(exchange.socket)
+        exchange.socket.close()
+        in_process_queue.unregister(exchange.message_type, exchange.queue)
+        if socket_file:
+            # A newer consumer has the socket file when this was taken over
+            if in_process_queue.get_queue(exchange.message_type) is None:
+                ready_event(exchange.message_type).clear()
+                try:
+                    os.remove(
+                        SOCKET_FOLDER + os.sep + exchange.message_type
+                    )
+                except OSError:
+                    pass
+        exchange.done.set()
@@ -1,32 +1,169 @@
-"""Message broker that sends to Unix domain sockets."""
+"""Message broker that sends to consumers in this process, or to Unix domain
+sockets for consumers in other processes.
+"""
 
+import collections
+import json
 import os
 import socket
-import time
+import threading
+
+from messaging import metrics
+from messaging.in_process_queue import get_queue
+
+# Messages to keep while waiting for a consumer
+DEFAULT_BUFFER_SIZE = 1000
+
+_PRODUCERS = {}
+_PRODUCERS_LOCK = threading.Lock()
+
+
+def dump_message(message):
+    """Returns a message as a string, JSON encoded if it isn't one. Objects
+    with a to_dict method, like telemetry messages, are encoded as dicts.
+    """
+    if isinstance(message, str):
+        return message
+    return json.dumps(message, default=_to_dict)
+
+
+def _to_dict(obj):
+    """Converts objects that JSON can't encode by itself."""
+    if hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    raise TypeError('{!r} is not JSON serializable'.format(obj))
+
+
+def get_producer(message_type):
+    """Returns the shared producer for an exchange."""
+    with _PRODUCERS_LOCK:
+        if message_type not in _PRODUCERS:
+            _PRODUCERS[message_type] = MessageProducer(message_type)
+        return _PRODUCERS[message_type]
 
 
 class MessageProducer(object):
-    """Message broker that sends to Unix domain sockets."""
+    """Message broker that sends to consumers in this process, or to Unix
+    domain sockets for consumers in other processes. Producers can be shared
+    between threads.
+
+    Producers can be created before the exchange has a consumer. Messages
+    are kept until the consumer is ready, up to buffer_size of them, and if
+    the consumer restarts, the producer reconnects.
+    """
 
-    def __init__(self, message_type):
+    def __init__(
+            self,
+            message_type,
+            in_process=True,
+            buffer_size=DEFAULT_BUFFER_SIZE,
+            blocking=True
+    ):
+        """in_process=False always uses the socket, e.g. for benchmarks.
+        blocking=False keeps messages in the buffer instead of waiting when
+        the consumer's socket is full.
+        """
         self._message_type = message_type
-        socket_address = os.sep.join(
+        self._in_process = in_process
+        self._blocking = blocking
+        self._socket_address = os.sep.join(
             ('.', 'messaging', 'sockets', message_type)
         )
+        self._socket = None
+        self._buffer = collections.deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
 
-        if not os.path.exists(socket_address):
-            raise ValueError('Socket does not exist: {}'.format(socket_address))
+        self._published = metrics.counter(
+            'messages_published_total',
+            'Messages published per exchange',
+            exchange=message_type
+        )
+        self._buffered = metrics.counter(
+            'producer_messages_buffered_total',
+            'Messages kept until the exchange had a consumer',
+            exchange=message_type
+        )
+        self._dropped = metrics.counter(
+            'producer_messages_dropped_total',
+            'Messages dropped while the exchange had no consumer',
+            exchange=message_type
+        )
 
-        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
-        self._socket.connect(socket_address)
+    def is_in_process(self):
+        """Returns True if messages are passed directly to a consumer in
+        this process.
+        """
+        return self._in_process and get_queue(self._message_type) is not None
 
     def publish(self, message):
-        """Publishes a message."""
-        self._socket.sendall(message.encode('utf-8'))
+        """Publishes a message. Consumers in this process receive the message
+        itself, so it shouldn't be changed afterward; consumers in other
+        processes receive it as a string, encoded by dump_message.
+        """
+        queue = get_queue(self._message_type) if self._in_process else None
+        if queue is not None and not self._buffer:
+            queue.put(message)
+        else:
+            with self._lock:
+                # Make room for this message if the consumer is ready now
+                if self._buffer:
+                    self._flush()
+                if len(self._buffer) == self._buffer.maxlen:
+                    self._dropped.inc()
+                self._buffer.append(message)
+                if not self._flush():
+                    self._buffered.inc()
+        self._published.inc()
 
     def kill(self):
         """Kills all listening consumers."""
+        with self._lock:
+            if not self._flush():
+                # Nobody to kill
+                return
+            self._buffer.append('QUIT')
+            if not self._flush():
+                # Don't kill the next consumer
+                self._buffer.clear()
+
+    def _flush(self):
+        """Sends the buffered messages. Returns False if there's no consumer
+        to send them to yet. Call this with the lock held.
+        """
+        queue = get_queue(self._message_type) if self._in_process else None
+        if queue is not None:
+            while self._buffer:
+                queue.put(self._buffer.popleft())
+            return True
+
+        # Try again once if the consumer restarted since the last message
+        for _ in range(2):
+            if self._socket is None and not self._connect():
+                return False
+            try:
+                while self._buffer:
+                    message = dump_message(self._buffer[0])
+                    self._socket.sendall(message.encode('utf-8'))
+                    self._buffer.popleft()
+                return True
+            except BlockingIOError:  # pylint: disable=undefined-variable
+                # The consumer is behind; try again with the next message
+                return False
+            except (ConnectionRefusedError, FileNotFoundError):  # pylint: disable=undefined-variable
+                self._socket.close()
+                self._socket = None
+        return False
+
+    def _connect(self):
+        """Connects to the consumer's socket. Returns False if it isn't
+        there.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
         try:
-            self._socket.sendall(b'QUIT')
-        except ConnectionRefusedError:  # pylint: disable=undefined-variable
-            pass
+            sock.connect(self._socket_address)
+        except (ConnectionRefusedError, FileNotFoundError):  # pylint: disable=undefined-variable
+            sock.close()
+            return False
+        sock.setblocking(self._blocking)
+        self._socket = sock
+        return True
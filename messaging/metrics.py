@@ -0,0 +1,331 @@
+"""Lightweight runtime metrics: counters, gauges, fixed bucket histograms and
+summaries with streaming quantiles.
+
+Metrics are cheap enough to update from the control loop. Counters and
+histograms are sharded per thread, so each thread only ever writes its own
+values and no locks are needed on the hot path; values are summed when read.
+Look up metric objects once and keep them around, e.g.:
+
+    self._dropped = metrics.counter('dropped_total', device='sup800f')
+    ...
+    self._dropped.inc()
+"""
+
+import bisect
+import threading
+
+from messaging.streaming_statistics import P2Quantile
+from messaging.streaming_statistics import RunningStats
+
+# Default summary quantiles
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+# Default histogram buckets, in seconds
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0,
+)
+
+
+class Counter(object):
+    """Monotonically increasing count."""
+    TYPE = 'counter'
+
+    def __init__(self, name, labels, help_):
+        self.name = name
+        self.labels = labels
+        self.help = help_
+        # Thread ident -> count
+        self._values = {}
+
+    def inc(self, amount=1):
+        """Increments the counter."""
+        ident = threading.get_ident()
+        self._values[ident] = self._values.get(ident, 0) + amount
+
+    def value(self):
+        """Returns the current value."""
+        return sum(list(self._values.values()))
+
+    def samples(self):
+        """Returns a list of (suffix, extra labels, value) tuples."""
+        return [('', (), self.value())]
+
+
+class Gauge(object):
+    """Value that can go up and down."""
+    TYPE = 'gauge'
+
+    def __init__(self, name, labels, help_):
+        self.name = name
+        self.labels = labels
+        self.help = help_
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        """Sets the gauge."""
+        self._value = value
+
+    def inc(self, amount=1):
+        """Increments the gauge."""
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        """Decrements the gauge."""
+        with self._lock:
+            self._value -= amount
+
+    def value(self):
+        """Returns the current value."""
+        return self._value
+
+    def samples(self):
+        """Returns a list of (suffix, extra labels, value) tuples."""
+        return [('', (), self._value)]
+
+
+class Histogram(object):
+    """Counts observations in fixed buckets."""
+    TYPE = 'histogram'
+
+    def __init__(self, name, labels, help_, buckets=None):
+        self.name = name
+        self.labels = labels
+        self.help = help_
+        if buckets is None:
+            buckets = DEFAULT_BUCKETS
+        self.buckets = tuple(sorted(buckets))
+        # Thread ident -> [bucket counts..., +Inf count, sum]
+        self._values = {}
+
+    def observe(self, value):
+        """Records an observation."""
+        ident = threading.get_ident()
+        values = self._values.get(ident)
+        if values is None:
+            values = [0] * (len(self.buckets) + 1) + [0.0]
+            self._values[ident] = values
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def counts(self):
+        """Returns the (non-cumulative) bucket counts, with the +Inf bucket
+        last, and the sum of all observations.
+        """
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        for values in list(self._values.values()):
+            for index in range(len(counts)):
+                counts[index] += values[index]
+            total += values[-1]
+        return counts, total
+
+    def count(self):
+        """Returns the number of observations."""
+        return sum(self.counts()[0])
+
+    def value(self):
+        """Returns a summary of the histogram."""
+        counts, total = self.counts()
+        return {
+            'buckets': dict(zip(
+                [str(bucket) for bucket in self.buckets] + ['+Inf'],
+                counts
+            )),
+            'count': sum(counts),
+            'sum': total,
+        }
+
+    def samples(self):
+        """Returns a list of (suffix, extra labels, value) tuples."""
+        counts, total = self.counts()
+        samples = []
+        cumulative = 0
+        for bucket, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            samples.append(('_bucket', (('le', str(bucket)),), cumulative))
+        samples.append(('_sum', (), total))
+        samples.append(('_count', (), cumulative))
+        return samples
+
+
+class Summary(object):
+    """Tracks the count, sum, mean, variance and estimated quantiles of
+    observations, without buckets. Quantiles can't be combined across
+    threads, so unlike histograms, observations take a lock.
+    """
+    TYPE = 'summary'
+
+    def __init__(self, name, labels, help_, quantiles=None):
+        self.name = name
+        self.labels = labels
+        self.help = help_
+        if quantiles is None:
+            quantiles = DEFAULT_QUANTILES
+        self._quantiles = [P2Quantile(quantile) for quantile in quantiles]
+        self._stats = RunningStats()
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Records an observation."""
+        with self._lock:
+            self._stats.add(value)
+            self._sum += value
+            for quantile in self._quantiles:
+                quantile.add(value)
+
+    def count(self):
+        """Returns the number of observations."""
+        return self._stats.count
+
+    def value(self):
+        """Returns a summary of the observations."""
+        with self._lock:
+            stats = self._stats
+            return {
+                'quantiles': {
+                    str(quantile.quantile): quantile.value()
+                    for quantile in self._quantiles
+                },
+                'count': stats.count,
+                'sum': self._sum,
+                'mean': stats.mean if stats.count else None,
+                'std_dev': stats.std_dev() if stats.count else None,
+                'min': stats.minimum if stats.count else None,
+                'max': stats.maximum if stats.count else None,
+            }
+
+    def samples(self):
+        """Returns a list of (suffix, extra labels, value) tuples."""
+        with self._lock:
+            samples = [
+                (
+                    '',
+                    (('quantile', str(quantile.quantile)),),
+                    quantile.value() if quantile.count else float('nan')
+                )
+                for quantile in self._quantiles
+            ]
+            samples.append(('_sum', (), self._sum))
+            samples.append(('_count', (), self._stats.count))
+        return samples
+
+
+class MetricsRegistry(object):
+    """Holds all of the metrics."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, class_, name, help_, labels, **kwargs):
+        """Returns the existing metric or creates a new one."""
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = class_(name, key[1], help_, **kwargs)
+                    self._metrics[key] = metric
+        if not isinstance(metric, class_):
+            raise ValueError(
+                'Metric {} is already registered as a {}'.format(
+                    name,
+                    metric.TYPE
+                )
+            )
+        return metric
+
+    def counter(self, name, help_=None, **labels):
+        """Returns the named counter."""
+        return self._get(Counter, name, help_, labels)
+
+    def gauge(self, name, help_=None, **labels):
+        """Returns the named gauge."""
+        return self._get(Gauge, name, help_, labels)
+
+    def histogram(self, name, help_=None, buckets=None, **labels):
+        """Returns the named histogram."""
+        return self._get(Histogram, name, help_, labels, buckets=buckets)
+
+    def summary(self, name, help_=None, quantiles=None, **labels):
+        """Returns the named summary."""
+        return self._get(Summary, name, help_, labels, quantiles=quantiles)
+
+    def clear(self):
+        """Removes all metrics. Only meant for testing."""
+        with self._lock:
+            self._metrics.clear()
+
+    def _sorted_metrics(self):
+        """Returns the metrics sorted by name and labels."""
+        with self._lock:
+            return [self._metrics[key] for key in sorted(self._metrics)]
+
+    def to_json(self):
+        """Returns all of the metrics as a JSON serializable dictionary."""
+        values = {}
+        for metric in self._sorted_metrics():
+            values.setdefault(metric.name, []).append({
+                'labels': dict(metric.labels),
+                'value': metric.value(),
+            })
+        return values
+
+    def to_prometheus(self):
+        """Returns all of the metrics in the Prometheus text format."""
+        lines = []
+        described = set()
+        for metric in self._sorted_metrics():
+            if metric.name not in described:
+                described.add(metric.name)
+                if metric.help is not None:
+                    lines.append(
+                        '# HELP {} {}'.format(metric.name, metric.help)
+                    )
+                lines.append('# TYPE {} {}'.format(metric.name, metric.TYPE))
+            for suffix, extra_labels, value in metric.samples():
+                labels = metric.labels + extra_labels
+                if labels:
+                    label_text = '{' + ','.join(
+                        '{}="{}"'.format(
+                            key,
+                            str(label).replace('\\', r'\\').replace('"', r'\"')
+                        )
+                        for key, label in labels
+                    ) + '}'
+                else:
+                    label_text = ''
+                lines.append('{}{}{} {}'.format(
+                    metric.name,
+                    suffix,
+                    label_text,
+                    value
+                ))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, help_=None, **labels):
+    """Returns the named counter from the global registry."""
+    return REGISTRY.counter(name, help_, **labels)
+
+
+def gauge(name, help_=None, **labels):
+    """Returns the named gauge from the global registry."""
+    return REGISTRY.gauge(name, help_, **labels)
+
+
+def histogram(name, help_=None, buckets=None, **labels):
+    """Returns the named histogram from the global registry."""
+    return REGISTRY.histogram(name, help_, buckets, **labels)
+
+
+def summary(name, help_=None, quantiles=None, **labels):
+    """Returns the named summary from the global registry."""
+    return REGISTRY.summary(name, help_, quantiles, **labels)
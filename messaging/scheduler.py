@@ -0,0 +1,217 @@
+"""Runs delayed and one-off tasks on a small, fixed pool of worker threads.
+
+Things like "stop recording in 5 seconds" used to start a new thread that
+slept until it was time. Those threads couldn't be cancelled, and nothing
+stopped a second one from being started while the first was still waiting.
+Tasks scheduled here can be cancelled, and tasks with the same key are
+deduplicated: while one is pending, scheduling another returns it instead
+(or replaces it).
+
+Message handlers also use it for slow work, like loading a course, so that
+they don't hold up the message dispatcher's thread.
+
+The pending tasks are kept in a heap ordered by when they're due. The workers
+wait on it, so there's no separate timer thread. Tasks should be short; a
+long task holds up the ones behind it once every worker is busy.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+from messaging import metrics
+
+WORKER_COUNT = 2
+
+_SCHEDULER = None
+_SCHEDULER_LOCK = threading.Lock()
+
+
+def get_scheduler():
+    """Returns the scheduler for this process, starting it if needed."""
+    global _SCHEDULER  # pylint: disable=global-statement
+    with _SCHEDULER_LOCK:
+        if _SCHEDULER is None or not _SCHEDULER.is_alive():
+            _SCHEDULER = Scheduler()
+            _SCHEDULER.start()
+        return _SCHEDULER
+
+
+class ScheduledTask(object):  # pylint: disable=too-few-public-methods
+    """A task waiting to be run by the scheduler."""
+
+    def __init__(self, scheduler, due_s, function, key):
+        self.due_s = due_s
+        self.function = function
+        self.key = key
+        self.cancelled = False
+        self.started = False
+        self._scheduler = scheduler
+
+    def cancel(self):
+        """Cancels the task. Returns False if it had already started or been
+        cancelled.
+        """
+        return self._scheduler.cancel_task(self)
+
+
+class Scheduler(object):
+    """Runs functions after a delay on a fixed pool of worker threads."""
+
+    def __init__(self, worker_count=None):
+        if worker_count is None:
+            worker_count = WORKER_COUNT
+        self._condition = threading.Condition()
+        # (due, sequence, task) so that ties run in the order scheduled
+        self._heap = []
+        self._sequence = itertools.count()
+        self._keys = {}
+        self._pending = 0
+        self._run = True
+        self._workers = []
+        for index in range(worker_count):
+            worker = threading.Thread(target=self._work)
+            worker.name = '{}:worker:{}'.format(self.__class__.__name__, index)
+            worker.daemon = True
+            self._workers.append(worker)
+
+        self._pending_gauge = metrics.gauge(
+            'scheduler_pending_tasks',
+            'Tasks waiting to be run by the scheduler'
+        )
+        self._latency = metrics.summary(
+            'scheduler_task_latency_seconds',
+            'How much later than scheduled tasks started running'
+        )
+        self._run_time = metrics.histogram(
+            'scheduler_task_seconds',
+            'Time spent running each scheduled task'
+        )
+        self._errors = metrics.counter(
+            'scheduler_task_errors_total',
+            'Exceptions raised by scheduled tasks'
+        )
+
+    def start(self):
+        """Starts the worker threads."""
+        for worker in self._workers:
+            worker.start()
+
+    def is_alive(self):
+        """Returns True if the workers are running."""
+        return any(worker.is_alive() for worker in self._workers)
+
+    def schedule(self, delay_s, function, key=None, replace=False):
+        """Calls function with no arguments after delay_s seconds. If key is
+        given and a task with that key is already pending, nothing new is
+        scheduled and that task is returned instead, unless replace is True,
+        in which case the pending task is cancelled. Returns the task, which
+        can be cancelled.
+        """
+        with self._condition:
+            if key is not None and key in self._keys:
+                pending = self._keys[key]
+                if not replace:
+                    return pending
+                pending.cancelled = True
+                self._forget(pending)
+            task = ScheduledTask(
+                self,
+                time.monotonic() + delay_s,
+                function,
+                key
+            )
+            heapq.heappush(self._heap, (task.due_s, next(self._sequence), task))
+            if key is not None:
+                self._keys[key] = task
+            self._pending += 1
+            self._pending_gauge.set(self._pending)
+            self._condition.notify()
+            return task
+
+    def cancel(self, key):
+        """Cancels the pending task with key. Returns False if there wasn't
+        one.
+        """
+        with self._condition:
+            task = self._keys.get(key)
+        if task is None:
+            return False
+        return self.cancel_task(task)
+
+    def cancel_task(self, task):
+        """Cancels a task. Returns False if it had already started or been
+        cancelled.
+        """
+        with self._condition:
+            if task.started or task.cancelled:
+                return False
+            task.cancelled = True
+            self._forget(task)
+            # It's left in the heap until it's due, then skipped
+            return True
+
+    def pending(self):
+        """Returns the number of tasks waiting to be run."""
+        with self._condition:
+            return self._pending
+
+    def kill(self):
+        """Stops the workers. Pending tasks are dropped."""
+        with self._condition:
+            self._run = False
+            self._condition.notify_all()
+
+    def join(self, timeout=None):
+        """Waits for the workers to finish their current tasks."""
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _forget(self, task):
+        """Removes a task that's no longer pending. Call with the condition
+        held.
+        """
+        if task.key is not None and self._keys.get(task.key) is task:
+            del self._keys[task.key]
+        self._pending -= 1
+        self._pending_gauge.set(self._pending)
+
+    def _next_task(self):
+        """Waits for the next task to be due and returns it, or None if the
+        scheduler was killed.
+        """
+        with self._condition:
+            while self._run:
+                heap = self._heap
+                while heap and heap[0][2].cancelled:
+                    heapq.heappop(heap)
+                if not heap:
+                    self._condition.wait()
+                    continue
+                wait_s = heap[0][0] - time.monotonic()
+                if wait_s > 0.0:
+                    self._condition.wait(wait_s)
+                    continue
+                task = heapq.heappop(heap)[2]
+                task.started = True
+                self._forget(task)
+                return task
+            return None
+
+    def _work(self):
+        """Runs tasks until killed."""
+        while True:
+            task = self._next_task()
+            if task is None:
+                return
+            start = time.monotonic()
+            self._latency.observe(start - task.due_s)
+            try:
+                task.function()
+            except Exception:  # pylint: disable=broad-except
+                # Other tasks share this worker, so keep going
+                self._errors.inc()
+                traceback.print_exc()
+            self._run_time.observe(time.monotonic() - start)
@@ -0,0 +1,285 @@
+"""Latest state of the car in shared memory, for readers in other processes.
+
+Messages are queues: every reader gets every value. Things like the web
+monitor, an external controller or an analysis tool attached to a running car
+only want the newest values, so the control process writes them into a block
+of shared memory instead, and readers copy them out whenever they want.
+
+The block has a header, then a section for each kind of state, e.g. the
+fused estimate or the last GPS reading. Each section is a seqlock: a sequence
+number followed by a fixed list of doubles. The writer makes the sequence
+number odd, writes the values, then makes it even again. Readers copy the
+values and check that the sequence number was the same even number before
+and after; if it wasn't, they read again. Readers never block the writer,
+nobody takes a lock, and reading doesn't make any system calls.
+
+Usage from another process:
+    state = attach()
+    print(state.read('estimate'))
+"""
+
+import collections
+import math
+import multiprocessing
+import struct
+import threading
+import time
+import zlib
+
+from multiprocessing import shared_memory
+
+DEFAULT_NAME = 'sparkfun-avc-state'
+
+# Every section has a timestamp_s field with the time it was written
+CAR_STATE_LAYOUT = (
+    # Fused by the location filter, written by SharedStatePublisher
+    ('estimate', (
+        'timestamp_s',
+        'x_m',
+        'y_m',
+        'heading_d',
+        'speed_m_s',
+        'throttle',
+        'steering',
+        'waypoint_x_m',
+        'waypoint_y_m',
+    )),
+    # The rest are written by Telemetry as it receives them
+    ('gps', (
+        'timestamp_s',
+        'latitude_d',
+        'longitude_d',
+        'accuracy_m',
+        'heading_d',
+        'speed_m_s',
+    )),
+    ('compass', (
+        'timestamp_s',
+        'compass_d',
+        'confidence',
+    )),
+    # What the car was last told to drive with
+    ('drive', (
+        'timestamp_s',
+        'throttle',
+        'steering',
+    )),
+)
+
+# Reads to try while the writer is busy before giving up
+MAX_READ_ATTEMPTS = 1000
+
+_MAGIC = 0x53435641  # 'AVCS'
+# The magic number and a checksum of the layout, so that readers can tell if
+# they were built with a different layout than the writer
+_HEADER = struct.Struct('<II')
+_SEQUENCE = struct.Struct('<Q')
+
+# Blocks created by this process, which its resource tracker should remove
+_CREATED = set()
+
+
+def layout_checksum(layout):
+    """Returns a checksum of the section and field names."""
+    return zlib.crc32(repr(tuple(
+        (section, tuple(fields)) for section, fields in layout
+    )).encode('utf-8'))
+
+
+class _Section(object):  # pylint: disable=too-few-public-methods
+    """Where a section is in the block."""
+
+    def __init__(self, fields, offset):
+        self.fields = tuple(fields)
+        self.offset = offset
+        self.values = struct.Struct('<{}d'.format(len(self.fields)))
+        self.size = _SEQUENCE.size + self.values.size
+        self.write_lock = threading.Lock()
+
+
+def _make_sections(layout):
+    """Returns the sections of a layout by name, in order."""
+    sections = collections.OrderedDict()
+    offset = _HEADER.size
+    for name, fields in layout:
+        sections[name] = _Section(fields, offset)
+        offset += sections[name].size
+    return sections
+
+
+class SharedState(object):
+    """Block of shared memory with the latest values of the car's state. One
+    process creates it and writes to it; any process can attach to it by name
+    and read consistent snapshots of each section. Missing values are stored
+    as NaN and read as None.
+    """
+
+    def __init__(self, name=DEFAULT_NAME, layout=CAR_STATE_LAYOUT, create=False):
+        """Creates the block, replacing any that was left behind, or attaches
+        to an existing one. Raises FileNotFoundError if there's nothing to
+        attach to, and ValueError if the block has a different layout.
+        """
+        self._sections = _make_sections(layout)
+        size = _HEADER.size + sum(
+            section.size for section in self._sections.values()
+        )
+        checksum = layout_checksum(layout)
+
+        if create:
+            try:
+                self._memory = shared_memory.SharedMemory(name, True, size)
+            except FileExistsError:  # pylint: disable=undefined-variable
+                # Left behind by a process that didn't exit cleanly
+                stale = shared_memory.SharedMemory(name)
+                stale.close()
+                stale.unlink()
+                self._memory = shared_memory.SharedMemory(name, True, size)
+            _CREATED.add(self._memory.name)
+        else:
+            self._memory = shared_memory.SharedMemory(name)
+            if (
+                    self._memory.name not in _CREATED
+                    and multiprocessing.parent_process() is None
+            ):
+                # Before Python 3.13, attaching registers the block with this
+                # process's resource tracker, which unlinks it at exit.
+                # Children from multiprocessing share their parent's tracker,
+                # so leave them alone.
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(
+                    self._memory._name,  # pylint: disable=protected-access
+                    'shared_memory'
+                )
+        self._owner = create
+        self._buffer = self._memory.buf
+
+        if create:
+            for section in self._sections:
+                self.write(section, {'timestamp_s': float('nan')})
+            _HEADER.pack_into(self._buffer, 0, _MAGIC, checksum)
+        elif _HEADER.unpack_from(self._buffer)[0] == 0:
+            # The header is written last
+            self.close()
+            raise FileNotFoundError(  # pylint: disable=undefined-variable
+                'Shared state {} is still being created'.format(name)
+            )
+        elif (
+                self._memory.size < size
+                or _HEADER.unpack_from(self._buffer) != (_MAGIC, checksum)
+        ):
+            self.close()
+            raise ValueError(
+                'Shared state {} has a different layout'.format(name)
+            )
+
+    @property
+    def name(self):
+        """The name that other processes attach with."""
+        return self._memory.name
+
+    @property
+    def sections(self):
+        """The section names, in the order they're stored."""
+        return tuple(self._sections)
+
+    def fields(self, section):
+        """Returns a section's field names, in the order they're stored."""
+        return self._sections[section].fields
+
+    def write(self, section, values):
+        """Replaces a section. Fields that are missing from values are set to
+        None, except for timestamp_s, which is set to the current time.
+        """
+        section = self._sections[section]
+        if values.get('timestamp_s') is None:
+            values = dict(values, timestamp_s=time.time())
+        packed = [
+            float('nan') if values.get(field) is None else values[field]
+            for field in section.fields
+        ]
+        buffer_ = self._buffer
+        offset = section.offset
+        with section.write_lock:
+            sequence = _SEQUENCE.unpack_from(buffer_, offset)[0]
+            _SEQUENCE.pack_into(buffer_, offset, sequence + 1)
+            section.values.pack_into(
+                buffer_,
+                offset + _SEQUENCE.size,
+                *packed
+            )
+            _SEQUENCE.pack_into(buffer_, offset, sequence + 2)
+
+    def read(self, section):
+        """Returns a consistent snapshot of a section as a dict, or None if
+        the writer was never done writing, e.g. because it died mid-write.
+        """
+        section = self._sections[section]
+        buffer_ = self._buffer
+        offset = section.offset
+        for attempt in range(MAX_READ_ATTEMPTS):
+            before = _SEQUENCE.unpack_from(buffer_, offset)[0]
+            if before % 2 == 0:
+                values = section.values.unpack_from(
+                    buffer_,
+                    offset + _SEQUENCE.size
+                )
+                if _SEQUENCE.unpack_from(buffer_, offset)[0] == before:
+                    return {
+                        field: None if math.isnan(value) else value
+                        for field, value in zip(section.fields, values)
+                    }
+            if attempt > 10:
+                # Let the writer finish
+                time.sleep(0)
+        return None
+
+    def read_all(self):
+        """Returns snapshots of every section, keyed by section. Each section
+        is consistent by itself, but they're read one at a time.
+        """
+        return {section: self.read(section) for section in self._sections}
+
+    def sequence(self, section):
+        """Returns a section's sequence number, which goes up by 2 for every
+        write.
+        """
+        return _SEQUENCE.unpack_from(
+            self._buffer,
+            self._sections[section].offset
+        )[0]
+
+    def close(self):
+        """Detaches from the block. The creator also removes it."""
+        if self._buffer is None:
+            return
+        self._buffer.release()
+        self._buffer = None
+        self._memory.close()
+        if self._owner:
+            _CREATED.discard(self._memory.name)
+            self._memory.unlink()
+
+
+def attach(name=DEFAULT_NAME, timeout_s=None, layout=CAR_STATE_LAYOUT):
+    """Attaches to the car's state, waiting for the control process to
+    create it. Returns None if it times out.
+    """
+    start = time.time()
+    while True:
+        try:
+            return SharedState(name, layout)
+        except FileNotFoundError:  # pylint: disable=undefined-variable
+            if timeout_s is not None and time.time() - start >= timeout_s:
+                return None
+            time.sleep(0.1)
+
+
+def age_s(values, now=None):
+    """Returns how long ago a section was written, or None if it never
+    was.
+    """
+    if values is None or values.get('timestamp_s') is None:
+        return None
+    if now is None:
+        now = time.time()
+    return now - values['timestamp_s']
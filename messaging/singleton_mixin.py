@@ -1,9 +1,14 @@
-"""Provides a singleton of an object per thread."""
+"""Provides a singleton of an object per process."""
 import threading
 
+_INSTANCES = {}
+_LOCK = threading.Lock()
+
 
 class SingletonMixin(object):  # pylint: disable=too-few-public-methods
-    """Provides a singleton of an object per thread.
+    """Provides a singleton of an object per process. Every thread gets the
+    same instance, so subclasses need to be thread safe. Note that __init__
+    is still called on every construction.
 
     Usage:
     class ObjectYouWantSingletoned(SingletonMixin):
@@ -11,24 +16,13 @@ class SingletonMixin(object):  # pylint: disable=too-few-public-methods
     instance = ObjectYouWantSingletoned()
     """
 
-    def __new__(cls, *args, **kwargs):
-        lock = None
-
-        # Create dictionary if needed
-        if not hasattr(cls, '_singleton_instances'):
-            lock = threading.Lock()
-            with lock:
-                if not hasattr(cls, '_singleton_instances'):
-                    cls._singleton_instances = {}
-
-        # Create new instance if needed
-        key = str(hash(cls))
-        if key not in cls._singleton_instances:
-            if lock is None:
-                lock = threading.Lock()
-            with lock:
-                if key not in cls._singleton_instances:
-                    cls._singleton_instances[key] = super(SingletonMixin, cls) \
-                            .__new__(cls, *args, **kwargs)
-
-        return cls._singleton_instances[key]
+    def __new__(cls, *args, **kwargs):  # pylint: disable=unused-argument
+        # Keyed by the class itself, so that subclasses don't share instances
+        instance = _INSTANCES.get(cls)
+        if instance is None:
+            with _LOCK:
+                instance = _INSTANCES.get(cls)
+                if instance is None:
+                    instance = super(SingletonMixin, cls).__new__(cls)
+                    _INSTANCES[cls] = instance
+        return instance
@@ -0,0 +1,323 @@
+"""Streaming statistics for sensor data and metrics.
+
+Everything here takes one sample at a time, in O(1) time (amortized for the
+windowed statistics) and O(1) memory, so it can be updated from the control
+loop or from sensor threads without keeping readings around. The classes use
+__slots__ because there can be a lot of them, e.g. one per metric.
+
+    RunningStats: count, mean, variance, min and max (Welford's algorithm)
+    Ewma: exponentially weighted mean and variance, which follows drift
+    WindowedMinMax: min and max of the last N samples
+    TimeWindowedStats: mean and variance of the samples from the last N seconds
+    P2Quantile: estimate of a quantile with the P-squared algorithm
+"""
+
+import collections
+import math
+
+
+class RunningStats(object):
+    """Mean, variance, min and max using Welford's algorithm."""
+    __slots__ = ('count', 'mean', '_m2', 'minimum', 'maximum')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.minimum = float('inf')
+        self.maximum = -float('inf')
+
+    def add(self, value):
+        """Adds a sample."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+
+    def variance(self):
+        """Returns the population variance, like numpy.var."""
+        if self.count == 0:
+            return 0.0
+        return self._m2 / self.count
+
+    def sample_variance(self):
+        """Returns the sample variance, like statistics.variance."""
+        if self.count < 2:
+            return 0.0
+        return self._m2 / (self.count - 1)
+
+    def std_dev(self):
+        """Returns the population standard deviation, like numpy.std."""
+        return math.sqrt(self.variance())
+
+
+class Ewma(object):
+    """Exponentially weighted moving mean and variance. Unlike RunningStats,
+    this follows values that drift over time. alpha is the weight of each new
+    sample.
+    """
+    __slots__ = ('alpha', 'count', 'mean', 'variance')
+
+    def __init__(self, alpha, mean=None, variance=None):
+        """mean and variance can be used to start from known values."""
+        if not 0.0 < alpha <= 1.0:
+            raise ValueError('alpha must be in (0, 1], not {}'.format(alpha))
+        self.alpha = alpha
+        self.count = 0 if mean is None else 1
+        self.mean = 0.0 if mean is None else mean
+        self.variance = 0.0 if variance is None else variance
+
+    def add(self, value):
+        """Adds a sample."""
+        if self.count == 0:
+            self.mean = value
+        else:
+            delta = value - self.mean
+            increment = self.alpha * delta
+            self.mean += increment
+            self.variance = (1.0 - self.alpha) * (
+                self.variance + delta * increment
+            )
+        self.count += 1
+
+    def std_dev(self):
+        """Returns the standard deviation."""
+        return math.sqrt(self.variance)
+
+
+class WindowedMinMax(object):
+    """Min and max of the last size samples, using monotonic queues."""
+    __slots__ = ('size', '_index', '_start', '_minimums', '_maximums')
+
+    def __init__(self, size):
+        self.size = size
+        self._index = 0
+        self._start = 0
+        # (index, value) pairs with increasing and decreasing values
+        self._minimums = collections.deque()
+        self._maximums = collections.deque()
+
+    def add(self, value):
+        """Adds a sample."""
+        index = self._index
+        self._index += 1
+        expired = index - self.size
+
+        minimums = self._minimums
+        while minimums and minimums[-1][1] >= value:
+            minimums.pop()
+        minimums.append((index, value))
+        if minimums[0][0] <= expired:
+            minimums.popleft()
+
+        maximums = self._maximums
+        while maximums and maximums[-1][1] <= value:
+            maximums.pop()
+        maximums.append((index, value))
+        if maximums[0][0] <= expired:
+            maximums.popleft()
+
+    def minimum(self):
+        """Returns the minimum of the window, or None if it's empty."""
+        return self._minimums[0][1] if self._minimums else None
+
+    def maximum(self):
+        """Returns the maximum of the window, or None if it's empty."""
+        return self._maximums[0][1] if self._maximums else None
+
+    def last(self):
+        """Returns the newest sample, or None if it's empty."""
+        return self._minimums[-1][1] if self._minimums else None
+
+    def full(self):
+        """Returns True if the window has size samples."""
+        return len(self) == self.size
+
+    def clear(self):
+        """Removes all of the samples."""
+        self._start = self._index
+        self._minimums.clear()
+        self._maximums.clear()
+
+    def __len__(self):
+        return min(self._index - self._start, self.size)
+
+
+class TimeWindowedStats(object):
+    """Mean and variance of the samples from the last window_s seconds, for
+    sources that don't report at a steady rate. Samples are removed with the
+    inverse of Welford's algorithm as they expire, and the mean and sum of
+    squared differences are recomputed from the remaining ones once as many
+    have been removed as are left, which is still O(1) amortized.
+    """
+    __slots__ = ('window_s', 'mean', '_m2', '_samples', '_removed')
+
+    def __init__(self, window_s):
+        if window_s <= 0.0:
+            raise ValueError(
+                'window_s must be positive, not {}'.format(window_s)
+            )
+        self.window_s = window_s
+        self.mean = 0.0
+        self._m2 = 0.0
+        # (timestamp, value) pairs, oldest first
+        self._samples = collections.deque()
+        self._removed = 0
+
+    def add(self, timestamp_s, value):
+        """Adds a sample taken at timestamp_s and expires the old ones."""
+        self.expire(timestamp_s)
+        self._samples.append((timestamp_s, value))
+        delta = value - self.mean
+        self.mean += delta / len(self._samples)
+        self._m2 += delta * (value - self.mean)
+
+    def expire(self, timestamp_s):
+        """Removes the samples from more than window_s before timestamp_s."""
+        samples = self._samples
+        oldest_s = timestamp_s - self.window_s
+        while samples and samples[0][0] <= oldest_s:
+            value = samples.popleft()[1]
+            if not samples:
+                self.mean = 0.0
+                self._m2 = 0.0
+                self._removed = 0
+                return
+            mean = self.mean
+            self.mean -= (value - mean) / len(samples)
+            self._m2 -= (value - mean) * (value - self.mean)
+            self._removed += 1
+        if self._removed > 0 and self._removed >= len(samples):
+            self._recompute()
+
+    def _recompute(self):
+        """Recomputes the mean and sum of squared differences exactly."""
+        values = [value for _, value in self._samples]
+        self.mean = math.fsum(values) / len(values)
+        self._m2 = math.fsum((value - self.mean) ** 2 for value in values)
+        self._removed = 0
+
+    def variance(self):
+        """Returns the population variance of the window."""
+        if not self._samples:
+            return 0.0
+        # Rounding can make it slightly negative
+        return max(self._m2 / len(self._samples), 0.0)
+
+    def std_dev(self):
+        """Returns the population standard deviation of the window."""
+        return math.sqrt(self.variance())
+
+    def clear(self):
+        """Removes all of the samples."""
+        self.mean = 0.0
+        self._m2 = 0.0
+        self._samples.clear()
+        self._removed = 0
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class P2Quantile(object):
+    """Estimates a quantile without storing the samples, using the P-squared
+    algorithm from Jain and Chlamtac, "The P2 algorithm for dynamic
+    calculation of quantiles and histograms without storing observations".
+    """
+    __slots__ = ('quantile', 'count', '_heights', '_positions', '_desired',
+                 '_increments')
+
+    def __init__(self, quantile):
+        if not 0.0 < quantile < 1.0:
+            raise ValueError(
+                'quantile must be in (0, 1), not {}'.format(quantile)
+            )
+        self.quantile = quantile
+        self.count = 0
+        # Marker heights and positions
+        self._heights = []
+        self._positions = [0, 1, 2, 3, 4]
+        self._desired = [
+            0.0, 2.0 * quantile, 4.0 * quantile, 2.0 + 2.0 * quantile, 4.0
+        ]
+        self._increments = [
+            0.0, quantile / 2.0, quantile, (1.0 + quantile) / 2.0, 1.0
+        ]
+
+    def add(self, value):
+        """Adds a sample."""
+        self.count += 1
+        heights = self._heights
+        if self.count <= 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = 0
+            while value >= heights[cell + 1]:
+                cell += 1
+
+        positions = self._positions
+        for index in range(cell + 1, 5):
+            positions[index] += 1
+        desired = self._desired
+        for index in range(5):
+            desired[index] += self._increments[index]
+
+        for index in range(1, 4):
+            offset = desired[index] - positions[index]
+            gap_above = positions[index + 1] - positions[index]
+            gap_below = positions[index] - positions[index - 1]
+            if (offset >= 1.0 and gap_above > 1) or (
+                    offset <= -1.0 and gap_below > 1
+            ):
+                direction = 1 if offset > 0.0 else -1
+                height = self._parabolic(index, direction)
+                if not heights[index - 1] < height < heights[index + 1]:
+                    height = self._linear(index, direction)
+                heights[index] = height
+                positions[index] += direction
+
+    def value(self):
+        """Returns the estimate, or None if there are no samples."""
+        if self.count == 0:
+            return None
+        if self.count <= 5:
+            # Few enough samples to just look it up
+            index = int(round(self.quantile * (self.count - 1)))
+            return self._heights[index]
+        return self._heights[2]
+
+    def _parabolic(self, index, direction):
+        """Returns the piecewise parabolic prediction of a marker height."""
+        heights = self._heights
+        positions = self._positions
+        return heights[index] + direction / float(
+            positions[index + 1] - positions[index - 1]
+        ) * (
+            (positions[index] - positions[index - 1] + direction)
+            * (heights[index + 1] - heights[index])
+            / float(positions[index + 1] - positions[index])
+            + (positions[index + 1] - positions[index] - direction)
+            * (heights[index] - heights[index - 1])
+            / float(positions[index] - positions[index - 1])
+        )
+
+    def _linear(self, index, direction):
+        """Returns the linear prediction of a marker height."""
+        heights = self._heights
+        positions = self._positions
+        return heights[index] + direction * (
+            heights[index + direction] - heights[index]
+        ) / float(positions[index + direction] - positions[index])
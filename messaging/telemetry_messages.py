@@ -0,0 +1,135 @@
+"""Typed telemetry messages.
+
+Producers in this process publish these directly. Messages from other
+processes, and readings from phones, are dicts with the same keys; use
+message_from_dict to convert them.
+"""
+
+
+class _TelemetryMessage(object):
+    """Base class for telemetry messages. Fields are listed in __slots__."""
+    __slots__ = ()
+
+    def to_dict(self):
+        """Returns the message as a dict, e.g. for JSON encoding."""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Creates a message from a dict. Missing fields are None."""
+        return cls(**{field: data.get(field) for field in cls.__slots__})
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, field) == getattr(other, field)
+            for field in self.__slots__
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '{}({})'.format(
+            self.__class__.__name__,
+            ', '.join(
+                '{}={!r}'.format(field, getattr(self, field))
+                for field in self.__slots__
+            )
+        )
+
+
+class GpsReading(_TelemetryMessage):
+    """A GPS reading."""
+    __slots__ = (
+        'latitude_d',
+        'longitude_d',
+        'accuracy_m',
+        'heading_d',
+        'speed_m_s',
+        'timestamp_s',
+        'device_id',
+    )
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self,
+            latitude_d,
+            longitude_d,
+            accuracy_m,
+            heading_d,
+            speed_m_s,
+            timestamp_s=None,
+            device_id=None
+    ):
+        self.latitude_d = latitude_d
+        self.longitude_d = longitude_d
+        self.accuracy_m = accuracy_m
+        self.heading_d = heading_d
+        self.speed_m_s = speed_m_s
+        self.timestamp_s = timestamp_s
+        self.device_id = device_id
+
+
+class CompassReading(_TelemetryMessage):
+    """A compass reading."""
+    __slots__ = ('compass_d', 'confidence', 'device_id')
+
+    def __init__(self, compass_d, confidence, device_id=None):
+        self.compass_d = compass_d
+        self.confidence = confidence
+        self.device_id = device_id
+
+
+class AccelReading(_TelemetryMessage):
+    """An accelerometer reading. Some sources only report the z axis, and
+    timestamp_s is None if the source doesn't know when it was taken.
+    """
+    __slots__ = (
+        'acceleration_g_x',
+        'acceleration_g_y',
+        'acceleration_g_z',
+        'device_id',
+        'timestamp_s',
+    )
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self,
+            acceleration_g_x,
+            acceleration_g_y,
+            acceleration_g_z,
+            device_id=None,
+            timestamp_s=None
+    ):
+        self.acceleration_g_x = acceleration_g_x
+        self.acceleration_g_y = acceleration_g_y
+        self.acceleration_g_z = acceleration_g_z
+        self.device_id = device_id
+        self.timestamp_s = timestamp_s
+
+
+class DriveCommand(_TelemetryMessage):
+    """The throttle and steering that the car was told to drive with."""
+    __slots__ = ('throttle', 'steering')
+
+    def __init__(self, throttle, steering):
+        self.throttle = throttle
+        self.steering = steering
+
+
+# The key that identifies each type of message in dicts, in the order they're
+# checked
+_TYPE_KEYS = (
+    ('compass_d', CompassReading),
+    ('acceleration_g_z', AccelReading),
+    ('latitude_d', GpsReading),
+    ('throttle', DriveCommand),
+)
+
+
+def message_from_dict(data):
+    """Converts a dict to a telemetry message. Returns None if it isn't one,
+    e.g. for commands like load_waypoints.
+    """
+    for key, class_ in _TYPE_KEYS:
+        if key in data:
+            return class_.from_dict(data)
+    return None
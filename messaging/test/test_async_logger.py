@@ -0,0 +1,45 @@
+"""Tests the async logger."""
+
+import threading
+import unittest
+
+from messaging.async_logger import AsyncLoggerReceiver
+
+
+class RecordingLogger(object):
+    """Saves the messages and the threads they were logged from."""
+
+    def __init__(self):
+        self.messages = []
+        self.threads = set()
+
+    def _log(self, message):
+        """Saves a message."""
+        self.messages.append(message)
+        self.threads.add(threading.current_thread().name)
+
+    debug = info = warn = error = critical = _log
+
+
+class TestAsyncLogger(unittest.TestCase):
+    """Tests the async logger."""
+
+    def test_receiver(self):
+        """Messages should be written in order by the writer thread."""
+        logger = RecordingLogger()
+        receiver = AsyncLoggerReceiver(logger)
+        receiver._writer.start()  # pylint: disable=protected-access
+        for index in range(100):
+            receiver._callback({'level': 'info', 'message': str(index)})  # pylint: disable=protected-access
+        receiver._callback('{"level": "warn", "message": {"a": 1}}')  # pylint: disable=protected-access
+        receiver._messages.put(None)  # pylint: disable=protected-access
+        receiver._writer.join(1.0)  # pylint: disable=protected-access
+        self.assertEqual(
+            logger.messages,
+            [str(index) for index in range(100)] + ['{"a": 1}']
+        )
+        self.assertEqual(logger.threads, {'AsyncLoggerReceiver:write'})
+
+
+if __name__ == '__main__':
+    unittest.main()
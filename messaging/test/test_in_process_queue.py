@@ -0,0 +1,78 @@
+"""Tests the in-process message queue."""
+
+import threading
+import unittest
+
+from messaging import in_process_queue
+from messaging import metrics
+from messaging.in_process_queue import InProcessQueue
+
+
+class TestInProcessQueue(unittest.TestCase):
+    """Tests the in-process message queue."""
+
+    def test_put_get(self):
+        """Messages should come out in order, as the same objects."""
+        queue = InProcessQueue('test-queue')
+        message = {'compass_d': 1.0}
+        queue.put(message)
+        queue.put('banana')
+        self.assertEqual(len(queue), 2)
+        self.assertIs(queue.get(), message)
+        self.assertEqual(queue.get(), 'banana')
+        with self.assertRaises(IndexError):
+            queue.get(0.01)
+
+        for message in range(3):
+            queue.put(message)
+        self.assertEqual(queue.drain(), [0, 1, 2])
+        self.assertEqual(queue.drain(), [])
+
+    def test_drops_oldest(self):
+        """When full, the oldest messages should be dropped."""
+        queue = InProcessQueue('test-queue-full', max_size=2)
+        dropped = metrics.counter(
+            'messages_dropped_total',
+            exchange='test-queue-full'
+        )
+        before = dropped.value()
+        for message in range(5):
+            queue.put(message)
+        self.assertEqual(dropped.value() - before, 3)
+        self.assertEqual([queue.get(), queue.get()], [3, 4])
+
+    def test_wakeup(self):
+        """Waiting consumers should be woken up by new messages."""
+        queue = InProcessQueue('test-queue-wakeup')
+        received = []
+        count = 1000
+
+        def consume():
+            """Consumes all of the messages."""
+            for _ in range(count):
+                received.append(queue.get(1.0))
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        for message in range(count):
+            queue.put(message)
+        consumer.join(2.0)
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(received, list(range(count)))
+
+    def test_register(self):
+        """Only the registered consumer's queue should be removed."""
+        exchange = 'test-queue-register'
+        first = InProcessQueue(exchange)
+        second = InProcessQueue(exchange)
+        in_process_queue.register(exchange, first)
+        in_process_queue.register(exchange, second)
+        self.assertIs(in_process_queue.get_queue(exchange), second)
+        in_process_queue.unregister(exchange, first)
+        self.assertIs(in_process_queue.get_queue(exchange), second)
+        in_process_queue.unregister(exchange, second)
+        self.assertIs(in_process_queue.get_queue(exchange), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+"""Tests the asynchronous log file handler."""
+
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from messaging import metrics
+from messaging.log_sink import AsyncFileHandler
+
+
+class TestLogSink(unittest.TestCase):
+    """Tests the asynchronous log file handler."""
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._file_name = os.path.join(self._directory, 'test.log')
+        self._logger = logging.Logger('test_log_sink')
+        self._logger.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def _add_handler(self, **kwargs):
+        """Adds an AsyncFileHandler that doesn't write until it's closed."""
+        kwargs.setdefault('flush_interval_s', 100.0)
+        handler = AsyncFileHandler(self._file_name, **kwargs)
+        handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        self._logger.addHandler(handler)
+        return handler
+
+    def test_order(self):
+        """Records should be written in order, whatever their level."""
+        handler = self._add_handler()
+        self._logger.debug('apple')
+        self._logger.info('banana')
+        self._logger.debug('cherry')
+        handler.flush()
+        self._logger.error('date')
+        handler.close()
+        with open(self._file_name) as file_:
+            self.assertEqual(
+                file_.read(),
+                'DEBUG apple\nINFO banana\nDEBUG cherry\nERROR date\n'
+            )
+
+    def test_compressed_rotation(self):
+        """Compressed files should be rotated and readable as streams."""
+        handler = self._add_handler(
+            compress=True,
+            max_bytes=200,
+            backup_count=10
+        )
+        self.assertEqual(handler.file_name(), self._file_name + '.gz')
+        for index in range(10):
+            self._logger.info('message {}'.format(index))
+            # Each flush is a separate gzip member
+            handler.flush()
+        handler.close()
+
+        lines = []
+        for index in range(10, -1, -1):
+            file_name = self._file_name + ('.{}'.format(index) if index else '')
+            if os.path.exists(file_name + '.gz'):
+                with gzip.open(file_name + '.gz', 'rt') as file_:
+                    lines.extend(file_.read().splitlines())
+        self.assertTrue(os.path.exists(self._file_name + '.1.gz'))
+        self.assertEqual(
+            lines,
+            ['INFO message {}'.format(index) for index in range(10)]
+        )
+
+    def test_drop_debug_first(self):
+        """When the queue is full, debug records should be dropped first."""
+        dropped = metrics.counter('log_sink_records_dropped_total', level='DEBUG')
+        before = dropped.value()
+        handler = self._add_handler(max_queued=4)
+        for index in range(5):
+            self._logger.debug(index)
+        for index in range(3):
+            self._logger.info(index)
+        handler.close()
+        self._logger.info('after close')
+
+        with open(self._file_name) as file_:
+            self.assertEqual(
+                file_.read().splitlines(),
+                ['DEBUG 4', 'INFO 0', 'INFO 1', 'INFO 2']
+            )
+        self.assertEqual(dropped.value() - before, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
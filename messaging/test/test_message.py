@@ -1,11 +1,17 @@
 """Tests the message framework."""
 
+import os
+import socket
 import threading
 import time
 import unittest
 
+from messaging import metrics
 from messaging.message_consumer import consume_messages
+from messaging.message_consumer import load_message
+from messaging.message_consumer import wait_for_consumer
 from messaging.message_producer import MessageProducer
+from messaging.message_producer import get_producer
 
 
 class TestMessage(unittest.TestCase):
@@ -50,6 +56,162 @@ class TestMessage(unittest.TestCase):
         producer.kill()
         self.assertEqual(self.message, sent_message)
 
+    def test_wait_for_consumer(self):
+        """Producers should be able to wait for consumers to be ready."""
+        exchange = 'test-ready'
+        self.assertFalse(wait_for_consumer(exchange, 0.01))
+        messages = []
+        consumer = threading.Thread(
+            target=lambda: consume_messages(exchange, messages.append)
+        )
+        consumer.start()
+        self.assertTrue(wait_for_consumer(exchange, 1.0))
+
+        # No resending is needed once the consumer is ready
+        producer = MessageProducer(exchange)
+        producer.publish('banana')
+        producer.kill()
+        consumer.join(1.0)
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(messages, ['banana'])
+        self.assertFalse(wait_for_consumer(exchange, 0.01))
+
+    def test_in_process(self):
+        """Producers in the same process should pass objects directly, and
+        should still be able to use the socket.
+        """
+        exchange = 'test-in-process'
+        messages = []
+        consumer = threading.Thread(
+            target=lambda: consume_messages(exchange, messages.append)
+        )
+        consumer.start()
+        self.assertTrue(wait_for_consumer(exchange, 1.0))
+
+        message = {'compass_d': 1.0}
+        producer = MessageProducer(exchange)
+        self.assertTrue(producer.is_in_process())
+        producer.publish(message)
+        socket_producer = MessageProducer(exchange, in_process=False)
+        self.assertFalse(socket_producer.is_in_process())
+        socket_producer.publish(message)
+        socket_producer.publish('banana')
+        # Datagrams go through another thread, so wait for them first
+        for _ in range(100):
+            if len(messages) == 3:
+                break
+            time.sleep(0.01)
+        producer.kill()
+        consumer.join(1.0)
+        self.assertFalse(consumer.is_alive())
+
+        self.assertIs(messages[0], message)
+        self.assertEqual(load_message(messages[1]), message)
+        self.assertEqual(messages[2], 'banana')
+        self.assertFalse(producer.is_in_process())
+
+    def test_buffer_until_consumer(self):
+        """Messages sent before the consumer is ready should be kept, up to
+        a limit.
+        """
+        exchange = 'test-buffer'
+        dropped = metrics.counter(
+            'producer_messages_dropped_total',
+            exchange=exchange
+        )
+        dropped_before = dropped.value()
+        producer = MessageProducer(exchange, buffer_size=2)
+        for message in ('apple', 'banana', 'cherry'):
+            producer.publish(message)
+        self.assertEqual(dropped.value() - dropped_before, 1)
+        # Nothing to kill yet, so this shouldn't stop the consumer below
+        producer.kill()
+
+        messages = []
+        consumer = threading.Thread(
+            target=lambda: consume_messages(exchange, messages.append)
+        )
+        consumer.start()
+        self.assertTrue(wait_for_consumer(exchange, 1.0))
+        producer.publish('date')
+        producer.kill()
+        consumer.join(1.0)
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(messages, ['banana', 'cherry', 'date'])
+
+    def test_reconnect(self):
+        """Producers should reconnect when the consumer restarts."""
+        exchange = 'test-reconnect'
+        producer = MessageProducer(exchange, in_process=False)
+        for message in ('apple', 'banana'):
+            messages = []
+            consumer = threading.Thread(
+                target=lambda: consume_messages(exchange, messages.append)
+            )
+            consumer.start()
+            self.assertTrue(wait_for_consumer(exchange, 1.0))
+            producer.publish(message)
+            producer.kill()
+            consumer.join(1.0)
+            self.assertFalse(consumer.is_alive())
+            self.assertEqual(messages, [message])
+
+    def test_non_blocking(self):
+        """Non-blocking producers should keep messages instead of waiting for
+        a consumer that's behind.
+        """
+        exchange = 'test-non-blocking'
+        socket_address = os.sep.join(('.', 'messaging', 'sockets', exchange))
+        if os.path.exists(socket_address):
+            os.remove(socket_address)
+        # A consumer that never reads
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(socket_address)
+        try:
+            producer = MessageProducer(
+                exchange,
+                buffer_size=10,
+                blocking=False
+            )
+            message = 'x' * 10000
+            for _ in range(1000):
+                producer.publish(message)
+
+            sock.setblocking(False)
+            received = 0
+            try:
+                while True:
+                    self.assertEqual(sock.recv(65536).decode('utf-8'), message)
+                    received += 1
+            except BlockingIOError:  # pylint: disable=undefined-variable
+                pass
+            self.assertGreater(received, 0)
+            self.assertLess(received, 1000)
+            # The buffered messages are sent once there's room
+            producer.publish(message)
+            sock.setblocking(True)
+            sock.settimeout(1.0)
+            for _ in range(10):
+                self.assertEqual(sock.recv(65536).decode('utf-8'), message)
+        finally:
+            sock.close()
+            os.remove(socket_address)
+
+    def test_get_producer(self):
+        """Every thread should share the same producer."""
+        producers = []
+        threads = [
+            threading.Thread(
+                target=lambda: producers.append(get_producer('test-shared'))
+            )
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(id(producer) for producer in producers)), 1)
+
 
 if __name__ == '__main__':
     unittest.main()
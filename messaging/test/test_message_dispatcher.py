@@ -0,0 +1,169 @@
+"""Tests the message dispatcher."""
+
+import select
+import threading
+import time
+import unittest
+
+from messaging import metrics
+from messaging.message_consumer import wait_for_consumer
+from messaging.message_dispatcher import _Wakeup
+from messaging.message_dispatcher import get_dispatcher
+from messaging.message_producer import MessageProducer
+
+
+class TestMessageDispatcher(unittest.TestCase):
+    """Tests the message dispatcher."""
+
+    @staticmethod
+    def _wait_for(condition):
+        """Waits for the dispatcher thread to do something."""
+        for _ in range(100):
+            if condition():
+                return
+            time.sleep(0.01)
+
+    def test_exchanges(self):
+        """Every exchange should be handled by the dispatcher thread."""
+        dispatcher = get_dispatcher()
+        received = []
+        thread_names = set()
+
+        def handler(message):
+            """Saves the message."""
+            received.append(message)
+            thread_names.add(threading.current_thread().name)
+
+        exchanges = ('test-dispatch-1', 'test-dispatch-2')
+        done = [dispatcher.register(exchange, handler) for exchange in exchanges]
+        for exchange in exchanges:
+            self.assertTrue(wait_for_consumer(exchange, 1.0))
+
+        in_process = MessageProducer(exchanges[0])
+        socket_producer = MessageProducer(exchanges[1], in_process=False)
+        # More than one batch, all waiting before the dispatcher wakes up
+        count = 250
+        for index in range(count):
+            in_process.publish(index)
+            socket_producer.publish(str(index))
+        self._wait_for(lambda: len(received) == 2 * count)
+        self.assertEqual(
+            [message for message in received if isinstance(message, int)],
+            list(range(count))
+        )
+        self.assertEqual(
+            [message for message in received if isinstance(message, str)],
+            [str(index) for index in range(count)]
+        )
+        self.assertEqual(thread_names, set((dispatcher.name,)))
+
+        in_process.kill()
+        socket_producer.kill()
+        for event in done:
+            self.assertTrue(event.wait(1.0))
+        self.assertFalse(wait_for_consumer(exchanges[0], 0.01))
+        self.assertTrue(dispatcher.is_alive())
+
+    def test_handler_error(self):
+        """Exceptions in handlers shouldn't stop the dispatcher."""
+        exchange = 'test-dispatch-error'
+        received = []
+
+        def handler(message):
+            """Fails on the first message."""
+            if message == 'fail':
+                raise ValueError(message)
+            received.append(message)
+
+        done = get_dispatcher().register(exchange, handler)
+        errors = metrics.counter('message_handler_errors_total', exchange=exchange)
+        before = errors.value()
+        producer = MessageProducer(exchange)
+        producer.publish('fail')
+        producer.publish('banana')
+        producer.kill()
+        self.assertTrue(done.wait(1.0))
+        self.assertEqual(received, ['banana'])
+        self.assertEqual(errors.value() - before, 1)
+
+    def test_handler_budget(self):
+        """Slow handlers should be counted."""
+        exchange = 'test-dispatch-budget'
+        done = get_dispatcher().register(
+            exchange,
+            lambda message: time.sleep(float(message))
+        )
+        over_budget = metrics.counter(
+            'message_handler_over_budget_total',
+            exchange=exchange
+        )
+        before = over_budget.value()
+        producer = MessageProducer(exchange)
+        producer.publish('0.0')
+        producer.publish('0.02')
+        producer.kill()
+        self.assertTrue(done.wait(1.0))
+        self.assertEqual(over_budget.value() - before, 1)
+
+    def test_take_over(self):
+        """Registering an exchange again should replace its handler."""
+        exchange = 'test-dispatch-take-over'
+        first = []
+        second = []
+        dispatcher = get_dispatcher()
+        first_done = dispatcher.register(exchange, first.append)
+        second_done = dispatcher.register(exchange, second.append)
+        self.assertTrue(first_done.wait(1.0))
+        self.assertTrue(wait_for_consumer(exchange, 0.01))
+
+        producer = MessageProducer(exchange, in_process=False)
+        producer.publish('banana')
+        self._wait_for(lambda: second)
+        producer.kill()
+        self.assertTrue(second_done.wait(1.0))
+        self.assertEqual(first, [])
+        self.assertEqual(second, ['banana'])
+
+    def test_wakeup_race(self):
+        """A wakeup set while another is being cleared shouldn't be lost."""
+
+        class Reader(object):  # pylint: disable=too-few-public-methods
+            """Calls set() at the start or end of draining the socket."""
+
+            def __init__(self, reader, wakeup, at_end):
+                self._reader = reader
+                self._wakeup = wakeup
+                self._at_end = at_end
+                self._calls = 0
+
+            def recv(self, size):
+                """Receives, setting the wakeup from "another thread"."""
+                self._calls += 1
+                try:
+                    data = self._reader.recv(size)
+                except BlockingIOError:
+                    if self._at_end:
+                        self._wakeup.set()
+                    raise
+                if self._calls == 1 and not self._at_end:
+                    self._wakeup.set()
+                return data
+
+        for at_end in (False, True):
+            wakeup = _Wakeup()
+            wakeup.set()
+            socket_ = wakeup._reader  # pylint: disable=protected-access
+            wakeup._reader = Reader(socket_, wakeup, at_end)  # pylint: disable=protected-access
+            wakeup.clear()
+            wakeup._reader = socket_  # pylint: disable=protected-access
+            readable, _, _ = select.select((socket_,), (), (), 0.0)
+            # Puts skip set() while it's set, so the dispatcher has to be
+            # woken up by a byte that's still in the socket
+            self.assertTrue(
+                not wakeup.is_set() or readable,
+                'Lost wakeup, set at end: {}'.format(at_end)
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
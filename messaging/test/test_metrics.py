@@ -0,0 +1,105 @@
+"""Tests the metrics registry."""
+
+import threading
+import unittest
+
+from messaging.metrics import MetricsRegistry
+
+
+class TestMetrics(unittest.TestCase):
+    """Tests the metrics registry."""
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter(self):
+        """Counters from multiple threads should be summed."""
+        counter = self.registry.counter('count_total', exchange='test')
+        self.assertIs(
+            counter,
+            self.registry.counter('count_total', exchange='test')
+        )
+        self.assertIsNot(
+            counter,
+            self.registry.counter('count_total', exchange='other')
+        )
+
+        def increment():
+            """Increments the counter a bunch."""
+            for _ in range(1000):
+                counter.inc()
+
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc(5)
+        self.assertEqual(counter.value(), 4005)
+
+    def test_gauge(self):
+        """Tests the gauge."""
+        gauge = self.registry.gauge('depth')
+        gauge.set(3)
+        gauge.inc()
+        gauge.dec(2)
+        self.assertEqual(gauge.value(), 2)
+
+    def test_type_mismatch(self):
+        """Registering the same name as another type should fail."""
+        self.registry.counter('thing')
+        with self.assertRaises(ValueError):
+            self.registry.gauge('thing')
+
+    def test_histogram(self):
+        """Tests the histogram buckets."""
+        histogram = self.registry.histogram('time_s', buckets=(1, 2, 3))
+        for value in (0.5, 1, 1.5, 2.5, 10):
+            histogram.observe(value)
+        counts, total = histogram.counts()
+        self.assertEqual(counts, [2, 1, 1, 1])
+        self.assertAlmostEqual(total, 15.5)
+        self.assertEqual(histogram.count(), 5)
+
+    def test_summary(self):
+        """Tests the summary quantiles."""
+        summary = self.registry.summary('latency_s', quantiles=(0.5, 0.9))
+        for value in range(1, 1001):
+            summary.observe(value / 1000.0)
+        value = summary.value()
+        self.assertEqual(value['count'], 1000)
+        self.assertAlmostEqual(value['sum'], 500.5)
+        self.assertAlmostEqual(value['quantiles']['0.5'], 0.5, 2)
+        self.assertAlmostEqual(value['quantiles']['0.9'], 0.9, 2)
+        self.assertEqual(value['min'], 0.001)
+        self.assertEqual(value['max'], 1.0)
+
+        text = self.registry.to_prometheus()
+        self.assertIn('# TYPE latency_s summary', text)
+        self.assertIn('latency_s{quantile="0.5"} 0.5', text)
+        self.assertIn('latency_s_count 1000', text)
+
+    def test_prometheus(self):
+        """Tests the Prometheus text output."""
+        self.registry.counter('sent_total', 'Sent messages', exchange='a').inc(2)
+        self.registry.histogram('time_s', buckets=(1,)).observe(0.5)
+        text = self.registry.to_prometheus()
+        self.assertIn('# HELP sent_total Sent messages', text)
+        self.assertIn('# TYPE sent_total counter', text)
+        self.assertIn('sent_total{exchange="a"} 2', text)
+        self.assertIn('time_s_bucket{le="1"} 1', text)
+        self.assertIn('time_s_bucket{le="+Inf"} 1', text)
+        self.assertIn('time_s_count 1', text)
+
+    def test_json(self):
+        """Tests the JSON output."""
+        self.registry.counter('sent_total', exchange='a').inc()
+        values = self.registry.to_json()
+        self.assertEqual(
+            values['sent_total'],
+            [{'labels': {'exchange': 'a'}, 'value': 1}]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""Tests the scheduler."""
+
+import threading
+import time
+import unittest
+
+from messaging import metrics
+from messaging.scheduler import Scheduler
+from messaging.scheduler import get_scheduler
+
+
+class TestScheduler(unittest.TestCase):
+    """Tests the scheduler."""
+
+    def setUp(self):
+        self.scheduler = Scheduler(worker_count=2)
+        self.scheduler.start()
+
+    def tearDown(self):
+        self.scheduler.kill()
+        self.scheduler.join()
+
+    def test_order(self):
+        """Tasks should run in the order they're due, on the workers."""
+        ran = []
+        done = threading.Event()
+        thread_names = set()
+
+        def task(name):
+            """Saves the task name."""
+            ran.append(name)
+            thread_names.add(threading.current_thread().name)
+            if len(ran) == 3:
+                done.set()
+
+        start = time.monotonic()
+        self.scheduler.schedule(0.1, lambda: task('third'))
+        self.scheduler.schedule(0.0, lambda: task('first'))
+        self.scheduler.schedule(0.05, lambda: task('second'))
+        self.assertTrue(done.wait(1.0))
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual(ran, ['first', 'second', 'third'])
+        self.assertTrue(
+            all(name.startswith('Scheduler:worker') for name in thread_names)
+        )
+        self.assertEqual(self.scheduler.pending(), 0)
+
+    def test_cancel(self):
+        """Cancelled tasks shouldn't run."""
+        ran = []
+        done = threading.Event()
+        task = self.scheduler.schedule(0.05, lambda: ran.append('cancelled'))
+        self.scheduler.schedule(0.05, lambda: ran.append('key'), key='key')
+        self.assertEqual(self.scheduler.pending(), 2)
+        self.assertTrue(task.cancel())
+        self.assertFalse(task.cancel())
+        self.assertTrue(self.scheduler.cancel('key'))
+        self.assertFalse(self.scheduler.cancel('key'))
+        self.assertEqual(self.scheduler.pending(), 0)
+
+        self.scheduler.schedule(0.1, done.set)
+        self.assertTrue(done.wait(1.0))
+        self.assertEqual(ran, [])
+
+    def test_deduplicate(self):
+        """Only one task with a key should be pending at a time."""
+        ran = []
+        done = threading.Event()
+        first = self.scheduler.schedule(0.05, lambda: ran.append(1), key='key')
+        second = self.scheduler.schedule(0.0, lambda: ran.append(2), key='key')
+        self.assertIs(first, second)
+        self.assertEqual(self.scheduler.pending(), 1)
+
+        def reschedule():
+            """Schedules another task with the same key while running."""
+            ran.append(3)
+            self.scheduler.schedule(0.0, done.set, key='key')
+
+        self.scheduler.schedule(0.1, reschedule, key='other')
+        self.assertTrue(done.wait(1.0))
+        self.assertEqual(ran, [1, 3])
+
+    def test_errors(self):
+        """A task that raises shouldn't stop the workers."""
+        errors = metrics.counter('scheduler_task_errors_total')
+        before = errors.value()
+        done = threading.Event()
+
+        def fail():
+            """Raises."""
+            raise ValueError('Expected')
+
+        self.scheduler.schedule(0.0, fail)
+        self.scheduler.schedule(0.01, done.set)
+        self.assertTrue(done.wait(1.0))
+        self.assertEqual(errors.value(), before + 1)
+
+    def test_kill(self):
+        """Killing should drop pending tasks and stop the workers."""
+        ran = []
+        self.scheduler.schedule(0.05, lambda: ran.append(1))
+        self.scheduler.kill()
+        self.scheduler.join(1.0)
+        self.assertFalse(self.scheduler.is_alive())
+        time.sleep(0.1)
+        self.assertEqual(ran, [])
+
+    def test_get_scheduler(self):
+        """There should be one running scheduler per process."""
+        scheduler = get_scheduler()
+        self.assertIs(get_scheduler(), scheduler)
+        self.assertTrue(scheduler.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+"""Tests the shared memory state."""
+
+import multiprocessing
+import os
+import unittest
+
+from messaging import shared_state
+from messaging.shared_state import SharedState
+from messaging.shared_state import age_s
+from messaging.shared_state import attach
+
+LAYOUT = (
+    ('first', ('timestamp_s', 'a', 'b', 'c')),
+    ('second', ('d',)),
+)
+
+
+def write_rows(name, count):
+    """Writes rows where every field has the same value."""
+    state = SharedState(name, LAYOUT)
+    for value in range(count):
+        state.write('first', dict.fromkeys(LAYOUT[0][1], float(value)))
+        state.write('second', {'d': float(value)})
+    state.close()
+
+
+class TestSharedState(unittest.TestCase):
+    """Tests the shared memory state."""
+
+    def setUp(self):
+        self.name = 'test-shared-state-{}'.format(os.getpid())
+        self.state = SharedState(self.name, LAYOUT, create=True)
+
+    def tearDown(self):
+        self.state.close()
+
+    def test_read_write(self):
+        """Readers should see the last write, with None for missing
+        values.
+        """
+        self.assertEqual(
+            self.state.read_all(),
+            {
+                'first': {'timestamp_s': None, 'a': None, 'b': None, 'c': None},
+                'second': {'d': None},
+            }
+        )
+        self.assertIs(age_s(self.state.read('first')), None)
+        reader = SharedState(self.name, LAYOUT)
+        self.state.write('first', {'a': 1.0, 'b': -2.5})
+        values = reader.read('first')
+        self.assertEqual((values['a'], values['b'], values['c']), (1.0, -2.5, None))
+        self.assertLess(age_s(values), 1.0)
+        self.state.write('first', {'timestamp_s': 100.0, 'c': 3})
+        self.assertEqual(
+            reader.read('first'),
+            {'timestamp_s': 100.0, 'a': None, 'b': None, 'c': 3.0}
+        )
+        self.assertEqual(age_s(reader.read('first'), 105.0), 5.0)
+        self.assertEqual(reader.sequence('first'), 6)
+        # Sections are independent
+        self.assertEqual(reader.read('second'), {'d': None})
+        self.assertEqual(reader.sequence('second'), 2)
+        reader.close()
+        # Closing a reader leaves the block alone
+        self.assertEqual(self.state.read('first')['c'], 3.0)
+
+    def test_writer_busy(self):
+        """Reads should give up if the writer never finishes."""
+        offset = self.state._sections['second'].offset  # pylint: disable=protected-access
+        self.state._buffer[offset] = 1  # pylint: disable=protected-access
+        self.assertIs(self.state.read('second'), None)
+        self.assertIsNot(self.state.read('first'), None)
+
+    def test_other_process(self):
+        """Snapshots read while another process writes should be
+        consistent.
+        """
+        count = 20000
+        writer = multiprocessing.Process(
+            target=write_rows,
+            args=(self.name, count)
+        )
+        writer.start()
+        reads = 0
+        while writer.is_alive() or reads == 0:
+            values = self.state.read('first')
+            self.assertEqual(len(set(values.values())), 1, values)
+            reads += 1
+        writer.join()
+        self.assertEqual(self.state.read('first')['a'], count - 1.0)
+        self.assertEqual(self.state.read('second')['d'], count - 1.0)
+        self.assertEqual(self.state.sequence('first'), 2 + 2 * count)
+
+    def test_layout(self):
+        """Attaching with a different layout should fail."""
+        with self.assertRaises(ValueError):
+            SharedState(self.name, (('first', ('timestamp_s', 'a')),))
+
+    def test_replace_stale(self):
+        """Creating should replace a block that was left behind."""
+        state = SharedState(self.name, LAYOUT, create=True)
+        state.write('second', {'d': 1.0})
+        reader = attach(self.name, layout=LAYOUT)
+        self.assertEqual(reader.read('second')['d'], 1.0)
+        reader.close()
+        state.close()
+        self.state._owner = False  # pylint: disable=protected-access
+
+    def test_close(self):
+        """The creator should remove the block when it's closed."""
+        self.state.close()
+        self.assertNotIn(self.name, shared_state._CREATED)  # pylint: disable=protected-access
+        with self.assertRaises(FileNotFoundError):  # pylint: disable=undefined-variable
+            SharedState(self.name, LAYOUT)
+        self.assertIs(attach(self.name, 0.0, LAYOUT), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
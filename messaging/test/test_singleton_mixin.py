@@ -0,0 +1,44 @@
+"""Tests the singleton mixin."""
+
+import threading
+import unittest
+
+from messaging.singleton_mixin import SingletonMixin
+
+
+class Parent(SingletonMixin):  # pylint: disable=too-few-public-methods
+    """Singleton for testing."""
+    def __init__(self, value=None):
+        super(Parent, self).__init__()
+        self.value = value
+
+
+class Child(Parent):  # pylint: disable=too-few-public-methods
+    """Subclass singleton for testing."""
+    pass
+
+
+class TestSingletonMixin(unittest.TestCase):
+    """Tests the singleton mixin."""
+
+    def test_singleton(self):
+        """Every thread should get the same instance, but subclasses should
+        get their own.
+        """
+        instances = []
+        threads = [
+            threading.Thread(target=lambda: instances.append(Parent(1)))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(id(instance) for instance in instances)), 1)
+        self.assertIs(Parent(), instances[0])
+        self.assertIsNot(Child(), instances[0])
+        self.assertIs(Child(), Child())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+"""Tests the streaming statistics."""
+
+import numpy
+import random
+import unittest
+
+from messaging.streaming_statistics import Ewma
+from messaging.streaming_statistics import P2Quantile
+from messaging.streaming_statistics import RunningStats
+from messaging.streaming_statistics import WindowedMinMax
+from messaging.streaming_statistics import TimeWindowedStats
+
+
+class TestStreamingStatistics(unittest.TestCase):
+    """Tests the streaming statistics."""
+
+    def setUp(self):
+        rng = random.Random(1)
+        self.values = [rng.gauss(350.0, 120.0) for _ in range(1000)]
+
+    def test_running_stats(self):
+        """Should match the batch computations."""
+        stats = RunningStats()
+        self.assertEqual(stats.variance(), 0.0)
+        for value in self.values:
+            stats.add(value)
+        self.assertEqual(stats.count, len(self.values))
+        self.assertAlmostEqual(stats.mean, numpy.mean(self.values))
+        self.assertAlmostEqual(stats.std_dev(), numpy.std(self.values))
+        self.assertAlmostEqual(
+            stats.sample_variance(),
+            numpy.var(self.values, ddof=1)
+        )
+        self.assertEqual(stats.minimum, min(self.values))
+        self.assertEqual(stats.maximum, max(self.values))
+
+        # Large offsets shouldn't lose precision
+        stats = RunningStats()
+        for value in (1e9 + 4, 1e9 + 7, 1e9 + 13, 1e9 + 16):
+            stats.add(value)
+        self.assertAlmostEqual(stats.sample_variance(), 30.0)
+
+    def test_ewma(self):
+        """Should follow drift."""
+        ewma = Ewma(0.1)
+        for _ in range(100):
+            ewma.add(10.0)
+        self.assertAlmostEqual(ewma.mean, 10.0)
+        self.assertAlmostEqual(ewma.variance, 0.0)
+        for _ in range(100):
+            ewma.add(20.0)
+        self.assertAlmostEqual(ewma.mean, 20.0, 3)
+
+        ewma = Ewma(0.05, mean=350.0, variance=100.0)
+        self.assertEqual(ewma.std_dev(), 10.0)
+        for value in (340.0, 360.0) * 500:
+            ewma.add(value)
+        self.assertAlmostEqual(ewma.mean, 350.0, 0)
+        self.assertAlmostEqual(ewma.std_dev(), 10.0, 0)
+
+        with self.assertRaises(ValueError):
+            Ewma(0.0)
+
+    def test_windowed_min_max(self):
+        """Should match the min and max of the last samples."""
+        window = WindowedMinMax(10)
+        self.assertIsNone(window.maximum())
+        for index, value in enumerate(self.values):
+            window.add(value)
+            recent = self.values[max(0, index - 9):index + 1]
+            self.assertEqual(window.minimum(), min(recent))
+            self.assertEqual(window.maximum(), max(recent))
+            self.assertEqual(window.last(), value)
+            self.assertEqual(len(window), len(recent))
+        self.assertTrue(window.full())
+
+        window.clear()
+        self.assertEqual(len(window), 0)
+        self.assertIsNone(window.minimum())
+        window.add(1.0)
+        self.assertEqual(len(window), 1)
+        self.assertFalse(window.full())
+
+    def test_time_windowed_stats(self):
+        """Should match the mean and variance of the recent samples, with
+        irregular gaps between them.
+        """
+        rng = random.Random(2)
+        window = TimeWindowedStats(1.0)
+        self.assertEqual(window.variance(), 0.0)
+        timestamps_s = []
+        timestamp_s = 0.0
+        for index, value in enumerate(self.values):
+            # Bursts of readings with gaps between them
+            timestamp_s += 0.05 if index % 3 else rng.uniform(0.2, 1.5)
+            timestamps_s.append(timestamp_s)
+            window.add(timestamp_s, value)
+            recent = [
+                recent_value for recent_s, recent_value
+                in zip(timestamps_s, self.values)
+                if recent_s > timestamp_s - 1.0
+            ]
+            self.assertEqual(len(window), len(recent))
+            self.assertAlmostEqual(window.mean, numpy.mean(recent), 6)
+            self.assertAlmostEqual(window.variance(), numpy.var(recent), 4)
+
+        # Old samples are forgotten, including large ones
+        window = TimeWindowedStats(1.0)
+        for timestamp_s, value in ((0.0, 1e6), (0.5, 1.0), (1.2, 2.0)):
+            window.add(timestamp_s, value)
+        self.assertAlmostEqual(window.mean, 1.5)
+        self.assertAlmostEqual(window.std_dev(), 0.5)
+        window.expire(1.6)
+        self.assertEqual(len(window), 1)
+        self.assertEqual(window.variance(), 0.0)
+        window.expire(10.0)
+        self.assertEqual(len(window), 0)
+        self.assertEqual(window.mean, 0.0)
+
+        window.add(11.0, 5.0)
+        window.clear()
+        self.assertEqual(len(window), 0)
+
+        with self.assertRaises(ValueError):
+            TimeWindowedStats(0.0)
+
+    def test_p2_quantile(self):
+        """Should be close to the true quantiles."""
+        for quantile in (0.1, 0.5, 0.9, 0.99):
+            estimator = P2Quantile(quantile)
+            for value in self.values:
+                estimator.add(value)
+            expected = numpy.percentile(self.values, quantile * 100.0)
+            # Within a few percent of the spread
+            self.assertLess(abs(estimator.value() - expected), 10.0)
+
+        estimator = P2Quantile(0.5)
+        self.assertIsNone(estimator.value())
+        for value in (3.0, 1.0, 2.0):
+            estimator.add(value)
+        self.assertEqual(estimator.value(), 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
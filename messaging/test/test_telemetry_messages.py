@@ -0,0 +1,56 @@
+"""Tests the typed telemetry messages."""
+
+import json
+import unittest
+
+from messaging.message_producer import dump_message
+from messaging.telemetry_messages import AccelReading
+from messaging.telemetry_messages import CompassReading
+from messaging.telemetry_messages import DriveCommand
+from messaging.telemetry_messages import GpsReading
+from messaging.telemetry_messages import message_from_dict
+
+
+class TestTelemetryMessages(unittest.TestCase):
+    """Tests the typed telemetry messages."""
+
+    def test_round_trip(self):
+        """Messages should survive being sent to another process."""
+        messages = (
+            GpsReading(40.0, -105.0, 5.0, 90.0, 1.0, 100.0, 'phone'),
+            CompassReading(45.0, 0.5, 'sup800f'),
+            AccelReading(0.1, -0.2, 1.0, 'sup800f'),
+            AccelReading(0.1, -0.2, 1.0, 'sup800f', 100.0),
+            DriveCommand(0.5, -1.0),
+        )
+        for message in messages:
+            decoded = message_from_dict(json.loads(dump_message(message)))
+            self.assertEqual(decoded, message)
+            self.assertIs(type(decoded), type(message))
+        with self.assertRaises(AttributeError):
+            messages[0].x_m = 0.0
+
+    def test_from_dict(self):
+        """Dicts from other sources should be converted by their keys."""
+        self.assertEqual(
+            message_from_dict({
+                'latitude_d': 40.0,
+                'longitude_d': -105.0,
+                'accuracy_m': 5.0,
+                'heading_d': None,
+                'speed_m_s': None,
+                'device_id': 'phone',
+            }),
+            GpsReading(40.0, -105.0, 5.0, None, None, None, 'phone')
+        )
+        self.assertEqual(
+            message_from_dict({'acceleration_g_z': 1.0}),
+            AccelReading(None, None, 1.0)
+        )
+        self.assertIs(message_from_dict({'load_waypoints': 'a.kml'}), None)
+        with self.assertRaises(TypeError):
+            dump_message(object())
+
+
+if __name__ == '__main__':
+    unittest.main()
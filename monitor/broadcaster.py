@@ -0,0 +1,249 @@
+"""Sends messages to websocket clients from dedicated threads. Each client has
+its own bounded queue and sender thread, so a slow client on the access point
+can't stall the threads that log or dump telemetry, or the other clients.
+Telemetry is sent before logs. Pending telemetry is coalesced (only the newest
+value of each field is kept), and when the log queue is full, the oldest log
+message is dropped.
+"""
+
+import collections
+import json
+import threading
+
+from messaging import metrics
+
+
+class _ClientSender(threading.Thread):
+    """Pending messages and the sender thread for a single client."""
+
+    def __init__(self, client, name, log_queue_size, on_failure):
+        super(_ClientSender, self).__init__()
+        self.name = 'Broadcaster:{}'.format(name)
+        self.client_name = name
+        self.daemon = True
+
+        self._client = client
+        self._on_failure = on_failure
+        self._condition = threading.Condition()
+        self._run = True
+        self._logs = collections.deque(maxlen=log_queue_size)
+        # Pending telemetry fields and whether it's a full key frame
+        self._telemetry = None
+        self._telemetry_full = False
+
+        # The metrics are shared by all of the clients, so that they don't
+        # keep a series for every address that ever connected
+        self.dropped_logs = 0
+        self.dropped_telemetry = 0
+        self._dropped_logs = metrics.counter(
+            'websocket_dropped_frames_total',
+            'Frames dropped because a websocket client was too slow',
+            type='log'
+        )
+        self._dropped_telemetry = metrics.counter(
+            'websocket_dropped_frames_total',
+            'Frames dropped because a websocket client was too slow',
+            type='telemetry'
+        )
+        self._queued = metrics.gauge(
+            'websocket_queued_frames',
+            'Frames waiting to be sent to websocket clients'
+        )
+        # This client's part of the queued frames gauge
+        self._queued_count = 0
+        self._sent = metrics.counter(
+            'websocket_sent_frames_total',
+            'Frames sent to websocket clients'
+        )
+
+    def queue_log(self, payload):
+        """Queues an encoded log message."""
+        with self._condition:
+            if len(self._logs) == self._logs.maxlen:
+                self.dropped_logs += 1
+                self._dropped_logs.inc()
+            self._logs.append(payload)
+            self._update_queued()
+            self._condition.notify()
+
+    def queue_telemetry(self, values, full):
+        """Queues telemetry fields, merging them into any unsent telemetry."""
+        with self._condition:
+            if self._telemetry is None:
+                self._telemetry = dict(values)
+                self._telemetry_full = full
+            else:
+                self.dropped_telemetry += 1
+                self._dropped_telemetry.inc()
+                if full:
+                    self._telemetry = dict(values)
+                else:
+                    self._telemetry.update(values)
+                self._telemetry_full = self._telemetry_full or full
+            self._update_queued()
+            self._condition.notify()
+
+    def pending(self):
+        """Returns the number of frames waiting to be sent."""
+        with self._condition:
+            return self._pending()
+
+    def _pending(self):
+        """Returns the number of pending frames. Must hold the lock."""
+        return len(self._logs) + (0 if self._telemetry is None else 1)
+
+    def _update_queued(self, count=None):
+        """Updates this client's part of the queued frames gauge, to count or
+        the number of pending frames. Must hold the lock.
+        """
+        if count is None:
+            count = self._pending()
+        self._queued.inc(count - self._queued_count)
+        self._queued_count = count
+
+    def run(self):
+        """Runs in a thread, sends queued messages."""
+        while self._run:
+            with self._condition:
+                payload = self._next_frame()
+                while payload is None and self._run:
+                    self._condition.wait(1.0)
+                    payload = self._next_frame()
+                self._update_queued()
+            if payload is None:
+                break
+
+            try:
+                self._client.send(payload)
+                self._sent.inc()
+            except Exception:  # pylint: disable=broad-except
+                # The client has gone away
+                self._run = False
+                self._on_failure(self._client)
+
+        # Anything left won't be sent
+        with self._condition:
+            self._update_queued(0)
+
+    def kill(self):
+        """Stops the thread."""
+        with self._condition:
+            self._run = False
+            self._condition.notify()
+
+    def _next_frame(self):
+        """Takes the next frame, telemetry first. Must hold the lock."""
+        if self._telemetry is not None:
+            payload = json.dumps({
+                'type': 'telemetry',
+                'full': self._telemetry_full,
+                'message': self._telemetry,
+            })
+            self._telemetry = None
+            self._telemetry_full = False
+            return payload
+        if self._logs:
+            return self._logs.popleft()
+        return None
+
+
+class Broadcaster(object):
+    """Sends messages to websocket clients from dedicated threads."""
+    LOG_QUEUE_SIZE = 100
+
+    def __init__(self, log_queue_size=None):
+        if log_queue_size is None:
+            self._log_queue_size = self.LOG_QUEUE_SIZE
+        else:
+            self._log_queue_size = log_queue_size
+        self._senders = {}
+        self._lock = threading.Lock()
+
+    def add_client(self, client):
+        """Starts sending messages to a client."""
+        sender = _ClientSender(
+            client,
+            self._client_name(client),
+            self._log_queue_size,
+            self.remove_client
+        )
+        with self._lock:
+            old_sender = self._senders.get(client)
+            self._senders[client] = sender
+        if old_sender is not None:
+            old_sender.kill()
+        sender.start()
+
+    def remove_client(self, client):
+        """Stops sending messages to a client."""
+        with self._lock:
+            sender = self._senders.pop(client, None)
+        if sender is not None:
+            sender.kill()
+
+    def has_client(self, client):
+        """Returns True if the client is connected."""
+        return client in self._senders
+
+    def broadcast_log(self, message):
+        """Queues a log message for every client."""
+        payload = json.dumps({'type': 'log', 'message': message})
+        with self._lock:
+            senders = list(self._senders.values())
+        for sender in senders:
+            sender.queue_log(payload)
+
+    def send_telemetry(self, client, values, full):
+        """Queues telemetry fields for a client. If the client still has
+        unsent telemetry, the fields are merged into it.
+        """
+        sender = self._senders.get(client)
+        if sender is not None:
+            sender.queue_telemetry(values, full)
+
+    def dropped(self, client):
+        """Returns the number of (log, telemetry) frames dropped for a
+        client.
+        """
+        sender = self._senders[client]
+        return (sender.dropped_logs, sender.dropped_telemetry)
+
+    def pending(self):
+        """Returns the number of frames waiting to be sent."""
+        with self._lock:
+            senders = list(self._senders.values())
+        return sum(sender.pending() for sender in senders)
+
+    def clients(self):
+        """Returns the dropped and pending frames of each connected client,
+        keyed by client address. Clients are removed when they disconnect.
+        """
+        with self._lock:
+            senders = list(self._senders.values())
+        return {
+            sender.client_name: {
+                'dropped_logs': sender.dropped_logs,
+                'dropped_telemetry': sender.dropped_telemetry,
+                'pending': sender.pending(),
+            }
+            for sender in senders
+        }
+
+    def kill(self):
+        """Stops all of the sender threads."""
+        with self._lock:
+            senders = list(self._senders.values())
+            self._senders.clear()
+        for sender in senders:
+            sender.kill()
+
+    @staticmethod
+    def _client_name(client):
+        """Returns a name for a client to use in metrics."""
+        try:
+            return '{}:{}'.format(*client.peer_address[:2])
+        except Exception:  # pylint: disable=broad-except
+            return str(id(client))
+
+
+BROADCASTER = Broadcaster()
@@ -0,0 +1,175 @@
+"""Caches rendered pages and compressed static assets so that reloading the
+monitor doesn't cost the Pi any disk reads, templating or compression.
+"""
+
+import cherrypy
+from cherrypy.lib import cptools
+from cherrypy.lib import httputil
+from cherrypy.lib import static
+import gzip
+import hashlib
+import io
+import mimetypes
+import os
+import threading
+
+
+def _validate(etag, last_modified_s):
+    """Sets the validation headers and raises a 304 if the client's copy is
+    still current.
+    """
+    headers = cherrypy.response.headers
+    headers['ETag'] = etag
+    headers['Last-Modified'] = httputil.HTTPDate(last_modified_s)
+    cptools.validate_etags()
+    cptools.validate_since()
+
+
+class CachedPage(object):
+    """Renders a template once and serves the result until the template file
+    or any of the watched directories change (a directory's modification time
+    changes when files are added or removed).
+    """
+
+    def __init__(self, file_name, render, watched_directories=None):
+        """Render is a function that takes the template text and returns the
+        page.
+        """
+        self._file_name = file_name
+        self._render = render
+        if watched_directories is None:
+            watched_directories = ()
+        self._watched_directories = tuple(watched_directories)
+        self._lock = threading.Lock()
+        self._signature = None
+        self._page = None
+        self._etag = None
+        self._last_modified_s = None
+
+    def _current_signature(self):
+        """Returns the modification times of all of the watched files."""
+        return tuple(
+            os.stat(path).st_mtime
+            for path in (self._file_name,) + self._watched_directories
+        )
+
+    def get(self):
+        """Returns the rendered page as bytes, its ETag and when it was last
+        modified.
+        """
+        signature = self._current_signature()
+        with self._lock:
+            if signature != self._signature:
+                with open(self._file_name, 'rb') as file_:
+                    template = file_.read().decode('utf-8')
+                self._page = self._render(template).encode('utf-8')
+                self._etag = '"{}"'.format(
+                    hashlib.md5(self._page).hexdigest()
+                )
+                self._last_modified_s = max(signature)
+                self._signature = signature
+            return self._page, self._etag, self._last_modified_s
+
+    def serve(self):
+        """Serves the page from a CherryPy handler."""
+        page, etag, last_modified_s = self.get()
+        cherrypy.response.headers['Content-Type'] = 'text/html;charset=utf-8'
+        # Browsers need to check back, but usually get a 304
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+        _validate(etag, last_modified_s)
+        return page
+
+
+class StaticAssets(object):
+    """Serves static files with long cache lifetimes. Text files are served
+    gzipped to clients that support it; the compressed version is made once
+    and kept in memory, or read from a precompressed .gz file next to the
+    original if there is one.
+    """
+    MAX_AGE_S = 7 * 24 * 60 * 60
+    COMPRESSIBLE_EXTENSIONS = {
+        '.css', '.eot', '.html', '.js', '.json', '.map', '.svg', '.ttf',
+        '.txt',
+    }
+
+    def __init__(self, directory):
+        self._directory = os.path.abspath(directory)
+        self._lock = threading.Lock()
+        # Path -> (mtime, compressed bytes)
+        self._compressed = {}
+
+    @cherrypy.expose
+    def default(self, *path_parts):
+        """Serves a file."""
+        file_name = self.resolve(path_parts)
+        if file_name is None:
+            raise cherrypy.NotFound()
+
+        headers = cherrypy.response.headers
+        headers['Cache-Control'] = 'public, max-age={}'.format(self.MAX_AGE_S)
+        headers['Vary'] = 'Accept-Encoding'
+
+        extension = os.path.splitext(file_name)[1].lower()
+        if (
+                extension in self.COMPRESSIBLE_EXTENSIONS
+                and self._accepts_gzip()
+        ):
+            mtime, compressed = self.compressed(file_name)
+            content_type = mimetypes.guess_type(file_name)[0]
+            if content_type is not None:
+                headers['Content-Type'] = content_type
+            headers['Content-Encoding'] = 'gzip'
+            _validate('"{}-gz"'.format(int(mtime * 1000)), mtime)
+            return compressed
+
+        return static.serve_file(file_name)
+
+    def resolve(self, path_parts):
+        """Returns the absolute file name for a request path, or None if it
+        doesn't exist or is outside of the static directory.
+        """
+        file_name = os.path.abspath(
+            os.path.join(self._directory, *path_parts)
+        )
+        if not file_name.startswith(self._directory + os.sep):
+            return None
+        if not os.path.isfile(file_name):
+            return None
+        return file_name
+
+    def compressed(self, file_name):
+        """Returns the modification time and gzipped contents of a file."""
+        mtime = os.stat(file_name).st_mtime
+        cached = self._compressed.get(file_name)
+        if cached is not None and cached[0] == mtime:
+            return cached
+
+        precompressed = file_name + '.gz'
+        if (
+                os.path.isfile(precompressed)
+                and os.stat(precompressed).st_mtime >= mtime
+        ):
+            with open(precompressed, 'rb') as file_:
+                data = file_.read()
+        else:
+            with open(file_name, 'rb') as file_:
+                data = self._gzip(file_.read())
+        with self._lock:
+            self._compressed[file_name] = (mtime, data)
+        return mtime, data
+
+    @staticmethod
+    def _gzip(data):
+        """Compresses data. The timestamp is left out of the header so that
+        the output only depends on the contents.
+        """
+        buffer_ = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer_, mode='wb', mtime=0) as file_:
+            file_.write(data)
+        return buffer_.getvalue()
+
+    @staticmethod
+    def _accepts_gzip():
+        """Returns True if the client accepts gzip encoded responses."""
+        accept = cherrypy.request.headers.get('Accept-Encoding', '')
+        return 'gzip' in accept
@@ -0,0 +1,163 @@
+"""Low overhead sampling profiler that periodically records the stacks of all
+running threads. The results are stored as collapsed stacks (the format used by
+Brendan Gregg's flamegraph.pl) and can also be returned as a tree for
+rendering flame graphs in the browser.
+"""
+
+import collections
+import os
+import re
+import sys
+import threading
+import time
+
+
+class SamplingProfiler(threading.Thread):
+    """Samples the stacks of all named threads."""
+    DEFAULT_INTERVAL_S = 0.01
+    # Don't let the profiler use more than this fraction of a core. If taking
+    # a sample takes longer than this, the sampling interval is stretched.
+    MAX_OVERHEAD = 0.02
+    MAX_DEPTH = 64
+
+    def __init__(self, interval_s=None, max_overhead=None):
+        super(SamplingProfiler, self).__init__()
+        self.name = self.__class__.__name__
+        # Never keep the process alive just to profile it
+        self.daemon = True
+
+        if interval_s is None:
+            self._interval_s = self.DEFAULT_INTERVAL_S
+        else:
+            self._interval_s = interval_s
+        if max_overhead is None:
+            self._max_overhead = self.MAX_OVERHEAD
+        else:
+            self._max_overhead = max_overhead
+
+        self._run = True
+        self._lock = threading.Lock()
+        self._stacks = collections.Counter()
+        # Formatting frame names is the most expensive part of taking a
+        # sample, so cache them per code object
+        self._frame_names = {}
+        self._samples = 0
+        self._sampling_time_s = 0.0
+        self._start_time_s = None
+        self._stop_time_s = None
+
+    def run(self):
+        """Runs in a thread, periodically samples the other threads."""
+        self._start_time_s = time.time()
+        own_ident = threading.current_thread().ident
+        while self._run:
+            start = time.time()
+            self._sample(own_ident)
+            cost_s = time.time() - start
+            self._sampling_time_s += cost_s
+            time.sleep(max(self._interval_s, cost_s / self._max_overhead))
+        self._stop_time_s = time.time()
+
+    def kill(self):
+        """Stops sampling. Collected samples are kept."""
+        self._run = False
+
+    def _sample(self, own_ident):
+        """Records the current stack of every thread."""
+        thread_names = {
+            thread.ident: self._normalize_thread_name(thread.name)
+            for thread in threading.enumerate()
+        }
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        stacks = []
+        for ident, frame in frames.items():
+            if ident == own_ident:
+                continue
+            names = []
+            while frame is not None and len(names) < self.MAX_DEPTH:
+                names.append(self._frame_name(frame.f_code))
+                frame = frame.f_back
+            names.append(thread_names.get(ident, 'unknown'))
+            names.reverse()
+            stacks.append(';'.join(names))
+
+        with self._lock:
+            self._samples += 1
+            for stack in stacks:
+                self._stacks[stack] += 1
+
+    def _frame_name(self, code):
+        """Returns the display name for a code object."""
+        name = self._frame_names.get(code)
+        if name is None:
+            name = '{function} ({file}:{line})'.format(
+                function=code.co_name,
+                file=os.path.basename(code.co_filename),
+                line=code.co_firstlineno
+            )
+            self._frame_names[code] = name
+        return name
+
+    @staticmethod
+    def _normalize_thread_name(name):
+        """Merges numbered threads, e.g. from the CherryPy thread pool."""
+        return re.sub(r'[-\s]?\d+$', '', name).replace(';', ':')
+
+    def collapsed(self):
+        """Returns the samples as collapsed stacks, one stack per line,
+        suitable for flamegraph.pl.
+        """
+        with self._lock:
+            items = sorted(self._stacks.items())
+        return '\n'.join(
+            '{stack} {count}'.format(stack=stack, count=count)
+            for stack, count in items
+        )
+
+    def flame_graph(self):
+        """Returns the samples as a nested tree of
+        {'name': ..., 'value': ..., 'children': [...]} dictionaries, which is
+        the format used by d3-flame-graph.
+        """
+        with self._lock:
+            items = list(self._stacks.items())
+
+        def new_node(name):
+            """Returns a new tree node."""
+            return {'name': name, 'value': 0, 'children': {}}
+
+        root = new_node('all')
+        for stack, count in items:
+            node = root
+            node['value'] += count
+            for name in stack.split(';'):
+                if name not in node['children']:
+                    node['children'][name] = new_node(name)
+                node = node['children'][name]
+                node['value'] += count
+
+        def to_lists(node):
+            """Converts the children dictionaries into lists."""
+            node['children'] = [
+                to_lists(child) for child in node['children'].values()
+            ]
+            return node
+
+        return to_lists(root)
+
+    def stats(self):
+        """Returns statistics about the profiler itself."""
+        if self._start_time_s is None:
+            elapsed_s = 0.0
+        elif self._stop_time_s is None:
+            elapsed_s = time.time() - self._start_time_s
+        else:
+            elapsed_s = self._stop_time_s - self._start_time_s
+        return {
+            'running': self.is_alive() and self._run,
+            'samples': self._samples,
+            'elapsed_s': elapsed_s,
+            'overhead': (
+                self._sampling_time_s / elapsed_s if elapsed_s > 0.0 else 0.0
+            ),
+        }
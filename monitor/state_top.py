@@ -0,0 +1,115 @@
+"""Shows the state of a running car, like top.
+
+Attaches to the shared memory that the control process writes its latest
+state to, and redraws it every interval. Run it on the car, e.g. over ssh:
+    python -m monitor.state_top [--interval 0.5] [--once]
+"""
+
+import argparse
+import sys
+import time
+
+from messaging.shared_state import DEFAULT_NAME
+from messaging.shared_state import age_s
+from messaging.shared_state import attach
+
+CLEAR_SCREEN = '\x1b[H\x1b[2J'
+
+
+def format_value(value):
+    """Formats a field value."""
+    if value is None:
+        return '-'
+    return '{:.6g}'.format(value)
+
+
+def render(state, previous_sequences, interval_s, now=None):
+    """Returns the state as text, and the sequence numbers for the next
+    call. The update rate of each section is worked out from how much its
+    sequence number went up since the previous call.
+    """
+    if now is None:
+        now = time.time()
+    lines = []
+    sequences = {}
+    for section in state.sections:
+        values = state.read(section)
+        sequences[section] = state.sequence(section)
+        age = age_s(values, now)
+        if section in previous_sequences:
+            writes = (sequences[section] - previous_sequences[section]) // 2
+            rate = '{:.1f}/s'.format(writes / interval_s)
+        else:
+            rate = '-'
+        lines.append(
+            '{:10} age {:>9}  rate {:>8}'.format(
+                section,
+                '-' if age is None else '{:.3f}s'.format(age),
+                rate
+            )
+        )
+        if values is None:
+            lines.append('  (being written)')
+            continue
+        for field in state.fields(section):
+            if field == 'timestamp_s':
+                continue
+            lines.append(
+                '  {:16} {:>14}'.format(field, format_value(values[field]))
+            )
+    return '\n'.join(lines), sequences
+
+
+def main():
+    """Parses the arguments and shows the state until interrupted."""
+    parser = argparse.ArgumentParser(
+        description='Shows the state of a running car.'
+    )
+    parser.add_argument(
+        '--name',
+        dest='name',
+        help='The shared memory block to read.',
+        default=DEFAULT_NAME
+    )
+    parser.add_argument(
+        '-i',
+        '--interval',
+        dest='interval_s',
+        help='Seconds between updates.',
+        default=1.0,
+        type=float
+    )
+    parser.add_argument(
+        '--once',
+        dest='once',
+        help='Print the state once and quit.',
+        action='store_true'
+    )
+    args = parser.parse_args()
+
+    state = attach(args.name, timeout_s=0.0)
+    if state is None:
+        print('No car state named {}, is the car running?'.format(args.name))
+        if args.once:
+            sys.exit(1)
+        print('Waiting for it to start')
+        state = attach(args.name)
+
+    sequences = {}
+    try:
+        while True:
+            text, sequences = render(state, sequences, args.interval_s)
+            if args.once:
+                print(text)
+                break
+            sys.stdout.write(CLEAR_SCREEN + text + '\n')
+            sys.stdout.flush()
+            time.sleep(args.interval_s)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        state.close()
+
+
+if __name__ == '__main__':
+    main()
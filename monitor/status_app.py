@@ -1,12 +1,17 @@
 """Status page for the vehicle."""
 
 import cherrypy
+import json
 import netifaces
 import os
 import signal
 import subprocess
-import sys
 
+from messaging import metrics
+from monitor.broadcaster import BROADCASTER
+from monitor.page_cache import CachedPage
+from monitor.page_cache import StaticAssets
+from monitor.sampling_profiler import SamplingProfiler
 from monitor.web_socket_handler import WebSocketHandler
 from messaging.async_logger import AsyncLogger
 from messaging.async_producers import CommandProducer
@@ -20,12 +25,14 @@ MONITOR_DIR = 'monitor' + os.sep
 class StatusApp(object):
     """Status page for the vehicle."""
 
-    def __init__(self, telemetry, waypoint_generator, port):
+    def __init__(self, telemetry, waypoint_generator, port, control_pid=None):
         self._command = CommandProducer()
+        self._control_pid = os.getpid() if control_pid is None else control_pid
         self._telemetry = telemetry
         self._logger = AsyncLogger()
         self._port = port
         self._waypoint_generator = waypoint_generator
+        self._profiler = None
 
         def get_ip(interface):
             """Returns the IPv4 address of a given interface."""
@@ -72,6 +79,13 @@ class StatusApp(object):
             self._logger.error('No valid host found, listening on loopback')
             self._host_ip = get_ip('lo')
 
+        self._index_page = CachedPage(
+            MONITOR_DIR + 'index.html',
+            self._render_index,
+            ('paths',)
+        )
+        self.static = StaticAssets(STATIC_DIR)
+
     @staticmethod
     def get_config(monitor_root_dir):
         """Returns the required CherryPy configuration for this application."""
@@ -80,10 +94,6 @@ class StatusApp(object):
                 'tools.sessions.on': True,
                 'tools.staticdir.root': monitor_root_dir + '/monitor/',
             },
-            '/static': {
-                'tools.staticdir.on': True,
-                'tools.staticdir.dir': '..' + os.sep + STATIC_DIR
-            },
             '/ws': {
                 'tools.websocket.on': True,
                 'tools.websocket.handler_cls': WebSocketHandler
@@ -91,18 +101,14 @@ class StatusApp(object):
         }
 
     @cherrypy.expose
-    def index(self):  # pylint: disable=no-self-use
+    def index(self):
         """Index page."""
+        return self._index_page.serve()
+
+    def _render_index(self, index_page):
+        """Fills in the index page template."""
         # This is the worst templating ever, but I don't feel like it's worth
         # installing a full engine just for this one substitution
-        index_page = None
-        index_file_name = MONITOR_DIR + 'index.html'
-        if sys.version_info.major == 2:
-            with open(index_file_name) as file_:
-                index_page = file_.read().decode('utf-8')
-        else:
-            with open(index_file_name, encoding='utf-8') as file_:
-                index_page = file_.read()
         return index_page.replace(
             '${webSocketAddress}',
             '{host_ip}:{port}/ws'.format(
@@ -113,7 +119,7 @@ class StatusApp(object):
             '${waypointFileOptions}',
             '\n'.join((
                 '<option value="{file}">{file}</option>'.format(file=i)
-                for i in os.listdir('paths')
+                for i in sorted(os.listdir('paths'))
                 if i.endswith('kml') or i.endswith('kmz')
             ))
         )
@@ -193,9 +199,75 @@ class StatusApp(object):
         """Shuts down the Pi."""
         self._command.stop()
         subprocess.Popen(('bash', '-c', 'sleep 10 && sudo shutdown -h now'))
-        os.kill(os.getpid(), signal.SIGINT)
+        os.kill(self._control_pid, signal.SIGINT)
         return {'success': True}
 
+    @cherrypy.expose
+    def metrics(self):  # pylint: disable=no-self-use
+        """Returns the runtime metrics in the Prometheus text format."""
+        cherrypy.response.headers['Content-Type'] = \
+            'text/plain; version=0.0.4'
+        return metrics.REGISTRY.to_prometheus().encode('utf-8')
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def metrics_json(self):  # pylint: disable=no-self-use
+        """Returns the runtime metrics as JSON."""
+        return metrics.REGISTRY.to_json()
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def websocket_clients(self):  # pylint: disable=no-self-use
+        """Returns the dropped and pending frames of each websocket client."""
+        return BROADCASTER.clients()
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def start_profiler(self, interval_ms=None):
+        """Starts the sampling profiler. Any previous samples are discarded."""
+        self._check_post()
+        if self._profiler is not None and self._profiler.is_alive():
+            return {'success': False, 'message': 'Profiler is already running'}
+        try:
+            interval_s = None
+            if interval_ms is not None:
+                interval_s = float(interval_ms) / 1000.0
+        except ValueError:
+            return {'success': False, 'message': 'Bad interval'}
+        self._profiler = SamplingProfiler(interval_s)
+        self._profiler.start()
+        self._logger.info('Started profiler from web')
+        return {'success': True}
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def stop_profiler(self):
+        """Stops the sampling profiler. The samples are kept until the
+        profiler is started again.
+        """
+        self._check_post()
+        if self._profiler is None:
+            return {'success': False, 'message': 'Profiler was never started'}
+        self._profiler.kill()
+        self._logger.info('Stopped profiler from web')
+        return {'success': True, 'stats': self._profiler.stats()}
+
+    @cherrypy.expose
+    def profile(self, output=None):
+        """Returns the profiler samples, either as collapsed stacks (the
+        default) or as flame graph JSON if output is 'json'.
+        """
+        if self._profiler is None:
+            raise cherrypy.HTTPError(404, 'Profiler was never started')
+        if output == 'json':
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            return json.dumps({
+                'stats': self._profiler.stats(),
+                'flame_graph': self._profiler.flame_graph(),
+            }).encode('utf-8')
+        cherrypy.response.headers['Content-Type'] = 'text/plain'
+        return self._profiler.collapsed().encode('utf-8')
+
     @cherrypy.expose
     def ws(self):  # pylint: disable=invalid-name
         """Dummy method to tell CherryPy to expose the web socket end point."""
@@ -0,0 +1,139 @@
+"""Streams telemetry to websocket clients. Each client picks its own update
+rate, and only the fields that changed since the last frame sent to that
+client are included. Frames are handed to a Broadcaster, which coalesces them
+if the client hasn't received the previous one yet, so a slow client gets
+fewer frames instead of a growing backlog of stale ones.
+"""
+
+import threading
+import time
+
+from monitor.broadcaster import BROADCASTER
+
+
+class _ClientState(object):  # pylint: disable=too-few-public-methods
+    """Streaming state for a single client."""
+
+    def __init__(self, interval_s):
+        self.interval_s = interval_s
+        self.next_send_s = 0.0
+        self.next_key_frame_s = 0.0
+        self.sent = {}
+
+
+class TelemetryStream(object):
+    """Sends delta encoded telemetry frames to websocket clients."""
+    DEFAULT_RATE_HZ = 10.0
+    # There's no point in sending updates faster than the control loop
+    MAX_RATE_HZ = 50.0
+    MIN_RATE_HZ = 0.1
+    # Send every field every so often in case a client missed something
+    KEY_FRAME_S = 5.0
+    # The monitor only displays 3 decimal places, and rounding means that
+    # noise in the last digits doesn't count as a change
+    PRECISION = 3
+
+    def __init__(self, sender):
+        """Sender should have a send_telemetry(client, values, full) method,
+        e.g. a Broadcaster.
+        """
+        self._sender = sender
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def add_client(self, client, rate_hz=None):
+        """Starts streaming to a client."""
+        with self._lock:
+            self._clients[client] = _ClientState(
+                1.0 / self._clamp_rate(rate_hz)
+            )
+
+    def remove_client(self, client):
+        """Stops streaming to a client."""
+        with self._lock:
+            self._clients.pop(client, None)
+
+    def set_rate(self, client, rate_hz):
+        """Sets the update rate for a client. Returns the rate that will
+        actually be used.
+        """
+        rate_hz = self._clamp_rate(rate_hz)
+        with self._lock:
+            state = self._clients.get(client)
+            if state is None:
+                raise ValueError('Unknown client')
+            state.interval_s = 1.0 / rate_hz
+            state.next_send_s = 0.0
+        return rate_hz
+
+    def interval_s(self):
+        """Returns the shortest update interval of all the clients, or None if
+        there are no clients.
+        """
+        with self._lock:
+            if not self._clients:
+                return None
+            return min(state.interval_s for state in self._clients.values())
+
+    def client_count(self):
+        """Returns the number of connected clients."""
+        return len(self._clients)
+
+    def broadcast(self, data, now=None):
+        """Queues a frame for every client that is due for an update. Returns
+        the number of frames queued.
+        """
+        if now is None:
+            now = time.time()
+        values = self._quantize(data)
+        with self._lock:
+            clients = list(self._clients.items())
+
+        sent_count = 0
+        for client, state in clients:
+            # Allow some slack, otherwise a little jitter in when we're called
+            # would make clients skip every other frame
+            if now < state.next_send_s - 0.1 * state.interval_s:
+                continue
+
+            key_frame = now >= state.next_key_frame_s
+            if key_frame:
+                changed = values
+                state.next_key_frame_s = now + self.KEY_FRAME_S
+            else:
+                changed = {
+                    key: value for key, value in values.items()
+                    if key not in state.sent or state.sent[key] != value
+                }
+            if not changed:
+                state.next_send_s = now + state.interval_s
+                continue
+
+            self._sender.send_telemetry(client, changed, key_frame)
+            state.sent.update(changed)
+            state.next_send_s = now + state.interval_s
+            sent_count += 1
+        return sent_count
+
+    def _clamp_rate(self, rate_hz):
+        """Clamps a rate to the allowed range."""
+        if rate_hz is None:
+            return self.DEFAULT_RATE_HZ
+        rate_hz = float(rate_hz)
+        if rate_hz != rate_hz:  # NaN
+            return self.DEFAULT_RATE_HZ
+        return min(max(rate_hz, self.MIN_RATE_HZ), self.MAX_RATE_HZ)
+
+    @classmethod
+    def _quantize(cls, data):
+        """Rounds float values to the display precision."""
+        return {
+            key: (
+                round(value, cls.PRECISION) if isinstance(value, float)
+                else value
+            )
+            for key, value in data.items()
+        }
+
+
+TELEMETRY_STREAM = TelemetryStream(BROADCASTER)
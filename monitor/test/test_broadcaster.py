@@ -0,0 +1,166 @@
+"""Tests the websocket broadcaster."""
+
+import json
+import threading
+import time
+import unittest
+
+from messaging import metrics
+from monitor.broadcaster import Broadcaster
+
+
+class DummyClient(object):
+    """Records sent frames, optionally blocking until released."""
+    port = 1000
+
+    def __init__(self, blocked=False, fail=False):
+        self.frames = []
+        # Give each client a unique address, like real ones
+        DummyClient.port += 1
+        self.peer_address = ('10.0.0.1', DummyClient.port)
+        self._fail = fail
+        self._released = threading.Event()
+        if not blocked:
+            self._released.set()
+
+    def release(self):
+        """Lets sends through."""
+        self._released.set()
+
+    def send(self, payload):
+        """Records the frame."""
+        self._released.wait()
+        if self._fail:
+            raise IOError('Connection closed')
+        self.frames.append(json.loads(payload))
+
+
+def wait_for(condition, timeout_s=2.0):
+    """Waits for a condition to become true."""
+    end = time.time() + timeout_s
+    while not condition() and time.time() < end:
+        time.sleep(0.005)
+    return condition()
+
+
+class TestBroadcaster(unittest.TestCase):
+    """Tests the websocket broadcaster."""
+
+    def setUp(self):
+        self.broadcaster = Broadcaster(log_queue_size=3)
+
+    def tearDown(self):
+        self.broadcaster.kill()
+
+    def test_send(self):
+        """Messages should be delivered to every client."""
+        clients = [DummyClient(), DummyClient()]
+        for client in clients:
+            self.broadcaster.add_client(client)
+        self.broadcaster.broadcast_log('hello')
+        self.broadcaster.send_telemetry(clients[0], {'x_m': 1.0}, True)
+        self.assertTrue(wait_for(lambda: len(clients[0].frames) == 2))
+        self.assertTrue(wait_for(lambda: len(clients[1].frames) == 1))
+        # Telemetry goes first
+        self.assertEqual(clients[0].frames[0]['type'], 'telemetry')
+        self.assertEqual(clients[0].frames[0]['message'], {'x_m': 1.0})
+        self.assertEqual(clients[0].frames[1]['message'], 'hello')
+
+    def test_slow_client(self):
+        """A slow client shouldn't block producers or other clients, and
+        should have its frames dropped.
+        """
+        slow = DummyClient(blocked=True)
+        fast = DummyClient()
+        self.broadcaster.add_client(slow)
+        self.broadcaster.add_client(fast)
+
+        # The first frame gets stuck sending to the slow client
+        self.broadcaster.broadcast_log('stuck')
+        self.assertTrue(wait_for(lambda: len(fast.frames) == 1))
+
+        start = time.time()
+        for index in range(10):
+            self.broadcaster.broadcast_log(str(index))
+            self.broadcaster.send_telemetry(slow, {'tick': index}, False)
+        self.broadcaster.send_telemetry(slow, {'other': 1}, False)
+        # Queueing never waits on the clients
+        self.assertLess(time.time() - start, 0.5)
+
+        # The other client isn't held up
+        self.assertTrue(
+            wait_for(lambda: fast.frames and fast.frames[-1]['message'] == '9')
+        )
+        self.assertEqual(self.broadcaster.dropped(slow), (7, 10))
+        clients = self.broadcaster.clients()
+        slow_name = '10.0.0.1:{}'.format(slow.peer_address[1])
+        self.assertEqual(clients[slow_name]['dropped_logs'], 7)
+        self.assertEqual(clients[slow_name]['dropped_telemetry'], 10)
+        self.assertEqual(clients[slow_name]['pending'], 4)
+
+        slow.release()
+        self.assertTrue(wait_for(lambda: len(slow.frames) == 5))
+        # Telemetry is coalesced into one frame with the newest values
+        self.assertEqual(slow.frames[1]['type'], 'telemetry')
+        self.assertEqual(slow.frames[1]['message'], {'tick': 9, 'other': 1})
+        # Only the newest logs are kept
+        self.assertEqual(
+            [frame['message'] for frame in slow.frames[2:]],
+            ['7', '8', '9']
+        )
+        self.assertTrue(wait_for(lambda: self.broadcaster.pending() == 0))
+
+    def test_failed_client(self):
+        """Clients that fail should be removed."""
+        client = DummyClient(fail=True)
+        self.broadcaster.add_client(client)
+        self.broadcaster.broadcast_log('hello')
+        self.assertTrue(
+            wait_for(lambda: not self.broadcaster.has_client(client))
+        )
+        # Sending to removed clients is ignored
+        self.broadcaster.send_telemetry(client, {'x_m': 1.0}, False)
+
+    def test_metrics(self):
+        """Clients coming and going shouldn't add metrics, and frames that
+        won't be sent shouldn't stay queued.
+        """
+        queued = metrics.gauge('websocket_queued_frames')
+        before = queued.value()
+        client = DummyClient(blocked=True)
+        self.broadcaster.add_client(client)
+        self.broadcaster.broadcast_log('stuck')
+        self.broadcaster.broadcast_log('queued')
+        self.assertTrue(wait_for(lambda: queued.value() == before + 1))
+        series = len(metrics.REGISTRY.to_json()['websocket_queued_frames'])
+
+        for _ in range(5):
+            other = DummyClient()
+            self.broadcaster.add_client(other)
+            self.broadcaster.broadcast_log('hello')
+            self.assertTrue(wait_for(lambda: len(other.frames) == 1))
+            self.broadcaster.remove_client(other)
+        # Only the connected client is reported
+        self.assertEqual(
+            list(self.broadcaster.clients()),
+            ['10.0.0.1:{}'.format(client.peer_address[1])]
+        )
+        self.assertEqual(
+            len(metrics.REGISTRY.to_json()['websocket_queued_frames']),
+            series
+        )
+        self.assertTrue(
+            all(
+                set(labels['labels']) == {'type'}
+                for labels
+                in metrics.REGISTRY.to_json()['websocket_dropped_frames_total']
+            )
+        )
+
+        self.broadcaster.remove_client(client)
+        client.release()
+        self.assertTrue(wait_for(lambda: queued.value() == before))
+
+
+if __name__ == '__main__':
+    unittest.main()
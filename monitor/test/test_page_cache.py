@@ -0,0 +1,120 @@
+"""Tests the page and static asset caches."""
+
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from monitor.page_cache import CachedPage
+from monitor.page_cache import StaticAssets
+
+
+class TestCachedPage(unittest.TestCase):
+    """Tests the cached page."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = os.path.join(self.directory, 'paths')
+        os.mkdir(self.paths)
+        self.file_name = os.path.join(self.directory, 'index.html')
+        with open(self.file_name, 'w') as file_:
+            file_.write('${files}')
+        self.renders = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def render(self, template):
+        """Lists the files in the paths directory."""
+        self.renders += 1
+        return template.replace(
+            '${files}',
+            ','.join(sorted(os.listdir(self.paths)))
+        )
+
+    @staticmethod
+    def touch(path, mtime):
+        """Sets the modification time of a file."""
+        os.utime(path, (mtime, mtime))
+
+    def test_cache(self):
+        """Pages should only be rendered when something changes."""
+        self.touch(self.file_name, 1000)
+        self.touch(self.paths, 1000)
+        page = CachedPage(self.file_name, self.render, (self.paths,))
+        body, etag, last_modified_s = page.get()
+        self.assertEqual(body, b'')
+        self.assertEqual(last_modified_s, 1000)
+        for _ in range(5):
+            self.assertEqual(page.get(), (body, etag, last_modified_s))
+        self.assertEqual(self.renders, 1)
+
+        # Adding a file changes the directory
+        open(os.path.join(self.paths, 'course.kml'), 'w').close()
+        self.touch(self.paths, 2000)
+        body, new_etag, last_modified_s = page.get()
+        self.assertEqual(body, b'course.kml')
+        self.assertNotEqual(etag, new_etag)
+        self.assertEqual(last_modified_s, 2000)
+        self.assertEqual(self.renders, 2)
+
+        # So does editing the template
+        with open(self.file_name, 'w') as file_:
+            file_.write('<p>${files}</p>')
+        self.touch(self.file_name, 3000)
+        self.assertEqual(page.get()[0], b'<p>course.kml</p>')
+        self.assertEqual(self.renders, 3)
+
+
+class TestStaticAssets(unittest.TestCase):
+    """Tests the static asset handler."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.static = os.path.join(self.directory, 'static')
+        os.mkdir(self.static)
+        self.file_name = os.path.join(self.static, 'status.js')
+        with open(self.file_name, 'w') as file_:
+            file_.write('var x = 1;\n' * 100)
+        self.assets = StaticAssets(self.static)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_resolve(self):
+        """Only files in the static directory should be served."""
+        self.assertEqual(self.assets.resolve(('status.js',)), self.file_name)
+        self.assertIsNone(self.assets.resolve(('missing.js',)))
+        with open(os.path.join(self.directory, 'secret'), 'w') as file_:
+            file_.write('secret')
+        self.assertIsNone(self.assets.resolve(('..', 'secret')))
+        self.assertIsNone(self.assets.resolve(('..', 'static', '..')))
+
+    def test_compressed(self):
+        """Files should only be compressed once."""
+        mtime, data = self.assets.compressed(self.file_name)
+        with gzip.GzipFile(fileobj=io.BytesIO(data)) as file_:
+            self.assertEqual(file_.read(), b'var x = 1;\n' * 100)
+        self.assertLess(len(data), 100)
+        self.assertIs(self.assets.compressed(self.file_name)[1], data)
+
+        # Precompressed files are used if they're up to date
+        with open(self.file_name + '.gz', 'wb') as file_:
+            file_.write(b'precompressed')
+        self.touch(self.file_name + '.gz', mtime + 20)
+        self.touch(self.file_name, mtime + 10)
+        self.assertEqual(
+            self.assets.compressed(self.file_name),
+            (mtime + 10, b'precompressed')
+        )
+
+    @staticmethod
+    def touch(path, mtime):
+        """Sets the modification time of a file."""
+        os.utime(path, (mtime, mtime))
+
+
+if __name__ == '__main__':
+    unittest.main()
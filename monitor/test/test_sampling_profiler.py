@@ -0,0 +1,78 @@
+"""Tests the sampling profiler."""
+
+import threading
+import time
+import unittest
+
+from monitor.sampling_profiler import SamplingProfiler
+
+
+def busy_wait(event):
+    """Spins until the event is set."""
+    while not event.is_set():
+        sum(range(100))
+
+
+class TestSamplingProfiler(unittest.TestCase):
+    """Tests the sampling profiler."""
+
+    def _profile_busy_thread(self):
+        """Profiles a busy thread for a little while and returns the profiler."""
+        done = threading.Event()
+        busy = threading.Thread(target=busy_wait, args=(done,))
+        busy.name = 'Busy'
+        busy.start()
+
+        profiler = SamplingProfiler(interval_s=0.001, max_overhead=0.5)
+        profiler.start()
+        time.sleep(0.2)
+        profiler.kill()
+        profiler.join()
+        done.set()
+        busy.join()
+        return profiler
+
+    def test_collapsed(self):
+        """Samples should be attributed to the right thread and function."""
+        profiler = self._profile_busy_thread()
+        lines = profiler.collapsed().split('\n')
+        busy_lines = [line for line in lines if line.startswith('Busy;')]
+        self.assertGreater(len(busy_lines), 0)
+        self.assertTrue(any('busy_wait' in line for line in busy_lines))
+        # The profiler shouldn't sample itself
+        self.assertFalse(
+            any(line.startswith('SamplingProfiler;') for line in lines)
+        )
+        for line in lines:
+            self.assertGreater(int(line.rsplit(' ', 1)[1]), 0)
+
+    def test_flame_graph(self):
+        """The tree values should add up to the number of samples."""
+        profiler = self._profile_busy_thread()
+        tree = profiler.flame_graph()
+        self.assertEqual(tree['name'], 'all')
+        self.assertEqual(
+            tree['value'],
+            sum(child['value'] for child in tree['children'])
+        )
+        self.assertIn('Busy', [child['name'] for child in tree['children']])
+
+        stats = profiler.stats()
+        self.assertFalse(stats['running'])
+        self.assertGreater(stats['samples'], 0)
+        self.assertLess(stats['overhead'], 1.0)
+
+    def test_normalize_thread_name(self):
+        """Thread pool threads should be merged."""
+        normalize = SamplingProfiler._normalize_thread_name  # pylint: disable=protected-access
+        self.assertEqual(normalize('CP Server Thread-12'), 'CP Server Thread')
+        self.assertEqual(normalize('Thread-3'), 'Thread')
+        self.assertEqual(normalize('Command'), 'Command')
+        self.assertEqual(
+            normalize('Telemetry:consume_messages:telemetry'),
+            'Telemetry:consume_messages:telemetry'
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
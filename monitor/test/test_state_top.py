@@ -0,0 +1,43 @@
+"""Tests the state viewer."""
+
+import os
+import unittest
+
+from messaging.shared_state import SharedState
+from monitor.state_top import render
+
+
+class TestStateTop(unittest.TestCase):
+    """Tests the state viewer."""
+
+    def setUp(self):
+        self.state = SharedState(
+            'test-state-top-{}'.format(os.getpid()),
+            create=True
+        )
+
+    def tearDown(self):
+        self.state.close()
+
+    def test_render(self):
+        """Every section should be shown with its age and update rate."""
+        text, sequences = render(self.state, {}, 1.0)
+        self.assertIn('estimate', text)
+        self.assertIn('compass_d', text)
+        self.assertNotIn('timestamp_s', text)
+
+        self.state.write('drive', {'timestamp_s': 100.0, 'throttle': 0.25})
+        self.state.write('drive', {'timestamp_s': 100.0, 'throttle': 0.5})
+        text, _ = render(self.state, sequences, 0.5, now=101.5)
+        lines = text.split('\n')
+        drive = lines.index(
+            [line for line in lines if line.startswith('drive')][0]
+        )
+        self.assertEqual(lines[drive].split()[2], '1.500s')
+        self.assertEqual(lines[drive].split()[4], '4.0/s')
+        self.assertEqual(lines[drive + 1].split(), ['throttle', '0.5'])
+        self.assertEqual(lines[drive + 2].split(), ['steering', '-'])
+
+
+if __name__ == '__main__':
+    unittest.main()
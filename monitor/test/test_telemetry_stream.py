@@ -0,0 +1,101 @@
+"""Tests the telemetry stream."""
+
+import unittest
+
+from monitor.telemetry_stream import TelemetryStream
+
+
+class DummyClient(object):  # pylint: disable=too-few-public-methods
+    """Records sent frames."""
+
+    def __init__(self):
+        self.frames = []
+
+
+class DummySender(object):  # pylint: disable=too-few-public-methods
+    """Sends frames directly to the client."""
+
+    @staticmethod
+    def send_telemetry(client, values, full):
+        """Records the frame."""
+        client.frames.append({
+            'type': 'telemetry',
+            'full': full,
+            'message': dict(values),
+        })
+
+
+class TestTelemetryStream(unittest.TestCase):
+    """Tests the telemetry stream."""
+
+    def test_delta(self):
+        """Only changed fields should be sent after the first frame."""
+        stream = TelemetryStream(DummySender())
+        client = DummyClient()
+        stream.add_client(client, 10.0)
+
+        stream.broadcast({'x_m': 1.0, 'y_m': 2.0, 'heading_d': 3.0}, 100.0)
+        self.assertEqual(len(client.frames), 1)
+        self.assertTrue(client.frames[0]['full'])
+        self.assertEqual(
+            client.frames[0]['message'],
+            {'x_m': 1.0, 'y_m': 2.0, 'heading_d': 3.0}
+        )
+        self.assertEqual(client.frames[0]['type'], 'telemetry')
+
+        # Changes below the display precision are ignored
+        stream.broadcast({'x_m': 1.5, 'y_m': 2.0001, 'heading_d': 3.0}, 100.2)
+        self.assertEqual(len(client.frames), 2)
+        self.assertFalse(client.frames[1]['full'])
+        self.assertEqual(client.frames[1]['message'], {'x_m': 1.5})
+
+        # Nothing changed, so nothing is sent
+        stream.broadcast({'x_m': 1.5, 'y_m': 2.0, 'heading_d': 3.0}, 100.4)
+        self.assertEqual(len(client.frames), 2)
+
+        # Key frames include everything
+        stream.broadcast(
+            {'x_m': 1.5, 'y_m': 2.0, 'heading_d': 3.0},
+            100.0 + TelemetryStream.KEY_FRAME_S
+        )
+        self.assertEqual(len(client.frames), 3)
+        self.assertTrue(client.frames[2]['full'])
+        self.assertEqual(len(client.frames[2]['message']), 3)
+
+    def test_rates(self):
+        """Clients should only get frames at their requested rates."""
+        stream = TelemetryStream(DummySender())
+        fast = DummyClient()
+        slow = DummyClient()
+        self.assertIsNone(stream.interval_s())
+        stream.add_client(fast, 16.0)
+        stream.add_client(slow)
+        self.assertEqual(stream.set_rate(slow, 2.0), 2.0)
+        self.assertAlmostEqual(stream.interval_s(), 0.0625)
+
+        for tick in range(16):
+            stream.broadcast({'tick': tick}, 1024.0 + tick * 0.0625)
+        self.assertEqual(len(fast.frames), 16)
+        self.assertEqual(len(slow.frames), 2)
+        # The slow client should get the latest value, not a queued one
+        self.assertEqual(slow.frames[-1]['message'], {'tick': 8})
+
+    def test_clamp_rate(self):
+        """Rates should be limited to the control loop rate."""
+        stream = TelemetryStream(DummySender())
+        client = DummyClient()
+        stream.add_client(client)
+        self.assertEqual(
+            stream.set_rate(client, 1000.0),
+            TelemetryStream.MAX_RATE_HZ
+        )
+        self.assertEqual(
+            stream.set_rate(client, 0.0),
+            TelemetryStream.MIN_RATE_HZ
+        )
+        with self.assertRaises(ValueError):
+            stream.set_rate(DummyClient(), 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+"""Runs the web servers in their own process.
+
+CherryPy's threads, the TLS handshakes and the websocket broadcasts all need
+the GIL, so in the control process they make the control loop late whenever
+a few phones are connected. In this process, they read the car's state from
+the shared memory block that the control process writes to, and send
+commands and telemetry back over the message exchanges, just like before.
+
+Run by main.py with --web-process:
+    python -m monitor.web_process --control-pid <pid>
+"""
+
+import argparse
+import os
+import signal
+import threading
+
+from control.shared_telemetry import SharedTelemetry
+from control.telemetry_dumper import TelemetryDumper
+from messaging import config
+from messaging.async_logger import AsyncLogger
+from messaging.message_dispatcher import get_dispatcher
+from messaging.shared_state import DEFAULT_NAME
+from monitor.broadcaster import BROADCASTER
+from monitor.web_server import CherryPyServer
+from monitor.web_socket_logging_handler import WebSocketLoggingHandler
+
+# How often to check that the control process is still running
+PARENT_CHECK_S = 1.0
+
+
+def run(port, address, state_name, control_pid):
+    """Runs the web servers until the control process quits."""
+    logger = AsyncLogger()
+    telemetry = SharedTelemetry(state_name)
+    # The control process forwards its log lines here for the websockets
+    done = get_dispatcher().register(
+        config.MONITOR_LOGS_EXCHANGE,
+        BROADCASTER.broadcast_log
+    )
+    stop = threading.Event()
+
+    def terminate(signal_number, stack_frame):  # pylint: disable=unused-argument
+        """Stops the servers."""
+        stop.set()
+
+    signal.signal(signal.SIGINT, terminate)
+    signal.signal(signal.SIGTERM, terminate)
+
+    threads = (
+        CherryPyServer(port, address, telemetry, telemetry, control_pid),
+        TelemetryDumper(telemetry, telemetry, WebSocketLoggingHandler()),
+    )
+    for thread in threads:
+        thread.start()
+    logger.info('Started web process {}'.format(os.getpid()))
+
+    while not stop.wait(PARENT_CHECK_S):
+        if (done is not None and done.is_set()) or os.getppid() != control_pid:
+            break
+
+    for thread in threads:
+        thread.kill()
+        thread.join()
+    telemetry.close()
+
+
+def main():
+    """Parses the arguments and runs the web servers."""
+    parser = argparse.ArgumentParser(
+        description='Web servers for the Sparkfun AVC.'
+    )
+    parser.add_argument('--port', dest='port', default=8080, type=int)
+    parser.add_argument('--address', dest='address', default='0.0.0.0')
+    parser.add_argument(
+        '--state',
+        dest='state_name',
+        help='The shared memory block with the state of the car.',
+        default=DEFAULT_NAME
+    )
+    parser.add_argument(
+        '--control-pid',
+        dest='control_pid',
+        help='The control process, which is shut down from the monitor.',
+        default=os.getppid(),
+        type=int
+    )
+    args = parser.parse_args()
+    run(args.port, args.address, args.state_name, args.control_pid)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Runs the web monitor and web telemetry apps."""
+
+import logging
+import os
+import threading
+
+
+class CherryPyServer(threading.Thread):
+    """Runs the various web apps in a thread."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self,
+            port,
+            address,
+            telemetry,
+            waypoint_generator,
+            control_pid=None
+    ):
+        """control_pid is the process that the monitor shuts down; it's this
+        one by default.
+        """
+        super(CherryPyServer, self).__init__()
+        self.name = self.__class__.__name__
+        from ws4py.server.cherrypyserver import WebSocketPlugin
+        from ws4py.server.cherrypyserver import WebSocketTool
+        import cherrypy
+        from control.web_telemetry.status_app import StatusApp as WebTelemetryStatusApp
+        from monitor.status_app import StatusApp as MonitorApp
+
+        # Web monitor
+        config = MonitorApp.get_config(os.path.abspath(os.getcwd()))
+        status_app = cherrypy.tree.mount(
+            MonitorApp(telemetry, waypoint_generator, port, control_pid),
+            '/',
+            config
+        )
+        cherrypy.config.update({
+            'server.socket_host': address,
+            'server.socket_port': port,
+            'server.ssl_module': 'builtin',
+            'server.ssl_certificate': 'control/web_telemetry/cert.pem',
+            'server.ssl_private_key': 'control/web_telemetry/key.pem',
+            'engine.autoreload.on': False,
+        })
+
+        WebSocketPlugin(cherrypy.engine).subscribe()
+        cherrypy.tools.websocket = WebSocketTool()
+
+        # Web telemetry
+        config = WebTelemetryStatusApp.get_config(os.path.abspath(os.getcwd()))
+        web_telemetry_app = cherrypy.tree.mount(
+            WebTelemetryStatusApp(telemetry, port),
+            '/telemetry',
+            config
+        )
+
+        # OMG, shut up CherryPy, nobody cares about your problems
+        for app in (status_app, web_telemetry_app, cherrypy):
+            app.log.access_log.setLevel(logging.ERROR)
+            app.log.error_log.setLevel(logging.ERROR)
+
+    def run(self):
+        """Runs the thread and server in a thread."""
+        import cherrypy
+        cherrypy.engine.start()
+
+    @staticmethod
+    def kill():
+        """Stops the thread and server."""
+        import cherrypy
+        cherrypy.engine.exit()
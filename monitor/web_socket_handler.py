@@ -1,21 +1,39 @@
 """Websocket handler for sending messages to clients."""
 
+import json
 from ws4py.websocket import WebSocket
 
+from monitor.broadcaster import BROADCASTER
+from monitor.telemetry_stream import TELEMETRY_STREAM
+
 
 class WebSocketHandler(WebSocket):  # pylint: disable=no-init
     """Websocket handler for sending messages to clients."""
 
-    def received_message(self, message): # pylint: disable=no-self-use
-        """Handler for receiving a message on the websocket."""
+    def opened(self):
+        """Handler for when a websocket is opened."""
+        BROADCASTER.add_client(self)
+        TELEMETRY_STREAM.add_client(self)
+
+    def received_message(self, message):
+        """Handler for receiving a message on the websocket. Clients can
+        request a telemetry rate by sending {"type": "rate", "hz": 10}.
+        """
+        text = message.data.decode('utf-8')
+        try:
+            data = json.loads(text)
+            if data.get('type') == 'rate':
+                TELEMETRY_STREAM.set_rate(self, data['hz'])
+                return
+        except (AttributeError, KeyError, TypeError, ValueError):
+            pass
         # TODO(2015-01-04) Use a logger instead of a raw print
         print(
             'Warning: Received unexpected message'
-            ' from websocket client: {}'.format(
-                message.data.decode('utf-8')
-            )
+            ' from websocket client: {}'.format(text)
         )
 
     def closed(self, code, reason=None):
         """Handler for when a websocket is closed."""
-        # There's nothing to do here for now
+        TELEMETRY_STREAM.remove_client(self)
+        BROADCASTER.remove_client(self)
@@ -1,8 +1,24 @@
 """Logging handler for websocket clients."""
 
-import cherrypy
-import json
 import logging
+import time
+
+from messaging import config
+from messaging import metrics
+from messaging.message_producer import MessageProducer
+from monitor.broadcaster import BROADCASTER
+from monitor.telemetry_stream import TELEMETRY_STREAM
+
+LOG_BROADCAST_TIME = metrics.histogram(
+    'websocket_broadcast_seconds',
+    'Time spent broadcasting to websocket clients',
+    type='log'
+)
+TELEMETRY_BROADCAST_TIME = metrics.histogram(
+    'websocket_broadcast_seconds',
+    'Time spent broadcasting to websocket clients',
+    type='telemetry'
+)
 
 
 class WebSocketLoggingHandler(logging.Handler):
@@ -14,18 +30,43 @@ class WebSocketLoggingHandler(logging.Handler):
     def emit(self, record):
         """Overridden from Handler; actually emit the log entry."""
         message = self.format(record)
-        cherrypy.engine.publish(
-            'websocket-broadcast',
-            json.dumps({'type': 'log', 'message': message})
-        )
+        start = time.time()
+        # This only queues the message; the broadcaster sends it from its own
+        # thread so that slow clients don't block logging
+        BROADCASTER.broadcast_log(message)
+        LOG_BROADCAST_TIME.observe(time.time() - start)
 
     @staticmethod
     def broadcast_telemetry(telemetry_data):
-        """Broadcasts telemetry data to all connected clients."""
-        cherrypy.engine.publish(
-            'websocket-broadcast',
-            json.dumps({
-                'type': 'telemetry',
-                'message': json.dumps(telemetry_data)
-            })
+        """Sends telemetry data to all connected clients that are due for an
+        update.
+        """
+        start = time.time()
+        if TELEMETRY_STREAM.broadcast(telemetry_data, start) > 0:
+            TELEMETRY_BROADCAST_TIME.observe(time.time() - start)
+
+    @staticmethod
+    def telemetry_interval_s():
+        """Returns how often telemetry should be broadcast, or None if there
+        are no clients.
+        """
+        return TELEMETRY_STREAM.interval_s()
+
+
+class ForwardingLoggingHandler(logging.Handler):
+    """Logging handler that sends log entries to the web process, which
+    broadcasts them to its websocket clients.
+    """
+
+    def __init__(self):
+        super(ForwardingLoggingHandler, self).__init__()
+        # Records are logged from the message dispatcher's thread, so don't
+        # wait for the web process if it's behind
+        self._producer = MessageProducer(
+            config.MONITOR_LOGS_EXCHANGE,
+            blocking=False
         )
+
+    def emit(self, record):
+        """Overridden from Handler; actually emit the log entry."""
+        self._producer.publish(self.format(record))
@@ -56,6 +56,11 @@ sparkfun.status.Status = function(
 
     this.heading = null;
 
+    // Telemetry frames only include the fields that changed, so keep the
+    // latest value of every field
+    this.telemetry = {};
+    this.telemetryRateHz = 10;
+
     this.webSocket = null;
     webSocketAddress = (window.location.protocol === 'http:' ? 'ws://' : 'wss://') + webSocketAddress;
     if (!navigator.userAgent.match('Mac OS X') && window.WebSocket) {
@@ -81,13 +86,22 @@ sparkfun.status.Status = function(
     }.bind(this);
 
     if (this.webSocket) {
+        this.webSocket.onopen = function () {
+            this.webSocket.send(
+                JSON.stringify({'type': 'rate', 'hz': this.telemetryRateHz}));
+        }.bind(this);
+
         this.webSocket.onmessage = function(evt) {
             var data = JSON.parse(evt.data);
             if (data.type === 'log') {
                 this.logs.text(
                     data.message + '\n' + this.logs.text());
             } else if (data.type === 'telemetry') {
-                this.handleTelemetryMessage(JSON.parse(data.message));
+                if (data.full) {
+                    this.telemetry = {};
+                }
+                $.extend(this.telemetry, data.message);
+                this.handleTelemetryMessage($.extend({}, this.telemetry));
             } else {
                 sparkfun.status.addAlert('Unknown message type: ' + data.type);
             }
@@ -83,9 +83,17 @@ sparkfun.telemetry.Telemetry = function(
         };
     }
     this.watchId = null;
+    this._pendingReadings = [];
+    this._flushTimeout = null;
 };
 
 
+/** Readings are sent in batches, at most this long after they are taken. */
+sparkfun.telemetry.BATCH_INTERVAL_MS = 200;
+/** Batches are sent early if they get this big. */
+sparkfun.telemetry.MAX_BATCH_SIZE = 20;
+
+
 /**
  * Binds the buttons to the actions. I was having trouble getting this to work
  * in the constructor, so just do it here instead.
@@ -169,14 +177,7 @@ sparkfun.telemetry.Telemetry.prototype.watch = function(position) {
             device_id: this.deviceId});
     }
 
-    if (this.webSocket) {
-        this.webSocket.send(data);
-    } else {
-        sparkfun.telemetry.poke(
-            this.postEndPoint,
-            {'message': data}
-        );
-    }
+    this.queueReading(data);
     this.latitude.text(position.coords.latitude);
     this.longitude.text(position.coords.longitude);
     this.speed.text(position.coords.speed);
@@ -187,6 +188,53 @@ sparkfun.telemetry.Telemetry.prototype.watch = function(position) {
 };
 
 
+/**
+ * Queues an encoded reading to be sent in the next batch.
+ * @param {string} data
+ */
+sparkfun.telemetry.Telemetry.prototype.queueReading = function(data) {
+    'use strict';
+    this._pendingReadings.push(data);
+    if (this._pendingReadings.length >= sparkfun.telemetry.MAX_BATCH_SIZE) {
+        this.flush();
+    } else if (this._flushTimeout === null) {
+        this._flushTimeout = window.setTimeout(
+            this.flush.bind(this),
+            sparkfun.telemetry.BATCH_INTERVAL_MS);
+    }
+};
+
+
+/**
+ * Sends all of the queued readings to the server.
+ */
+sparkfun.telemetry.Telemetry.prototype.flush = function() {
+    'use strict';
+    if (this._flushTimeout !== null) {
+        window.clearTimeout(this._flushTimeout);
+        this._flushTimeout = null;
+    }
+    if (this._pendingReadings.length === 0) {
+        return;
+    }
+    // Built by hand because iPhone 1 doesn't have a JSON object
+    var batch = (
+        '{"device_id":"' + this.deviceId + '",' +
+        '"readings":[' + this._pendingReadings.join(',') + ']}'
+    );
+    this._pendingReadings = [];
+
+    if (this.webSocket) {
+        this.webSocket.send(batch);
+    } else {
+        sparkfun.telemetry.poke(
+            this.postEndPoint,
+            {'message': batch}
+        );
+    }
+};
+
+
 /**
  * Sends a POST request to the url.
  * @param {string} url
@@ -275,6 +323,7 @@ sparkfun.telemetry.Telemetry.prototype.stopSending = function () {
     } else {
         window.clearInterval(this.watchId);
     }
+    this.flush();
     this._noSleep.disable();
 
     // Enable no sleep next time we touch anything